@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+import argparse
+import numpy as np
+from lsst.sims.catUtils.dust import EBVbase
+
+
+if __name__ == '__main__':
+
+    # Compare E(B-V) from the HEALPix dust maps (as written by
+    # createHealDustMap.py) with E(B-V) from the Schlegel dust maps
+    # at random points on the sky
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_points', type=int, default=100000,
+                        help='number of random points at which to compare the maps')
+    parser.add_argument('--seed', type=int, default=99)
+    parser.add_argument('--nside', type=int, nargs='+',
+                        default=[2, 4, 8, 16, 32, 64, 128, 256, 512, 1024])
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    ra = rng.random_sample(args.n_points)*2.0*np.pi
+    dec = np.arcsin(rng.random_sample(args.n_points)*2.0-1.0)
+    equatorialCoordinates = np.array([ra, dec])
+
+    sfd = EBVbase()
+    ebv_sfd = sfd.calculateEbv(equatorialCoordinates=equatorialCoordinates, interp=True)
+
+    print('%6s %6s %12s %12s %12s %12s' % ('nside', 'interp', 'median|dE|', '95%|dE|',
+                                           'median|dE|/E', '95%|dE|/E'))
+    for nside in args.nside:
+        healpix = EBVbase()
+        healpix.ebvMapBackend = 'healpix'
+        healpix.ebvHealpixNside = nside
+        for interp in (False, True):
+            ebv = healpix.calculateEbv(equatorialCoordinates=equatorialCoordinates, interp=interp)
+            d_ebv = np.abs(ebv-ebv_sfd)
+            frac = d_ebv/ebv_sfd
+            print('%6d %6s %12.4e %12.4e %12.4e %12.4e' % (nside, interp,
+                                                         np.median(d_ebv), np.percentile(d_ebv, 95),
+                                                         np.median(frac), np.percentile(frac, 95)))
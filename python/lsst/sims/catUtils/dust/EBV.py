@@ -1,12 +1,13 @@
-from builtins import zip
 from builtins import object
 import os
+import json
+import hashlib
 import numpy
 from astropy.io import fits
 
 from lsst.sims.utils.CodeUtilities import sims_clean_up
-from lsst.sims.utils import _galacticFromEquatorial
-from functools import reduce
+from lsst.sims.utils import _galacticFromEquatorial, _equatorialFromGalactic
+from .EBVhealpix import EBVhealpixMap
 
 __all__ = ["EBVmap", "EBVbase"]
 
@@ -22,20 +23,47 @@ def interp1D(z1, z2, offset):
 class EBVmap(object):
     '''Class  for describing a map of EBV
 
-    Images are read in from a fits file and assume a ZEA projection
+    Images are read in from a fits file and assume a ZEA projection.
+
+    If readMapFits is given an mmapDir, the image is copied (once) into that
+    directory as a native-endian .npy file, which is then memory-mapped
+    rather than read.  Every process reading the map shares the same pages
+    of the operating system's file cache, rather than holding its own copy
+    of the map in memory.
     '''
 
+    # the keywords of the fits header needed by xyFromSky
+    _header_keys = ('CD1_1', 'CD2_2', 'CRPIX1', 'CRVAL1', 'CRPIX2', 'CRVAL2',
+                    'LAM_NSGP', 'LAM_SCAL', 'LONPOLE')
+
+    # incremented whenever the layout of the memory-mapped files changes
+    _mmap_format_version = 1
+
+    hdulist = None
+
     def __del__(self):
-        self.hdulist.close()
+        if self.hdulist is not None:
+            self.hdulist.close()
+
+    def readMapFits(self, fileName, mmapDir=None):
+        """
+        read a fits file containing the ebv data
+
+        @param [in] fileName is the name of the fits file
 
-    def readMapFits(self, fileName):
-        """ read a fits file containing the ebv data"""
+        @param [in] mmapDir (optional) is a directory in which to keep a
+        memory-mappable copy of the map
+        """
 
         self._file_name = fileName
 
-        self.hdulist = fits.open(fileName)
-        self.header = self.hdulist[0].header
-        self.data = self.hdulist[0].data
+        if mmapDir is not None:
+            self.header = self._load_mmap(fileName, mmapDir)
+        else:
+            self.hdulist = fits.open(fileName)
+            self.header = self.hdulist[0].header
+            self.data = self.hdulist[0].data
+
         self.nr = self.data.shape[0]
         self.nc = self.data.shape[1]
 
@@ -56,6 +84,69 @@ class EBVmap(object):
         self.scale = self.header['LAM_SCAL']
         self.lonpole = self.header['LONPOLE']
 
+    def _mmap_names(self, fileName, mmapDir):
+        """
+        Return the names of the .npy file holding the memory-mappable copy
+        of the map in fileName and of the json file describing it
+        """
+        abs_name = os.path.abspath(fileName)
+        tag = hashlib.sha1(abs_name.encode('utf-8')).hexdigest()[:16]
+        root = os.path.splitext(os.path.basename(fileName))[0]
+        base_name = os.path.join(mmapDir, '%s_%s' % (root, tag))
+        return base_name + '.npy', base_name + '.json'
+
+    def _source_meta(self, fileName):
+        """
+        Return a dict identifying the version of the fits file fileName
+        """
+        stat = os.stat(fileName)
+        return {'format_version': self._mmap_format_version,
+                'file_name': os.path.abspath(fileName),
+                'size': stat.st_size,
+                'mtime': stat.st_mtime}
+
+    def _load_mmap(self, fileName, mmapDir):
+        """
+        Memory-map the copy of the map in fileName kept in mmapDir (writing
+        it first if it does not exist or if fileName has changed since it
+        was written).  Set self.data and return a dict of the header
+        keywords needed by xyFromSky.
+        """
+        data_name, meta_name = self._mmap_names(fileName, mmapDir)
+        source_meta = self._source_meta(fileName)
+
+        meta = None
+        if os.path.exists(meta_name) and os.path.exists(data_name):
+            with open(meta_name, 'r') as in_file:
+                meta = json.load(in_file)
+            if meta['source'] != source_meta:
+                meta = None
+
+        if meta is None:
+            if not os.path.exists(mmapDir):
+                os.makedirs(mmapDir)
+
+            with fits.open(fileName) as hdulist:
+                header = hdulist[0].header
+                data = hdulist[0].data
+                data = numpy.ascontiguousarray(data, dtype=data.dtype.newbyteorder('='))
+                meta = {'source': source_meta,
+                        'header': dict((key, header[key]) for key in self._header_keys)}
+
+            # write to temporary files and rename them so that processes
+            # reading the map never see partially written files; the
+            # metadata is written last, since it marks the map as valid
+            tmp_name = '%s.%d.tmp.npy' % (data_name, os.getpid())
+            numpy.save(tmp_name, data)
+            os.rename(tmp_name, data_name)
+            tmp_name = '%s.%d.tmp' % (meta_name, os.getpid())
+            with open(tmp_name, 'w') as out_file:
+                json.dump(meta, out_file)
+            os.rename(tmp_name, meta_name)
+
+        self.data = numpy.load(data_name, mmap_mode='r')
+        return meta['header']
+
     def xyFromSky(self, gLon, gLat):
         """ convert long, lat angles to pixel x y
 
@@ -121,33 +212,26 @@ class EBVmap(object):
         ix = (x + 0.5).astype(int)
         iy = (y + 0.5).astype(int)
 
-        unity = numpy.ones(len(ix), dtype=int)
-
         if (interpolate):
 
             # find the indices of the pixels bounding the point of interest
-            ixLow = numpy.minimum(ix, (self.nc - 2)*unity)
+            ixLow = numpy.minimum(ix, self.nc - 2)
             ixHigh = ixLow + 1
             dx = x - ixLow
 
-            iyLow = numpy.minimum(iy, (self.nr - 2)*unity)
+            iyLow = numpy.minimum(iy, self.nr - 2)
             iyHigh = iyLow + 1
             dy = y - iyLow
 
             # interpolate the EBV value at the point of interest by interpolating
             # first in x and then in y
-            x1 = numpy.array([self.data[ii][jj] for (ii, jj) in zip(iyLow, ixLow)])
-            x2 = numpy.array([self.data[ii][jj] for (ii, jj) in zip(iyLow, ixHigh)])
-            xLow = interp1D(x1, x2, dx)
-
-            x1 = numpy.array([self.data[ii][jj] for (ii, jj) in zip(iyHigh, ixLow)])
-            x2 = numpy.array([self.data[ii][jj] for (ii, jj) in zip(iyHigh, ixHigh)])
-            xHigh = interp1D(x1, x2, dx)
+            xLow = interp1D(self.data[iyLow, ixLow], self.data[iyLow, ixHigh], dx)
+            xHigh = interp1D(self.data[iyHigh, ixLow], self.data[iyHigh, ixHigh], dx)
 
             ebvVal = interp1D(xLow, xHigh, dy)
 
         else:
-            ebvVal = numpy.array([self.data[ii][jj] for (ii, jj) in zip(iy, ix)])
+            ebvVal = numpy.array(self.data[iy, ix])
 
         return ebvVal
 
@@ -191,6 +275,34 @@ class EBVbase(object):
     member variables ebvDataDir, ebvMapNorthName, ebvMapSouthName
 
     The actual dust maps (when loaded) are stored in ebvMapNorth and ebvMapSouth
+
+    If ebvMmapDir is set to a directory, the dust maps are memory-mapped from
+    native-endian copies kept in that directory (see EBVmap), so that many
+    worker processes can share one copy of the maps.
+
+    If ebvMapBackend is set to 'healpix', E(B-V) is instead looked up in a
+    single all-sky HEALPix map (see EBVhealpixMap) of resolution
+    ebvHealpixNside, stored in ebvHealpixMapName (formatted with the nside).
+    These are the maps written by bin.src/createHealDustMap.py, i.e. the
+    SFD maps sampled (without interpolation) at the centers of the HEALPix
+    pixels, for nside 2 through 1024.  The map is loaded as ebvMapHealpix.
+
+    On the accuracy of the HEALPix backend relative to the SFD maps:
+
+    - at the centers of the HEALPix pixels the two agree exactly (with
+      interp=False)
+
+    - elsewhere, the HEALPix map is a resampling of the SFD maps on a coarser
+      grid: the SFD pixels are 2.37 arcminutes across, while HEALPix pixels
+      are 3.4 arcminutes across at nside 1024 and twice that for every
+      halving of nside.  The differences are therefore largest where the
+      dust varies on small scales (near the Galactic plane and in
+      molecular clouds) and at small nside.  interp=True (bilinear
+      interpolation between the four nearest pixels) reduces them for
+      smoothly varying dust.
+
+    bin.src/compareHealDustMap.py tabulates the differences between the two
+    backends at random points on the sky for each available nside.
     """
 
     # these variables will tell the mixin where to get the dust maps
@@ -199,6 +311,14 @@ class EBVbase(object):
     ebvMapSouthName = "DustMaps/SFD_dust_4096_sgp.fits"
     ebvMapNorth = None
     ebvMapSouth = None
+    ebvMmapDir = None
+
+    # 'sfd' to use the two-hemisphere SFD maps; 'healpix' to use an all-sky
+    # HEALPix map
+    ebvMapBackend = 'sfd'
+    ebvHealpixNside = 1024
+    ebvHealpixMapName = "DustMaps/dust_nside_%d.npz"
+    ebvMapHealpix = None
 
     # A dict to hold every open instance of an EBVmap.
     # Since this is being declared outside of the constructor,
@@ -231,10 +351,22 @@ class EBVbase(object):
             return self._ebv_map_cache[file_name]
 
         ebv_map = EBVmap()
-        ebv_map.readMapFits(file_name)
+        ebv_map.readMapFits(file_name, mmapDir=self.ebvMmapDir)
         self._ebv_map_cache[file_name] = ebv_map
         return ebv_map
 
+    def load_ebvMapHealpix(self):
+        """
+        This will load the HEALPix map with nside = self.ebvHealpixNside
+        """
+        file_name = os.path.join(self.ebvDataDir, self.ebvHealpixMapName % self.ebvHealpixNside)
+        if file_name not in self._ebv_map_cache:
+            ebv_map = EBVhealpixMap()
+            ebv_map.readMap(file_name)
+            self._ebv_map_cache[file_name] = ebv_map
+        self.ebvMapHealpix = self._ebv_map_cache[file_name]
+        return None
+
     def load_ebvMapNorth(self):
         """
         This will load the northern SFD map
@@ -252,7 +384,7 @@ class EBVbase(object):
         return None
 
     def calculateEbv(self, galacticCoordinates=None, equatorialCoordinates=None, northMap=None, southMap=None,
-                     interp=False):
+                     interp=False, healpixMap=None):
         """
         For an array of Gal long, lat calculate E(B-V)
 
@@ -269,6 +401,9 @@ class EBVbase(object):
 
         @param [in] interp is a boolean determining whether or not to interpolate the EBV value
 
+        @param [in] healpixMap the HEALPix dust map (only used if
+        self.ebvMapBackend is 'healpix')
+
         @param [out] ebv is a list of EBV values for all of the gLon, gLat pairs
 
         """
@@ -279,6 +414,13 @@ class EBVbase(object):
                 raise RuntimeError("Specified both galacticCoordinates and "
                                    "equatorialCoordinates in calculateEbv")
 
+        if self.ebvMapBackend == 'healpix':
+            return self._calculateEbvHealpix(galacticCoordinates, equatorialCoordinates,
+                                             healpixMap, interp)
+        elif self.ebvMapBackend != 'sfd':
+            raise RuntimeError("EBVbase does not know the ebvMapBackend '%s'; "
+                               "use 'sfd' or 'healpix'" % self.ebvMapBackend)
+
         # convert (ra,dec) into gLon, gLat
         if galacticCoordinates is None:
 
@@ -307,26 +449,44 @@ class EBVbase(object):
 
             ebv = numpy.zeros(len(galacticCoordinates[0, :]))
 
-            # identify (by index) which points are in the galactic northern hemisphere
+            # identify which points are in the galactic northern hemisphere
             # and which points are in the galactic southern hemisphere
-            # taken from
-            # http://stackoverflow.com/questions/4578590/python-equivalent-of-filter-getting-two-output-lists-i-e-partition-of-a-list
-            inorth, isouth = reduce(lambda x, y: x[not y[1] > 0.0].append(y[0]) or x,
-                                    enumerate(galacticCoordinates[1, :]), ([], []))
+            inorth = galacticCoordinates[1, :] > 0.0
+            isouth = numpy.logical_not(inorth)
 
-            nSet = galacticCoordinates[:, inorth]
-            sSet = galacticCoordinates[:, isouth]
+            ebv[inorth] = northMap.generateEbv(galacticCoordinates[0, inorth],
+                                               galacticCoordinates[1, inorth],
+                                               interpolate=interp)
+            ebv[isouth] = southMap.generateEbv(galacticCoordinates[0, isouth],
+                                               galacticCoordinates[1, isouth],
+                                               interpolate=interp)
 
-            ebvNorth = northMap.generateEbv(nSet[0, :], nSet[1, :], interpolate=interp)
-            ebvSouth = southMap.generateEbv(sSet[0, :], sSet[1, :], interpolate=interp)
+        return ebv
 
-            for (i, ee) in zip(inorth, ebvNorth):
-                ebv[i] = ee
+    def _calculateEbvHealpix(self, galacticCoordinates, equatorialCoordinates, healpixMap, interp):
+        """
+        calculateEbv for the HEALPix backend.  The HEALPix maps are in
+        equatorial coordinates, so galactic coordinates are converted.
+        """
 
-            for (i, ee) in zip(isouth, ebvSouth):
-                ebv[i] = ee
+        if equatorialCoordinates is None:
+            if galacticCoordinates is None:
+                raise RuntimeError("Must specify coordinates in calculateEbv")
 
-        return ebv
+            equatorialCoordinates = numpy.array(_equatorialFromGalactic(galacticCoordinates[0, :],
+                                                                        galacticCoordinates[1, :]))
+
+        if healpixMap is None:
+            if self.ebvMapHealpix is None:
+                self.load_ebvMapHealpix()
+
+            healpixMap = self.ebvMapHealpix
+
+        if equatorialCoordinates.shape[1] == 0:
+            return None
+
+        return healpixMap.generateEbv(equatorialCoordinates[0, :], equatorialCoordinates[1, :],
+                                      interpolate=interp)
 
 
 sims_clean_up.targets.append(EBVbase._ebv_map_cache)
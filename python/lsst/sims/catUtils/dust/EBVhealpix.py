@@ -0,0 +1,66 @@
+from builtins import object
+import os
+import numpy
+
+try:
+    import healpy as hp
+except ImportError:
+    pass
+
+__all__ = ["EBVhealpixMap"]
+
+
+class EBVhealpixMap(object):
+    '''Class for describing an all-sky HEALPix map of EBV
+
+    Maps are the files written by bin.src/createHealDustMap.py: a RING
+    ordered HEALPix map of E(B-V) in equatorial coordinates, stored as the
+    array 'ebvMap' of a .npz file.  The map can also be given as a .npy
+    file, in which case it is memory-mapped rather than read.
+    '''
+
+    def readMap(self, fileName):
+        """
+        read a file containing a HEALPix map of EBV
+
+        @param [in] fileName is the name of the .npz (or .npy) file
+        """
+
+        if 'hp' not in globals():
+            raise RuntimeError('You cannot use EBVhealpixMap without installing healpy')
+
+        self._file_name = fileName
+
+        if os.path.splitext(fileName)[1] == '.npy':
+            self.data = numpy.load(fileName, mmap_mode='r')
+        else:
+            with numpy.load(fileName) as input_data:
+                self.data = input_data['ebvMap']
+
+        self.nside = hp.npix2nside(len(self.data))
+
+    def generateEbv(self, ra, dec, interpolate=False):
+        """
+        Calculate EBV with option for interpolation
+
+        @param [in] ra is the RA in radians
+
+        @param [in] dec is the Dec in radians
+
+        @param [in] interpolate is a boolean; if True, EBV is interpolated
+        bilinearly from the four nearest pixels (with healpy.get_interp_val);
+        otherwise, it is the value of the pixel containing each point
+
+        @param [out] ebvVal is a numpy array of EBV values
+        """
+
+        theta = 0.5*numpy.pi - numpy.asarray(dec, dtype=float)
+        phi = numpy.asarray(ra, dtype=float)
+
+        if len(theta) == 0:
+            return numpy.zeros(0, dtype=float)
+
+        if interpolate:
+            return hp.get_interp_val(self.data, theta, phi)
+
+        return numpy.array(self.data[hp.ang2pix(self.nside, theta, phi)])
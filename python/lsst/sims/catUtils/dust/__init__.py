@@ -1 +1,2 @@
+from .EBVhealpix import *
 from .EBV import *
@@ -0,0 +1,374 @@
+"""
+This module provides ExtinctionTable, which tabulates the magnitudes of
+SED templates as a function of Milky Way extinction in the bandpasses of
+a BandpassDict and keeps the tables on disk, so that the photometry of
+dusty objects can be interpolated rather than calculated by reddening and
+integrating every object's spectrum.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+
+from lsst.utils import getPackageDir
+from lsst.sims.photUtils import Sed, Bandpass
+from lsst.sims.utils import defaultSpecMap
+from .SedCache import SedCache
+
+__all__ = ["ExtinctionTable"]
+
+
+class ExtinctionTable(object):
+    """
+    Tabulate the magnitudes of SED templates against A_v.
+
+    For each (SED template, R_v, BandpassDict) this class tabulates the
+    magnitudes of the template, normalized as SedList normalizes it (to
+    magNorm = 0 in the imsim bandpass), resampled onto the wavelength grid
+    of the BandpassDict and extincted by CCM dust on a grid of A_v.  The
+    magnitude of an object with magNorm and A_v is then the tabulated
+    magnitude, interpolated linearly in A_v, plus magNorm.  This is the
+    same calculation SedList does with a galacticAvList, with the addDust
+    and integration over the bandpasses done once per template rather
+    than once per object.
+
+    The A_v grid starts out with nodes at 0, 0.1, 0.3, 0.7, 1.5, ...
+    (each interval twice as wide as the one before it), so that large A_v
+    are covered by few nodes.  Each interval is checked at its midpoint;
+    if the interpolation is off by more than `tolerance` magnitudes in any
+    bandpass, the interval is halved (up to max_refinements times).  The
+    grid initially covers [0, av_max] and is extended, an interval at a
+    time, whenever a larger A_v is asked for.  Negative A_v, and A_v in
+    intervals that could not be made to meet tolerance, are evaluated
+    exactly.
+
+    If cache_dir is given, each table is saved there as a .npz file named
+    after a hash of everything it depends on: the contents of the SED file,
+    the BandpassDict, R_v and the parameters of the grid.  Tables are read
+    back from there by any process (or later run) that needs them, and
+    are rebuilt automatically if any of their inputs change.
+
+    Assign an instance of this class to the extinctionTable member of an
+    InstanceCatalog that inherits from PhotometryStars to use it.  One
+    instance can be shared by many catalogs.
+    """
+
+    # incremented whenever the layout of the table files changes
+    _format_version = 2
+
+    # the width of the first interval of the A_v grid
+    _initial_step = 0.1
+
+    def __init__(self, cache_dir=None, av_max=10.0, tolerance=1.0e-4, max_refinements=8,
+                 fileDir=None, specMap=None):
+        """
+        Parameters
+        ----------
+        cache_dir is the directory in which to keep the tables (optional;
+        if None, tables are only kept in memory)
+
+        av_max is the A_v up to which tables are built when they are
+        first needed (default 10; tables are extended automatically to
+        cover larger A_v)
+
+        tolerance is the largest acceptable error in the interpolated
+        magnitudes (default 10^-4)
+
+        max_refinements is the largest number of times an interval of
+        the A_v grid is halved in trying to meet tolerance (default 8)
+
+        fileDir is the directory containing the SED templates (default
+        the sims_sed_library directory, as in PhotometryStars)
+
+        specMap maps the names of SED templates onto paths relative to
+        fileDir (default defaultSpecMap)
+        """
+        if av_max <= 0.0:
+            raise RuntimeError('ExtinctionTable needs av_max > 0; you gave %e' % av_max)
+
+        self.cache_dir = cache_dir
+        self.av_max = av_max
+        self.tolerance = tolerance
+        self._max_refinements = max_refinements
+        self._file_dir = fileDir
+        self._spec_map = specMap if specMap is not None else defaultSpecMap
+
+        self._imsim_band = Bandpass()
+        self._imsim_band.imsimBandpass()
+
+        # the normalized SEDs, keyed on name
+        self._seds = {}
+        # hashes of the SEDs, keyed on name
+        self._sed_hashes = {}
+        # hashes of BandpassDicts, keyed on id (the BandpassDict is kept
+        # with its hash so that its id cannot be reused)
+        self._bandpass_keys = {}
+        # (av_grid, mag_grid, error of each interval of av_grid), keyed
+        # on (sed name, R_v, bandpass key)
+        self._tables = {}
+
+    def register_sed(self, name, sed):
+        """
+        Make an SED that is not a file in fileDir available to the
+        table under the name `name` (e.g. the black body used to model
+        MLT dwarf flares).  The SED is normalized to magNorm = 0 in the
+        imsim bandpass.
+        """
+        sed = Sed(wavelen=sed.wavelen, flambda=sed.flambda)
+        sha = hashlib.sha1(np.ascontiguousarray(sed.wavelen, dtype=float).tobytes())
+        sha.update(np.ascontiguousarray(sed.flambda, dtype=float).tobytes())
+        self._add_sed(name, sed, sha.hexdigest())
+
+    def _add_sed(self, name, sed, sed_hash):
+        sed.multiplyFluxNorm(sed.calcFluxNorm(0.0, self._imsim_band))
+        self._seds[name] = sed
+        self._sed_hashes[name] = sed_hash
+
+    def _load_sed(self, name):
+        """
+        Read (and normalize) the SED template `name` if it has not
+        already been read
+        """
+        if name in self._seds:
+            return
+        if self._file_dir is None:
+            self._file_dir = getPackageDir('sims_sed_library')
+        file_name = os.path.join(self._file_dir, self._spec_map[name])
+        with open(file_name, 'rb') as input_file:
+            sed_hash = hashlib.sha1(input_file.read()).hexdigest()
+        sed = Sed()
+        sed.readSED_flambda(file_name)
+        self._add_sed(name, sed, sed_hash)
+
+    def _bandpass_key(self, bandpassDict):
+        if id(bandpassDict) not in self._bandpass_keys:
+            self._bandpass_keys[id(bandpassDict)] = (bandpassDict, SedCache.bandpass_key(bandpassDict))
+        return self._bandpass_keys[id(bandpassDict)][1]
+
+    def _meta(self, name, rv, bandpass_key):
+        """
+        Return the dict identifying the table of one SED
+        """
+        return {'format_version': self._format_version,
+                'sed_hash': self._sed_hashes[name],
+                'bandpass_key': bandpass_key,
+                'rv': float(rv),
+                'initial_step': self._initial_step,
+                'tolerance': self.tolerance,
+                'max_refinements': self._max_refinements}
+
+    def _table_file_name(self, meta):
+        tag = hashlib.sha1(json.dumps(meta, sort_keys=True).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, 'extinction_%s.npz' % tag)
+
+    def exact_magnitudes(self, bandpassDict, name, av, rv=3.1):
+        """
+        Calculate the magnitudes of the SED template `name` (normalized
+        to magNorm = 0) for an array of A_v by reddening and integrating
+        the spectrum.  Returns a (len(av), n_bandpasses) numpy array.
+        """
+        self._load_sed(name)
+        sed = Sed(wavelen=self._seds[name].wavelen, flambda=self._seds[name].flambda)
+        sed.resampleSED(wavelen_match=bandpassDict.wavelenMatch)
+        a_x, b_x = sed.setupCCM_ab()
+        av = np.atleast_1d(np.asarray(av, dtype=float))
+        mags = np.zeros((len(av), len(list(bandpassDict.keys()))), dtype=float)
+        for i_av, av_val in enumerate(av):
+            wv, fl = sed.addDust(a_x, b_x, A_v=av_val, R_v=rv,
+                                 wavelen=sed.wavelen, flambda=sed.flambda)
+            dusty_sed = Sed(wavelen=wv, flambda=fl)
+            mags[i_av] = bandpassDict.magListForSed(dusty_sed)
+        return mags
+
+    def _initial_grid(self, av_start, av_end):
+        """
+        Return the nodes of the initial A_v grid from av_start (which
+        must be one of them) up to the first node >= av_end
+        """
+        nodes = [0.0]
+        step = self._initial_step
+        while nodes[-1] < av_end:
+            nodes.append(nodes[-1]+step)
+            step *= 2.0
+        nodes = np.array(nodes)
+        return nodes[nodes >= av_start]
+
+    def _build_table(self, bandpassDict, name, rv, av_nodes):
+        """
+        Tabulate the magnitudes of the SED template `name` on the
+        intervals between av_nodes, halving each interval until linear
+        interpolation across it is good to within tolerance.  Returns
+        the A_v grid, the magnitudes on it and the error of each interval
+        of the grid (np.inf for intervals that could not be made to meet
+        tolerance).
+        """
+        av_list = list(av_nodes)
+        mag_list = list(self.exact_magnitudes(bandpassDict, name, av_nodes, rv=rv))
+        lo_av = np.array(av_list[:-1])
+        hi_av = np.array(av_list[1:])
+        lo_mag = np.array(mag_list[:-1])
+        hi_mag = np.array(mag_list[1:])
+
+        # the lower edges and errors of the intervals of the final grid
+        done_av = []
+        done_error = []
+        for i_refinement in range(self._max_refinements+1):
+            mid_av = 0.5*(lo_av+hi_av)
+            mid_mag = self.exact_magnitudes(bandpassDict, name, mid_av, rv=rv)
+            error = np.abs(0.5*(lo_mag+hi_mag)-mid_mag).max(axis=1)
+
+            good = error <= self.tolerance
+            # halving an interval cannot help if the magnitudes are not finite
+            refine = np.logical_and(np.logical_not(good), np.isfinite(error))
+            if i_refinement == self._max_refinements:
+                refine[:] = False
+            failed = np.logical_not(np.logical_or(good, refine))
+
+            done_av.extend(lo_av[good])
+            done_error.extend(error[good])
+            done_av.extend(lo_av[failed])
+            done_error.extend(np.inf*np.ones(failed.sum()))
+            if not refine.any():
+                break
+
+            av_list.extend(mid_av[refine])
+            mag_list.extend(mid_mag[refine])
+            lo_av, hi_av = (np.concatenate((lo_av[refine], mid_av[refine])),
+                            np.concatenate((mid_av[refine], hi_av[refine])))
+            lo_mag, hi_mag = (np.concatenate((lo_mag[refine], mid_mag[refine])),
+                              np.concatenate((mid_mag[refine], hi_mag[refine])))
+
+        av_sorted = np.argsort(av_list)
+        error_sorted = np.argsort(done_av)
+        return (np.array(av_list)[av_sorted], np.array(mag_list)[av_sorted],
+                np.array(done_error)[error_sorted])
+
+    def _get_table(self, bandpassDict, name, rv, av_max):
+        """
+        Return the table (av_grid, mag_grid, error) of the SED template
+        `name`, reading it from cache_dir or building it, and extending
+        it if it does not reach av_max
+        """
+        bandpass_key = self._bandpass_key(bandpassDict)
+        key = (name, float(rv), bandpass_key)
+        table = self._tables.get(key, None)
+        if table is not None and table[0][-1] >= av_max:
+            return table
+
+        self._load_sed(name)
+        meta = self._meta(name, rv, bandpass_key)
+        if self.cache_dir is not None:
+            # another process may already have built (or extended) the table
+            file_name = self._table_file_name(meta)
+            if os.path.exists(file_name):
+                with np.load(file_name) as data:
+                    if json.loads(str(data['meta'])) == meta:
+                        if table is None or data['av_grid'][-1] > table[0][-1]:
+                            table = (data['av_grid'], data['mag_grid'], data['error'])
+
+        if table is not None and table[0][-1] >= av_max:
+            self._tables[key] = table
+            return table
+
+        if table is None:
+            table = self._build_table(bandpassDict, name, rv, self._initial_grid(0.0, av_max))
+        else:
+            extension = self._build_table(bandpassDict, name, rv,
+                                          self._initial_grid(table[0][-1], av_max))
+            table = (np.concatenate((table[0], extension[0][1:])),
+                     np.concatenate((table[1], extension[1][1:])),
+                     np.concatenate((table[2], extension[2])))
+
+        if self.cache_dir is not None:
+            # write to a temporary file and rename it, so that another
+            # process never reads a partially written table
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            tmp_name = '%s.%d.tmp.npz' % (file_name, os.getpid())
+            np.savez(tmp_name, meta=np.array(json.dumps(meta)),
+                     av_grid=table[0], mag_grid=table[1], error=table[2])
+            os.rename(tmp_name, file_name)
+
+        self._tables[key] = table
+        return table
+
+    def max_error(self, bandpassDict, name, rv=3.1):
+        """
+        Return the largest error in the interpolated magnitudes of the
+        SED template `name` for A_v in [0, av_max], as found when
+        validating its table (np.inf if some interval of the table could
+        not be made to meet tolerance; A_v in such intervals are
+        evaluated exactly)
+        """
+        av_grid, mag_grid, error = self._get_table(bandpassDict, name, rv, self.av_max)
+        return error[:np.searchsorted(av_grid, self.av_max)].max()
+
+    def magnitudes(self, bandpassDict, sedNames, magNorms, av, rv=3.1):
+        """
+        Calculate magnitudes.
+
+        Parameters
+        ----------
+        bandpassDict is the BandpassDict in which to calculate magnitudes
+
+        sedNames is an array of the names of the objects' SED templates
+        (objects whose SED is None or 'None' get NaN magnitudes)
+
+        magNorms is an array of the objects' magNorms
+
+        av is an array of the objects' A_v
+
+        rv is R_v (default 3.1, as in SedList)
+
+        Returns
+        -------
+        A (n_objects, n_bandpasses) numpy array of magnitudes
+        """
+        sedNames = np.atleast_1d(np.asarray(sedNames)).astype(str)
+        magNorms = np.atleast_1d(np.asarray(magNorms, dtype=float))
+        av = np.atleast_1d(np.asarray(av, dtype=float))
+
+        n_bandpasses = len(list(bandpassDict.keys()))
+        mags = np.empty((len(sedNames), n_bandpasses), dtype=float)
+        mags.fill(np.nan)
+
+        for name in np.unique(sedNames):
+            if name == 'None':
+                continue
+            dexes = np.where(sedNames == name)[0]
+            local_av = av[dexes]
+            valid_av = local_av[np.isfinite(local_av)]
+            av_max = max(self.av_max, valid_av.max()) if len(valid_av) > 0 else self.av_max
+            av_grid, mag_grid, error = self._get_table(bandpassDict, name, rv, av_max)
+
+            i_interval = np.clip(np.searchsorted(av_grid, local_av, side='right')-1,
+                                 0, len(error)-1)
+            in_range = np.logical_and(local_av >= 0.0, local_av <= av_grid[-1])
+            in_range = np.logical_and(in_range, np.isfinite(error[i_interval]))
+
+            local_mags = np.empty((len(dexes), n_bandpasses), dtype=float)
+            local_mags.fill(np.nan)
+            if in_range.any():
+                for i_bp in range(n_bandpasses):
+                    local_mags[in_range, i_bp] = np.interp(local_av[in_range], av_grid,
+                                                           mag_grid[:, i_bp])
+            out_of_range = np.logical_and(np.logical_not(in_range), np.isfinite(local_av))
+            if out_of_range.any():
+                unq_av, unq_inv = np.unique(local_av[out_of_range], return_inverse=True)
+                local_mags[out_of_range] = self.exact_magnitudes(bandpassDict, name, unq_av,
+                                                                 rv=rv)[unq_inv]
+
+            mags[dexes] = local_mags + magNorms[dexes][:, None]
+
+        return mags
+
+    def extinction(self, bandpassDict, sedNames, av, rv=3.1):
+        """
+        Return a (n_objects, n_bandpasses) numpy array of the extinction
+        (in magnitudes) of objects with SED templates sedNames and A_v av
+        in each bandpass of bandpassDict
+        """
+        av = np.atleast_1d(np.asarray(av, dtype=float))
+        zeros = np.zeros(len(av), dtype=float)
+        return (self.magnitudes(bandpassDict, sedNames, zeros, av, rv=rv) -
+                self.magnitudes(bandpassDict, sedNames, zeros, zeros, rv=rv))
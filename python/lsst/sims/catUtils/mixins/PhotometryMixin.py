@@ -43,6 +43,24 @@ class PhotometryBase(object):
     #defaults to LSST values
     photParams = PhotometricParameters()
 
+    #an optional SNRLookup; if set, magnitude uncertainties in the bandpasses
+    #it knows about are interpolated from its tables instead of calling
+    #calcGamma for every catalog.  It is only used if it was built from the
+    #same BandpassDict and photParams as the catalog uses (see
+    #SNRLookup.matches); otherwise gamma is calculated as usual.
+    snrLookup = None
+
+    #an optional SedCache; if set, the magnitudes of SEDs are looked up in it
+    #(and added to it) so that SEDs which have already been integrated
+    #are not read in again.  It can be shared between catalogs.
+    sedCache = None
+
+    #an optional ExtinctionTable; if set, the magnitudes of stars are
+    #interpolated from its tables of magnitude against galacticAv rather
+    #than calculated by reddening and integrating each star's SED.  It can
+    #be shared between catalogs.
+    extinctionTable = None
+
 
     def _cacheGamma(self, m5_names, bandpassDict):
         """
@@ -65,6 +83,36 @@ class PhotometryBase(object):
                 self._gamma_cache[mm] = calcGamma(bp, self.obs_metadata.m5[mm], photParams=self.photParams)
 
 
+    def _cachedMagnitudeGetter(self, bandpassDict, key_columns, key_tag, sedListLoader):
+        """
+        Calculate magnitudes using self.sedCache.
+
+        @param [in] bandpassDict is the BandpassDict in which to calculate magnitudes
+
+        @param [in] key_columns is a list of the columns that determine the
+        SEDs of the objects in the current chunk (see SedCache.make_keys)
+
+        @param [in] key_tag is a hashable identifying the kind of SED
+
+        @param [in] sedListLoader is a method that takes a boolean mask of
+        the objects in the current chunk and returns a SedList containing
+        the SEDs of only those objects
+
+        @param [out] magnitudes is a 2-D numpy array of magnitudes in which
+        rows correspond to bandpasses and columns correspond to astronomical
+        objects.
+        """
+        n_bandpasses = len(list(bandpassDict.keys()))
+        keys = self.sedCache.make_keys(bandpassDict, key_columns, tag=key_tag)
+        magnitudes, missing = self.sedCache.lookup(keys, n_bandpasses)
+        if missing.any():
+            sedList = sedListLoader(missing)
+            new_magnitudes = np.array(bandpassDict.magListForSedList(sedList))
+            magnitudes[missing] = new_magnitudes
+            self.sedCache.store([keys[ix] for ix in np.where(missing)[0]], new_magnitudes)
+
+        return magnitudes.transpose()
+
     def _magnitudeUncertaintyGetter(self, column_name_list, m5_name_list, bandpassDict_name):
         """
         Generic getter for magnitude uncertainty columns.
@@ -111,20 +159,27 @@ class PhotometryBase(object):
         # the bandpassDict will not be loaded until the magnitude
         # getters are called
         bandpassDict = getattr(self, bandpassDict_name)
-        self._cacheGamma(m5_name_list, bandpassDict)
 
+        use_lookup = (self.snrLookup is not None and
+                      self.snrLookup.matches(bandpassDict, self.photParams))
 
         output = []
 
-        for name, m5_name, bp in zip(column_name_list, m5_name_list, bandpassDict.values()):
+        for name, m5_name, bp_name, bp in zip(column_name_list, m5_name_list,
+                                              bandpassDict.keys(), bandpassDict.values()):
             if 'sigma_%s' % name not in self._actually_calculated_columns:
                 output.append(np.ones(num_elements)*np.NaN)
             else:
                 try:
                     m5 = self.obs_metadata.m5[m5_name]
-                    gamma = self._gamma_cache[m5_name]
 
-                    sigma_list, gamma = calcMagError_m5(mag_dict[name], bp, m5, self.photParams, gamma=gamma)
+                    if use_lookup and bp_name in self.snrLookup:
+                        sigma_list = self.snrLookup.calcMagError_m5(mag_dict[name], bp_name, m5)
+                    else:
+                        self._cacheGamma(m5_name_list, bandpassDict)
+                        gamma = self._gamma_cache[m5_name]
+
+                        sigma_list, gamma = calcMagError_m5(mag_dict[name], bp, m5, self.photParams, gamma=gamma)
 
                     output.append(sigma_list)
 
@@ -246,13 +301,16 @@ class PhotometryGalaxies(PhotometryBase):
         return False
 
 
-    def _loadBulgeSedList(self, wavelen_match):
+    def _loadBulgeSedList(self, wavelen_match, object_mask=None):
         """
         Load a SedList of galaxy bulge Seds.
         The list will be stored in the variable self._bulgeSedList.
 
         @param [in] wavelen_match is the wavelength grid (in nm)
         on which the Seds are to be sampled.
+
+        @param [in] object_mask is an optional boolean array selecting
+        which objects in the current chunk to load (default: all of them)
         """
 
         sedNameList = self.column_by_name('sedFilenameBulge')
@@ -261,6 +319,12 @@ class PhotometryGalaxies(PhotometryBase):
         internalAvList = self.column_by_name('internalAvBulge')
         cosmologicalDimming = not self._hasCosmoDistMod()
 
+        if object_mask is not None:
+            sedNameList = sedNameList[object_mask]
+            magNormList = magNormList[object_mask]
+            redshiftList = redshiftList[object_mask]
+            internalAvList = internalAvList[object_mask]
+
         if len(sedNameList)==0:
             return np.ones((0))
 
@@ -279,13 +343,16 @@ class PhotometryGalaxies(PhotometryBase):
                                                redshiftList=redshiftList)
 
 
-    def _loadDiskSedList(self, wavelen_match):
+    def _loadDiskSedList(self, wavelen_match, object_mask=None):
         """
         Load a SedList of galaxy disk Seds.
-        The list will be stored in the variable self._bulgeSedList.
+        The list will be stored in the variable self._diskSedList.
 
         @param [in] wavelen_match is the wavelength grid (in nm)
         on which the Seds are to be sampled.
+
+        @param [in] object_mask is an optional boolean array selecting
+        which objects in the current chunk to load (default: all of them)
         """
 
         sedNameList = self.column_by_name('sedFilenameDisk')
@@ -294,6 +361,12 @@ class PhotometryGalaxies(PhotometryBase):
         internalAvList = self.column_by_name('internalAvDisk')
         cosmologicalDimming = not self._hasCosmoDistMod()
 
+        if object_mask is not None:
+            sedNameList = sedNameList[object_mask]
+            magNormList = magNormList[object_mask]
+            redshiftList = redshiftList[object_mask]
+            internalAvList = internalAvList[object_mask]
+
         if len(sedNameList)==0:
             return np.ones((0))
 
@@ -312,13 +385,16 @@ class PhotometryGalaxies(PhotometryBase):
                                                redshiftList=redshiftList)
 
 
-    def _loadAgnSedList(self, wavelen_match):
+    def _loadAgnSedList(self, wavelen_match, object_mask=None):
         """
         Load a SedList of galaxy AGN Seds.
-        The list will be stored in the variable self._bulgeSedList.
+        The list will be stored in the variable self._agnSedList.
 
         @param [in] wavelen_match is the wavelength grid (in nm)
         on which the Seds are to be sampled.
+
+        @param [in] object_mask is an optional boolean array selecting
+        which objects in the current chunk to load (default: all of them)
         """
 
         sedNameList = self.column_by_name('sedFilenameAgn')
@@ -326,6 +402,11 @@ class PhotometryGalaxies(PhotometryBase):
         redshiftList = self.column_by_name('redshift')
         cosmologicalDimming = not self._hasCosmoDistMod()
 
+        if object_mask is not None:
+            sedNameList = sedNameList[object_mask]
+            magNormList = magNormList[object_mask]
+            redshiftList = redshiftList[object_mask]
+
         if len(sedNameList)==0:
             return np.ones((0))
 
@@ -441,32 +522,58 @@ class PhotometryGalaxies(PhotometryBase):
         if len(indices) == len(columnNameList):
             indices = None
 
-        if componentName == 'bulge':
-            self._loadBulgeSedList(bandpassDict.wavelenMatch)
-            if not hasattr(self, '_bulgeSedList'):
-                sedList = None
-            else:
-                sedList = self._bulgeSedList
-        elif componentName == 'disk':
-            self._loadDiskSedList(bandpassDict.wavelenMatch)
-            if not hasattr(self, '_diskSedList'):
-                sedList = None
-            else:
-                sedList = self._diskSedList
-        elif componentName == 'agn':
-            self._loadAgnSedList(bandpassDict.wavelenMatch)
-            if not hasattr(self, '_agnSedList'):
-                sedList = None
-            else:
-                sedList = self._agnSedList
-        else:
+        if componentName not in ('bulge', 'disk', 'agn'):
             raise RuntimeError('_quiescentMagnitudeGetter does not understand component %s ' \
                                % componentName)
 
-        if sedList is None:
-            magnitudes = np.ones((len(columnNameList), 0))
+        if self.sedCache is not None:
+            suffix = componentName.capitalize()
+            sedNameList = self.column_by_name('sedFilename%s' % suffix)
+            if len(sedNameList) == 0:
+                magnitudes = np.ones((len(columnNameList), 0))
+            else:
+                key_columns = [sedNameList,
+                               self.column_by_name('magNorm%s' % suffix),
+                               self.column_by_name('redshift')]
+                if componentName != 'agn':
+                    key_columns.append(self.column_by_name('internalAv%s' % suffix))
+
+                loader = {'bulge': self._loadBulgeSedList,
+                          'disk': self._loadDiskSedList,
+                          'agn': self._loadAgnSedList}[componentName]
+                sedListName = '_%sSedList' % componentName
+
+                def sedListLoader(object_mask):
+                    loader(bandpassDict.wavelenMatch, object_mask=object_mask)
+                    return getattr(self, sedListName)
+
+                magnitudes = self._cachedMagnitudeGetter(bandpassDict, key_columns,
+                                                         (componentName, not self._hasCosmoDistMod()),
+                                                         sedListLoader)
         else:
-            magnitudes = bandpassDict.magListForSedList(sedList, indices=indices).transpose()
+            if componentName == 'bulge':
+                self._loadBulgeSedList(bandpassDict.wavelenMatch)
+                if not hasattr(self, '_bulgeSedList'):
+                    sedList = None
+                else:
+                    sedList = self._bulgeSedList
+            elif componentName == 'disk':
+                self._loadDiskSedList(bandpassDict.wavelenMatch)
+                if not hasattr(self, '_diskSedList'):
+                    sedList = None
+                else:
+                    sedList = self._diskSedList
+            else:
+                self._loadAgnSedList(bandpassDict.wavelenMatch)
+                if not hasattr(self, '_agnSedList'):
+                    sedList = None
+                else:
+                    sedList = self._agnSedList
+
+            if sedList is None:
+                magnitudes = np.ones((len(columnNameList), 0))
+            else:
+                magnitudes = bandpassDict.magListForSedList(sedList, indices=indices).transpose()
 
         if self._hasCosmoDistMod():
             cosmoDistMod = self.column_by_name('cosmologicalDistanceModulus')
@@ -606,18 +713,26 @@ class PhotometryStars(PhotometryBase):
     It assumes that we want LSST filters.
     """
 
-    def _loadSedList(self, wavelen_match):
+    def _loadSedList(self, wavelen_match, object_mask=None):
         """
         Method to load the member variable self._sedList, which is a SedList.
         If self._sedList does not already exist, this method sets it up.
         If it does already exist, this method flushes its contents and loads a new
         chunk of Seds.
+
+        object_mask is an optional boolean array selecting which objects
+        in the current chunk to load (default: all of them)
         """
 
         sedNameList = self.column_by_name('sedFilename')
         magNormList = self.column_by_name('magNorm')
         galacticAvList = self.column_by_name('galacticAv')
 
+        if object_mask is not None:
+            sedNameList = sedNameList[object_mask]
+            magNormList = magNormList[object_mask]
+            galacticAvList = galacticAvList[object_mask]
+
         if len(sedNameList)==0:
             return np.ones((0))
 
@@ -657,6 +772,30 @@ class PhotometryStars(PhotometryBase):
         if len(indices) == len(columnNameList):
             indices = None
 
+        if self.extinctionTable is not None:
+            sedNameList = self.column_by_name('sedFilename')
+            if len(sedNameList) == 0:
+                return np.ones((len(columnNameList), 0))
+
+            return self.extinctionTable.magnitudes(bandpassDict, sedNameList,
+                                                   self.column_by_name('magNorm'),
+                                                   self.column_by_name('galacticAv')).transpose()
+
+        if self.sedCache is not None:
+            sedNameList = self.column_by_name('sedFilename')
+            if len(sedNameList) == 0:
+                return np.ones((len(columnNameList), 0))
+
+            def sedListLoader(object_mask):
+                self._loadSedList(bandpassDict.wavelenMatch, object_mask=object_mask)
+                return self._sedList
+
+            key_columns = [sedNameList,
+                           self.column_by_name('magNorm'),
+                           self.column_by_name('galacticAv')]
+
+            return self._cachedMagnitudeGetter(bandpassDict, key_columns, 'star', sedListLoader)
+
         self._loadSedList(bandpassDict.wavelenMatch)
 
         if not hasattr(self, '_sedList'):
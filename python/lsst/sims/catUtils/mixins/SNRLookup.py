@@ -0,0 +1,231 @@
+"""
+This module provides SNRLookup, a class that tabulates the photometric
+gamma parameter (equation 5 of the LSST overview paper arXiv:0805.2366)
+as a function of m5 in each bandpass, so that signal to noise ratios and
+magnitude uncertainties can be evaluated for many (object, visit) pairs,
+each with its own m5, without calling calcGamma for every visit.
+"""
+import numpy as np
+from lsst.sims.photUtils import calcGamma, calcSNR_m5, calcMagError_m5
+from lsst.sims.photUtils import PhotometricParameters
+from .SedCache import SedCache
+
+__all__ = ["SNRLookup"]
+
+
+class SNRLookup(object):
+    """
+    Evaluate calcSNR_m5 and calcMagError_m5 for arrays of magnitudes, m5
+    values and bandpasses in one vectorized pass.
+
+    The only expensive part of calcSNR_m5 is calcGamma, which integrates
+    a flat spectrum over the bandpass.  For a given bandpass and
+    PhotometricParameters, 0.04-gamma is proportional to 10^(0.4*m5), so
+    this class tabulates ln(0.04-gamma) on a grid of m5 in each band and
+    interpolates it linearly.  The grid is refined until the interpolated
+    ln(0.04-gamma) agrees with calcGamma to within `tolerance` at the
+    midpoints of the grid, i.e. (0.04-gamma) has a relative error of at most
+    ~tolerance.  Because 1/SNR^2 = (0.04-gamma)*x + gamma*x^2 (x being the
+    flux of the source in units of the m5 flux), the relative error in SNR
+    is then at most ~tolerance/2.
+
+    m5 values outside [m5_min, m5_max] are handled with calcGamma
+    directly.
+
+    Tables are built lazily, the first time each bandpass is used.
+
+    A lookup is only valid for the bandpasses and PhotometricParameters
+    it was built from; use matches() to check that it applies to a
+    given BandpassDict and PhotometricParameters.
+    """
+
+    # the attributes of PhotometricParameters that affect SNR and
+    # magnitude uncertainties
+    _phot_param_names = ('exptime', 'nexp', 'effarea', 'gain', 'readnoise',
+                         'darkcurrent', 'othernoise', 'platescale', 'sigmaSys')
+
+    def __init__(self, bandpassDict, photParams=None, m5_min=15.0, m5_max=30.0,
+                 tolerance=1.0e-6, max_refinements=10):
+        """
+        Parameters
+        ----------
+        bandpassDict is a BandpassDict of the bandpasses that SNRs
+        will be calculated in
+
+        photParams is the PhotometricParameters used by calcGamma
+        (optional; defaults to PhotometricParameters())
+
+        m5_min, m5_max delimit the range of m5 covered by the tables
+        (default 15 to 30)
+
+        tolerance is the largest acceptable error in ln(0.04-gamma)
+        (default 10^-6)
+
+        max_refinements is the largest number of times the m5 grid
+        spacing (initially 0.1 mag) is halved in trying to meet tolerance
+        (default 10)
+        """
+        if m5_max <= m5_min:
+            raise RuntimeError('SNRLookup needs m5_max > m5_min; you gave %e, %e' % (m5_min, m5_max))
+
+        if photParams is None:
+            photParams = PhotometricParameters()
+
+        self.bandpassDict = bandpassDict
+        self.photParams = photParams
+        self.m5_min = m5_min
+        self.m5_max = m5_max
+        self.tolerance = tolerance
+        self._max_refinements = max_refinements
+
+        # the tables; keyed on bandpass name
+        self._m5_grid = {}
+        self._log_gamma_grid = {}
+
+        # the largest error in ln(0.04-gamma) found when validating
+        # each table (np.inf if no acceptable table could be built,
+        # in which case calcGamma is always called directly)
+        self.max_error = {}
+
+        self._bandpass_key = SedCache.bandpass_key(bandpassDict)
+        # results of matches(), keyed on the ids of the arguments (the
+        # arguments are kept with the results so that their ids cannot
+        # be reused)
+        self._matches = {}
+
+    def __contains__(self, bandpass_name):
+        return bandpass_name in self.bandpassDict
+
+    def _phot_param_values(self, photParams):
+        return tuple(getattr(photParams, name, None) for name in self._phot_param_names)
+
+    def matches(self, bandpassDict, photParams):
+        """
+        Return True if this lookup was built from the same bandpasses
+        (compared by content, with SedCache.bandpass_key) as bandpassDict
+        and from the same PhotometricParameters as photParams
+        """
+        key = (id(bandpassDict), id(photParams))
+        if key not in self._matches:
+            if photParams is self.photParams:
+                params_match = True
+            else:
+                params_match = (self._phot_param_values(photParams) ==
+                                self._phot_param_values(self.photParams))
+            if bandpassDict is self.bandpassDict:
+                bandpasses_match = True
+            else:
+                bandpasses_match = SedCache.bandpass_key(bandpassDict) == self._bandpass_key
+            self._matches[key] = (bandpassDict, photParams, params_match and bandpasses_match)
+        return self._matches[key][2]
+
+    def _exact_gamma(self, bandpass_name, m5):
+        bp = self.bandpassDict[bandpass_name]
+        return np.array([calcGamma(bp, mm, photParams=self.photParams) for mm in m5])
+
+    def _build_table(self, bandpass_name):
+        """
+        Tabulate ln(0.04-gamma) against m5 for one bandpass
+        """
+        step = 0.1
+        for i_refinement in range(self._max_refinements+1):
+            n_grid = int(np.ceil((self.m5_max-self.m5_min)/step)) + 1
+            m5_grid = np.linspace(self.m5_min, self.m5_max, n_grid)
+            m5_mid = 0.5*(m5_grid[1:]+m5_grid[:-1])
+
+            gamma_grid = self._exact_gamma(bandpass_name, m5_grid)
+            gamma_mid = self._exact_gamma(bandpass_name, m5_mid)
+            if (gamma_grid >= 0.04).any() or (gamma_mid >= 0.04).any():
+                break
+
+            log_gamma_grid = np.log(0.04-gamma_grid)
+            error = np.abs(np.interp(m5_mid, m5_grid, log_gamma_grid) -
+                           np.log(0.04-gamma_mid)).max()
+
+            if error <= self.tolerance:
+                self._m5_grid[bandpass_name] = m5_grid
+                self._log_gamma_grid[bandpass_name] = log_gamma_grid
+                self.max_error[bandpass_name] = error
+                return
+
+            step *= 0.5
+
+        self.max_error[bandpass_name] = np.inf
+
+    def calcGamma(self, bandpass_name, m5):
+        """
+        Return the photometric gamma for an array of m5 values
+        in the bandpass bandpass_name
+        """
+        if bandpass_name not in self.bandpassDict:
+            raise RuntimeError('SNRLookup has no bandpass %s' % str(bandpass_name))
+
+        if bandpass_name not in self.max_error:
+            self._build_table(bandpass_name)
+
+        m5 = np.atleast_1d(np.asarray(m5, dtype=float))
+        gamma = np.zeros(m5.shape, dtype=float)
+
+        if np.isfinite(self.max_error[bandpass_name]):
+            in_range = np.logical_and(m5 >= self.m5_min, m5 <= self.m5_max)
+        else:
+            in_range = np.zeros(m5.shape, dtype=bool)
+
+        if in_range.any():
+            gamma[in_range] = 0.04 - np.exp(np.interp(m5[in_range],
+                                                      self._m5_grid[bandpass_name],
+                                                      self._log_gamma_grid[bandpass_name]))
+        out_of_range = np.logical_not(in_range)
+        if out_of_range.any():
+            unq_m5, unq_inv = np.unique(m5[out_of_range], return_inverse=True)
+            gamma[out_of_range] = self._exact_gamma(bandpass_name, unq_m5)[unq_inv]
+
+        return gamma
+
+    def _evaluate(self, method, magnitude, bandpass_name, m5):
+        """
+        Broadcast magnitude, bandpass_name and m5 against each other and
+        call method (calcSNR_m5 or calcMagError_m5) once per bandpass
+        """
+        mag, m5, band = np.broadcast_arrays(np.asarray(magnitude, dtype=float),
+                                            np.asarray(m5, dtype=float),
+                                            np.asarray(bandpass_name))
+        output = np.zeros(mag.shape, dtype=float)
+        for name in np.unique(band):
+            mask = (band == name)
+            local_m5 = m5[mask]
+            gamma = self.calcGamma(str(name), local_m5)
+            output[mask], _ = method(mag[mask], self.bandpassDict[str(name)], local_m5,
+                                     self.photParams, gamma=gamma)
+        if output.ndim == 0:
+            return float(output)
+        return output
+
+    def calcSNR_m5(self, magnitude, bandpass_name, m5):
+        """
+        Calculate signal to noise ratios.
+
+        Parameters
+        ----------
+        magnitude is an array of magnitudes
+
+        bandpass_name is the name of the bandpass (or an array of names)
+
+        m5 is the 5-sigma limiting magnitude (or an array of them)
+
+        magnitude, bandpass_name, and m5 are broadcast against each other,
+        so that, e.g., a (n_objects, n_visits) array of magnitudes can be
+        evaluated against (n_visits,) arrays of bandpass names and m5.
+
+        Returns
+        -------
+        An array of signal to noise ratios with the broadcast shape
+        """
+        return self._evaluate(calcSNR_m5, magnitude, bandpass_name, m5)
+
+    def calcMagError_m5(self, magnitude, bandpass_name, m5):
+        """
+        Calculate magnitude uncertainties (including photParams.sigmaSys).
+        The inputs are as in calcSNR_m5.
+        """
+        return self._evaluate(calcMagError_m5, magnitude, bandpass_name, m5)
@@ -0,0 +1,191 @@
+"""
+This module provides SedCache, a bounded least-recently-used cache of the
+magnitudes of SEDs, which the photometry mixins can use to avoid reading
+in and integrating the same SEDs over and over again (e.g. when the same
+objects are simulated in many visits).
+"""
+import numpy as np
+import sys
+import hashlib
+from collections import OrderedDict
+
+__all__ = ["SedCache"]
+
+
+class SedCache(object):
+    """
+    A bounded, least-recently-used cache of the magnitudes of SEDs in a
+    BandpassDict.
+
+    Entries are keyed on the content that determines an object's
+    magnitudes: a hash of the BandpassDict, a tag naming the kind of
+    object (e.g. the galaxy component), and the values of the columns
+    that define the SED (e.g. sedFilename, magNorm and galacticAv).
+    Identical objects therefore share an entry no matter which chunk or
+    field of view they are queried in.
+
+    When the estimated memory used by the cache exceeds max_bytes, the
+    least recently used entries are discarded.  The estimate (see
+    _entry_bytes) counts each key tuple and its per-object values, each
+    magnitude array and the bookkeeping of the OrderedDict holding them;
+    it is approximate, since it ignores the allocator's overhead.
+
+    Assign an instance of this class to the sedCache member of an
+    InstanceCatalog that inherits from PhotometryStars or
+    PhotometryGalaxies to use it.  One instance can be shared by many
+    catalogs.
+    """
+
+    def __init__(self, max_bytes=256*1024*1024):
+        """
+        Parameters
+        ----------
+        max_bytes is the largest amount of memory (in bytes) that the
+        cache is allowed to use (default 256 MB)
+        """
+        if max_bytes <= 0:
+            raise RuntimeError('SedCache needs max_bytes > 0; you gave %e' % max_bytes)
+
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        # hashes of BandpassDicts, keyed on id (the BandpassDict is kept
+        # with its hash so that its id cannot be reused)
+        self._bandpass_keys = {}
+
+    # approximate memory (in bytes) used by the OrderedDict for each
+    # entry: its slot in the hash table (allowing for the table being
+    # partly empty) and its node in the linked list recording the order
+    _entry_overhead = 100
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def clear(self):
+        """
+        Empty the cache (the hit and miss counters are not reset)
+        """
+        self._data = OrderedDict()
+        self.n_bytes = 0
+
+    @staticmethod
+    def bandpass_key(bandpassDict):
+        """
+        Return a string identifying the contents of a BandpassDict
+        """
+        sha = hashlib.sha1()
+        for name in bandpassDict.keys():
+            bp = bandpassDict[name]
+            sha.update(str(name).encode('utf-8'))
+            sha.update(np.ascontiguousarray(bp.wavelen, dtype=float).tobytes())
+            sha.update(np.ascontiguousarray(bp.sb, dtype=float).tobytes())
+        return sha.hexdigest()
+
+    def _cached_bandpass_key(self, bandpassDict):
+        """
+        Return bandpass_key(bandpassDict), only hashing each
+        BandpassDict the first time it is seen
+        """
+        if id(bandpassDict) not in self._bandpass_keys:
+            self._bandpass_keys[id(bandpassDict)] = (bandpassDict, self.bandpass_key(bandpassDict))
+        return self._bandpass_keys[id(bandpassDict)][1]
+
+    @staticmethod
+    def _key_column(column):
+        """
+        Convert a column of values into a list of hashable values,
+        replacing NaNs with None (NaN != NaN, so NaNs could never be
+        found in the cache)
+        """
+        values = np.asarray(column).tolist()
+        return [None if (isinstance(vv, float) and vv != vv) else vv for vv in values]
+
+    def make_keys(self, bandpassDict, key_columns, tag=None):
+        """
+        Build the keys for a chunk of objects.
+
+        Parameters
+        ----------
+        bandpassDict is the BandpassDict in which magnitudes are calculated
+
+        key_columns is a list of the columns (one value per object) that
+        determine the objects' SEDs
+
+        tag is an optional hashable identifying the kind of object (so
+        that, e.g., galaxy bulges and disks with the same SED parameters
+        do not share entries if they are treated differently)
+
+        Returns
+        -------
+        A list of keys; one per object
+        """
+        prefix = (self._cached_bandpass_key(bandpassDict), tag)
+        columns = [self._key_column(col) for col in key_columns]
+        return [prefix + values for values in zip(*columns)]
+
+    def lookup(self, keys, n_bandpasses):
+        """
+        Look up the magnitudes of a list of keys.
+
+        Returns
+        -------
+        A (len(keys), n_bandpasses) numpy array of magnitudes (NaN
+        for keys that are not in the cache)
+
+        A boolean numpy array that is True for keys that are not
+        in the cache
+        """
+        magnitudes = np.empty((len(keys), n_bandpasses), dtype=float)
+        magnitudes.fill(np.nan)
+        missing = np.zeros(len(keys), dtype=bool)
+        for i_key, key in enumerate(keys):
+            value = self._data.pop(key, None)
+            if value is None:
+                missing[i_key] = True
+                self.misses += 1
+            else:
+                # re-insert the key to mark it as most recently used
+                self._data[key] = value
+                magnitudes[i_key] = value
+                self.hits += 1
+        return magnitudes, missing
+
+    @classmethod
+    def _entry_bytes(cls, key, row):
+        """
+        Estimate the memory used by one entry of the cache.  The first
+        two elements of a key (the BandpassDict hash and the tag) are
+        shared by all of the keys made by one make_keys call, so only the
+        values that follow them are counted.
+        """
+        n_bytes = cls._entry_overhead + sys.getsizeof(key) + sys.getsizeof(row)
+        for value in key[2:]:
+            n_bytes += sys.getsizeof(value)
+        return n_bytes
+
+    def store(self, keys, magnitudes):
+        """
+        Add entries to the cache.
+
+        Parameters
+        ----------
+        keys is a list of keys (see make_keys)
+
+        magnitudes is a (len(keys), n_bandpasses) array of magnitudes
+        """
+        for key, row in zip(keys, magnitudes):
+            if key in self._data:
+                old_row = self._data.pop(key)
+                self.n_bytes -= self._entry_bytes(key, old_row)
+            row = np.array(row, dtype=float)
+            self._data[key] = row
+            self.n_bytes += self._entry_bytes(key, row)
+
+        while self.n_bytes > self.max_bytes and len(self._data) > 0:
+            key, row = self._data.popitem(last=False)
+            self.n_bytes -= self._entry_bytes(key, row)
@@ -848,24 +848,35 @@ class MLTflaringMixin(Variability):
             bb_flambda = np.exp(log_bb_flambda)
             bb_sed = Sed(wavelen=bb_wavelen, flambda=bb_flambda)
 
-            base_fluxes = self.lsstBandpassDict.fluxListForSed(bb_sed)
-
-            a_x, b_x = bb_sed.setupCCM_ab()
             self._mlt_dust_lookup = {}
             self._mlt_dust_lookup['ebv'] = ebv_grid
             list_of_bp = self.lsstBandpassDict.keys()
-            for bp in list_of_bp:
-                self._mlt_dust_lookup[bp] = np.zeros(len(ebv_grid))
-            for iebv, ebv_val in enumerate(ebv_grid):
-                wv, fl = bb_sed.addDust(a_x, b_x,
-                                        ebv=ebv_val,
-                                        wavelen=bb_wavelen,
-                                        flambda=bb_flambda)
-
-                dusty_bb = Sed(wavelen=wv, flambda=fl)
-                dusty_fluxes = self.lsstBandpassDict.fluxListForSed(dusty_bb)
+
+            extinction_table = getattr(self, 'extinctionTable', None)
+            if extinction_table is not None:
+                # interpolate the extinction of the black body from
+                # the (persistent) tables of the ExtinctionTable
+                extinction_table.register_sed('mlt_flare_bb_9000K', bb_sed)
+                extinction = extinction_table.extinction(self.lsstBandpassDict,
+                                                         ['mlt_flare_bb_9000K']*len(ebv_grid),
+                                                         3.1*ebv_grid)
                 for ibp, bp in enumerate(list_of_bp):
-                    self._mlt_dust_lookup[bp][iebv] = dusty_fluxes[ibp]/base_fluxes[ibp]
+                    self._mlt_dust_lookup[bp] = np.power(10.0, -0.4*extinction[:, ibp])
+            else:
+                base_fluxes = self.lsstBandpassDict.fluxListForSed(bb_sed)
+                a_x, b_x = bb_sed.setupCCM_ab()
+                for bp in list_of_bp:
+                    self._mlt_dust_lookup[bp] = np.zeros(len(ebv_grid))
+                for iebv, ebv_val in enumerate(ebv_grid):
+                    wv, fl = bb_sed.addDust(a_x, b_x,
+                                            ebv=ebv_val,
+                                            wavelen=bb_wavelen,
+                                            flambda=bb_flambda)
+
+                    dusty_bb = Sed(wavelen=wv, flambda=fl)
+                    dusty_fluxes = self.lsstBandpassDict.fluxListForSed(dusty_bb)
+                    for ibp, bp in enumerate(list_of_bp):
+                        self._mlt_dust_lookup[bp][iebv] = dusty_fluxes[ibp]/base_fluxes[ibp]
 
         # get the distance to each star in parsecs
         _au_to_parsec = 1.0/206265.0
@@ -1,4 +1,7 @@
 from .AstrometryMixin import *
+from .SNRLookup import *
+from .SedCache import *
+from .ExtinctionTable import *
 from .PhotometryMixin import *
 from .VariabilityMixin import *
 from .EBVmixin import *
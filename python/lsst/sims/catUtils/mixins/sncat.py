@@ -24,6 +24,8 @@ from lsst.sims.catUtils.mixins import CosmologyMixin
 import lsst.sims.photUtils.PhotometricParameters as PhotometricParameters
 from lsst.sims.catUtils.supernovae import SNObject
 from lsst.sims.catUtils.supernovae import SNUniverse
+from lsst.sims.catUtils.supernovae import SALT2PhotometryEngine
+from lsst.sims.photUtils import calcSNR_m5, calcMagError_m5
 from lsst.sims.catUtils.mixins import EBVmixin
 from lsst.sims.utils import _galacticFromEquatorial
 import astropy
@@ -73,7 +75,9 @@ class SNFunctionality(InstanceCatalog, EBVmixin, CosmologyMixin, SNUniverse):
     # 'mag_u', 'mag_g', 'mag_r', 'mag_i', 'mag_z', 'mag_y']
     cannot_be_null = ['x0', 'z', 't0']
 
-    _sn_object_cache = None
+    # SALT2FluxGrid (built for lsstBandpassDict) from which to interpolate
+    # SN fluxes; if None, fluxes are integrated from the SALT2 SEDs
+    snFluxGrid = None
 
     @astropy.utils.lazyproperty
     def mjdobs(self):
@@ -123,6 +127,15 @@ class SNFunctionality(InstanceCatalog, EBVmixin, CosmologyMixin, SNUniverse):
     def lsstBandpassDict(self):
         return BandpassDict.loadTotalBandpassesFromFiles()
 
+    @astropy.utils.lazyproperty
+    def snPhotometryEngine(self):
+        """
+        The SALT2PhotometryEngine used to calculate the photometry of the SN
+        """
+        return SALT2PhotometryEngine(self.lsstBandpassDict,
+                                     photParams=self.photometricparameters,
+                                     flux_grid=self.snFluxGrid)
+
     @astropy.utils.lazyproperty
     def observedIndices(self):
         bandPassNames = self.obs_metadata.bandpass
@@ -246,27 +259,19 @@ class SNFunctionality(InstanceCatalog, EBVmixin, CosmologyMixin, SNUniverse):
         """
         getters for brightness related parameters of sn
         """
-        if self._sn_object_cache is None or len(self._sn_object_cache) > 1000000:
-            self._sn_object_cache = {}
-
-        c, x1, x0, t0, _z, ra, dec = self.column_by_name('c'),\
+        c, x1, x0, t0, _z = self.column_by_name('c'),\
             self.column_by_name('x1'),\
             self.column_by_name('x0'),\
             self.column_by_name('t0'),\
-            self.column_by_name('redshift'),\
-            self.column_by_name('raJ2000'),\
-            self.column_by_name('decJ2000')
-
-        raDeg = np.degrees(ra)
-        decDeg = np.degrees(dec)
+            self.column_by_name('redshift')
 
         ebv = self.column_by_name('EBV')
-        id_list = self.column_by_name('snid')
 
         bandname = self.obs_metadata.bandpass
         if isinstance(bandname, list):
             raise ValueError('bandname expected to be string, but is list\n')
         bandpass = self.lsstBandpassDict[bandname]
+        i_band = list(self.lsstBandpassDict.keys()).index(bandname)
 
         # Initialize return array so that it contains the values you would get
         # if you passed through a t0=self.badvalues supernova
@@ -274,49 +279,31 @@ class SNFunctionality(InstanceCatalog, EBVmixin, CosmologyMixin, SNUniverse):
                         [np.nan]*len(t0), [np.inf]*len(t0),
                         [0.0]*len(t0)]).transpose()
 
-        for i in np.where(np.logical_and(np.isfinite(t0),
-                                         np.abs(self.mjdobs - t0) < self.maxTimeSNVisible))[0]:
-
-            if id_list[i] in self._sn_object_cache:
-                SNobject = self._sn_object_cache[id_list[i]]
-            else:
-                SNobject = SNObject()
-                SNobject.set(z=_z[i], c=c[i], x1=x1[i], t0=t0[i], x0=x0[i])
-                SNobject.setCoords(ra=raDeg[i], dec=decDeg[i])
-                SNobject.set_MWebv(ebv[i])
-                self._sn_object_cache[id_list[i]] = SNobject
-
-            if self.mjdobs <= SNobject.maxtime() and self.mjdobs >= SNobject.mintime():
-
-                # Calculate fluxes
-                fluxinMaggies = SNobject.catsimBandFlux(time=self.mjdobs,
-                                                        bandpassobject=bandpass)
-                mag = SNobject.catsimBandMag(time=self.mjdobs,
-                                             fluxinMaggies=fluxinMaggies,
-                                             bandpassobject=bandpass)
-                vals[i, 0] = fluxinMaggies
-                vals[i, 1] = mag
-                flux_err = SNobject.catsimBandFluxError(time=self.mjdobs,
-                                                        bandpassobject=bandpass,
-                                                        m5=self.obs_metadata.m5[
-                                                            bandname],
-                                                        photParams=self.photometricparameters,
-                                                        fluxinMaggies=fluxinMaggies,
-                                                        magnitude=mag)
-
-                mag_err = SNobject.catsimBandMagError(time=self.mjdobs,
-                                                      bandpassobject=bandpass,
-                                                      m5=self.obs_metadata.m5[
-                                                          bandname],
-                                                      photParams=self.photometricparameters,
-                                                      magnitude=mag)
-                sed = SNobject.SNObjectSED(time=self.mjdobs,
-                                           bandpass=self.lsstBandpassDict,
-                                           applyExtinction=True)
-                adu = sed.calcADU(bandpass, photParams=self.photometricparameters)
-                vals[i, 2] = flux_err
-                vals[i, 3] = mag_err
-                vals[i, 4] = adu
+        with np.errstate(invalid='ignore'):
+            candidates = np.logical_and(np.isfinite(t0),
+                                        np.abs(self.mjdobs - t0) < self.maxTimeSNVisible)
+        candidates[candidates] = self.snPhotometryEngine.in_time_range(self.mjdobs,
+                                                                       t0[candidates],
+                                                                       _z[candidates])
+        active = np.where(candidates)[0]
+
+        if len(active) > 0:
+            flux, mag, adu = self.snPhotometryEngine.photometry(self.mjdobs, c[active],
+                                                                x1[active], x0[active],
+                                                                t0[active], _z[active],
+                                                                ebv[active])
+            mag = mag[:, i_band]
+            m5 = self.obs_metadata.m5[bandname]
+            snr, gamma = calcSNR_m5(mag, bandpass, m5, self.photometricparameters)
+            mag_err, gamma = calcMagError_m5(mag, bandpass, m5, self.photometricparameters)
+
+            vals[active, 0] = flux[:, i_band]
+            vals[active, 1] = mag
+            # as in SNObject.catsimBandFluxError, the flux error is
+            # calculated from the flux implied by the magnitude
+            vals[active, 2] = np.power(10.0, -0.4*mag)/snr
+            vals[active, 3] = mag_err
+            vals[active, 4] = adu[:, i_band]
 
         return (vals[:, 0], vals[:, 1], vals[:, 2], vals[:, 3], vals[:, 4])
 
@@ -333,34 +320,17 @@ class SNFunctionality(InstanceCatalog, EBVmixin, CosmologyMixin, SNUniverse):
             self.column_by_name('raJ2000'),\
             self.column_by_name('decJ2000')
 
-        raDeg = np.degrees(ra)
-        decDeg = np.degrees(dec)
+        # the (uninterpolated) E(B-V) that SNObject.mwEBVfromMaps would find
+        if len(ra) > 0:
+            mwebv = np.array(self.calculateEbv(equatorialCoordinates=np.array([ra, dec])))
+        else:
+            mwebv = np.zeros(0, dtype=float)
 
-        snobject = SNObject()
-        # Initialize return array
-        vals = np.zeros(shape=(self.numobjs, 19))
-        for i, _ in enumerate(vals):
-            snobject.set(z=_z[i], c=c[i], x1=x1[i], t0=t0[i], x0=x0[i])
-            snobject.setCoords(ra=raDeg[i], dec=decDeg[i])
-            snobject.mwEBVfromMaps()
-            # Calculate fluxes
-            vals[i, :6] = snobject.catsimManyBandFluxes(time=self.mjdobs,
-                                                        bandpassDict=self.lsstBandpassDict,
-                                                        observedBandPassInd=None)
-            # Calculate magnitudes
-            vals[i, 6:12] = snobject.catsimManyBandMags(time=self.mjdobs,
-                                                        bandpassDict=self.lsstBandpassDict,
-                                                        observedBandPassInd=None)
-
-            vals[i, 12:18] = snobject.catsimManyBandADUs(time=self.mjdobs,
-                                                         bandpassDict=self.lsstBandpassDict,
-                                                         photParams=self.photometricparameters)
-            vals[i, 18] = snobject.ebvofMW
-        return (vals[:, 0], vals[:, 1], vals[:, 2], vals[:, 3],
-                vals[:, 4], vals[:, 5], vals[:, 6], vals[:, 7],
-                vals[:, 8], vals[:, 9], vals[:, 10], vals[:, 11],
-                vals[:, 12], vals[:, 13], vals[:, 14], vals[:, 15],
-                vals[:, 16], vals[:, 17], vals[:, 18])
+        flux, mag, adu = self.snPhotometryEngine.photometry(self.mjdobs, c, x1, x0, t0,
+                                                            _z, mwebv)
+
+        return tuple(flux.transpose()) + tuple(mag.transpose()) + \
+               tuple(adu.transpose()) + (mwebv,)
 
     #def get_EBV(self):
     #    return self.column_by_name('EBV')
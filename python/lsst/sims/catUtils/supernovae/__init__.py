@@ -1,3 +1,8 @@
 from .snObject import *
+from .snVisibility import *
+from .counterRNG import *
+from .x0Lookup import *
 from .snUniversalRules import *
 from .utils import *
+from .salt2FluxGrid import *
+from .snPhotometry import *
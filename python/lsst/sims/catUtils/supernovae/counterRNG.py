@@ -0,0 +1,78 @@
+"""
+This module provides CounterRNG, a counter-based random number generator
+that draws random numbers for many keys (e.g. host galaxy ids) at once,
+each key getting the same sequence no matter how the keys are batched.
+"""
+import numpy as np
+
+__all__ = ["CounterRNG"]
+
+
+def _splitmix64(x):
+    """
+    The splitmix64 finalizer, applied to a numpy array of uint64
+    (arithmetic wraps modulo 2^64)
+    """
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+class CounterRNG(object):
+    """
+    A counter-based random number generator.
+
+    The n-th random number of the sequence belonging to a key is a hash
+    of (seed, key, n), so the random numbers of a whole array of keys are
+    drawn with a handful of vectorized integer operations, and the numbers
+    drawn for a key do not depend on which other keys are drawn alongside
+    it.  Callers assign the counters: e.g. SNUniverse.drawSNParamArrays
+    uses counter 0 for t0, counters 1 and 2 for c, and so on.
+    """
+
+    def __init__(self, seed=0):
+        """
+        Parameters
+        ----------
+        seed is an int that selects an independent family of sequences
+        (default 0)
+        """
+        self.seed = seed
+        with np.errstate(over='ignore'):
+            self._seed_hash = _splitmix64(np.array([seed], dtype=np.int64).view(np.uint64))[0]
+
+    def _bits(self, key, counter):
+        key = np.atleast_1d(np.asarray(key)).astype(np.int64).view(np.uint64)
+        with np.errstate(over='ignore'):
+            x = _splitmix64(key ^ self._seed_hash)
+            return _splitmix64(x + np.uint64(counter))
+
+    def uniform(self, key, counter, low=0.0, high=1.0):
+        """
+        Return a numpy array of random numbers drawn uniformly from
+        the open interval (low, high), one for each of key
+
+        Parameters
+        ----------
+        key is an int or numpy array of ints (e.g. host galaxy ids)
+
+        counter is the (non-negative int) position in the sequence of
+        each key of the numbers to draw
+
+        low and high delimit the interval (default 0 to 1)
+        """
+        bits = self._bits(key, counter)
+        unit = ((bits >> np.uint64(11)).astype(float) + 0.5)*(1.0/9007199254740992.0)
+        return low + (high-low)*unit
+
+    def normal(self, key, counter, loc=0.0, scale=1.0):
+        """
+        Return a numpy array of normally distributed random numbers, one
+        for each of key.  The numbers are calculated with the Box-Muller
+        transform from the uniform numbers at counter and counter+1, so
+        callers must not use counter+1 for anything else.
+        """
+        u1 = self.uniform(key, counter)
+        u2 = self.uniform(key, counter+1)
+        return loc + scale*np.sqrt(-2.0*np.log(u1))*np.cos(2.0*np.pi*u2)
@@ -0,0 +1,451 @@
+"""
+This module provides SALT2FluxGrid, a table of SALT2 band fluxes on a grid
+of redshift, rest-frame phase, x1 and c, which is interpolated to evaluate
+supernova light curves without integrating the model spectrum over the
+bandpasses for every supernova at every epoch.
+"""
+import os
+import json
+import hashlib
+import itertools
+import numpy as np
+
+from lsst.sims.photUtils import Sed
+from .snObject import SNObject
+
+__all__ = ["SALT2FluxGrid"]
+
+
+class SALT2FluxGrid(object):
+    """
+    Evaluate SALT2 band fluxes for many supernovae and epochs by interpolating
+    a precomputed grid.
+
+    The flux of a SALT2 model is proportional to x0, so the grid holds the
+    flux (in maggies) per unit x0 in every bandpass of a BandpassDict on a
+    regular grid of redshift z, rest-frame phase, x1 and c.  Fluxes are
+    calculated exactly as SNObject.catsimBandFlux calculates them (the SED is
+    rectified and integrated over the bandpass with sims_photUtils).  Milky
+    Way extinction is applied with the CCM model of Sed.addDust: the grid
+    holds the fluxes both without extinction and with E(B-V) = ebv_ref;
+    because the extinction curve is exponential in E(B-V), the flux at any
+    other E(B-V) is interpolated as
+    F(0)*(F(ebv_ref)/F(0))^(E(B-V)/ebv_ref).
+
+    The grid is refined until, at the midpoints of the grid cells along each
+    axis, the interpolated flux agrees with the exact flux to within
+    `tolerance` times the peak flux of the light curve in that band.  The
+    check is done on a random sample of grid cells and without extinction.
+
+    Supernovae whose z, x1 or c are outside of the grid are evaluated
+    exactly, one supernova at a time.
+
+    If file_name is given, the grid is read from that file if it was built
+    with the same model, bandpasses, ranges and tolerance; otherwise the grid
+    is built and written to file_name.
+    """
+
+    # bump this when the layout of the grid file changes
+    _format_version = 1
+
+    # the E(B-V) at which the extincted fluxes are tabulated
+    _ebv_ref = 0.1
+
+    def __init__(self, bandpassDict, source='salt2-extended',
+                 z_range=(0.01, 1.2), x1_range=(-3.0, 3.0), c_range=(-0.3, 0.3),
+                 tolerance=0.005, max_refinements=4, n_check=100,
+                 file_name=None, seed=88):
+        """
+        Parameters
+        ----------
+        bandpassDict is the BandpassDict of the bandpasses in which
+        fluxes will be calculated
+
+        source is the sncosmo source (or name of the source) of the SALT2
+        model (default 'salt2-extended', as in SNObject)
+
+        z_range, x1_range and c_range are tuples of the (min, max) redshift,
+        x1 and c covered by the grid (defaults (0.01, 1.2), (-3, 3),
+        (-0.3, 0.3))
+
+        tolerance is the largest acceptable error of the interpolated flux
+        as a fraction of the peak flux of the light curve (default 0.005)
+
+        max_refinements is the largest number of times the step of one
+        of the axes of the grid is halved in trying to meet tolerance
+        (default 4)
+
+        n_check is the number of randomly chosen grid cells at which the
+        interpolation is checked against the exact fluxes (default 100)
+
+        file_name is the name of the (.npz) file in which the grid is kept
+        (optional; if None, the grid is built and kept in memory only)
+
+        seed seeds the random number generator choosing the grid cells
+        at which the interpolation is checked
+        """
+        for name, val_range in (('z_range', z_range), ('x1_range', x1_range),
+                                ('c_range', c_range)):
+            if val_range[1] <= val_range[0]:
+                raise RuntimeError('SALT2FluxGrid needs %s[1] > %s[0]; you gave %s'
+                                   % (name, name, str(val_range)))
+        if z_range[0] <= 0.0:
+            raise RuntimeError('SALT2FluxGrid needs z_range[0] > 0; you gave %e' % z_range[0])
+
+        self.bandpassDict = bandpassDict
+        self.bandpass_names = list(bandpassDict.keys())
+        self.z_range = tuple(float(zz) for zz in z_range)
+        self.x1_range = tuple(float(xx) for xx in x1_range)
+        self.c_range = tuple(float(cc) for cc in c_range)
+        self.tolerance = tolerance
+        self.file_name = file_name
+        self._max_refinements = max_refinements
+        self._n_check = n_check
+        self._seed = seed
+
+        self._snobj = SNObject(source=source)
+        self._snobj.set(x0=1.0, t0=0.0)
+        if isinstance(source, str):
+            self._source_name = source
+        else:
+            self._source_name = '%s:%s' % (source.name, str(source.version))
+        self._min_phase = self._snobj.source.minphase()
+        self._max_phase = self._snobj.source.maxphase()
+
+        # convert flambda on the wavelength grid of the bandpasses into
+        # fluxes in maggies with one matrix product
+        self._wavelen = bandpassDict.wavelenMatch
+        self._phi = bandpassDict.phiArray
+        unit_sed = Sed(wavelen=self._wavelen, flambda=np.ones(len(self._wavelen)))
+        unit_sed.flambdaTofnu()
+        self._fnu_factor = unit_sed.fnu*bandpassDict.wavelenStep/3631.0
+
+        # log10 of the dust transmission per unit E(B-V)
+        dust_sed = Sed(wavelen=self._wavelen, flambda=np.ones(len(self._wavelen)))
+        a_x, b_x = dust_sed.setupCCM_ab()
+        dust_sed.addDust(a_x, b_x, ebv=1.0)
+        self._log_dust = np.log10(dust_sed.flambda)
+
+        # the largest interpolation error found along each axis
+        # of the grid (z, phase, x1, c)
+        self.max_error = None
+
+        self._z_grid = None
+        self._phase_grid = None
+        self._x1_grid = None
+        self._c_grid = None
+        self._flux = None
+
+        if file_name is not None and self._read_grid(file_name):
+            return
+
+        self._build_grid()
+
+        if file_name is not None:
+            self._write_grid(file_name)
+
+    def _meta(self):
+        """
+        Return the dict identifying the grids this instance can use
+        """
+        bp_hash = hashlib.sha1(np.ascontiguousarray(self._wavelen).tobytes())
+        bp_hash.update(np.ascontiguousarray(self._phi).tobytes())
+        return {'format_version': self._format_version,
+                'source': self._source_name,
+                'bandpasses': self.bandpass_names,
+                'bandpass_hash': bp_hash.hexdigest(),
+                'z_range': list(self.z_range),
+                'x1_range': list(self.x1_range),
+                'c_range': list(self.c_range),
+                'tolerance': self.tolerance,
+                'ebv_ref': self._ebv_ref}
+
+    def _read_grid(self, file_name):
+        """
+        Read the grid from file_name.  Return True if the file exists
+        and contains a grid built for this instance; False otherwise.
+        """
+        if not os.path.exists(file_name):
+            return False
+        with np.load(file_name) as data:
+            if json.loads(str(data['meta'])) != self._meta():
+                return False
+            self._z_grid = data['z_grid']
+            self._phase_grid = data['phase_grid']
+            self._x1_grid = data['x1_grid']
+            self._c_grid = data['c_grid']
+            self._flux = data['flux']
+            self.max_error = data['max_error']
+        return True
+
+    def _write_grid(self, file_name):
+        """
+        Write the grid to file_name (via a temporary file, so that another
+        process never reads a partially written grid)
+        """
+        out_dir = os.path.dirname(os.path.abspath(file_name))
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        tmp_name = '%s.%d.tmp.npz' % (file_name, os.getpid())
+        np.savez(tmp_name, meta=np.array(json.dumps(self._meta())),
+                 z_grid=self._z_grid, phase_grid=self._phase_grid,
+                 x1_grid=self._x1_grid, c_grid=self._c_grid,
+                 flux=self._flux, max_error=self.max_error)
+        os.rename(tmp_name, file_name)
+
+    def _exact_fluxes(self, z, x1, c, phase, ebv_list):
+        """
+        Calculate the fluxes in maggies per unit x0 of one supernova.
+
+        Parameters
+        ----------
+        z, x1 and c are the SALT2 parameters of the supernova
+
+        phase is a numpy array of rest-frame phases (in days)
+
+        ebv_list is a list of Milky Way E(B-V) values
+
+        Returns
+        -------
+        A numpy array of shape (len(phase), len(ebv_list), n_bandpasses).
+        Fluxes outside of the phase range of the model are zero.
+        """
+        snobj = self._snobj
+        snobj.set(z=z, x1=x1, c=c)
+        phase = np.atleast_1d(phase)
+
+        wave_ang = self._wavelen*10.0
+        wave_mask = np.logical_and(wave_ang >= snobj.minwave(),
+                                   wave_ang <= snobj.maxwave())
+        in_range = np.logical_and(phase >= self._min_phase, phase <= self._max_phase)
+
+        flambda = np.zeros((len(phase), len(self._wavelen)), dtype=float)
+        if in_range.any() and wave_mask.any():
+            sn_flux = snobj.flux(time=phase[in_range]*(1.0+z), wave=wave_ang[wave_mask])
+            flambda[np.ix_(np.where(in_range)[0], np.where(wave_mask)[0])] = \
+                np.where(sn_flux > 0.0, sn_flux, 0.0)*10.0
+
+        output = np.zeros((len(phase), len(ebv_list), len(self.bandpass_names)), dtype=float)
+        fnu = flambda*self._fnu_factor
+        for i_ebv, ebv in enumerate(ebv_list):
+            if ebv == 0.0:
+                output[:, i_ebv, :] = np.dot(fnu, self._phi.transpose())
+            else:
+                output[:, i_ebv, :] = np.dot(fnu*np.power(10.0, ebv*self._log_dust),
+                                             self._phi.transpose())
+        return output
+
+    def _tabulate(self, z_grid, phase_grid, x1_grid, c_grid):
+        flux = np.zeros((len(z_grid), len(phase_grid), len(x1_grid), len(c_grid),
+                         2, len(self.bandpass_names)), dtype=float)
+        for i_z, zz in enumerate(z_grid):
+            for i_x1, x1 in enumerate(x1_grid):
+                for i_c, cc in enumerate(c_grid):
+                    flux[i_z, :, i_x1, i_c] = self._exact_fluxes(zz, x1, cc, phase_grid,
+                                                                 [0.0, self._ebv_ref])
+        return flux
+
+    def _interpolation_errors(self):
+        """
+        Return the largest error of the interpolated fluxes (as a fraction
+        of the peak flux of the light curve) at the midpoints of a random
+        sample of grid cells along each axis (z, phase, x1, c)
+        """
+        rng = np.random.RandomState(self._seed)
+        grids = [self._z_grid, self._x1_grid, self._c_grid]
+        phase_mid = 0.5*(self._phase_grid[1:]+self._phase_grid[:-1])
+        phase_all = np.concatenate([self._phase_grid, phase_mid])
+        n_phase = len(self._phase_grid)
+
+        errors = np.zeros(4, dtype=float)
+        for i_check in range(self._n_check):
+            cell = [rng.randint(0, len(gg)-1) for gg in grids]
+            node = [gg[ii] for gg, ii in zip(grids, cell)]
+            tests = [(1, node, phase_mid)]
+            for i_axis, axis in ((0, 0), (2, 1), (3, 2)):
+                params = list(node)
+                params[axis] = 0.5*(grids[axis][cell[axis]]+grids[axis][cell[axis]+1])
+                tests.append((i_axis, params, self._phase_grid))
+
+            for i_axis, params, phase in tests:
+                if i_axis == 1:
+                    exact_all = self._exact_fluxes(params[0], params[1], params[2],
+                                                   phase_all, [0.0])[:, 0, :]
+                    peak = exact_all.max(axis=0)
+                    exact = exact_all[n_phase:]
+                else:
+                    exact = self._exact_fluxes(params[0], params[1], params[2],
+                                               phase, [0.0])[:, 0, :]
+                    peak = exact.max(axis=0)
+                n_pts = len(phase)
+                interp = self._interpolate(np.full(n_pts, params[0]), phase,
+                                           np.full(n_pts, params[1]),
+                                           np.full(n_pts, params[2]))[:, 0, :]
+                valid = peak > 0.0
+                if valid.any():
+                    err = np.abs(interp[:, valid]-exact[:, valid])/peak[valid]
+                    errors[i_axis] = max(errors[i_axis], err.max())
+        return errors
+
+    def _build_grid(self):
+        """
+        Tabulate the fluxes, halving the step of the axis along which the
+        interpolation is worst until the interpolation meets tolerance
+        """
+        steps = [0.05, 1.0, 1.0, 0.1]
+        ranges = [self.z_range, (self._min_phase, self._max_phase),
+                  self.x1_range, self.c_range]
+
+        for i_refinement in range(self._max_refinements+1):
+            grids = []
+            for step, val_range in zip(steps, ranges):
+                n_grid = max(int(np.ceil((val_range[1]-val_range[0])/step)), 1) + 1
+                grids.append(np.linspace(val_range[0], val_range[1], n_grid))
+            self._z_grid, self._phase_grid, self._x1_grid, self._c_grid = grids
+            self._flux = self._tabulate(*grids)
+            self.max_error = self._interpolation_errors()
+            if self.max_error.max() <= self.tolerance:
+                return
+            steps[np.argmax(self.max_error)] *= 0.5
+
+        raise RuntimeError('SALT2FluxGrid could not meet tolerance %e after %d refinements; '
+                           'the largest errors along (z, phase, x1, c) are %s.  '
+                           'Increase tolerance or max_refinements.'
+                           % (self.tolerance, self._max_refinements, str(self.max_error)))
+
+    @staticmethod
+    def _locate(grid, values):
+        """
+        Return the index of the grid cell containing each of values
+        and the fractional position of values within those cells
+        """
+        step = grid[1]-grid[0]
+        dex = np.clip(np.floor((values-grid[0])/step).astype(int), 0, len(grid)-2)
+        return dex, (values-grid[dex])/step
+
+    def _interpolate(self, z, phase, x1, c, band_dex=None):
+        """
+        Multilinearly interpolate the grid at the points (z, phase, x1, c)
+        (numpy arrays of the same length, all within the grid).
+
+        Returns a numpy array of shape (n_points, 2, n_bandpasses) holding
+        the fluxes with E(B-V) = 0 and E(B-V) = ebv_ref or, if band_dex (an
+        array of bandpass indexes, one per point) is given, of shape
+        (n_points, 2).
+        """
+        located = [self._locate(grid, vv) for grid, vv in
+                   ((self._z_grid, z), (self._phase_grid, phase),
+                    (self._x1_grid, x1), (self._c_grid, c))]
+
+        if band_dex is None:
+            output = np.zeros((len(z), 2, len(self.bandpass_names)), dtype=float)
+        else:
+            output = np.zeros((len(z), 2), dtype=float)
+
+        for corner in itertools.product((0, 1), repeat=4):
+            weight = np.ones(len(z), dtype=float)
+            dexes = []
+            for offset, (dex, frac) in zip(corner, located):
+                weight *= frac if offset == 1 else 1.0-frac
+                dexes.append(dex+offset)
+            if band_dex is None:
+                output += weight[:, None, None]*self._flux[dexes[0], dexes[1], dexes[2], dexes[3]]
+            else:
+                output += weight[:, None]*self._flux[dexes[0], dexes[1], dexes[2], dexes[3],
+                                                     :, band_dex]
+        return output
+
+    def fluxes(self, mjd, t0, z, x1, c, x0, ebv=0.0, bandpass_name=None):
+        """
+        Calculate the fluxes of supernovae in maggies.
+
+        Parameters
+        ----------
+        mjd is the MJD of observation
+
+        t0, z, x1, c and x0 are the SALT2 parameters of the supernovae
+
+        ebv is the Milky Way E(B-V) along the line of sight (default 0)
+
+        bandpass_name is the name of the bandpass in which to calculate
+        the flux (or an array of them; optional)
+
+        All of the parameters are broadcast against each other, so that,
+        e.g., the fluxes of n_sne supernovae in n_visits visits are
+        calculated by passing mjd and bandpass_name as (n_visits,) arrays
+        and the SALT2 parameters as (n_sne, 1) arrays.
+
+        Returns
+        -------
+        A numpy array of fluxes with the broadcast shape of the parameters
+        or, if bandpass_name is None, with the broadcast shape plus a last
+        axis running over the bandpasses of bandpassDict.  Fluxes outside of
+        the time range of the model are zero.
+        """
+        params = [mjd, t0, z, x1, c, x0, ebv]
+        if bandpass_name is not None:
+            params.append(np.asarray(bandpass_name))
+        params = np.broadcast_arrays(*[np.asarray(pp) for pp in params])
+        shape = params[0].shape
+        mjd, t0, z, x1, c, x0, ebv = [pp.astype(float).flatten() for pp in params[:7]]
+
+        band_dex = None
+        n_bands = len(self.bandpass_names)
+        if bandpass_name is not None:
+            names = params[7].astype(str).flatten()
+            band_dex = np.zeros(len(names), dtype=int)
+            for name in np.unique(names):
+                if name not in self.bandpass_names:
+                    raise RuntimeError('SALT2FluxGrid has no bandpass %s' % name)
+                band_dex[names == name] = self.bandpass_names.index(name)
+            n_bands = 1
+
+        phase = (mjd-t0)/(1.0+z)
+        flux = np.zeros((len(mjd), 2, n_bands), dtype=float)
+
+        active = np.logical_and(phase > self._min_phase, phase < self._max_phase)
+        on_grid = np.logical_and(active, np.isfinite(x0))
+        for vv, val_range in ((z, self.z_range), (x1, self.x1_range), (c, self.c_range)):
+            on_grid &= np.logical_and(vv >= val_range[0], vv <= val_range[1])
+
+        if on_grid.any():
+            dex = np.where(on_grid)[0]
+            if band_dex is None:
+                flux[dex] = self._interpolate(z[dex], phase[dex], x1[dex], c[dex])
+            else:
+                flux[dex, :, 0] = self._interpolate(z[dex], phase[dex], x1[dex], c[dex],
+                                                    band_dex=band_dex[dex])
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dust_ratio = np.where(flux[:, 0, :] > 0.0, flux[:, 1, :]/flux[:, 0, :], 1.0)
+            output = flux[:, 0, :]*np.power(dust_ratio, (ebv/self._ebv_ref)[:, None])
+        output = np.where(output > 0.0, output, 0.0)
+
+        # supernovae off of the grid are evaluated exactly
+        off_grid = np.logical_and(active, np.logical_not(on_grid))
+        if off_grid.any():
+            dex = np.where(off_grid)[0]
+            sn_params = np.array([z[dex], x1[dex], c[dex], ebv[dex]]).transpose()
+            unq_params, unq_inv = np.unique(sn_params, axis=0, return_inverse=True)
+            unq_inv = unq_inv.flatten()
+            for i_sn, sn in enumerate(unq_params):
+                sn_dex = dex[unq_inv == i_sn]
+                exact = self._exact_fluxes(sn[0], sn[1], sn[2], phase[sn_dex], [sn[3]])[:, 0, :]
+                if band_dex is None:
+                    output[sn_dex] = exact
+                else:
+                    output[sn_dex, 0] = exact[np.arange(len(sn_dex)), band_dex[sn_dex]]
+
+        output = output*x0[:, None]
+        if band_dex is not None:
+            return output[:, 0].reshape(shape)
+        return output.reshape(shape+(len(self.bandpass_names),))
+
+    def mags(self, mjd, t0, z, x1, c, x0, ebv=0.0, bandpass_name=None):
+        """
+        Calculate the AB magnitudes of supernovae.  The parameters and
+        outputs are as in fluxes(); zero fluxes have magnitude np.inf.
+        """
+        flux = self.fluxes(mjd, t0, z, x1, c, x0, ebv=ebv, bandpass_name=bandpass_name)
+        with np.errstate(divide='ignore'):
+            return -2.5*np.log10(flux)
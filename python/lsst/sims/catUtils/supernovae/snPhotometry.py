@@ -0,0 +1,167 @@
+"""
+This module provides SALT2PhotometryEngine, which calculates the fluxes,
+magnitudes and ADU of many SALT2 supernovae observed at one time in every
+bandpass of a BandpassDict at once.
+"""
+import numpy as np
+
+from lsst.sims.photUtils import Sed, PhotometricParameters
+from .snObject import SNObject
+from .snVisibility import SALT2VisibilityWindow
+
+__all__ = ["SALT2PhotometryEngine"]
+
+
+class SALT2PhotometryEngine(object):
+    """
+    Calculate SALT2 photometry for arrays of supernovae.
+
+    The SED of each supernova is still evaluated by its SNObject, but the
+    SEDs are stacked into one (n_sne, n_wavelengths) array so that Milky Way
+    extinction, the conversion to f_nu and the integrals over the bandpasses
+    are done with a handful of vectorized operations.  The bandpass
+    integrals are shared by all of the supernovae:
+
+    - the flux in maggies is the matrix product of f_nu with the phiArray
+      of the BandpassDict
+
+    - ADU are proportional to the flux in maggies, so they are the flux
+      times the ADU of a flat, 0th magnitude (AB) source, calculated once
+      per bandpass with Sed.calcADU
+
+    The results are the same as those of SNObject.catsimManyBandFluxes,
+    catsimManyBandMags and catsimManyBandADUs.  If a SALT2FluxGrid is given,
+    the fluxes are interpolated from it instead (to within its tolerance)
+    and no SEDs are evaluated at all.
+    """
+
+    def __init__(self, bandpassDict, photParams=None, flux_grid=None,
+                 source='salt2-extended'):
+        """
+        Parameters
+        ----------
+        bandpassDict is the BandpassDict of the bandpasses in which the
+        photometry is calculated
+
+        photParams is the PhotometricParameters used to calculate ADU
+        (optional; defaults to PhotometricParameters())
+
+        flux_grid is a SALT2FluxGrid (built for bandpassDict) from which to
+        interpolate fluxes (optional)
+
+        source is the sncosmo source (or name of the source) of the SALT2
+        model (default 'salt2-extended', as in SNObject)
+        """
+        if photParams is None:
+            photParams = PhotometricParameters()
+
+        if flux_grid is not None and flux_grid.bandpass_names != list(bandpassDict.keys()):
+            raise RuntimeError('SALT2PhotometryEngine was given a SALT2FluxGrid for bandpasses '
+                               '%s, not %s' % (str(flux_grid.bandpass_names),
+                                               str(list(bandpassDict.keys()))))
+
+        self.bandpassDict = bandpassDict
+        self.bandpass_names = list(bandpassDict.keys())
+        self.photParams = photParams
+        self.flux_grid = flux_grid
+
+        self._snobj = SNObject(source=source)
+        self.visibility_window = SALT2VisibilityWindow(source=source)
+
+        self._wavelen = bandpassDict.wavelenMatch
+        self._phi = bandpassDict.phiArray
+
+        # flux in maggies per unit flambda at each wavelength
+        unit_sed = Sed(wavelen=self._wavelen, flambda=np.ones(len(self._wavelen)))
+        unit_sed.flambdaTofnu()
+        self._fnu_factor = unit_sed.fnu*bandpassDict.wavelenStep/3631.0
+
+        # log10 of the Milky Way dust transmission per unit E(B-V)
+        dust_sed = Sed(wavelen=self._wavelen, flambda=np.ones(len(self._wavelen)))
+        a_x, b_x = dust_sed.setupCCM_ab()
+        dust_sed.addDust(a_x, b_x, ebv=1.0)
+        self._log_dust = np.log10(dust_sed.flambda)
+
+        # ADU of a source with a flux of 1 maggie in each bandpass
+        flat_sed = Sed()
+        flat_sed.setFlatSED()
+        self._adu_per_maggie = np.array([flat_sed.calcADU(bandpassDict[name], photParams=photParams)
+                                         for name in self.bandpass_names])
+
+    def in_time_range(self, mjd, t0, z):
+        """
+        Return a numpy array of booleans indicating which supernovae
+        (with peaks at t0 and redshifts z) are within the time range of
+        the model at mjd
+        """
+        return self.visibility_window.in_window(mjd, t0, z)
+
+    def _flambda(self, mjd, c, x1, x0, t0, z):
+        """
+        Return the (rectified, unextincted) flambda of each supernova at mjd
+        as a (n_sne, n_wavelengths) numpy array
+        """
+        snobj = self._snobj
+        wave_ang = self._wavelen*10.0
+        flambda = np.zeros((len(c), len(self._wavelen)), dtype=float)
+        for ii in range(len(c)):
+            snobj.set(c=c[ii], x1=x1[ii], x0=x0[ii], t0=t0[ii], z=z[ii])
+            # as in SNObject.catsimBandFlux, there is no flux at the
+            # limits of the time range of the model
+            if mjd <= snobj.mintime() or mjd >= snobj.maxtime():
+                continue
+            mask = np.logical_and(wave_ang >= snobj.minwave(), wave_ang <= snobj.maxwave())
+            ff = snobj.flux(time=mjd, wave=wave_ang[mask])*10.0
+            flambda[ii, mask] = np.where(ff > 0.0, ff, 0.0)
+        return flambda
+
+    def fluxes(self, mjd, c, x1, x0, t0, z, ebv):
+        """
+        Calculate the fluxes of supernovae in maggies.
+
+        Parameters
+        ----------
+        mjd is the (float) MJD of the observation
+
+        c, x1, x0, t0 and z are numpy arrays of the SALT2 parameters of the
+        supernovae
+
+        ebv is a numpy array of the Milky Way E(B-V) of the supernovae
+
+        Returns
+        -------
+        A (n_sne, n_bandpasses) numpy array of fluxes in maggies
+        """
+        c, x1, x0, t0, z, ebv = [np.atleast_1d(np.asarray(vv, dtype=float))
+                                 for vv in (c, x1, x0, t0, z, ebv)]
+
+        flux = np.zeros((len(c), len(self.bandpass_names)), dtype=float)
+        active = np.where(self.in_time_range(mjd, t0, z))[0]
+        if len(active) == 0:
+            return flux
+
+        if self.flux_grid is not None:
+            flux[active] = self.flux_grid.fluxes(mjd, t0[active], z[active], x1[active],
+                                                 c[active], x0[active], ebv=ebv[active])
+            return flux
+
+        flambda = self._flambda(mjd, c[active], x1[active], x0[active], t0[active], z[active])
+        flambda *= np.power(10.0, ebv[active][:, None]*self._log_dust[None, :])
+        flux[active] = np.dot(flambda*self._fnu_factor, self._phi.transpose())
+        return flux
+
+    def photometry(self, mjd, c, x1, x0, t0, z, ebv):
+        """
+        Calculate the fluxes, magnitudes and ADU of supernovae.  The
+        parameters are as in fluxes().
+
+        Returns
+        -------
+        Three (n_sne, n_bandpasses) numpy arrays: the fluxes in maggies,
+        the AB magnitudes (np.inf for zero flux) and the ADU
+        """
+        flux = self.fluxes(mjd, c, x1, x0, t0, z, ebv)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mag = -2.5*np.log10(flux)
+        adu = flux*self._adu_per_maggie[None, :]
+        return flux, mag, adu
@@ -1,6 +1,8 @@
 from __future__ import absolute_import
 from builtins import object
 import numpy as np
+from .counterRNG import CounterRNG
+from .x0Lookup import SALT2X0Lookup
 
 __all__ = ['SNUniverse']
 
@@ -28,8 +30,20 @@ class SNUniverse(object):
     suppressDimSN : bool, if true drop observations of SN with peak at t0, if
         abs(mjdobs - t0) > self.maxTimeVisible
 
+    If useCounterRNG is True, the SN parameters of a whole chunk of hosts are
+    drawn at once by drawSNParamArrays, with a counter-based random number
+    generator keyed on hostid (so each host still gets the same SN however
+    the hosts are chunked).  These draws are not the same as those made with
+    the default per-host `np.random.RandomState`.
     """
 
+    useCounterRNG = False
+
+    # the CounterRNG and SALT2X0Lookup used by drawSNParamArrays; shared
+    # by all instances, since the x0 table is expensive to build
+    _counter_rng = None
+    _x0_lookup = None
+
     @property
     def snFrequency(self):
         """
@@ -124,6 +138,10 @@ class SNUniverse(object):
         hostmu : float, mandatory
             distance modulus of host in 'magnitudes'
         """
+        if self.useCounterRNG:
+            cval, x1val, x0val, t0val, mBval = self.drawSNParamArrays(hostid, hostmu)
+            return np.array([cval, x1val, x0val, t0val]).transpose()
+
         vals = np.zeros(shape=(self.numobjs, 4))
 
         for i, v in enumerate(vals):
@@ -157,6 +175,53 @@ class SNUniverse(object):
             x0val = self.drawFromX0Dist(rng, x1val, cval, hostmu=hostmu)
         return [cval, x1val, x0val, t0val]
 
+    def drawSNParamArrays(self, hostid, hostmu):
+        """
+        return arrays of the SALT2 parameters c, x1, x0, t0 and of the peak
+        apparent BessellB AB magnitude mB for the SN of many hosts at once.
+
+        The parameters follow the same distributions as drawFromcDist,
+        drawFromx1Dist, drawFromX0Dist and drawFromT0Dist, but the random
+        numbers come from a CounterRNG keyed on hostid, and x0 is found
+        from mB with a SALT2X0Lookup rather than with one SNObject per SN.
+        SN whose t0 is suppressed get self.badvalues for every parameter.
+
+        Parameters
+        ----------
+        hostid: `np.ndarray` of ints, mandatory
+            ids of the hosts
+        hostmu: `np.ndarray` of floats, mandatory
+            distance moduli of the hosts
+        """
+        if SNUniverse._counter_rng is None:
+            SNUniverse._counter_rng = CounterRNG()
+        if SNUniverse._x0_lookup is None:
+            SNUniverse._x0_lookup = SALT2X0Lookup()
+
+        rng = SNUniverse._counter_rng
+        hostid = np.atleast_1d(hostid)
+        hostmu = np.atleast_1d(hostmu).astype(float)
+
+        hundredyear = 1.0 / self.snFrequency
+        t0val = rng.uniform(hostid, 0, -hundredyear / 2.0 + self.midSurveyTime,
+                            hundredyear / 2.0 + self.midSurveyTime)
+        cval = rng.normal(hostid, 1, 0., 0.1)
+        x1val = rng.normal(hostid, 3, 0., 1.0)
+        mBval = rng.normal(hostid, 5, -19.3, 0.3) + hostmu
+
+        valid = np.ones(len(hostid), dtype=bool)
+        if self.suppressDimSN:
+            valid = np.abs(t0val - self.mjdobs) <= self.maxTimeSNVisible
+
+        x0val = np.zeros(len(hostid), dtype=float)
+        if valid.any():
+            x0val[valid] = SNUniverse._x0_lookup.x0(x1val[valid], cval[valid], mBval[valid])
+
+        bad = np.logical_not(valid)
+        for vv in (cval, x1val, x0val, t0val, mBval):
+            vv[bad] = self.badvalues
+
+        return cval, x1val, x0val, t0val, mBval
 
 
                     
@@ -0,0 +1,84 @@
+"""
+This module provides SALT2VisibilityWindow, which finds the range of MJD
+over which the SALT2 model of a supernova is defined and selects the
+observations that fall in that range from a time-sorted list of visits.
+"""
+import numpy as np
+
+from .snObject import SNObject
+
+__all__ = ["SALT2VisibilityWindow"]
+
+
+class SALT2VisibilityWindow(object):
+    """
+    The flux of a SALT2 supernova is only defined between the minimum and
+    maximum rest-frame phase of the model (roughly -20 to +50 days), so a
+    supernova peaking at t0 and observed at redshift z can only be seen in
+    the MJD window
+
+        t0 + min_phase*(1+z) <= mjd <= t0 + max_phase*(1+z)
+
+    (the same window as SNObject.mintime() and SNObject.maxtime()).  This
+    class calculates that window for arrays of supernovae without setting
+    up an SNObject for each of them and, given the (sorted) MJDs of a set of
+    visits, finds the visits inside each window with binary searches rather
+    than by comparing every visit to every supernova.
+    """
+
+    def __init__(self, source='salt2-extended'):
+        """
+        Parameters
+        ----------
+        source is the sncosmo source (or name of the source) of the SALT2
+        model (default 'salt2-extended', as in SNObject)
+        """
+        model_source = SNObject(source=source).source
+        self.min_phase = model_source.minphase()
+        self.max_phase = model_source.maxphase()
+
+    def mjd_window(self, t0, z):
+        """
+        Return two numpy arrays: the first and last MJD at which the
+        supernovae with peaks at t0 and redshifts z are defined
+        (NaN if t0 or z is NaN)
+        """
+        t0 = np.atleast_1d(np.asarray(t0, dtype=float))
+        z = np.atleast_1d(np.asarray(z, dtype=float))
+        return t0 + self.min_phase*(1.0+z), t0 + self.max_phase*(1.0+z)
+
+    def in_window(self, mjd, t0, z):
+        """
+        Return a numpy array of booleans indicating which supernovae
+        (with peaks at t0 and redshifts z) are defined at the MJD mjd
+        """
+        mjd_min, mjd_max = self.mjd_window(t0, z)
+        with np.errstate(invalid='ignore'):
+            return np.logical_and(mjd >= mjd_min, mjd <= mjd_max)
+
+    def visit_slices(self, sorted_mjd, t0, z):
+        """
+        Find the visits at which supernovae are defined.
+
+        Parameters
+        ----------
+        sorted_mjd is a numpy array of the MJDs of the visits, sorted in
+        ascending order
+
+        t0 and z are numpy arrays of the peak MJDs and redshifts of the
+        supernovae
+
+        Returns
+        -------
+        Two numpy arrays of ints, i_start and i_end, such that
+        sorted_mjd[i_start[ii]:i_end[ii]] are the visits inside the window
+        of the ii-th supernova (i_start == i_end if there are none, including
+        when t0 or z is NaN)
+        """
+        mjd_min, mjd_max = self.mjd_window(t0, z)
+        i_start = np.searchsorted(sorted_mjd, mjd_min, side='left')
+        i_end = np.searchsorted(sorted_mjd, mjd_max, side='right')
+        # NaNs are sorted past the end of the array by searchsorted
+        bad = np.logical_not(np.logical_and(np.isfinite(mjd_min), np.isfinite(mjd_max)))
+        i_end[bad] = i_start[bad]
+        return i_start, np.maximum(i_start, i_end)
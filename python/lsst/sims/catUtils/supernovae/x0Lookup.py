@@ -0,0 +1,159 @@
+"""
+This module provides SALT2X0Lookup, a table of the SALT2 peak BessellB
+magnitude per unit x0 as a function of x1 and c, used to convert the
+apparent peak magnitudes of many supernovae into x0 at once.
+"""
+import numpy as np
+
+from .snObject import SNObject
+
+__all__ = ["SALT2X0Lookup"]
+
+
+class SALT2X0Lookup(object):
+    """
+    Convert SALT2 (x1, c, peak magnitude) into x0.
+
+    SNUniverse.drawFromX0Dist finds x0 by calling
+    source.set_peakmag(mag, 'bessellb', 'ab') on an SNObject.  Because the
+    flux of the SALT2 source is proportional to x0, that is the same as
+
+        x0 = 10^(-0.4*(mag - m1(x1, c)))
+
+    where m1(x1, c) is the rest-frame peak BessellB AB magnitude of the
+    source with x0 = 1.  This class tabulates m1 on a regular grid of x1 and
+    c and interpolates it bilinearly.  The tabulation is checked at the
+    midpoints of the grid cells; if the interpolation is off by more than
+    `tolerance` magnitudes anywhere, the step of the grid is halved (up to
+    max_refinements times).  (x1, c) outside of the grid are evaluated
+    exactly.
+
+    The peak magnitude is a rest-frame property of the source, so x0 does
+    not depend on the redshift of the supernova.
+    """
+
+    def __init__(self, source='salt2-extended', x1_range=(-5.0, 5.0), c_range=(-1.0, 1.0),
+                 tolerance=1.0e-3, max_refinements=4):
+        """
+        Parameters
+        ----------
+        source is the sncosmo source (or name of the source) of the SALT2
+        model (default 'salt2-extended', as in SNObject)
+
+        x1_range and c_range are tuples of the (min, max) x1 and c covered
+        by the table (defaults (-5, 5) and (-1, 1))
+
+        tolerance is the largest acceptable error in the interpolated
+        magnitude (default 10^-3)
+
+        max_refinements is the largest number of times the grid steps
+        (initially 0.5 in x1 and 0.05 in c) are halved in trying to meet
+        tolerance (default 4)
+        """
+        if x1_range[1] <= x1_range[0] or c_range[1] <= c_range[0]:
+            raise RuntimeError('SALT2X0Lookup needs ranges with max > min; you gave '
+                               'x1_range %s, c_range %s' % (str(x1_range), str(c_range)))
+
+        self.x1_range = x1_range
+        self.c_range = c_range
+        self.tolerance = tolerance
+        self._max_refinements = max_refinements
+        self._source = SNObject(source=source).source
+
+        self._x1_grid = None
+        self._c_grid = None
+        self._mag_grid = None
+
+        # the largest error in the interpolated magnitude found when
+        # validating the table (np.inf if no acceptable table could be
+        # built, in which case every magnitude is evaluated exactly)
+        self.max_error = None
+
+    def exact_peakmag(self, x1, c):
+        """
+        Return the rest-frame peak BessellB AB magnitude of the source
+        with x0 = 1 for arrays of x1 and c
+        """
+        x1 = np.atleast_1d(x1)
+        c = np.atleast_1d(c)
+        mags = np.zeros(len(x1), dtype=float)
+        for ii in range(len(x1)):
+            self._source.set(x0=1.0, x1=x1[ii], c=c[ii])
+            mags[ii] = self._source.peakmag('bessellb', 'ab')
+        return mags
+
+    def _build_table(self):
+        d_x1 = 0.5
+        d_c = 0.05
+        for i_refinement in range(self._max_refinements+1):
+            x1_grid = np.linspace(self.x1_range[0], self.x1_range[1],
+                                  int(np.ceil((self.x1_range[1]-self.x1_range[0])/d_x1))+1)
+            c_grid = np.linspace(self.c_range[0], self.c_range[1],
+                                 int(np.ceil((self.c_range[1]-self.c_range[0])/d_c))+1)
+            x1_mesh, c_mesh = np.meshgrid(x1_grid, c_grid, indexing='ij')
+            self._x1_grid = x1_grid
+            self._c_grid = c_grid
+            self._mag_grid = self.exact_peakmag(x1_mesh.flatten(),
+                                                c_mesh.flatten()).reshape(x1_mesh.shape)
+
+            x1_mid = 0.5*(x1_grid[1:]+x1_grid[:-1])
+            c_mid = 0.5*(c_grid[1:]+c_grid[:-1])
+            x1_mesh, c_mesh = np.meshgrid(x1_mid, c_mid, indexing='ij')
+            x1_mesh = x1_mesh.flatten()
+            c_mesh = c_mesh.flatten()
+            error = np.abs(self._interpolate(x1_mesh, c_mesh) -
+                           self.exact_peakmag(x1_mesh, c_mesh)).max()
+            if error <= self.tolerance:
+                self.max_error = error
+                return
+            d_x1 *= 0.5
+            d_c *= 0.5
+
+        self.max_error = np.inf
+
+    def _interpolate(self, x1, c):
+        output = np.zeros(len(x1), dtype=float)
+        located = []
+        for grid, vv in ((self._x1_grid, x1), (self._c_grid, c)):
+            step = grid[1]-grid[0]
+            dex = np.clip(np.floor((vv-grid[0])/step).astype(int), 0, len(grid)-2)
+            located.append((dex, (vv-grid[dex])/step))
+        (i_x1, w_x1), (i_c, w_c) = located
+        output += (1.0-w_x1)*(1.0-w_c)*self._mag_grid[i_x1, i_c]
+        output += w_x1*(1.0-w_c)*self._mag_grid[i_x1+1, i_c]
+        output += (1.0-w_x1)*w_c*self._mag_grid[i_x1, i_c+1]
+        output += w_x1*w_c*self._mag_grid[i_x1+1, i_c+1]
+        return output
+
+    def peakmag(self, x1, c):
+        """
+        Return the rest-frame peak BessellB AB magnitude of the source
+        with x0 = 1 for arrays of x1 and c (interpolated from the table)
+        """
+        if self.max_error is None:
+            self._build_table()
+
+        x1 = np.atleast_1d(np.asarray(x1, dtype=float))
+        c = np.atleast_1d(np.asarray(c, dtype=float))
+        mags = np.zeros(len(x1), dtype=float)
+
+        in_range = np.logical_and(np.logical_and(x1 >= self.x1_range[0], x1 <= self.x1_range[1]),
+                                  np.logical_and(c >= self.c_range[0], c <= self.c_range[1]))
+        if not np.isfinite(self.max_error):
+            in_range[:] = False
+
+        if in_range.any():
+            mags[in_range] = self._interpolate(x1[in_range], c[in_range])
+        out_of_range = np.where(np.logical_and(np.logical_not(in_range),
+                                               np.logical_and(np.isfinite(x1), np.isfinite(c))))
+        if len(out_of_range[0]) > 0:
+            mags[out_of_range] = self.exact_peakmag(x1[out_of_range], c[out_of_range])
+        mags[np.logical_not(np.logical_and(np.isfinite(x1), np.isfinite(c)))] = np.nan
+        return mags
+
+    def x0(self, x1, c, mag):
+        """
+        Return x0 for arrays of x1, c and apparent peak BessellB AB
+        magnitude mag
+        """
+        return np.power(10.0, -0.4*(np.asarray(mag, dtype=float)-self.peakmag(x1, c)))
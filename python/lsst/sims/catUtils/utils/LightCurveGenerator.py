@@ -3,17 +3,27 @@ from builtins import zip
 from builtins import str
 from builtins import object
 import numpy as np
-import copy
 from collections import OrderedDict
 
 from lsst.sims.catUtils.utils import ObservationMetaDataGenerator
+from lsst.sims.catUtils.utils import ObservationMetaDataArray
+from lsst.sims.catUtils.utils import AdaptiveChunkSizer
+from lsst.sims.catUtils.utils import LightCurveStore, LightCurveResult
 from lsst.sims.catUtils.mixins import PhotometryStars, VariabilityStars
 from lsst.sims.catUtils.mixins import PhotometryGalaxies, VariabilityGalaxies
+from lsst.sims.catUtils.mixins import SedCache
 from lsst.sims.catalogs.definitions import InstanceCatalog
 from lsst.sims.catalogs.decorators import compound, cached
-from lsst.sims.utils import haversine
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 
+import os
 import time
+import tempfile
+import shutil
+import pickle
+import multiprocessing
 
 __all__ = ["StellarLightCurveGenerator",
            "FastStellarLightCurveGenerator",
@@ -23,10 +33,6 @@ __all__ = ["StellarLightCurveGenerator",
            "LightCurveGenerator",
            "FastLightCurveGenerator"]
 
-# a global cache to store SedLists loaded by the light curve catalogs
-_sed_cache = {}
-
-
 class _baseLightCurveCatalog(InstanceCatalog):
     """
     """
@@ -67,18 +73,35 @@ class _baseLightCurveCatalog(InstanceCatalog):
                 yield line
         else:
             # Otherwise iterate over the query cache
-            transform_keys = list(self.transformations.keys())
-            for chunk in query_cache:
-                self._set_current_chunk(chunk, column_cache=column_cache)
-                chunk_cols = [self.transformations[col](self.column_by_name(col))
-                              if col in transform_keys else
-                              self.column_by_name(col)
-                              for col in self.iter_column_names()]
+            for chunk_cols in self.iter_catalog_columns(query_cache, column_cache=column_cache):
                 # iterate over lines in the cache and yield lines augmented by
                 # values calculated using this catalogs getter methods
                 for line in zip(*chunk_cols):
                     yield line
 
+    def iter_catalog_columns(self, query_cache, column_cache=None):
+        """
+        Returns an iterator over chunks of the catalog.  Each chunk is
+        a list of the catalog's columns (in the order of column_outputs)
+        as arrays, rather than a sequence of rows.
+
+        Parameters
+        ----------
+        query_cache : iterator over database rows
+            the result of calling db_obj.query_columns()
+
+        column_cache : a dict that will be copied over into the catalogs self._column_cache.
+            Should be left as None, unless you know what you are doing.
+        """
+        transform_keys = list(self.transformations.keys())
+        for chunk in query_cache:
+            self._set_current_chunk(chunk, column_cache=column_cache)
+            chunk_cols = [self.transformations[col](self.column_by_name(col))
+                          if col in transform_keys else
+                          self.column_by_name(col)
+                          for col in self.iter_column_names()]
+            yield chunk_cols
+
     @cached
     def get_truthInfo(self):
         """
@@ -96,51 +119,21 @@ class _stellarLightCurveCatalog(_baseLightCurveCatalog, VariabilityStars, Photom
     1) only returns the magnitude and uncertainty in the bandpass specified by
     self.obs_metadata
 
-    2) caches all of the SEDs read in so that they can be reused when sampling the
-    objects in this catalog at a different MJD.
+    2) looks up the magnitudes of SEDs in the LightCurveGenerator's SedCache so that
+    they can be reused when sampling the objects in this catalog at a different MJD
+    (or in a different field of view).
 
     It should only be used in the context of the LightCurveGenerator class.
     """
 
-    def _loadSedList(self, wavelen_match):
-        """
-        Wraps the PhotometryStars._loadSedList method.
-
-        If current chunk of objects is not represetned in the global
-        _sed_cache, this will call the base method defined in
-        PhotometryStars.
-
-        Otherwise, it will read self._sedList from the cache.
-        That way, the photometry getters defined in PhotometryStars will
-        not read in SEDs that have already been cached.
-        """
-
-        global _sed_cache
-
-        object_names = self.column_by_name("uniqueId")
-
-        if len(object_names) > 0:
-            cache_name = "stellar_%s_%s" % (object_names[0], object_names[-1])
-        else:
-            cache_name = None
-
-        if cache_name not in _sed_cache:
-
-            PhotometryStars._loadSedList(self, wavelen_match)
-
-            if cache_name is not None:
-                _sed_cache[cache_name] = copy.copy(self._sedList)
-        else:
-            self._sedList = copy.copy(_sed_cache[cache_name])
-
     @compound("lightCurveMag", "sigma_lightCurveMag", "quiescent_lightCurveMag")
     def get_lightCurvePhotometry(self):
         """
         A getter which returns the magnitudes and uncertainties in magnitudes
         in the bandpass specified by self.obs_metdata.
 
-        As it runs, this method will cache the SedLists it reads in so that
-        they can be used later.
+        As it runs, this method will cache the magnitudes of the SEDs it
+        reads in (in self.sedCache) so that they can be used later.
         """
 
         if len(self.obs_metadata.bandpass) != 1:
@@ -156,45 +149,14 @@ class _stellarLightCurveCatalog(_baseLightCurveCatalog, VariabilityStars, Photom
 
 class _agnLightCurveCatalog(_baseLightCurveCatalog, VariabilityGalaxies, PhotometryGalaxies):
 
-    def _loadAgnSedList(self, wavelen_match):
-        """
-        Wraps the PhotometryGalaxies._loadAgnSedList method.
-
-        If current chunk of objects is not represented in the global
-        _sed_cache, this will call the base method defined in
-        PhotometryGalaxies.
-
-        Otherwise, it will read self._sedList from the cache.
-        That way, the photometry getters defined in PhotometryGalaxies will
-        not read in SEDs that have already been cached.
-        """
-
-        global _sed_cache
-
-        object_names = self.column_by_name("uniqueId")
-
-        if len(object_names) > 0:
-            cache_name = "agn_%s_%s" % (object_names[0], object_names[-1])
-        else:
-            cache_name = None
-
-        if cache_name not in _sed_cache:
-
-            PhotometryGalaxies._loadAgnSedList(self, wavelen_match)
-
-            if cache_name is not None:
-                _sed_cache[cache_name] = copy.copy(self._agnSedList)
-        else:
-            self._agnSedList = copy.copy(_sed_cache[cache_name])
-
     @compound("lightCurveMag", "sigma_lightCurveMag", "quiescent_lightCurveMag")
     def get_lightCurvePhotometry(self):
         """
         A getter which returns the magnitudes and uncertainties in magnitudes
         in the bandpass specified by self.obs_metdata.
 
-        As it runs, this method will cache the SedLists it reads in so that
-        they can be used later.
+        As it runs, this method will cache the magnitudes of the SEDs it
+        reads in (in self.sedCache) so that they can be used later.
         """
 
         if len(self.obs_metadata.bandpass) != 1:
@@ -239,9 +201,103 @@ class LightCurveGenerator(object):
         if not hasattr(self, '_constraint'):
             self._constraint = None
 
+        # AdaptiveChunkSizer used by light_curves_from_pointings
+        # when it is given a memory budget
+        self._chunk_sizer = None
+
+        # LightCurveHdf5Sink (if any) to which light_curves_from_pointings
+        # streams light curves as they are generated
+        self._lc_sink = None
+
+        # SedCache shared by the light curve catalogs so that SEDs are
+        # not read in again when the same objects are simulated at
+        # different MJDs or in overlapping fields of view.  Replace it with
+        # a SedCache(max_bytes=...) to change its memory budget.
+        self.sed_cache = SedCache()
+
+        # SNRLookup (if any) passed to light_curves_from_pointings
+        self._snr_lookup = None
+
     def _filter_chunk(self, chunk):
         return chunk
 
+    def _estimate_bytes_per_row(self, grp):
+        """
+        Estimate the memory needed to generate light curves for one
+        database row observed by the ObservationMetaData in grp
+        (an MJD, a brightness and an uncertainty per visit).
+        """
+        return AdaptiveChunkSizer.estimate_bytes_per_row(len(grp), n_bands=1, n_arrays=3)
+
+    def _update_chunk_size(self, query_result, n_rows, n_bytes, t_start):
+        """
+        Tell self._chunk_sizer (if any) how much memory and time the last
+        chunk of n_rows database rows needed, and resize the next chunk
+        fetched from query_result accordingly.
+        """
+        if self._chunk_sizer is None:
+            return
+        self._chunk_sizer.update(n_rows, n_bytes, elapsed=time.time()-t_start)
+        self._chunk_sizer.apply(query_result)
+
+    def _flush_to_sink(self):
+        """
+        If light curves are being streamed to a sink, write the points
+        and truth information accumulated so far to it and start again
+        with an empty LightCurveStore and truth_dict.
+        """
+        if self._lc_sink is None:
+            return
+        self._lc_sink.write(self._lc_store.get_result(), truth_dict=self.truth_dict)
+        self._lc_store = LightCurveStore(brightness_name=self._brightness_name)
+        self.truth_dict = {}
+
+    def _append_light_curve_points(self, cat, chunk, has_light_curve, column_cache=None):
+        """
+        Calculate the photometry of the objects in chunk at one visit
+        and add the points with finite brightness to self._lc_store.
+
+        Parameters
+        ----------
+        cat is the light curve InstanceCatalog whose obs_metadata is the visit
+
+        chunk is the numpy recarray of database rows for the objects
+
+        has_light_curve is a boolean array with one element per row of chunk.
+        It is True for objects which have already received a point; it
+        will be updated in place.  Objects receiving their first point
+        have their truth information added to self.truth_dict.
+
+        column_cache is an optional dict of pre-calculated columns
+        to be passed to cat (see _baseLightCurveCatalog.iter_catalog)
+
+        Returns
+        -------
+        The number of points added.
+        """
+        n_points = 0
+        for chunk_cols in cat.iter_catalog_columns([chunk], column_cache=column_cache):
+            unique_id = np.array(chunk_cols[0])
+            brightness = np.array(chunk_cols[3], dtype=float)
+            valid = np.isfinite(brightness)
+            n_valid = valid.sum()
+            if n_valid == 0:
+                continue
+            n_points += n_valid
+
+            self._lc_store.append(unique_id[valid], cat.obs_metadata.bandpass,
+                                  cat.obs_metadata.mjd.TAI, brightness[valid],
+                                  np.array(chunk_cols[4], dtype=float)[valid])
+
+            new_dexes = np.where(np.logical_and(valid, np.logical_not(has_light_curve)))[0]
+            has_light_curve[valid] = True
+            truth_info = chunk_cols[5]
+            for dex in new_dexes:
+                if unique_id[dex] not in self.truth_dict:
+                    self.truth_dict[unique_id[dex]] = truth_info[dex]
+
+        return n_points
+
     def get_pointings(self, ra, dec,
                       bandpass=('u', 'g', 'r', 'i', 'z', 'y'),
                       expMJD=None,
@@ -274,72 +330,82 @@ class LightCurveGenerator(object):
 
         print('parameters', ra, dec, bandpass, expMJD)
         if isinstance(bandpass, str):
-            obs_list = self._generator.getObservationMetaData(fieldRA=ra,
-                                                              fieldDec=dec,
-                                                              telescopeFilter=bandpass,
-                                                              expMJD=expMJD,
-                                                              boundLength=boundLength)
+            obs_array = self._generator.getObservationMetaDataArray(fieldRA=ra,
+                                                                    fieldDec=dec,
+                                                                    telescopeFilter=bandpass,
+                                                                    expMJD=expMJD,
+                                                                    boundLength=boundLength)
         else:
-            # obs_list will be populated with a list of lists of ObservationMetaData.
-            # These ObervationMetaData will have pointingRA, pointingDec, filters,
-            # and mjd values as specified by the user-input parameters.
-            # Each row of obs_list will be a list of ObservationMetaData with identical
-            # pointingRA and pointingDec.
-            #
-            obs_list = []
-            for bp in bandpass:
-                sub_list = self._generator.getObservationMetaData(fieldRA=ra,
-                                                                  fieldDec=dec,
-                                                                  telescopeFilter=bp,
-                                                                  expMJD=expMJD,
-                                                                  boundLength=boundLength)
-                obs_list += sub_list
-
-        if len(obs_list) == 0:
+            # Query the pointings in all bandpasses at once and then
+            # keep the ones in the requested bandpasses (rather than
+            # querying the OpSim database once per bandpass)
+            obs_array = self._generator.getObservationMetaDataArray(fieldRA=ra,
+                                                                    fieldDec=dec,
+                                                                    expMJD=expMJD,
+                                                                    boundLength=boundLength)
+            obs_array = obs_array.select(bandpass=bandpass)
+
+        if len(obs_array) == 0:
             print("No observations found matching your criterion")
             return None
 
-        # Group the OpSim pointings so that all of the pointings centered on the same
-        # point in the sky are in a list together (this will allow us to generate the
-        # light curves one pointing at a time without having to query the database for
-        # the same results more than once.
-        tol = 1.0e-12
-
-        obs_groups = []  # a list of list of the indices of the ObservationMetaDatas
-                         # in obs_list.  All of the ObservationMetaData in
-                         # obs_list[i] will point to the same point on the sky.
+        return [list(grp) for grp in self._group_obs_array(obs_array)]
 
-        mjd_groups = []  # a list of lists of the MJDs of the ObservationMetaDatas
-                         # so that they can be sorted into chronological order before
-                         # light curves are calculated
+    def _group_obs_array(self, obs_array):
+        """
+        Group the pointings in an ObservationMetaDataArray so that all of
+        the pointings centered on the same point in the sky are together
+        (this will allow us to generate the light curves one pointing at a
+        time without having to query the database for the same results more
+        than once).
 
-        for iobs, obs in enumerate(obs_list):
-            group_dex = -1
+        Returns a list of ObservationMetaDataArrays, each sorted by MJD.
+        """
+        group_dex = self._group_pointings(obs_array._pointingRA, obs_array._pointingDec)
+        sorted_dex = np.lexsort((obs_array.mjd, group_dex))
+        group_bounds = np.where(np.diff(group_dex[sorted_dex]) != 0)[0] + 1
+        return [obs_array[grp] for grp in np.split(sorted_dex, group_bounds)]
 
-            for ix, obs_g in enumerate(obs_groups):
-                dd = haversine(obs._pointingRA, obs._pointingDec,
-                               obs_list[obs_g[0]]._pointingRA, obs_list[obs_g[0]]._pointingDec)
-                if dd < tol:
-                    group_dex = ix
-                    break
+    @staticmethod
+    def _group_pointings(ra, dec, tol=1.0e-12):
+        """
+        Group pointings that point at the same place on the sky.
 
-            if group_dex == -1:
-                obs_groups.append([iobs])
-                mjd_groups.append([obs_list[iobs].mjd.TAI])
-            else:
-                obs_groups[group_dex].append(iobs)
-                mjd_groups[group_dex].append(obs_list[iobs].mjd.TAI)
+        Parameters
+        ----------
+        ra, dec are numpy arrays of the pointings' RA and Dec in radians
 
-        # rearrange each group of ObservationMetaDatas so that they
-        # appear in chronological order by MJD
-        obs_groups_out = []
-        for ix, (grp, mjd) in enumerate(zip(obs_groups, mjd_groups)):
-            oo = np.array(grp)
-            mm = np.array(mjd)
-            dexes = np.argsort(mm)
-            obs_groups_out.append([obs_list[ii] for ii in oo[dexes]])
+        tol is the angular distance (in radians) within which two
+        pointings are considered identical (default 1.0e-12)
 
-        return obs_groups_out
+        Returns
+        -------
+        A numpy array of ints assigning each pointing to a group.
+        Groups are numbered in the order in which their first
+        member appears in ra, dec.
+        """
+        xyz = np.array([np.cos(dec)*np.cos(ra),
+                        np.cos(dec)*np.sin(ra),
+                        np.sin(dec)]).transpose()
+
+        # pointings at the same field usually have identical coordinates;
+        # collapse those before looking for near-matches
+        unq_xyz, unq_inv = np.unique(xyz, axis=0, return_inverse=True)
+        unq_inv = unq_inv.flatten()
+
+        # join distinct coordinates that are within tol of each other
+        tree = cKDTree(unq_xyz)
+        pairs = np.array(list(tree.query_pairs(2.0*np.sin(0.5*tol))), dtype=int).reshape(-1, 2)
+        adjacency = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])),
+                               shape=(len(unq_xyz), len(unq_xyz)))
+        n_components, unq_label = connected_components(adjacency, directed=False)
+        label = unq_label[unq_inv]
+
+        # renumber groups in order of first appearance
+        first_label, first_dex = np.unique(label, return_index=True)
+        order = np.zeros(n_components, dtype=int)
+        order[first_label[np.argsort(first_dex)]] = np.arange(len(first_label))
+        return order[label]
 
     def _get_query_from_group(self, grp, chunk_size, lc_per_field=None, constraint=None):
         """
@@ -410,12 +476,9 @@ class LightCurveGenerator(object):
         Output
         ------
         This method does not output anything.  It adds light curves to the
-        instance member variables self.mjd_dict, self.bright_dict, self.sig_dict,
-        and self.truth_dict.
+        instance member variables self._lc_store and self.truth_dict.
         """
 
-        global _sed_cache
-
         # local_gamma_cache will cache the InstanceCatalog._gamma_cache
         # values used by the photometry mixins to efficiently calculate
         # photometric uncertainties in each catalog.
@@ -424,6 +487,8 @@ class LightCurveGenerator(object):
         row_ct = 0
 
         for raw_chunk in query_result:
+            t_start_chunk = time.time()
+            n_points = 0
             chunk = self._filter_chunk(raw_chunk)
             if lc_per_field is not None:
 
@@ -437,6 +502,7 @@ class LightCurveGenerator(object):
                     row_ct += len(chunk)
 
             if chunk is not None:
+                has_light_curve = np.zeros(len(chunk), dtype=bool)
                 for ix, obs in enumerate(grp):
                     cat = cat_dict[obs.bandpass]
                     cat.obs_metadata = obs
@@ -445,36 +511,151 @@ class LightCurveGenerator(object):
                     else:
                         cat._gamma_cache = {}
 
-                    for star_obj in \
-                        cat.iter_catalog(query_cache=[chunk]):
+                    n_points += self._append_light_curve_points(cat, chunk, has_light_curve)
 
-                        if not np.isnan(star_obj[3]) and not np.isinf(star_obj[3]):
+                    if ix not in local_gamma_cache:
+                        local_gamma_cache[ix] = cat._gamma_cache
+
+                self._update_chunk_size(query_result, len(raw_chunk),
+                                        raw_chunk.nbytes + 24*n_points, t_start_chunk)
+                self._flush_to_sink()
 
-                            if star_obj[0] not in self.truth_dict:
-                                self.truth_dict[star_obj[0]] = star_obj[5]
+    def _light_curves_from_groups(self, pointings, cat_dict, chunk_size=100000,
+                                  lc_per_field=None, constraint=None, max_bytes=None):
+        """
+        Generate the light curves for each group of ObservationMetaData in
+        pointings, adding them to self._lc_store and self.truth_dict (or
+        self._lc_sink).  The other arguments are as in
+        light_curves_from_pointings; cat_dict is a dict of InstanceCatalogs
+        keyed on bandpass name (see _light_curves_from_query).
+        """
+        # Loop over the list of groups ObservationMetaData objects,
+        # querying the database and generating light curves.
+        for grp in pointings:
 
-                            if star_obj[0] not in self.mjd_dict:
-                                self.mjd_dict[star_obj[0]] = {}
-                                self.bright_dict[star_obj[0]] = {}
-                                self.sig_dict[star_obj[0]] = {}
+            # only build the ObservationMetaData of one group at a time
+            if isinstance(grp, ObservationMetaDataArray):
+                grp = list(grp)
 
-                            bp = cat.obs_metadata.bandpass
-                            if bp not in self.mjd_dict[star_obj[0]]:
-                                self.mjd_dict[star_obj[0]][bp] = []
-                                self.bright_dict[star_obj[0]][bp] = []
-                                self.sig_dict[star_obj[0]][bp] = []
+            self._mjd_min = grp[0].mjd.TAI
+            self._mjd_max = grp[-1].mjd.TAI
 
-                            self.mjd_dict[star_obj[0]][bp].append(cat.obs_metadata.mjd.TAI)
-                            self.bright_dict[star_obj[0]][bp].append(star_obj[3])
-                            self.sig_dict[star_obj[0]][bp].append(star_obj[4])
+            print('starting query')
 
-                    if ix not in local_gamma_cache:
-                        local_gamma_cache[ix] = cat._gamma_cache
+            if max_bytes is not None:
+                self._chunk_sizer = AdaptiveChunkSizer(max_bytes, self._estimate_bytes_per_row(grp))
+                grp_chunk_size = self._chunk_sizer.chunk_size
+            else:
+                self._chunk_sizer = None
+                grp_chunk_size = chunk_size
 
-            _sed_cache = {}  # before moving on to the next chunk of objects
+            t_before_query = time.time()
+            query_result = self._get_query_from_group(grp, grp_chunk_size, lc_per_field=lc_per_field,
+                                                      constraint=constraint)
+
+            print('query took ', time.time()-t_before_query)
+
+            self._light_curves_from_query(cat_dict, query_result, grp, lc_per_field=lc_per_field)
+
+        self._chunk_sizer = None
+
+    def _reset_db_connection(self):
+        """
+        Called in a newly forked worker process.  Connections to the
+        catalog database must not be shared between processes, so drop
+        the connections inherited from the parent; the connection pool
+        will open new connections for this process when it next queries
+        the database.  In-memory sqlite databases (e.g. fileDBObject) are
+        left alone; fork() has already given this process its own copy.
+        """
+        connection = getattr(self._catalogdb, 'connection', None)
+        engine = getattr(connection, 'engine', None)
+        if engine is None or engine.url.database in (None, '', ':memory:'):
+            return
+
+        connection.session.close()
+        try:
+            # do not close the parent's connections out from under it
+            engine.dispose(close=False)
+        except TypeError:
+            engine.dispose()
+
+    def _light_curve_worker(self, pointings, cat_dict, out_name, kwargs):
+        """
+        Generate the light curves for pointings in a worker process and
+        pickle the results (the LightCurveResult's data and band_names and
+        the truth_dict) to the file out_name.
+        """
+        self._reset_db_connection()
+        self._lc_sink = None
+        self._lc_store = LightCurveStore(brightness_name=self._brightness_name)
+        self.truth_dict = {}
+
+        self._light_curves_from_groups(pointings, cat_dict, **kwargs)
+
+        result = self._lc_store.get_result()
+        with open(out_name, 'wb') as out_file:
+            pickle.dump((result.data, result.band_names, self.truth_dict), out_file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _light_curves_in_parallel(self, pointings, cat_dict, n_processes,
+                                  scratch_dir=None, **kwargs):
+        """
+        Divide the groups of ObservationMetaData in pointings among
+        n_processes worker processes, each of which generates the light
+        curves for its groups with its own database connection and SED
+        cache.  Merge the results into self._lc_store and self.truth_dict
+        (or write them to self._lc_sink).
+
+        kwargs are passed to _light_curves_from_groups.
+        """
+        # give each process a roughly equal number of visits,
+        # assigning the largest groups first
+        group_lists = [[] for i_p in range(min(n_processes, len(pointings)))]
+        load = np.zeros(len(group_lists), dtype=int)
+        for i_grp in np.argsort([-1*len(grp) for grp in pointings], kind='mergesort'):
+            i_min = np.argmin(load)
+            group_lists[i_min].append(pointings[i_grp])
+            load[i_min] += len(pointings[i_grp])
+
+        scratch = tempfile.mkdtemp(dir=scratch_dir, prefix='light_curves_')
+        try:
+            p_list = []
+            out_name_list = []
+            for i_p, grp_list in enumerate(group_lists):
+                out_name = os.path.join(scratch, 'light_curves_%d.pickle' % i_p)
+                p = multiprocessing.Process(target=self._light_curve_worker,
+                                            args=(grp_list, cat_dict, out_name, kwargs))
+                p.start()
+                p_list.append(p)
+                out_name_list.append(out_name)
+            for p in p_list:
+                p.join()
+            for p in p_list:
+                if p.exitcode != 0:
+                    raise RuntimeError('A light curve process failed '
+                                       'with exit code %d' % p.exitcode)
+
+            for out_name in out_name_list:
+                with open(out_name, 'rb') as in_file:
+                    data, band_names, truth_dict = pickle.load(in_file)
+                partial = LightCurveResult(data, band_names, brightness_name=self._brightness_name)
+                if self._lc_sink is not None:
+                    self._lc_sink.write(partial, truth_dict=truth_dict)
+                else:
+                    self._lc_store.extend(partial)
+                    for unique_id in truth_dict:
+                        if unique_id not in self.truth_dict:
+                            self.truth_dict[unique_id] = truth_dict[unique_id]
+                os.unlink(out_name)
+        finally:
+            if os.path.exists(scratch):
+                shutil.rmtree(scratch)
 
     def light_curves_from_pointings(self, pointings, chunk_size=100000,
-                                    lc_per_field=None, constraint=None):
+                                    lc_per_field=None, constraint=None,
+                                    max_bytes=None, sink=None, n_processes=1,
+                                    scratch_dir=None, snr_lookup=None):
         """
         Generate light curves for all of the objects in a particular region
         of sky in a particular bandpass.
@@ -485,7 +666,11 @@ class LightCurveGenerator(object):
         pointings is a 2-D list of ObservationMetaData objects.  Each row
         of pointings is a list of ObservationMetaDatas that all point to
         the same patch of sky, sorted by MJD.  This can be generated with
-        the method get_pointings().
+        the method get_pointings().  pointings can also be an
+        ObservationMetaDataArray (e.g. from
+        ObservationMetaDataGenerator.getObservationMetaDataArray()), in
+        which case the pointings are grouped here and ObservationMetaData
+        are only built for one group at a time.
 
         chunk_size (optional; default=10000) is an int specifying how many
         objects to pull in from the database at a time.  Note: the larger
@@ -500,6 +685,34 @@ class LightCurveGenerator(object):
         all database queries associated with generating these light curves
         (optional).
 
+        max_bytes (optional; default None) is a memory budget (in bytes) for
+        processing one chunk of objects.  If set, chunk_size is ignored; the
+        chunk size for each field is instead derived from the number of
+        visits to that field and adjusted after every chunk from the memory
+        and time actually used (see AdaptiveChunkSizer).
+
+        sink (optional; default None) is a LightCurveHdf5Sink.  If set, the
+        light curves and truth information are written to the sink after
+        each chunk of objects is processed, rather than being accumulated
+        in memory, and this method returns (None, None).  The sink is not
+        closed.
+
+        n_processes (optional; default 1) is the number of processes among
+        which to divide the groups in pointings.  Each process has its own
+        connection to the database and its own SED cache.  The results are
+        merged into the same output as a single process would produce (or
+        written to sink when every process has finished).
+
+        scratch_dir (optional) is the directory in which the processes
+        write their partial results when n_processes > 1 (defaults to the
+        system's temporary directory).
+
+        snr_lookup (optional; default None) is an SNRLookup.  If it was
+        built from the bandpasses and PhotometricParameters used to
+        calculate the light curves (see SNRLookup.matches), magnitude
+        uncertainties are interpolated from its tables instead of calling
+        calcGamma for every visit.
+
         Output:
         -------
         A dict of light curves.  The dict is keyed on the object's uniqueId.
@@ -515,6 +728,12 @@ class LightCurveGenerator(object):
         output[111]['u']['error'] is a numpy array of the magnitude uncertainties
         of object 111 in the u band.
 
+        The output is actually a LightCurveResult, which stores all of the
+        light curves in one structured numpy array (output.data) sorted on
+        uniqueId, band, and MJD, with output.offsets indexing the first point
+        of each object in output.unique_id.  The per-object dicts above are
+        only built when they are asked for.
+
         And a dict of truth data for each of the objects (again, keyed on
         uniqueId).  The contents of this dict will vary, depending on the
         variability model being used, but should be sufficient to reconstruct
@@ -528,54 +747,56 @@ class LightCurveGenerator(object):
 
         t_start = time.time()
 
-        self.mjd_dict = {}
-        self.bright_dict = {}
-        self.sig_dict = {}
-        self.band_dict = {}
+        if sink is not None and sink.brightness_name != self._brightness_name:
+            raise RuntimeError('%s writes light curves in %s; your sink expects %s'
+                               % (self.__class__.__name__, self._brightness_name,
+                                  sink.brightness_name))
+
+        self._lc_store = LightCurveStore(brightness_name=self._brightness_name)
+        self._lc_sink = sink
+        self._snr_lookup = snr_lookup
         self.truth_dict = {}
 
+        if isinstance(pointings, ObservationMetaDataArray):
+            pointings = self._group_obs_array(pointings)
+
         cat_dict = {}
         for grp in pointings:
+            if isinstance(grp, ObservationMetaDataArray):
+                # only build one ObservationMetaData per new bandpass
+                band_arr = grp.bandpass
+                grp = [grp[int(np.where(band_arr == bp)[0][0])]
+                       for bp in np.unique(band_arr) if bp not in cat_dict]
             for obs in grp:
                 if obs.bandpass not in cat_dict:
                     cat_dict[obs.bandpass] = self._lightCurveCatalogClass(self._catalogdb, obs_metadata=obs)
-
-        # Loop over the list of groups ObservationMetaData objects,
-        # querying the database and generating light curves.
-        for grp in pointings:
-
-            self._mjd_min = grp[0].mjd.TAI
-            self._mjd_max = grp[-1].mjd.TAI
-
-            print('starting query')
-
-            t_before_query = time.time()
-            query_result = self._get_query_from_group(grp, chunk_size, lc_per_field=lc_per_field,
-                                                      constraint=constraint)
-
-            print('query took ', time.time()-t_before_query)
-
-            self._light_curves_from_query(cat_dict, query_result, grp, lc_per_field=lc_per_field)
-
-        output_dict = {}
-        for unique_id in self.mjd_dict:
-            output_dict[unique_id] = {}
-            for bp in self.mjd_dict[unique_id]:
-
-                output_dict[unique_id][bp] = {}
-
-                # we must sort the MJDs because, if an object appears in multiple
-                # spatial pointings, its observations will be concatenated out of order
-                mjd_arr = np.array(self.mjd_dict[unique_id][bp])
-                mjd_dexes = np.argsort(mjd_arr)
-
-                output_dict[unique_id][bp]['mjd'] = mjd_arr[mjd_dexes]
-                output_dict[unique_id][bp][self._brightness_name] = \
-                    np.array(self.bright_dict[unique_id][bp])[mjd_dexes]
-                output_dict[unique_id][bp]['error'] = np.array(self.sig_dict[unique_id][bp])[mjd_dexes]
+                    cat_dict[obs.bandpass].sedCache = self.sed_cache
+                    cat_dict[obs.bandpass].snrLookup = snr_lookup
+
+        if n_processes > 1 and len(pointings) > 1:
+            self._light_curves_in_parallel(pointings, cat_dict, n_processes,
+                                           chunk_size=chunk_size, lc_per_field=lc_per_field,
+                                           constraint=constraint, max_bytes=max_bytes,
+                                           scratch_dir=scratch_dir)
+        else:
+            self._light_curves_from_groups(pointings, cat_dict, chunk_size=chunk_size,
+                                           lc_per_field=lc_per_field, constraint=constraint,
+                                           max_bytes=max_bytes)
+
+        if self._lc_sink is not None:
+            self._flush_to_sink()
+            self._lc_sink.flush()
+            self._lc_sink = None
+            self._lc_store = None
+            self.truth_dict = None
+            print('light curves took %e seconds to generate' % (time.time()-t_start))
+            return None, None
+
+        output = self._lc_store.get_result()
+        self._lc_store = None
 
         print('light curves took %e seconds to generate' % (time.time()-t_start))
-        return output_dict, self.truth_dict
+        return output, self.truth_dict
 
 
 class FastLightCurveGenerator(LightCurveGenerator):
@@ -619,14 +840,11 @@ class FastLightCurveGenerator(LightCurveGenerator):
         Output
         ------
         This method does not output anything.  It adds light curves to the
-        instance member variables self.mjd_dict, self.bright_dict, self.sig_dict,
-        and self.truth_dict.
+        instance member variables self._lc_store and self.truth_dict.
         """
 
         print('using fast light curve generator')
 
-        global _sed_cache
-
         # local_gamma_cache will cache the InstanceCatalog._gamma_cache
         # values used by the photometry mixins to efficiently calculate
         # photometric uncertainties in each catalog.
@@ -661,6 +879,8 @@ class FastLightCurveGenerator(LightCurveGenerator):
             mjd_arr_dict[bp] = np.array(mjd_arr_dict[bp])
 
         for raw_chunk in query_result:
+            t_start_chunk = time.time()
+            n_points = 0
             chunk = self._filter_chunk(raw_chunk)
             if lc_per_field is not None:
 
@@ -674,6 +894,7 @@ class FastLightCurveGenerator(LightCurveGenerator):
                     row_ct += len(chunk)
 
             if chunk is not None:
+                has_light_curve = np.zeros(len(chunk), dtype=bool)
                 quiescent_mags = {}
                 d_mags = {}
                 # pre-calculate quiescent magnitudes
@@ -681,10 +902,8 @@ class FastLightCurveGenerator(LightCurveGenerator):
                 for bp in quiescent_obs_dict:
                     cat = cat_dict[bp]
                     cat.obs_metadata = quiescent_obs_dict[bp]
-                    local_quiescent_mags = []
-                    for star_obj in cat.iter_catalog(query_cache=[chunk]):
-                        local_quiescent_mags.append(star_obj[6])
-                    quiescent_mags[bp] = np.array(local_quiescent_mags)
+                    for chunk_cols in cat.iter_catalog_columns([chunk]):
+                        quiescent_mags[bp] = np.array(chunk_cols[6])
                     if self.delta_name_mapper(bp) not in cat._actually_calculated_columns:
                         cat._actually_calculated_columns.append(self.delta_name_mapper(bp))
                     varparamstr = cat.column_by_name('varParamStr')
@@ -733,33 +952,17 @@ class FastLightCurveGenerator(LightCurveGenerator):
                     else:
                         cat._gamma_cache = {}
 
-                    for star_obj in \
-                        cat.iter_catalog(query_cache=[chunk], column_cache=local_column_cache):
-
-                        if not np.isnan(star_obj[3]) and not np.isinf(star_obj[3]):
-
-                            if star_obj[0] not in self.truth_dict:
-                                self.truth_dict[star_obj[0]] = star_obj[5]
-
-                            if star_obj[0] not in self.mjd_dict:
-                                self.mjd_dict[star_obj[0]] = {}
-                                self.bright_dict[star_obj[0]] = {}
-                                self.sig_dict[star_obj[0]] = {}
-
-                            bp = cat.obs_metadata.bandpass
-                            if bp not in self.mjd_dict[star_obj[0]]:
-                                self.mjd_dict[star_obj[0]][bp] = []
-                                self.bright_dict[star_obj[0]][bp] = []
-                                self.sig_dict[star_obj[0]][bp] = []
-
-                            self.mjd_dict[star_obj[0]][bp].append(cat.obs_metadata.mjd.TAI)
-                            self.bright_dict[star_obj[0]][bp].append(star_obj[3])
-                            self.sig_dict[star_obj[0]][bp].append(star_obj[4])
+                    n_points += self._append_light_curve_points(cat, chunk, has_light_curve,
+                                                                column_cache=local_column_cache)
 
                     if ix not in local_gamma_cache:
                         local_gamma_cache[ix] = cat._gamma_cache
 
-            _sed_cache = {}  # before moving on to the next chunk of objects
+                chunk_bytes = raw_chunk.nbytes + 24*n_points
+                for bp in d_mags:
+                    chunk_bytes += d_mags[bp].nbytes + quiescent_mags[bp].nbytes
+                self._update_chunk_size(query_result, len(raw_chunk), chunk_bytes, t_start_chunk)
+                self._flush_to_sink()
 
 
 class StellarLightCurveGenerator(LightCurveGenerator):
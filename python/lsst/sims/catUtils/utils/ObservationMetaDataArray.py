@@ -0,0 +1,237 @@
+"""
+This module provides ObservationMetaDataArray, a columnar container of
+OpSim pointings that only builds ObservationMetaData objects when they
+are asked for.
+"""
+import numbers
+import numpy as np
+from lsst.sims.utils import _angularSeparation
+
+__all__ = ["ObservationMetaDataArray"]
+
+
+class ObservationMetaDataArray(object):
+    """
+    A columnar container of OpSim pointings.
+
+    The OpSim records are held in one numpy structured array (self.records)
+    and the quantities catalogs care about (pointing RA/Dec, MJD, rotSkyPos,
+    bandpass, m5, seeing, skyBrightness) are exposed as numpy arrays, so
+    that selecting pointings by bandpass, date, or position on the sky is
+    vectorized.
+
+    Indexing with an int returns the ObservationMetaData for that
+    pointing (built on the fly, exactly as
+    ObservationMetaDataGenerator.ObservationMetaDataFromPointing would build
+    it).  Indexing with a slice, a boolean mask, or an array of ints
+    returns a new ObservationMetaDataArray.  Iterating yields one
+    ObservationMetaData at a time, so an ObservationMetaDataArray can be
+    passed wherever a list of ObservationMetaData is expected without
+    materializing all of them at once.
+
+    Instances are usually made by
+    ObservationMetaDataGenerator.getObservationMetaDataArray()
+    """
+
+    def __init__(self, records, generator, boundType='circle', boundLength=1.75):
+        """
+        Parameters
+        ----------
+        records is a numpy structured array of OpSim records (e.g. the
+        output of ObservationMetaDataGenerator.getOpSimRecords())
+
+        generator is the ObservationMetaDataGenerator that knows the
+        OpSim schema of records (it is used to build ObservationMetaData)
+
+        boundType is the boundType of the ObservationMetaData
+        ('circle' or 'box'; default 'circle')
+
+        boundLength is the boundLength of the ObservationMetaData in
+        degrees (default 1.75)
+        """
+        self.records = records
+        self.boundType = boundType
+        self.boundLength = boundLength
+        self._generator = generator
+
+        column_names = records.dtype.names
+        generator._set_opsim_version_from_columns(column_names)
+        generator._set_seeing_column(column_names)
+        interface = generator.user_interface_to_opsim
+
+        for required in ('fieldRA', 'fieldDec', 'expMJD', 'telescopeFilter'):
+            if interface[required][0] not in column_names:
+                raise RuntimeError("ObservationMetaDataArray requires that the OpSim "
+                                   "records include data for:\nfieldRA"
+                                   "\nfieldDec\nexpMJD\nfilter")
+
+        # OpSim v3 stores angles in radians; OpSim v4 in degrees
+        self._in_degrees = interface['fieldRA'][1] is None
+
+        self._ra_name = interface['fieldRA'][0]
+        self._dec_name = interface['fieldDec'][0]
+        self._mjd_name = interface['expMJD'][0]
+        self._filter_name = interface['telescopeFilter'][0]
+        self._rotSky_name = interface['rotSkyPos'][0]
+        self._m5_name = interface['m5'][0]
+        self._seeing_name = interface['seeing'][0]
+
+    def _sub_array(self, records):
+        return ObservationMetaDataArray(records, self._generator,
+                                        boundType=self.boundType,
+                                        boundLength=self.boundLength)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, key):
+        if isinstance(key, numbers.Integral):
+            return self._generator.ObservationMetaDataFromPointing(self.records[key],
+                                                                   OpSimColumns=self.records.dtype.names,
+                                                                   boundLength=self.boundLength,
+                                                                   boundType=self.boundType)
+        return self._sub_array(self.records[key])
+
+    def __iter__(self):
+        for ii in range(len(self.records)):
+            yield self[ii]
+
+    def column(self, name):
+        """
+        Return the numpy array of an OpSim column, referred to either by
+        its name in the OpSim database or by its name in the
+        ObservationMetaDataGenerator interface (e.g. 'm5' for
+        'fiveSigmaDepth'), without any unit transformation.
+        """
+        if name in self.records.dtype.names:
+            return self.records[name]
+        interface = self._generator.user_interface_to_opsim
+        if name in interface and interface[name][0] in self.records.dtype.names:
+            return self.records[interface[name][0]]
+        raise RuntimeError('ObservationMetaDataArray has no column %s' % name)
+
+    def _angle_in_degrees(self, name):
+        if self._in_degrees:
+            return self.records[name].astype(float)
+        return np.degrees(self.records[name])
+
+    def _angle_in_radians(self, name):
+        if self._in_degrees:
+            return np.radians(self.records[name])
+        return self.records[name].astype(float)
+
+    @property
+    def pointingRA(self):
+        """
+        RA of the pointings in degrees
+        """
+        return self._angle_in_degrees(self._ra_name)
+
+    @property
+    def pointingDec(self):
+        """
+        Dec of the pointings in degrees
+        """
+        return self._angle_in_degrees(self._dec_name)
+
+    @property
+    def _pointingRA(self):
+        """
+        RA of the pointings in radians
+        """
+        return self._angle_in_radians(self._ra_name)
+
+    @property
+    def _pointingDec(self):
+        """
+        Dec of the pointings in radians
+        """
+        return self._angle_in_radians(self._dec_name)
+
+    @property
+    def mjd(self):
+        """
+        TAI MJD of the pointings
+        """
+        return self.records[self._mjd_name].astype(float)
+
+    @property
+    def bandpass(self):
+        """
+        Names of the bandpasses of the pointings
+        """
+        return self.records[self._filter_name].astype(str)
+
+    @property
+    def rotSkyPos(self):
+        """
+        rotSkyPos of the pointings in degrees (None if not in the records)
+        """
+        if self._rotSky_name not in self.records.dtype.names:
+            return None
+        return self._angle_in_degrees(self._rotSky_name)
+
+    @property
+    def m5(self):
+        """
+        Five sigma limiting magnitudes of the pointings
+        (None if not in the records)
+        """
+        if self._m5_name not in self.records.dtype.names:
+            return None
+        return self.records[self._m5_name].astype(float)
+
+    @property
+    def seeing(self):
+        """
+        FWHMeff (or finSeeing, for old OpSim outputs) of the pointings
+        in arcseconds (None if not in the records)
+        """
+        if self._seeing_name not in self.records.dtype.names:
+            return None
+        return self.records[self._seeing_name].astype(float)
+
+    @property
+    def skyBrightness(self):
+        """
+        Sky brightness of the pointings (None if not in the records)
+        """
+        if 'filtSkyBrightness' not in self.records.dtype.names:
+            return None
+        return self.records['filtSkyBrightness'].astype(float)
+
+    def select(self, bandpass=None, mjd=None):
+        """
+        Return an ObservationMetaDataArray containing only some of the
+        pointings.
+
+        Parameters
+        ----------
+        bandpass is a str or an iterable of strs naming the bandpasses
+        to keep (None keeps all bandpasses)
+
+        mjd is a tuple indicating the (min, max) TAI MJD to keep
+        (inclusive; None keeps all dates)
+        """
+        keep = np.ones(len(self.records), dtype=bool)
+        if bandpass is not None:
+            if isinstance(bandpass, str):
+                bandpass = [bandpass]
+            keep &= np.isin(self.bandpass, np.array(list(bandpass)))
+        if mjd is not None:
+            mjd_arr = self.mjd
+            keep &= (mjd_arr >= mjd[0]) & (mjd_arr <= mjd[1])
+        return self[keep]
+
+    def within(self, ra, dec, radius):
+        """
+        Return an ObservationMetaDataArray containing only the pointings
+        whose centers are within radius degrees of (ra, dec) (both in degrees).
+
+        To find all of the pointings whose fields of view overlap a
+        circle, add self.boundLength to radius.
+        """
+        dist = _angularSeparation(np.radians(ra), np.radians(dec),
+                                  self._pointingRA, self._pointingDec)
+        return self[dist <= np.radians(radius)]
+
@@ -4,6 +4,8 @@ import os
 import numbers
 from lsst.sims.catalogs.db import DBObject
 from lsst.sims.utils import ObservationMetaData
+from lsst.sims.catUtils.utils import ObservationMetaDataArray
+from lsst.sims.catUtils.utils import OpSimPointingCache
 
 __all__ = ["ObservationMetaDataGenerator"]
 
@@ -152,6 +154,25 @@ class ObservationMetaDataGenerator(object):
 
         self.user_interface_to_opsim['seeing'] = (self._seeing_column, None, float)
 
+    def _set_opsim_version_from_columns(self, OpSimColumns):
+        """
+        If this generator was not connected to an OpSim database, set
+        self._opsim_version from the names of the columns in a set of
+        OpSim records (OpSimColumns).
+        """
+        if self.opsim_version is not None:
+            return
+
+        if 'obsHistID' in OpSimColumns:
+            self._opsim_version = 3
+        elif 'observationId' in OpSimColumns:
+            self._opsim_version = 4
+        else:
+            raise RuntimeError("Unable to determine which OpSim version your "
+                               "OpSimPointingRecords correspond to; make sure "
+                               "obsHistID (v3) or observationId (v4) are in the "
+                               "records.")
+
     @property
     def opsim_version(self):
         return self._opsim_version
@@ -175,7 +196,8 @@ class ObservationMetaDataGenerator(object):
             return 'SummaryAllProps'
         raise RuntimeError("Unsure how to handle opsim_version ",self.opsim_version)
 
-    def __init__(self, database=None, driver='sqlite', host=None, port=None):
+    def __init__(self, database=None, driver='sqlite', host=None, port=None,
+                 cache_dir=None):
         """
         Constructor for the class
 
@@ -189,6 +211,13 @@ class ObservationMetaDataGenerator(object):
             hostName, None is good for a local database
         port : hostName, optional, defaults to None,
             port, None is good for a local database
+        cache_dir : string, optional, defaults to None
+            if not None, the OpSim summary table is copied (once) into a
+            memory-mapped OpSimPointingCache in this directory, and
+            getOpSimRecords answers queries from that copy rather than
+            from the database.  The cache is rebuilt whenever the size
+            or modification time of the database changes.  Only
+            supported for sqlite databases.
 
         Returns
         ------
@@ -203,6 +232,7 @@ class ObservationMetaDataGenerator(object):
         self.port = port
         self.database = database
         self._seeing_column = 'FWHMeff'
+        self._pointing_cache = None
 
         if self.database is None:
             return
@@ -262,6 +292,29 @@ class ObservationMetaDataGenerator(object):
 
         self.dtype = np.dtype(dtypeList)
 
+        if cache_dir is not None:
+            if self.driver != 'sqlite':
+                raise RuntimeError('ObservationMetaDataGenerator can only cache '
+                                   'sqlite OpSim databases; you gave driver=%s' % self.driver)
+            self._pointing_cache = OpSimPointingCache(cache_dir, self.database, self.table_name,
+                                                      self.user_interface_to_opsim['fieldRA'][0],
+                                                      self.user_interface_to_opsim['fieldDec'][0],
+                                                      self.user_interface_to_opsim['expMJD'][0],
+                                                      self.user_interface_to_opsim['fieldRA'][1] is None)
+
+    def _get_pointing_cache(self):
+        """
+        Return self._pointing_cache, building (or rebuilding) the cache
+        files first if they are missing or out of date
+        """
+        if not self._pointing_cache.is_valid(self.dtype):
+            mjd_name = self.user_interface_to_opsim['expMJD'][0]
+            query = self.baseQuery + ' FROM %s GROUP BY %s ORDER BY %s' % (self.table_name,
+                                                                           mjd_name, mjd_name)
+            self._pointing_cache.build(self.opsimdb.execute_arbitrary(query, dtype=self.dtype),
+                                      dtype=self.dtype)
+        return self._pointing_cache
+
     def getOpSimRecords(self, obsHistID=None, expDate=None, night=None, fieldRA=None,
                         fieldDec=None, moonRA=None, moonDec=None,
                         rotSkyPos=None, telescopeFilter=None, rawSeeing=None,
@@ -316,6 +369,9 @@ class ObservationMetaDataGenerator(object):
 
         nConstraints = 0  # the number of constraints in this query
 
+        # the same constraints, in the form used by OpSimPointingCache
+        cache_constraints = []
+
         for column in self.user_interface_to_opsim:
             transform = self.user_interface_to_opsim[column]
 
@@ -352,6 +408,11 @@ class ObservationMetaDataGenerator(object):
 
                     query += ' %s >= %s AND %s <= %s' % \
                              (transform[0], vmin, transform[0], vmax)
+                    if isinstance(vmin, str):
+                        # strings were quoted for SQL; compare the raw values
+                        cache_constraints.append(('range', transform[0], value[0], value[1]))
+                    else:
+                        cache_constraints.append(('range', transform[0], vmin, vmax))
                 else:
                     # perform any necessary coordinate transformations
                     if transform[1] is not None:
@@ -367,8 +428,11 @@ class ObservationMetaDataGenerator(object):
                                                                  vv+tol,
                                                                  transform[0],
                                                                  vv-tol)
+                        cache_constraints.append(('approx', transform[0], vv, tol))
                     else:
                         query += ' %s == %s' % (transform[0], vv)
+                        # strings were quoted for SQL; compare the raw value
+                        cache_constraints.append(('equal', transform[0], value))
 
                 nConstraints += 1
 
@@ -382,6 +446,9 @@ class ObservationMetaDataGenerator(object):
             raise RuntimeError('You did not specify any contraints on your query;' +
                                ' you will just return ObservationMetaData for all poitnings')
 
+        if self._pointing_cache is not None:
+            return self._get_pointing_cache().get_records(cache_constraints, limit=limit)
+
         results = self.opsimdb.execute_arbitrary(query, dtype=self.dtype)
         return results
 
@@ -508,16 +575,7 @@ class ObservationMetaDataGenerator(object):
         if OpSimColumns is None:
             OpSimColumns = OpSimPointingRecords.dtype.names
 
-        if self.opsim_version is None:
-            if 'obsHistID' in OpSimColumns:
-                self._opsim_version = 3
-            elif 'observationId' in OpSimColumns:
-                self._opsim_version = 4
-            else:
-                raise RuntimeError("Unable to determine which OpSim version your "
-                                   "OpSimPointingRecords correspond to; make sure "
-                                   "obsHistID (v3) or observationId (v4) are in the "
-                                   "records.")
+        self._set_opsim_version_from_columns(OpSimColumns)
 
         out = list(self.ObservationMetaDataFromPointing(OpSimPointingRecord,
                                                         OpSimColumns=OpSimColumns,
@@ -616,3 +674,47 @@ class ObservationMetaDataGenerator(object):
                                                            boundType=boundType,
                                                            boundLength=boundLength)
         return output
+
+    def getObservationMetaDataArray(self, obsHistID=None, expDate=None, night=None, fieldRA=None,
+                                    fieldDec=None, moonRA=None, moonDec=None, rotSkyPos=None,
+                                    telescopeFilter=None, rawSeeing=None, seeing=None, sunAlt=None,
+                                    moonAlt=None, dist2Moon=None, moonPhase=None, expMJD=None,
+                                    altitude=None, azimuth=None, visitExpTime=None, airmass=None,
+                                    skyBrightness=None, m5=None, boundType='circle',
+                                    boundLength=1.75, limit=None):
+        """
+        This method takes the same arguments as getObservationMetaData, but,
+        rather than a list of ObservationMetaData, it returns an
+        ObservationMetaDataArray, which keeps the OpSim records in numpy arrays
+        and only builds ObservationMetaData when they are asked for.  This is
+        much faster and uses much less memory when many pointings are
+        returned.
+        """
+        OpSimPointingRecords = self.getOpSimRecords(obsHistID=obsHistID,
+                                                    expDate=expDate,
+                                                    night=night,
+                                                    fieldRA=fieldRA,
+                                                    fieldDec=fieldDec,
+                                                    moonRA=moonRA,
+                                                    moonDec=moonDec,
+                                                    rotSkyPos=rotSkyPos,
+                                                    telescopeFilter=telescopeFilter,
+                                                    rawSeeing=rawSeeing,
+                                                    seeing=seeing,
+                                                    sunAlt=sunAlt,
+                                                    moonAlt=moonAlt,
+                                                    dist2Moon=dist2Moon,
+                                                    moonPhase=moonPhase,
+                                                    expMJD=expMJD,
+                                                    altitude=altitude,
+                                                    azimuth=azimuth,
+                                                    visitExpTime=visitExpTime,
+                                                    airmass=airmass,
+                                                    skyBrightness=skyBrightness,
+                                                    m5=m5, boundType=boundType,
+                                                    boundLength=boundLength,
+                                                    limit=limit)
+
+        return ObservationMetaDataArray(OpSimPointingRecords, self,
+                                        boundType=boundType,
+                                        boundLength=boundLength)
@@ -7,7 +7,7 @@ from lsst.sims.catUtils.mixins import SNIaCatalog, PhotometryBase
 from lsst.sims.catUtils.utils import _baseLightCurveCatalog
 from lsst.sims.catUtils.utils import LightCurveGenerator
 
-from lsst.sims.catUtils.supernovae import SNObject, SNUniverse
+from lsst.sims.catUtils.supernovae import SNObject, SNUniverse, SALT2VisibilityWindow
 from lsst.sims.photUtils import PhotometricParameters, calcGamma
 from lsst.sims.photUtils import Sed, calcSNR_m5, BandpassDict
 
@@ -56,10 +56,15 @@ class SNIaLightCurveGenerator(LightCurveGenerator):
         self.sn_universe.suppressDimSN = False
         self.z_cutoff = 1.2
         self._brightness_name = 'flux'
+
+        # SALT2FluxGrid (if any) with which the fluxes of the supernovae
+        # are interpolated rather than integrated from the SALT2 spectrum
+        self.flux_grid = None
         super(SNIaLightCurveGenerator, self).__init__(*args, **kwargs)
 
     def light_curves_from_pointings(self, pointings, chunk_size=100000, lc_per_field=None,
-                                    constraint=None):
+                                    constraint=None, max_bytes=None, sink=None,
+                                    n_processes=1, scratch_dir=None, snr_lookup=None):
         if lc_per_field is not None:
             warnings.warn("You have set lc_per_field in the SNIaLightCurveGenerator. "
                           "This will limit the number of candidate galaxies queried from the "
@@ -72,7 +77,12 @@ class SNIaLightCurveGenerator(LightCurveGenerator):
         return LightCurveGenerator.light_curves_from_pointings(self, pointings,
                                                                chunk_size=chunk_size,
                                                                lc_per_field=lc_per_field,
-                                                               constraint=constraint)
+                                                               constraint=constraint,
+                                                               max_bytes=max_bytes,
+                                                               sink=sink,
+                                                               n_processes=n_processes,
+                                                               scratch_dir=scratch_dir,
+                                                               snr_lookup=snr_lookup)
 
     def _get_query_from_group(self, grp, chunk_size, lc_per_field=None, constraint=None):
         """
@@ -94,27 +104,46 @@ class SNIaLightCurveGenerator(LightCurveGenerator):
         m5_dict = {}
         t_min = None
         t_max = None
+
+        snr_lookup = self._snr_lookup
+        if snr_lookup is not None and not snr_lookup.matches(self.lsstBandpassDict, self.phot_params):
+            snr_lookup = None
+
         for bp_name in cat_dict:
             self.lsstBandpassDict[bp_name].sbTophi()
 
             # generate a 2-D numpy array containing MJDs, m5, and photometric gamma values
             # for each observation in the given bandpass
-            raw_array = np.array([[obs.mjd.TAI, obs.m5[bp_name],
-                                   calcGamma(self.lsstBandpassDict[bp_name],
-                                             obs.m5[obs.bandpass],
-                                             self.phot_params)]
-                                  for obs in grp if obs.bandpass == bp_name]).transpose()
+            if snr_lookup is not None and bp_name in snr_lookup:
+                # interpolate gamma for all of the band's visits at once
+                band_obs = [obs for obs in grp if obs.bandpass == bp_name]
+                raw_array = np.array([])
+                if len(band_obs) > 0:
+                    m5_arr = np.array([obs.m5[bp_name] for obs in band_obs])
+                    raw_array = np.array([[obs.mjd.TAI for obs in band_obs],
+                                          m5_arr,
+                                          snr_lookup.calcGamma(bp_name, m5_arr)])
+            else:
+                raw_array = np.array([[obs.mjd.TAI, obs.m5[bp_name],
+                                       calcGamma(self.lsstBandpassDict[bp_name],
+                                                 obs.m5[obs.bandpass],
+                                                 self.phot_params)]
+                                      for obs in grp if obs.bandpass == bp_name]).transpose()
 
             if len(raw_array) > 0:
 
-                t_dict[bp_name] = raw_array[0]
+                # sort the observations in time so that the observations
+                # in the window of each SN can be found by binary search
+                time_sorted = np.argsort(raw_array[0], kind='mergesort')
 
-                m5_dict[bp_name] = raw_array[1]
+                t_dict[bp_name] = raw_array[0][time_sorted]
 
-                gamma_dict[bp_name] = raw_array[2]
+                m5_dict[bp_name] = raw_array[1][time_sorted]
 
-                local_t_min = t_dict[bp_name].min()
-                local_t_max = t_dict[bp_name].max()
+                gamma_dict[bp_name] = raw_array[2][time_sorted]
+
+                local_t_min = t_dict[bp_name][0]
+                local_t_max = t_dict[bp_name][-1]
                 if t_min is None or local_t_min < t_min:
                     t_min = local_t_min
 
@@ -122,6 +151,7 @@ class SNIaLightCurveGenerator(LightCurveGenerator):
                     t_max = local_t_max
 
         snobj = SNObject()
+        visibility_window = SALT2VisibilityWindow()
 
         cat = cat_dict[list(cat_dict.keys())[0]]  # does not need to be associated with a bandpass
 
@@ -135,94 +165,135 @@ class SNIaLightCurveGenerator(LightCurveGenerator):
                 break
 
             t_start_chunk = time.time()
-            for sn in cat.iter_catalog(query_cache=[chunk]):
-                sn_rng = self.sn_universe.getSN_rng(sn[1])
-                sn_t0 = self.sn_universe.drawFromT0Dist(sn_rng)
-                if sn[5] <= self.z_cutoff and np.isfinite(sn_t0) and \
-                    sn_t0 < t_max + cat.maxTimeSNVisible and \
-                    sn_t0 > t_min - cat.maxTimeSNVisible:
-
+            n_points = 0
+            sn_rows = list(cat.iter_catalog(query_cache=[chunk]))
+            chunk_z = np.array([sn[5] for sn in sn_rows], dtype=float)
+            if self.sn_universe.useCounterRNG:
+                # draw the parameters of every SN in the chunk at once
+                if len(sn_rows) > 0:
+                    (chunk_c, chunk_x1, chunk_x0,
+                     chunk_t0, chunk_mB) = self.sn_universe.drawSNParamArrays(np.array([sn[1] for sn in sn_rows]),
+                                                                              np.array([sn[4] for sn in sn_rows]))
+                else:
+                    chunk_t0 = np.zeros(0, dtype=float)
+            else:
+                # t0 is the first number drawn from each SN's random number
+                # generator; the rest are only drawn for SNe that survive
+                # the cuts below (re-seeding the generator)
+                chunk_t0 = np.array([self.sn_universe.drawFromT0Dist(self.sn_universe.getSN_rng(sn[1]))
+                                     for sn in sn_rows], dtype=float)
+
+            # drop the SNe whose SALT2 models do not overlap the observations
+            # before doing anything per SN
+            chunk_mjd_min, chunk_mjd_max = visibility_window.mjd_window(chunk_t0, chunk_z)
+            with np.errstate(invalid='ignore'):
+                candidates = np.where(np.logical_and.reduce((chunk_z <= self.z_cutoff,
+                                                             np.isfinite(chunk_t0),
+                                                             chunk_t0 < t_max + cat.maxTimeSNVisible,
+                                                             chunk_t0 > t_min - cat.maxTimeSNVisible,
+                                                             chunk_mjd_max >= t_min,
+                                                             chunk_mjd_min <= t_max)))[0]
+
+            # the observations in each candidate's window, in each bandpass
+            visit_slices = {}
+            for bp_name in t_dict:
+                visit_slices[bp_name] = visibility_window.visit_slices(t_dict[bp_name],
+                                                                       chunk_t0[candidates],
+                                                                       chunk_z[candidates])
+
+            for i_candidate, i_sn in enumerate(candidates):
+                sn = sn_rows[i_sn]
+                sn_t0 = chunk_t0[i_sn]
+
+                if self.sn_universe.useCounterRNG:
+                    sn_c = chunk_c[i_sn]
+                    sn_x1 = chunk_x1[i_sn]
+                    sn_x0 = chunk_x0[i_sn]
+                else:
+                    sn_rng = self.sn_universe.getSN_rng(sn[1])
+                    self.sn_universe.drawFromT0Dist(sn_rng)
                     sn_c = self.sn_universe.drawFromcDist(sn_rng)
                     sn_x1 = self.sn_universe.drawFromx1Dist(sn_rng)
                     sn_x0 = self.sn_universe.drawFromX0Dist(sn_rng, sn_x1, sn_c, sn[4])
 
-                    snobj.set(t0=sn_t0, c=sn_c, x1=sn_x1, x0=sn_x0, z=sn[5])
-
-                    for bp_name in t_dict:
-                        t_list = t_dict[bp_name]
-                        m5_list = m5_dict[bp_name]
-                        gamma_list = gamma_dict[bp_name]
-                        bandpass = self.lsstBandpassDict[bp_name]
-                        if len(t_list) == 0:
-                            continue
-
-                        if snobj.maxtime() >= t_list[0] and snobj.mintime() <= t_list[-1]:
-                            active_dexes = np.where(np.logical_and(t_list >= snobj.mintime(),
-                                                                   t_list <= snobj.maxtime()))
-
-                            t_active = t_list[active_dexes]
-                            m5_active = m5_list[active_dexes]
-                            gamma_active = gamma_list[active_dexes]
-
-                            if len(t_active) > 0:
-
-                                wave_ang = bandpass.wavelen*10.0
-                                mask = np.logical_and(wave_ang > snobj.minwave(),
-                                                      wave_ang < snobj.maxwave())
-
-                                wave_ang = wave_ang[mask]
-                                snobj.set(mwebv=sn[6])
-                                sn_ff_buffer = snobj.flux(time=t_active, wave=wave_ang)*10.0
-                                flambda_grid = np.zeros((len(t_active), len(bandpass.wavelen)))
-                                for ff, ff_sn in zip(flambda_grid, sn_ff_buffer):
-                                    ff[mask] = np.where(ff_sn > 0.0, ff_sn, 0.0)
-
-                                fnu_grid = flambda_grid*bandpass.wavelen* \
-                                           bandpass.wavelen*dummy_sed._physParams.nm2m* \
-                                           dummy_sed._physParams.ergsetc2jansky/dummy_sed._physParams.lightspeed
-
-                                flux_list = \
-                                (fnu_grid*bandpass.phi).sum(axis=1)*(bandpass.wavelen[1]-bandpass.wavelen[0])
-
-                                acceptable = np.where(flux_list>0.0)
-
-                                flux_error_list = flux_list[acceptable]/ \
-                                                  calcSNR_m5(dummy_sed.magFromFlux(flux_list[acceptable]),
-                                                             bandpass,
-                                                             m5_active[acceptable], self.phot_params,
-                                                             gamma=gamma_active[acceptable])
-
-                                if len(acceptable) > 0:
-
-                                    n_actual_sn += 1
-                                    if lc_per_field is not None and n_actual_sn > lc_per_field:
-                                        break
-
-                                    if sn[0] not in self.truth_dict:
-                                        self.truth_dict[sn[0]] = {}
-                                        self.truth_dict[sn[0]]['t0'] = sn_t0
-                                        self.truth_dict[sn[0]]['x1'] = sn_x1
-                                        self.truth_dict[sn[0]]['x0'] = sn_x0
-                                        self.truth_dict[sn[0]]['c'] = sn_c
-                                        self.truth_dict[sn[0]]['z'] = sn[5]
-                                        self.truth_dict[sn[0]]['E(B-V)'] = sn[6]
-
-                                    if sn[0] not in self.mjd_dict:
-                                        self.mjd_dict[sn[0]] = {}
-                                        self.bright_dict[sn[0]] = {}
-                                        self.sig_dict[sn[0]] = {}
-
-                                    if bp_name not in self.mjd_dict[sn[0]]:
-                                        self.mjd_dict[sn[0]][bp_name] = []
-                                        self.bright_dict[sn[0]][bp_name] = []
-                                        self.sig_dict[sn[0]][bp_name] = []
-
-                                for tt, ff, ee in zip(t_active[acceptable], flux_list[acceptable],
-                                                      flux_error_list[0]):
-
-                                    self.mjd_dict[sn[0]][bp_name].append(tt)
-                                    self.bright_dict[sn[0]][bp_name].append(ff/3631.0)
-                                    self.sig_dict[sn[0]][bp_name].append(ee/3631.0)
+                snobj.set(t0=sn_t0, c=sn_c, x1=sn_x1, x0=sn_x0, z=sn[5])
+
+                for bp_name in t_dict:
+                    t_list = t_dict[bp_name]
+                    m5_list = m5_dict[bp_name]
+                    gamma_list = gamma_dict[bp_name]
+                    bandpass = self.lsstBandpassDict[bp_name]
+                    if len(t_list) == 0:
+                        continue
+
+                    i_start = visit_slices[bp_name][0][i_candidate]
+                    i_end = visit_slices[bp_name][1][i_candidate]
+                    if i_end > i_start:
+                        active_dexes = slice(i_start, i_end)
+
+                        t_active = t_list[active_dexes]
+                        m5_active = m5_list[active_dexes]
+                        gamma_active = gamma_list[active_dexes]
+
+                        if len(t_active) > 0 and self.flux_grid is not None:
+                            flux_list = 3631.0*self.flux_grid.fluxes(t_active, sn_t0, sn[5],
+                                                                     sn_x1, sn_c, sn_x0,
+                                                                     ebv=sn[6],
+                                                                     bandpass_name=bp_name)
+
+                        elif len(t_active) > 0:
+
+                            wave_ang = bandpass.wavelen*10.0
+                            mask = np.logical_and(wave_ang > snobj.minwave(),
+                                                  wave_ang < snobj.maxwave())
+
+                            wave_ang = wave_ang[mask]
+                            snobj.set(mwebv=sn[6])
+                            sn_ff_buffer = snobj.flux(time=t_active, wave=wave_ang)*10.0
+                            flambda_grid = np.zeros((len(t_active), len(bandpass.wavelen)))
+                            for ff, ff_sn in zip(flambda_grid, sn_ff_buffer):
+                                ff[mask] = np.where(ff_sn > 0.0, ff_sn, 0.0)
+
+                            fnu_grid = flambda_grid*bandpass.wavelen* \
+                                       bandpass.wavelen*dummy_sed._physParams.nm2m* \
+                                       dummy_sed._physParams.ergsetc2jansky/dummy_sed._physParams.lightspeed
+
+                            flux_list = \
+                            (fnu_grid*bandpass.phi).sum(axis=1)*(bandpass.wavelen[1]-bandpass.wavelen[0])
+
+                        if len(t_active) > 0:
+
+                            acceptable = np.where(flux_list>0.0)
+
+                            flux_error_list = flux_list[acceptable]/ \
+                                              calcSNR_m5(dummy_sed.magFromFlux(flux_list[acceptable]),
+                                                         bandpass,
+                                                         m5_active[acceptable], self.phot_params,
+                                                         gamma=gamma_active[acceptable])
+
+                            if len(acceptable) > 0:
+
+                                n_actual_sn += 1
+                                if lc_per_field is not None and n_actual_sn > lc_per_field:
+                                    break
+
+                                if sn[0] not in self.truth_dict:
+                                    self.truth_dict[sn[0]] = {}
+                                    self.truth_dict[sn[0]]['t0'] = sn_t0
+                                    self.truth_dict[sn[0]]['x1'] = sn_x1
+                                    self.truth_dict[sn[0]]['x0'] = sn_x0
+                                    self.truth_dict[sn[0]]['c'] = sn_c
+                                    self.truth_dict[sn[0]]['z'] = sn[5]
+                                    self.truth_dict[sn[0]]['E(B-V)'] = sn[6]
+
+                            self._lc_store.append(sn[0], bp_name, t_active[acceptable],
+                                                  flux_list[acceptable]/3631.0,
+                                                  flux_error_list[0]/3631.0)
+                            n_points += len(acceptable[0])
+
+            self._update_chunk_size(query_result, len(chunk), chunk.nbytes + 24*n_points,
+                                    t_start_chunk)
+            self._flush_to_sink()
 
             print("chunk of ", len(chunk), " took ", time.time()-t_start_chunk)
 
@@ -1,9 +1,18 @@
 from .CatalogSetupFunctions import *
+from .ObservationMetaDataArray import *
+from .opsimPointingCache import *
 from .ObservationMetaDataGenerator import *
 from .testUtils import *
 from .DBobjectTestUtils import *
 from .CatalogTestUtils import *
+from .adaptiveChunkSize import *
+from .lightCurveStore import *
+from .lightCurveSink import *
 from .LightCurveGenerator import *
 from .SNIaLightCurveGenerator import *
+from .alertDataWriter import *
+from .multiVisitEvaluator import *
 from .alertDataGenerator import *
+from .trixelVariabilityIndex import *
+from .alertDataRepartitioner import *
 from .avroAlertGenerator import *
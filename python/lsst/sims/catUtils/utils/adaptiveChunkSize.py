@@ -0,0 +1,174 @@
+"""
+This module provides a class that chooses how many database rows the
+DB-driven generators (AlertDataGenerator, LightCurveGenerator and
+SNIaLightCurveGenerator) process at once, so that their working memory
+stays within a budget.
+"""
+import numpy as np
+
+__all__ = ["AdaptiveChunkSizer"]
+
+
+class AdaptiveChunkSizer(object):
+    """
+    Choose a database chunk_size from a memory budget.
+
+    The chunk size starts at max_bytes divided by an estimate of the
+    memory needed per database row (see estimate_bytes_per_row).  That
+    estimate only depends on the number of visits; the effect of the mix
+    of variability models (how many rows survive the photometric cuts
+    and need chip names, pupil coordinates etc.) is learned from the
+    measured memory per row.  After each chunk is processed, call update() with the number of rows in
+    the chunk, the number of bytes actually used to process it and the
+    time it took.  The chunk size is then recomputed from the measured
+    memory per row:
+
+    - if a chunk used more memory per row than expected, the chunk size
+      is reduced immediately;
+
+    - otherwise it grows by at most a factor of max_growth per chunk,
+      and stops growing if the last increase did not improve the
+      throughput (rows per second) by at least min_speedup.
+
+    Pass the sizer's chunk_size to the database query and call apply()
+    on the query's iterator after update() so that the next fetch uses
+    the new size.
+    """
+
+    def __init__(self, max_bytes, bytes_per_row, min_chunk_size=100,
+                 max_chunk_size=1000000, max_growth=2.0, min_speedup=1.05):
+        """
+        Parameters
+        ----------
+        max_bytes is the memory budget (in bytes) for processing one chunk
+
+        bytes_per_row is the initial estimate of the memory needed per
+        database row (see estimate_bytes_per_row)
+
+        min_chunk_size is the smallest chunk_size that will be used
+        (default 100)
+
+        max_chunk_size is the largest chunk_size that will be used
+        (default 1,000,000)
+
+        max_growth is the largest factor by which the chunk size can grow
+        from one chunk to the next (default 2)
+
+        min_speedup is the smallest improvement in throughput that justifies
+        continuing to grow the chunk size (default 1.05)
+        """
+        if max_bytes <= 0:
+            raise RuntimeError('AdaptiveChunkSizer needs max_bytes > 0; you gave %e' % max_bytes)
+        if bytes_per_row <= 0:
+            raise RuntimeError('AdaptiveChunkSizer needs bytes_per_row > 0; you gave %e' % bytes_per_row)
+
+        self._max_bytes = max_bytes
+        self._bytes_per_row = float(bytes_per_row)
+        self._min_chunk_size = min_chunk_size
+        self._max_chunk_size = max_chunk_size
+        self._max_growth = max_growth
+        self._min_speedup = min_speedup
+        self._last_throughput = None
+        self._last_chunk_size = None
+        self._growing = True
+        self._chunk_size = self._clip(self._max_bytes/self._bytes_per_row)
+
+    @staticmethod
+    def estimate_bytes_per_row(n_visits, n_bands=6, n_arrays=3, row_bytes=1024):
+        """
+        Estimate the memory needed to process one database row.
+
+        Parameters
+        ----------
+        n_visits is the number of visits each row is simulated in
+
+        n_bands is the number of bands for which per-visit values
+        are computed for each row (default 6)
+
+        n_arrays is the number of float64 arrays of shape
+        (n_visits, n_bands) held per row at the same time (default 3)
+
+        row_bytes is the memory of the database row itself and of its
+        per-row (not per-visit) derived columns (default 1024)
+
+        Returns
+        -------
+        The estimated number of bytes per row
+        """
+        return row_bytes + n_visits*n_bands*n_arrays*8
+
+    def _clip(self, chunk_size):
+        return int(np.clip(chunk_size, self._min_chunk_size, self._max_chunk_size))
+
+    @property
+    def chunk_size(self):
+        """
+        The number of rows to fetch in the next chunk
+        """
+        return self._chunk_size
+
+    @property
+    def bytes_per_row(self):
+        """
+        The current estimate of the memory needed per row
+        """
+        return self._bytes_per_row
+
+    def update(self, n_rows, n_bytes, elapsed=None):
+        """
+        Update the chunk size after processing a chunk.
+
+        Parameters
+        ----------
+        n_rows is the number of database rows in the chunk
+
+        n_bytes is the memory (in bytes) that was used to process the chunk
+
+        elapsed is the time (in seconds) it took to process the chunk
+        (optional; if None, throughput is not considered)
+
+        Returns
+        -------
+        The new chunk size
+        """
+        if n_rows <= 0:
+            return self._chunk_size
+
+        measured = float(n_bytes)/float(n_rows)
+        if measured > self._bytes_per_row:
+            # react to unexpectedly large chunks right away
+            self._bytes_per_row = measured
+        else:
+            self._bytes_per_row = 0.5*(self._bytes_per_row + measured)
+
+        target = self._max_bytes/self._bytes_per_row
+
+        if elapsed is not None and elapsed > 0.0:
+            throughput = n_rows/elapsed
+            if (self._last_throughput is not None and
+                self._last_chunk_size is not None and
+                n_rows > self._last_chunk_size and
+                throughput < self._min_speedup*self._last_throughput):
+
+                # bigger chunks stopped paying off
+                self._growing = False
+
+            self._last_throughput = throughput
+            self._last_chunk_size = n_rows
+
+        if target > self._chunk_size:
+            if self._growing:
+                target = min(target, self._max_growth*self._chunk_size)
+            else:
+                target = self._chunk_size
+
+        self._chunk_size = self._clip(target)
+        return self._chunk_size
+
+    def apply(self, query_result):
+        """
+        Make a database iterator (e.g. the ChunkIterator returned by
+        query_columns) fetch self.chunk_size rows at its next step
+        """
+        if hasattr(query_result, 'chunk_size') and query_result.chunk_size is not None:
+            query_result.chunk_size = self._chunk_size
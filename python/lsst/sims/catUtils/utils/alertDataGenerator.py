@@ -1,8 +1,6 @@
 import numpy as np
 import os
 import re
-import sqlite3
-from collections import OrderedDict
 import time
 import gc
 from lsst.utils import getPackageDir
@@ -13,6 +11,10 @@ from lsst.sims.utils import levelFromHtmid, halfSpaceFromRaDec
 from lsst.sims.utils import angularSeparation, ObservationMetaData
 from lsst.sims.utils import arcsecFromRadians
 from lsst.sims.catUtils.utils import _baseLightCurveCatalog
+from lsst.sims.catUtils.utils import AlertDataSqliteWriter
+from lsst.sims.catUtils.utils import AdaptiveChunkSizer
+from lsst.sims.catUtils.utils import MultiVisitEvaluator
+from lsst.sims.catUtils.utils import ObservationMetaDataArray
 from lsst.sims.utils import _pupilCoordsFromRaDec
 from lsst.sims.coordUtils import chipNameFromPupilCoords
 from lsst.sims.coordUtils import pixelCoordsFromPupilCoords
@@ -520,8 +522,28 @@ class AlertDataGenerator(object):
 
         The baseline_astrometry table is indexed on uniqueId
 
+    alert_data_from_htmid can also write these tables to columnar HDF5
+    files (see the writer_class kwarg and AlertDataHdf5Writer).  In
+    that case, each table is an HDF5 group containing one dataset per
+    column.  The read_table() classmethod of each writer class returns
+    the same numpy recarray for a given table regardless of which
+    backend wrote it.
+
+    Trixels that contain no variable sources able to trigger an alert
+    can be dropped from htmid_list before any database query is made
+    by passing a TrixelVariabilityIndex to apply_variability_index.
+
+    If only the alert stream is needed, passing AvroAlertStreamWriter
+    as the writer_class hands the alert data to an AvroAlertStream as it
+    is generated.  The stream writes one avro file per obsHistID, without
+    writing any of the tables above.
+
     """
 
+    # The dimmest magnitudes at which objects are considered visible
+    # in each of the LSST filters (from Table 2 of the overview paper)
+    obs_mag_cutoff = (23.68, 24.89, 24.43, 24.0, 24.45, 22.60)
+
     def __init__(self,
                  testing=False):
         """
@@ -584,7 +606,10 @@ class AlertDataGenerator(object):
 
         Parameters
         ----------
-        obs_list is a list of ObservationMetaData
+        obs_list is a list of ObservationMetaData or an
+        ObservationMetaDataArray (in which case ObservationMetaData
+        are only built for the trixel being simulated by
+        alert_data_from_htmid)
 
         htmid_level is an int denoting the level of
         the HTM mesh you want to use to tile the sky
@@ -615,22 +640,21 @@ class AlertDataGenerator(object):
             if levelFromHtmid(htmid) == htmid_level:
                 valid_htmid.append(htmid)
 
-        obs_list = np.array(obs_list)
-        self._obs_list = obs_list
-        obs_ra_list = []
-        obs_dec_list = []
-        halfspace_list = []
-        for obs in obs_list:
-            obs_ra_list.append(obs.pointingRA)
-            obs_dec_list.append(obs.pointingDec)
-            hs = halfSpaceFromRaDec(obs.pointingRA,
-                                    obs.pointingDec,
-                                    obs.boundLength)
-            halfspace_list.append(hs)
-
-        obs_ra_list = np.array(obs_ra_list)
-        obs_dec_list = np.array(obs_dec_list)
-        halfspace_list = np.array(halfspace_list)
+        if isinstance(obs_list, ObservationMetaDataArray):
+            self._obs_list = obs_list
+            obs_ra_list = obs_list.pointingRA
+            obs_dec_list = obs_list.pointingDec
+            bound_length_list = obs_list.boundLength*np.ones(len(obs_list))
+        else:
+            obs_list = np.array(obs_list)
+            self._obs_list = obs_list
+            obs_ra_list = np.array([obs.pointingRA for obs in obs_list])
+            obs_dec_list = np.array([obs.pointingDec for obs in obs_list])
+            bound_length_list = np.array([obs.boundLength for obs in obs_list])
+
+        halfspace_list = np.array([halfSpaceFromRaDec(ra, dec, bound_length)
+                                   for ra, dec, bound_length
+                                   in zip(obs_ra_list, obs_dec_list, bound_length_list)])
 
         self._htmid_dict = {}
         self._htmid_list = []
@@ -646,7 +670,6 @@ class AlertDataGenerator(object):
                 final_obs_list = []
                 for obs_dex in valid_obs[0]:
                     hs = halfspace_list[obs_dex]
-                    obs = obs_list[obs_dex]
                     if hs.contains_trixel(trixel) != 'outside':
                         final_obs_list.append(obs_dex)
 
@@ -685,64 +708,154 @@ class AlertDataGenerator(object):
     def obs_from_htmid(self, htmid):
         """
         Return a numpy array containing all of the ObservationMetaData
-        that intersect the trixel specified by htmid.
+        that intersect the trixel specified by htmid (or an
+        ObservationMetaDataArray, if that is what was passed to
+        subdivide_obs).
 
         Must run subdivide_obs in order for this method to
         work.
         """
         return self._obs_list[self._htmid_dict[htmid]]
 
-    def _output_alert_data(self, conn, data_cache):
+    def _bandpasses_from_htmid(self, htmid):
+        """
+        Return a numpy array of the bandpass names of the
+        ObservationMetaData that intersect the trixel
+        specified by htmid.
         """
-        Write a cache of alert data to the sqlite file currently open.
+        if isinstance(self._obs_list, ObservationMetaDataArray):
+            return self._obs_list.bandpass[self._htmid_dict[htmid]]
+        return np.array([obs.bandpass for obs in self.obs_from_htmid(htmid)])
+
+    def apply_variability_index(self, variability_index, dmag_cutoff):
+        """
+        Use a TrixelVariabilityIndex to drop the trixels that cannot
+        produce any alerts from htmid_list, and to sort the remaining
+        trixels so that those with the most work (number of observations
+        times the number of candidate variable sources) come first.
+
+        Must run subdivide_obs in order for this method to work.
 
         Parameters
         ----------
-        conn is the connection to the sqlite file (already open)
+        variability_index is a TrixelVariabilityIndex covering the
+        trixels in htmid_list
 
-        data_cache is a dict containing all of the data to be written.
-        It will keyed on a string like 'i_j' where i is the obshistID
-        of an OpSim pointing and j is an arbitrary integer.  That key
-        will lead to another dict keyed on the columns being output to
-        the sqlite file.  The values of this second layer of dict are
-        numpy arrays.
+        dmag_cutoff is the minimum delta magnitude needed to trigger
+        an alert
 
         Returns
         -------
-        The number of rows written to the sqlite file
+        A list of the htmids that were dropped
         """
+        work_list = []
+        kept_htmid = []
+        dropped_htmid = []
+        for htmid in self._htmid_list:
+            band_list = np.unique(self._bandpasses_from_htmid(htmid))
+            n_candidates = variability_index.n_candidates(htmid, band_list, dmag_cutoff,
+                                                          obs_mag_cutoff=self.obs_mag_cutoff)
+            if n_candidates == 0:
+                dropped_htmid.append(htmid)
+                continue
+            kept_htmid.append(htmid)
+            work_list.append(n_candidates*self.n_obs(htmid))
+
+        kept_htmid = np.array(kept_htmid, dtype=self._htmid_list.dtype)
+        sorted_dex = np.argsort(-1.0*np.array(work_list), kind='mergesort')
+        self._htmid_list = kept_htmid[sorted_dex]
+        for htmid in dropped_htmid:
+            self._htmid_dict.pop(htmid)
+        print('variability index dropped %d of %d htmid' %
+              (len(dropped_htmid), len(dropped_htmid)+len(self._htmid_list)))
+        return dropped_htmid
+
+    def quiescent_mag_constraint(self, dbobj, htmid, max_brightening=None,
+                                 variables_only=False):
+        """
+        Build an SQL constraint that lets the database discard the sources
+        in a trixel that can never trigger an alert, so that they are not
+        transferred and processed by alert_data_from_htmid.
 
-        cursor = conn.cursor()
-        n_rows_0 = cursor.execute('SELECT COUNT(uniqueId) FROM alert_data').fetchall()
+        Parameters
+        ----------
+        dbobj is the CatalogDBObject that will be queried
 
-        chunk_lengths = np.zeros(len(data_cache))
+        htmid is the trixel that will be queried (must be in self.htmid_list)
 
-        for i_cache_tag, cache_tag in enumerate(data_cache):
-            obshistid = int(cache_tag.split('_')[0])
-            n_obj = len(data_cache[cache_tag]['uniqueId'])
-            chunk_lengths[i_cache_tag] = n_obj
+        max_brightening is the largest amount (in magnitudes) by which
+        any source can brighten relative to its quiescent magnitude.  It
+        can be a float, or a dict mapping the names of variability models
+        (the "m" entry of varParamStr) to floats.  Sources whose quiescent
+        magnitudes minus max_brightening are fainter than obs_mag_cutoff
+        in every band observed in the trixel are discarded.  When it is
+        a dict, sources whose model is not listed are not filtered on
+        magnitude.  If None, no magnitude constraint is applied.
 
-            values = ((int(data_cache[cache_tag]['uniqueId'][i_obj]),
-                      obshistid,
-                      data_cache[cache_tag]['xPix'][i_obj],
-                      data_cache[cache_tag]['yPix'][i_obj],
-                      int(data_cache[cache_tag]['chipNum'][i_obj]),
-                      data_cache[cache_tag]['dflux'][i_obj],
-                      data_cache[cache_tag]['SNR'][i_obj],
-                      np.degrees(data_cache[cache_tag]['raICRS'][i_obj]),
-                      np.degrees(data_cache[cache_tag]['decICRS'][i_obj]))
-                      for i_obj in range(n_obj))
-            cursor.executemany('INSERT INTO alert_data VALUES (?,?,?,?,?,?,?,?,?)', values)
-        conn.commit()
+        variables_only is a boolean.  If True, sources whose varParamStr
+        is NULL or 'None' are discarded.
 
-        n_rows_1 = cursor.execute('SELECT COUNT(uniqueId) FROM alert_data').fetchall()
-        conn.commit()
-        n_written = (n_rows_1[0][0]-n_rows_0[0][0])
+        Returns
+        -------
+        A string containing the SQL constraint (None if there is nothing
+        to constrain)
 
-        return n_written
+        Note: the constraint uses the quiescent magnitude columns stored
+        in the database, which are only approximately the magnitudes
+        calculated by the photometry_class, so max_brightening should
+        include some margin.
+        """
+        if 'variabilityParameters' in dbobj.columnMap:
+            var_param_col = dbobj.columnMap['variabilityParameters']
+        else:
+            var_param_col = 'varParamStr'
+
+        constraint_list = []
+        if variables_only:
+            constraint_list.append("%s IS NOT NULL AND %s != 'None'" %
+                                   (var_param_col, var_param_col))
+
+        if max_brightening is not None:
+            if 'umag' in dbobj.columnMap:
+                mag_cols = ('umag', 'gmag', 'rmag', 'imag', 'zmag', 'ymag')
+            elif 'u_ab' in dbobj.columnMap:
+                mag_cols = ('u_ab', 'g_ab', 'r_ab', 'i_ab', 'z_ab', 'y_ab')
+            else:
+                raise RuntimeError('Not sure what quiescent '
+                                   'LSST magnitudes are called '
+                                   'in this CatalogDBObject')
+
+            mag_name_to_int = {'u': 0, 'g': 1, 'r': 2,
+                               'i': 3, 'z': 4, 'y': 5}
+            band_list = sorted(set([mag_name_to_int[bp]
+                                    for bp in self._bandpasses_from_htmid(htmid)]))
+
+            def visible_in_some_band(brightening):
+                return '(%s)' % ' OR '.join(['%s <= %.6f' % (dbobj.columnMap[mag_cols[i_band]],
+                                                             self.obs_mag_cutoff[i_band]+brightening)
+                                             for i_band in band_list])
+
+            if isinstance(max_brightening, dict):
+                model_list = sorted(max_brightening.keys())
+                model_match = dict((model, "%s LIKE '%%\"%s\"%%'" % (var_param_col, model))
+                                   for model in model_list)
+                clause_list = ['(%s AND %s)' % (model_match[model],
+                                                visible_in_some_band(max_brightening[model]))
+                               for model in model_list]
+                clause_list.append('(%s IS NULL OR (%s))' %
+                                   (var_param_col,
+                                    ' AND '.join(['NOT %s' % model_match[model]
+                                                  for model in model_list])))
+                constraint_list.append('(%s)' % ' OR '.join(clause_list))
+            else:
+                constraint_list.append(visible_in_some_band(max_brightening))
+
+        if len(constraint_list) == 0:
+            return None
+        return ' AND '.join(constraint_list)
 
     def _filter_on_photometry_then_chip_name(self, chunk, column_query,
-                                             obs_valid_dex, expmjd_list,
+                                             obs_valid_list, expmjd_list,
                                              photometry_catalog,
                                              dmag_cutoff):
         """
@@ -760,12 +873,11 @@ class AlertDataGenerator(object):
         column_query is a list of the columns that were queried from
         the database
 
-        obs_valid_dex is a list of integers corresponding to indexes in
-        self._obs_list of the ObservationMetaData that are actually valid
-        for the trixel currently being simulated
+        obs_valid_list is a list of the ObservationMetaData that are
+        actually valid for the trixel currently being simulated
 
         expmjd_list is a numpy array of the TAI dates of ObservtionMetaData
-        represented by obs_valid_dex
+        in obs_valid_list
 
         photometry_catalog is an instantiation of the InstanceCatalog class
         being used to calculate magnitudes for these variable sources.
@@ -773,7 +885,7 @@ class AlertDataGenerator(object):
         Outputs
         -------
         chip_name_dict is a dict keyed on i_obs (which is the index of
-        an ObservationMetaData's position in obs_valid_dex, NOT its
+        an ObservationMetaData's position in obs_valid_list, NOT its
         position in self._obs_list).  The values of chip_name_dict are
         tuples containing:
             - a list of the names of the detectors that objects from chunk
@@ -794,7 +906,7 @@ class AlertDataGenerator(object):
         dmag_arr_transpose is dmag_arr with the time and object columns
         transposed so that dmag_arr_transpose[4][3][11] == dmag_arr[11][3][4].
 
-        time_arr is an array of integers with shape == (len(chunk), len(obs_valid_dex)).
+        time_arr is an array of integers with shape == (len(chunk), len(obs_valid_list)).
         A -1 in time_arr means that that combination of object and observation did
         not yield a valid observation.  A +1 means that the object and observation
         combination are valid.
@@ -842,11 +954,10 @@ class AlertDataGenerator(object):
 
         # time_arr will keep track of which objects appear in which observations;
         # 1 means the object appears; -1 means it does not
-        time_arr_transpose = -1*np.ones((len(obs_valid_dex), len(chunk['raJ2000'])),
+        time_arr_transpose = -1*np.ones((len(obs_valid_list), len(chunk['raJ2000'])),
                                         dtype=int)
 
-        for i_obs, obs_dex in enumerate(obs_valid_dex):
-            obs = self._obs_list[obs_dex]
+        for i_obs, obs in enumerate(obs_valid_list):
             chip_name_list = np.array([None]*n_raw_obj)
             xpup_list = np.zeros(n_raw_obj, dtype=float)
             ypup_list = np.zeros(n_raw_obj, dtype=float)
@@ -879,7 +990,7 @@ class AlertDataGenerator(object):
                                      valid_obj)
 
         time_arr = time_arr_transpose.transpose()
-        assert len(chip_name_dict) == len(obs_valid_dex)
+        assert len(chip_name_dict) == len(obs_valid_list)
 
         return chip_name_dict, dmag_arr, dmag_arr_transpose, time_arr
 
@@ -890,11 +1001,17 @@ class AlertDataGenerator(object):
                               log_file_name=None,
                               photometry_class=None,
                               chunk_cutoff=-1,
-                              lock=None):
+                              lock=None,
+                              writer_class=None,
+                              writer_kwargs=None,
+                              max_brightening=None,
+                              variables_only=False,
+                              max_bytes=None,
+                              snr_lookup=None):
 
         """
-        Generate an sqlite file with all of the alert data for a given
-        trixel.
+        Generate a file (sqlite, by default) with all of the alert data for
+        a given trixel.
 
         Parameters
         ----------
@@ -932,6 +1049,37 @@ class AlertDataGenerator(object):
         lock is a multiprocessing.Lock() for use if running multiple
         instances of alert_data_from_htmid.  This will prevent multiple processes
         from writing to the log file or stdout simultaneously.
+
+        writer_class is the class (not an instantiation) that will be used
+        to write the output file.  It must inherit from AlertDataWriterBase.
+        Defaults to AlertDataSqliteWriter.  Use AlertDataHdf5Writer to produce
+        columnar HDF5 files instead, or AvroAlertStreamWriter (with
+        writer_kwargs={'alert_stream': an AvroAlertStream}) to skip the
+        intermediate files and write avro alerts directly.  The output
+        file will be named
+
+        output_dir/output_prefix_htmid + writer_class.file_suffix
+
+        writer_kwargs is an optional dict of keyword arguments passed to the
+        constructor of writer_class (e.g. {'use_float32': True} for the
+        AlertDataHdf5Writer)
+
+        max_brightening and variables_only are used to build an SQL
+        constraint that keeps sources which can never trigger an alert
+        from being queried at all (see quiescent_mag_constraint).
+        By default, every source in the trixel is queried.
+
+        max_bytes is an optional memory budget (in bytes) for processing
+        one chunk of sources.  If set, chunk_size is ignored; the chunk size
+        is instead derived from the number of visits to this trixel and
+        adjusted after every chunk from the memory actually used by the
+        per-visit photometry arrays and the throughput achieved (see
+        AdaptiveChunkSizer).
+
+        snr_lookup is an optional SNRLookup built from the LSST total
+        bandpasses and the default PhotometricParameters.  If given, the
+        photometric gamma of each visit is interpolated from its tables
+        instead of being calculated with calcGamma (see MultiVisitEvaluator).
         """
 
         htmid_level = levelFromHtmid(htmid)
@@ -1004,8 +1152,7 @@ class AlertDataGenerator(object):
 
         phot_params = PhotometricParameters()
 
-        # from Table 2 of the overview paper
-        obs_mag_cutoff = (23.68, 24.89, 24.43, 24.0, 24.45, 22.60)
+        obs_mag_cutoff = self.obs_mag_cutoff
 
         gamma_template = {}
         for i_filter in range(6):
@@ -1014,24 +1161,19 @@ class AlertDataGenerator(object):
         obs_valid_dex = self._htmid_dict[htmid]
         print('n valid obs %d' % len(obs_valid_dex))
 
-        cat_list = []
-        expmjd_list = []
         mag_name_to_int = {'u': 0, 'g': 1, 'r': 2,
                            'i': 3, 'z': 4, 'y': 5}
-        for obs_dex in obs_valid_dex:
-            obs = self._obs_list[obs_dex]
-            cat = photometry_class(dbobj, obs_metadata=obs)
-            cat.lsstBandpassDict = self.bp_dict
-            cat_list.append(cat)
-            expmjd_list.append(obs.mjd.TAI)
-
-        expmjd_list = np.array(expmjd_list)
-        cat_list = np.array(cat_list)
+
+        # build the ObservationMetaData of the visits to this
+        # trixel once (if self._obs_list is an ObservationMetaDataArray,
+        # this is the only place they are built)
+        obs_valid_list = list(self._obs_list[obs_valid_dex])
+        expmjd_list = np.array([obs.mjd.TAI for obs in obs_valid_list])
         sorted_dex = np.argsort(expmjd_list)
 
         expmjd_list = expmjd_list[sorted_dex]
-        cat_list = cat_list[sorted_dex]
         obs_valid_dex = obs_valid_dex[sorted_dex]
+        obs_valid_list = [obs_valid_list[ii] for ii in sorted_dex]
 
         available_columns = list(dbobj.columnMap.keys())
         column_query = []
@@ -1041,11 +1183,25 @@ class AlertDataGenerator(object):
 
         n_bits_off = 2*(21-htmid_level)
 
+        chunk_sizer = None
+        if max_bytes is not None:
+            # per source: dmag_arr and its transpose are (n_visits, 6);
+            # time_arr and the chip name/pupil coordinate arrays add
+            # about another (n_visits, 6) worth of 8-byte values
+            bytes_per_row = AdaptiveChunkSizer.estimate_bytes_per_row(len(obs_valid_dex), n_arrays=3)
+            chunk_sizer = AdaptiveChunkSizer(max_bytes, bytes_per_row)
+            chunk_size = chunk_sizer.chunk_size
+
+        constraint = self.quiescent_mag_constraint(dbobj, htmid,
+                                                   max_brightening=max_brightening,
+                                                   variables_only=variables_only)
+
         data_iter = dbobj.query_columns_htmid(colnames=column_query,
                                               htmid=htmid,
-                                              chunk_size=chunk_size)
+                                              chunk_size=chunk_size,
+                                              constraint=constraint)
 
-        photometry_catalog = photometry_class(dbobj, self._obs_list[obs_valid_dex[0]],
+        photometry_catalog = photometry_class(dbobj, obs_valid_list[0],
                                               column_outputs=['lsst_u',
                                                               'lsst_g',
                                                               'lsst_r',
@@ -1053,6 +1209,19 @@ class AlertDataGenerator(object):
                                                               'lsst_z',
                                                               'lsst_y'])
 
+        # evaluates the per-visit alert columns for all of the
+        # visits to this trixel at once
+        evaluator = MultiVisitEvaluator(photometry_catalog,
+                                        obs_valid_list,
+                                        bandpass_dict=self.bp_dict,
+                                        phot_params=phot_params,
+                                        camera=self.lsst_camera,
+                                        variability_cache=self._variability_cache,
+                                        snr_lookup=snr_lookup)
+
+        alert_columns = ('uniqueId', 'raICRS', 'decICRS', 'flux', 'dflux', 'SNR',
+                         'chipNum', 'xPix', 'yPix')
+
         i_chunk = 0
 
         output_data_cache = {}
@@ -1067,47 +1236,24 @@ class AlertDataGenerator(object):
                                     # "iterating over astrophysical objects" part
                                     # of the simulation will take
 
-        db_name = os.path.join(output_dir, '%s_%d_sqlite.db' % (output_prefix, htmid))
-        with sqlite3.connect(db_name, isolation_level='EXCLUSIVE') as conn:
-            creation_cmd = '''CREATE TABLE alert_data
-                           (uniqueId int, obshistId int, xPix float, yPix float,
-                            chipNum int, dflux float, snr float, ra float, dec float)'''
-
-            cursor = conn.cursor()
-            cursor.execute('PRAGMA journal_mode=WAL;')
-            conn.commit()
-            cursor.execute(creation_cmd)
-            conn.commit()
-
-            creation_cmd = '''CREATE TABLE metadata
-                           (obshistId int, TAI float, band int)'''
-            cursor.execute(creation_cmd)
-            conn.commit()
+        if writer_class is None:
+            writer_class = AlertDataSqliteWriter
+        if writer_kwargs is None:
+            writer_kwargs = {}
 
-            for obs_dex in obs_valid_dex:
-                obs = self._obs_list[obs_dex]
-                cmd = '''INSERT INTO metadata
-                      VALUES(%d, %.5f, %d)''' % (obs.OpsimMetaData['obsHistID'],
-                                                 obs.mjd.TAI,
-                                                 mag_name_to_int[obs.bandpass])
+        out_name = os.path.join(output_dir, '%s_%d%s' % (output_prefix, htmid,
+                                                         writer_class.file_suffix))
+        with writer_class(out_name, **writer_kwargs) as writer:
 
-                cursor.execute(cmd)
-            conn.commit()
-
-            creation_cmd = '''CREATE TABLE quiescent_flux
-                          (uniqueId int, band int, flux float, snr float)'''
-
-            cursor.execute(creation_cmd)
-            conn.commit()
-
-            creation_cmd = '''CREATE TABLE baseline_astrometry
-                           (uniqueId int, ra real, dec real, pmRA real,
-                            pmDec real, parallax real, TAI real)'''
-
-            cursor.execute(creation_cmd)
-            conn.commit()
+            meta_obshistid = np.array([obs.OpsimMetaData['obsHistID']
+                                       for obs in obs_valid_list])
+            meta_band = np.array([mag_name_to_int[obs.bandpass]
+                                  for obs in obs_valid_list])
+            writer.write_metadata(meta_obshistid, np.round(expmjd_list, decimals=5), meta_band)
+            writer.flush()
 
             for chunk in data_iter:
+                t_chunk = time.time()
                 n_raw_obj = len(chunk)
                 i_chunk += 1
 
@@ -1130,11 +1276,19 @@ class AlertDataGenerator(object):
                  dmag_arr,
                  dmag_arr_transpose,
                  time_arr) = self._filter_on_photometry_then_chip_name(chunk, column_query,
-                                                                       obs_valid_dex,
+                                                                       obs_valid_list,
                                                                        expmjd_list,
                                                                        photometry_catalog,
                                                                        dmag_cutoff)
 
+                if chunk_sizer is not None:
+                    chunk_bytes = chunk.nbytes + dmag_arr.nbytes + dmag_arr_transpose.nbytes
+                    chunk_bytes += time_arr.nbytes
+                    chunk_bytes += np.sum([arr.nbytes for i_obs in chip_name_dict
+                                           for arr in chip_name_dict[i_obs][:3]])
+                    chunk_sizer.update(n_raw_obj, chunk_bytes, elapsed=time.time()-t_chunk)
+                    chunk_sizer.apply(data_iter)
+
                 q_f_dict = {}
                 q_m_dict = {}
 
@@ -1219,13 +1373,14 @@ class AlertDataGenerator(object):
                 ############################
                 # Process and output sources
                 #
+                # First find every (source, visit) pair that is worth
+                # an alert, then evaluate all of them in one pass.
+                pair_obj = []
+                pair_visit = []
+                pair_chip_name = []
+                pair_xpup = []
+                pair_ypup = []
                 for i_obs, obs_dex in enumerate(obs_valid_dex):
-                    obs = self._obs_list[obs_dex]
-                    obshistid = obs.OpsimMetaData['obsHistID']
-
-                    obs_mag = obs.bandpass
-                    actual_i_mag = mag_name_to_int[obs_mag]
-                    assert mag_names[actual_i_mag] == obs_mag
 
                     # only include those sources which fall on a detector for this pointing
                     valid_chip_name, valid_xpup, valid_ypup, chip_valid_obj = chip_name_dict[i_obs]
@@ -1234,62 +1389,55 @@ class AlertDataGenerator(object):
                     if len(actually_valid_obj) == 0:
                         continue
 
-                    try:
-                        completely_valid[actually_valid_obj] += 1
-                    except:
-                        print('failed')
-                        print(actually_valid_obj)
-                        print(completely_valid)
-                        raise
-
-                    valid_sources = chunk[actually_valid_obj]
-                    local_column_cache = {}
-                    local_column_cache['deltaMagAvro'] = OrderedDict([('delta_%smag' % mag_names[i_mag],
-                                                                      dmag_arr[i_obs][i_mag][actually_valid_obj])
-                                                                      for i_mag in range(len(mag_names))])
-
-                    local_column_cache['chipName'] = valid_chip_name[actually_valid_obj]
-                    local_column_cache['pupilFromSky'] = OrderedDict([('x_pupil', valid_xpup[actually_valid_obj]),
-                                                                      ('y_pupil', valid_ypup[actually_valid_obj])])
-
-                    cat = cat_list[i_obs]
-                    i_valid_chunk = 0
-                    for valid_chunk, chunk_map in cat.iter_catalog_chunks(query_cache=[valid_sources],
-                                                                          column_cache=local_column_cache):
-                        i_valid_chunk += 1
-                        assert i_valid_chunk == 1
-                        n_time_last += len(valid_chunk[0])
-                        length_of_chunk = len(valid_chunk[chunk_map['uniqueId']])
+                    completely_valid[actually_valid_obj] += 1
+
+                    pair_obj.append(actually_valid_obj)
+                    pair_visit.append(i_obs*np.ones(len(actually_valid_obj), dtype=int))
+                    pair_chip_name.append(valid_chip_name[actually_valid_obj])
+                    pair_xpup.append(valid_xpup[actually_valid_obj])
+                    pair_ypup.append(valid_ypup[actually_valid_obj])
+
+                if len(pair_obj) > 0:
+                    pair_obj = np.concatenate(pair_obj)
+                    pair_visit = np.concatenate(pair_visit)
+                    pair_values = evaluator.evaluate_pairs(chunk, pair_obj, pair_visit,
+                                                           alert_columns,
+                                                           dmag_arr=dmag_arr,
+                                                           chip_name=np.concatenate(pair_chip_name),
+                                                           x_pupil=np.concatenate(pair_xpup),
+                                                           y_pupil=np.concatenate(pair_ypup))
+
+                    # pairs are grouped by visit; split them back up
+                    # so that they are cached one visit at a time
+                    visit_list, visit_start, visit_ct = np.unique(pair_visit,
+                                                                  return_index=True,
+                                                                  return_counts=True)
+
+                    for i_obs, i_start, n_pairs in zip(visit_list, visit_start, visit_ct):
+                        obshistid = obs_valid_list[i_obs].OpsimMetaData['obsHistID']
+                        n_time_last += n_pairs
                         cache_tag = '%d_%d' % (obshistid, i_chunk)
                         output_data_cache[cache_tag] = {}
+                        for col_name in alert_columns:
+                            output_data_cache[cache_tag][col_name] = \
+                                pair_values[col_name][i_start:i_start+n_pairs]
 
-                        for col_name in ('uniqueId', 'raICRS', 'decICRS', 'flux', 'dflux', 'SNR',
-                                         'chipNum', 'xPix', 'yPix'):
-
-                            output_data_cache[cache_tag][col_name] = valid_chunk[chunk_map[col_name]]
-
-                        n_rows_cached += length_of_chunk
+                        n_rows_cached += n_pairs
 
                 completely_valid = np.where(completely_valid > 0)
-                for i_filter in range(6):
-                    values = ((int(unq[completely_valid][i_q]),
-                               i_filter,
-                               q_f_dict[i_filter][completely_valid][i_q],
-                               q_snr_dict[i_filter][completely_valid][i_q])
-                              for i_q in range(len(completely_valid[0])))
-                    cursor.executemany('INSERT INTO quiescent_flux VALUES (?,?,?,?)', values)
-                    conn.commit()
-
-                values = ((int(unq[completely_valid][i_q]),
-                           q_ra[completely_valid][i_q],
-                           q_dec[completely_valid][i_q],
-                           q_pmra[completely_valid][i_q],
-                           q_pmdec[completely_valid][i_q],
-                           q_parallax[completely_valid][i_q],
-                           q_tai)
-                          for i_q in range(len(completely_valid[0])))
-
-                cursor.executemany('INSERT INTO baseline_astrometry VALUES (?,?,?,?,?,?,?)', values)
+                writer.write_quiescent_flux(unq[completely_valid],
+                                            np.array([q_f_dict[i_filter][completely_valid]
+                                                      for i_filter in range(6)]),
+                                            np.array([q_snr_dict[i_filter][completely_valid]
+                                                      for i_filter in range(6)]))
+
+                writer.write_baseline_astrometry(unq[completely_valid],
+                                                 q_ra[completely_valid],
+                                                 q_dec[completely_valid],
+                                                 q_pmra[completely_valid],
+                                                 q_pmdec[completely_valid],
+                                                 q_parallax[completely_valid],
+                                                 q_tai)
 
                 if n_rows_cached >= write_every:
                     self.acquire_lock()
@@ -1300,7 +1448,8 @@ class AlertDataGenerator(object):
 
                     self.release_lock()
 
-                    n_rows += self._output_alert_data(conn, output_data_cache)
+                    n_rows += writer.write_alert_data(output_data_cache)
+                    writer.flush()
                     output_data_cache = {}
                     n_rows_cached = 0
 
@@ -1329,8 +1478,9 @@ class AlertDataGenerator(object):
                         self.release_lock()
 
             if len(output_data_cache) > 0:
-                n_rows += self._output_alert_data(conn, output_data_cache)
+                n_rows += writer.write_alert_data(output_data_cache)
                 output_data_cache = {}
+            writer.flush()
 
             print('htmid %d that took %.2e hours; n_obj %d n_rows %d' %
                   (htmid, (time.time()-t_start)/3600.0, n_obj, n_rows))
@@ -1339,11 +1489,7 @@ class AlertDataGenerator(object):
             print("INDEXING %d" % htmid)
             self.release_lock()
 
-            cursor.execute('CREATE INDEX unq_obs ON alert_data (uniqueId, obshistId)')
-            cursor.execute('CREATE INDEX unq_flux ON quiescent_flux (uniqueId, band)')
-            cursor.execute('CREATE INDEX obs ON metadata (obshistid)')
-            cursor.execute('CREATE INDEX unq_ast ON baseline_astrometry (uniqueId)')
-            conn.commit()
+            writer.create_indexes()
 
             self.acquire_lock()
             with open(log_file_name, 'a') as out_file:
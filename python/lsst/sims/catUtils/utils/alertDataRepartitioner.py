@@ -0,0 +1,371 @@
+"""
+This module provides a stage that reads the per-trixel files written
+by the AlertDataGenerator once and rewrites them partitioned by
+obsHistID (or by night), so that the AvroAlertGenerator can produce the
+alerts for a visit with a single sequential read of a single file.
+"""
+import numpy as np
+import os
+import shutil
+import tempfile
+import multiprocessing
+import time
+
+from lsst.sims.catUtils.utils import alert_data_schema
+from lsst.sims.catUtils.utils import AlertDataSqliteWriter
+
+__all__ = ["AlertDataRepartitioner"]
+
+
+def _rows_in_sorted(sorted_values, target_values):
+    """
+    Find the indexes of all of the elements of sorted_values that are
+    equal to any of the elements of target_values.
+
+    Parameters
+    ----------
+    sorted_values is a sorted numpy array
+
+    target_values is a numpy array of unique values
+
+    Returns
+    -------
+    A numpy array of indexes into sorted_values
+    """
+    lo = np.searchsorted(sorted_values, target_values, side='left')
+    hi = np.searchsorted(sorted_values, target_values, side='right')
+    counts = hi - lo
+    n_tot = counts.sum()
+    if n_tot == 0:
+        return np.zeros(0, dtype=int)
+    offsets = np.cumsum(counts) - counts
+    return np.repeat(lo - offsets, counts) + np.arange(n_tot)
+
+
+class AlertDataRepartitioner(object):
+    """
+    This class reads the files produced by AlertDataGenerator.alert_data_from_htmid
+    (which are partitioned by trixel) and rewrites them as files partitioned
+    by obsHistID or by night.
+
+    Each output file has the same logical schema as the input files
+    (see alert_data_schema) and contains all of the alert_data rows in its
+    partition sorted on (obshistId, uniqueId), the metadata rows for the
+    corresponding pointings, and the quiescent_flux and baseline_astrometry
+    rows of every source with an alert in the partition.  Output files are
+    named
+
+    out_dir/out_prefix_NNNN + writer_class.file_suffix
+
+    where NNNN is the obsHistID or the night.  Because this is the same
+    naming convention as the per-trixel files, the partitioned sqlite files
+    can be passed directly to AvroAlertGenerator.write_alerts with
+    htmid_list = [obshistid] (or [night]) and prefix_list = [out_prefix].
+
+    The work happens in two stages, each of which can be spread over
+    several processes.  In the first stage, every input file is read
+    exactly once and its rows are scattered into per-partition shards in
+    a scratch directory.  In the second stage, the shards belonging to
+    each partition are gathered, sorted, de-duplicated, and written out.
+    """
+
+    def __init__(self, partition_by='obshistid', night_mjd_zero=None,
+                 reader_class=None, writer_class=None, writer_kwargs=None,
+                 buffer_rows=2000000):
+        """
+        Parameters
+        ----------
+        partition_by is either 'obshistid' or 'night'
+
+        night_mjd_zero is the TAI (as an MJD) at which night zero begins.
+        Must be specified if partition_by == 'night'.  The night of an
+        observation is floor(TAI - night_mjd_zero).
+
+        reader_class is the AlertDataWriterBase daughter class that wrote
+        the input files (its read_table() method will be used to read them).
+        Defaults to AlertDataSqliteWriter.
+
+        writer_class is the AlertDataWriterBase daughter class used to write
+        the output files.  Defaults to AlertDataSqliteWriter.
+
+        writer_kwargs is an optional dict of kwargs passed to the constructor
+        of writer_class
+
+        buffer_rows is the number of alert_data rows a process will hold in
+        memory during the first stage before writing its shards to disk
+        """
+        if partition_by not in ('obshistid', 'night'):
+            raise RuntimeError("partition_by must be 'obshistid' or 'night'; "
+                               "you gave %s" % str(partition_by))
+
+        if partition_by == 'night' and night_mjd_zero is None:
+            raise RuntimeError("Must specify night_mjd_zero if partitioning by night")
+
+        self._partition_by = partition_by
+        self._night_mjd_zero = night_mjd_zero
+
+        if reader_class is None:
+            reader_class = AlertDataSqliteWriter
+        if writer_class is None:
+            writer_class = AlertDataSqliteWriter
+        if writer_kwargs is None:
+            writer_kwargs = {}
+
+        self._reader_class = reader_class
+        self._writer_class = writer_class
+        self._writer_kwargs = writer_kwargs
+        self._buffer_rows = buffer_rows
+
+    def out_name(self, out_dir, out_prefix, partition):
+        """
+        Return the name of the output file corresponding to a partition
+        (an obsHistID or a night)
+        """
+        return os.path.join(out_dir, '%s_%d%s' % (out_prefix, partition,
+                                                  self._writer_class.file_suffix))
+
+    def _partition_keys(self, alert_data, metadata):
+        """
+        Return a numpy array containing the partition (obsHistID or night)
+        of every row in alert_data
+        """
+        if self._partition_by == 'obshistid':
+            return alert_data['obshistId']
+
+        sorted_dex = np.argsort(metadata['obshistId'])
+        meta_obshistid = metadata['obshistId'][sorted_dex]
+        meta_night = np.floor(metadata['TAI'][sorted_dex] - self._night_mjd_zero).astype(np.int64)
+        meta_dex = np.searchsorted(meta_obshistid, alert_data['obshistId'])
+        if len(meta_obshistid) == 0 or (meta_obshistid[np.clip(meta_dex, 0, len(meta_obshistid)-1)] !=
+                                        alert_data['obshistId']).any():
+            raise RuntimeError("There are obshistIds in alert_data that are not in metadata")
+        return meta_night[meta_dex]
+
+    @staticmethod
+    def _as_schema(table_name, data):
+        """
+        Convert the output of read_table() into a plain numpy structured
+        array so that it can be stored with np.savez
+        """
+        return np.array(data, dtype=np.dtype(alert_data_schema[table_name]))
+
+    def _scatter(self, in_file_list, shard_dir, i_proc):
+        """
+        Read each file in in_file_list once and write its rows into
+        per-partition shards in shard_dir.
+
+        Shards are written as shard_dir/NNNN/i_proc_j.npz where NNNN is the
+        partition and j is an integer that increments every time the
+        in-memory buffer is written out.
+        """
+        buffers = {}
+        n_buffered = [0]
+        i_dump = [0]
+
+        def dump_buffers():
+            for partition in buffers:
+                sub_dir = os.path.join(shard_dir, '%d' % partition)
+                if not os.path.exists(sub_dir):
+                    try:
+                        os.mkdir(sub_dir)
+                    except OSError:
+                        # another process created it first
+                        pass
+                out_name = os.path.join(sub_dir, '%d_%d.npz' % (i_proc, i_dump[0]))
+                np.savez(out_name,
+                         **dict((table_name, np.concatenate(buffers[partition][table_name]))
+                                for table_name in alert_data_schema))
+            buffers.clear()
+            n_buffered[0] = 0
+            i_dump[0] += 1
+
+        for file_name in in_file_list:
+            data = {}
+            for table_name in alert_data_schema:
+                data[table_name] = self._as_schema(table_name,
+                                                   self._reader_class.read_table(file_name,
+                                                                                 table_name))
+
+            alert_data = data['alert_data']
+            if len(alert_data) == 0:
+                continue
+
+            metadata = data['metadata']
+            metadata = metadata[np.argsort(metadata['obshistId'], kind='mergesort')]
+            q_flux = data['quiescent_flux']
+            q_flux = q_flux[np.argsort(q_flux['uniqueId'], kind='mergesort')]
+            astrometry = data['baseline_astrometry']
+            astrometry = astrometry[np.argsort(astrometry['uniqueId'], kind='mergesort')]
+
+            keys = self._partition_keys(alert_data, metadata)
+            sorted_dex = np.argsort(keys, kind='mergesort')
+            keys = keys[sorted_dex]
+            alert_data = alert_data[sorted_dex]
+            unq_keys, key_start = np.unique(keys, return_index=True)
+            key_end = np.append(key_start[1:], len(keys))
+
+            for partition, i_start, i_end in zip(unq_keys, key_start, key_end):
+                partition_alerts = alert_data[i_start:i_end]
+                unq_id = np.unique(partition_alerts['uniqueId'])
+                unq_obs = np.unique(partition_alerts['obshistId'])
+                if partition not in buffers:
+                    buffers[partition] = dict((table_name, []) for table_name in alert_data_schema)
+                buffers[partition]['alert_data'].append(partition_alerts)
+                buffers[partition]['metadata'].append(
+                    metadata[_rows_in_sorted(metadata['obshistId'], unq_obs)])
+                buffers[partition]['quiescent_flux'].append(
+                    q_flux[_rows_in_sorted(q_flux['uniqueId'], unq_id)])
+                buffers[partition]['baseline_astrometry'].append(
+                    astrometry[_rows_in_sorted(astrometry['uniqueId'], unq_id)])
+
+            n_buffered[0] += len(alert_data)
+            if n_buffered[0] >= self._buffer_rows:
+                dump_buffers()
+
+        if len(buffers) > 0:
+            dump_buffers()
+
+    def _gather(self, partition_list, shard_dir, out_dir, out_prefix):
+        """
+        Combine the shards of each partition in partition_list into a
+        single sorted, indexed output file.
+        """
+        for partition in partition_list:
+            sub_dir = os.path.join(shard_dir, '%d' % partition)
+            data = dict((table_name, []) for table_name in alert_data_schema)
+            for shard_name in sorted(os.listdir(sub_dir)):
+                with np.load(os.path.join(sub_dir, shard_name)) as shard:
+                    for table_name in alert_data_schema:
+                        data[table_name].append(shard[table_name])
+
+            for table_name in alert_data_schema:
+                data[table_name] = np.concatenate(data[table_name])
+
+            alert_data = data['alert_data']
+            alert_data = alert_data[np.lexsort((alert_data['uniqueId'], alert_data['obshistId']))]
+
+            metadata = data['metadata']
+            _, unq_dex = np.unique(metadata['obshistId'], return_index=True)
+            metadata = metadata[unq_dex]
+
+            # the same source can be in several shards
+            q_flux = data['quiescent_flux']
+            if len(q_flux) > 0:
+                _, unq_dex = np.unique(np.array([q_flux['uniqueId'], q_flux['band']]),
+                                       axis=1, return_index=True)
+                q_flux = q_flux[unq_dex]
+
+            astrometry = data['baseline_astrometry']
+            _, unq_dex = np.unique(astrometry['uniqueId'], return_index=True)
+            astrometry = astrometry[unq_dex]
+
+            out_name = self.out_name(out_dir, out_prefix, partition)
+            if os.path.exists(out_name):
+                os.unlink(out_name)
+
+            with self._writer_class(out_name, **self._writer_kwargs) as writer:
+                writer.write_table('metadata', metadata)
+                writer.write_table('alert_data', alert_data)
+                writer.write_table('quiescent_flux', q_flux)
+                writer.write_table('baseline_astrometry', astrometry)
+
+    @staticmethod
+    def _balance(item_list, weight_list, n_processes):
+        """
+        Divide item_list into n_processes lists with roughly equal
+        total weight
+        """
+        sub_lists = [[] for i_p in range(n_processes)]
+        load = np.zeros(n_processes, dtype=float)
+        for i_item in np.argsort(-1.0*np.array(weight_list, dtype=float), kind='mergesort'):
+            i_min = np.argmin(load)
+            sub_lists[i_min].append(item_list[i_item])
+            load[i_min] += weight_list[i_item]
+        return sub_lists
+
+    def _run(self, target, arg_lists):
+        """
+        Call target(*args) for each args in arg_lists, using a separate
+        process for each if there is more than one.
+        """
+        if len(arg_lists) == 1:
+            target(*arg_lists[0])
+            return
+
+        p_list = []
+        for args in arg_lists:
+            p = multiprocessing.Process(target=target, args=args)
+            p.start()
+            p_list.append(p)
+        for p in p_list:
+            p.join()
+        for p in p_list:
+            if p.exitcode != 0:
+                raise RuntimeError('A repartitioning process failed '
+                                   'with exit code %d' % p.exitcode)
+
+    def repartition(self, in_file_list, out_dir, out_prefix,
+                    n_processes=1, scratch_dir=None):
+        """
+        Repartition the outputs of the AlertDataGenerator.
+
+        Parameters
+        ----------
+        in_file_list is a list of the files written by
+        AlertDataGenerator.alert_data_from_htmid to be repartitioned
+        (e.g. all of the stellar and agn files for a survey)
+
+        out_dir is the directory in which to write the output files
+
+        out_prefix is the prefix of the output file names
+
+        n_processes is the number of independent processes to use
+
+        scratch_dir is the directory in which to write the intermediate
+        shards.  If None, a temporary directory in out_dir will be used.
+        The shards are deleted when this method is done.
+
+        Returns
+        -------
+        A dict mapping each partition (obsHistID or night) to the name of
+        the file containing it
+        """
+        t_start = time.time()
+        if os.path.exists(out_dir) and not os.path.isdir(out_dir):
+            raise RuntimeError('%s is not a dir' % out_dir)
+        if not os.path.exists(out_dir):
+            os.mkdir(out_dir)
+
+        in_file_list = [file_name for file_name in in_file_list
+                        if os.path.exists(file_name)]
+
+        shard_dir = tempfile.mkdtemp(dir=out_dir if scratch_dir is None else scratch_dir,
+                                     prefix='repartition_shards_')
+
+        try:
+            n_scatter = max(1, min(n_processes, len(in_file_list)))
+            file_lists = self._balance(in_file_list,
+                                       [os.path.getsize(file_name) for file_name in in_file_list],
+                                       n_scatter)
+            self._run(self._scatter, [(file_lists[i_p], shard_dir, i_p)
+                                      for i_p in range(n_scatter)])
+
+            partition_list = [int(sub_dir) for sub_dir in os.listdir(shard_dir)]
+            partition_weight = []
+            for partition in partition_list:
+                sub_dir = os.path.join(shard_dir, '%d' % partition)
+                partition_weight.append(np.sum([os.path.getsize(os.path.join(sub_dir, shard_name))
+                                                for shard_name in os.listdir(sub_dir)]))
+
+            n_gather = max(1, min(n_processes, len(partition_list)))
+            partition_lists = self._balance(partition_list, partition_weight, n_gather)
+            self._run(self._gather, [(partition_lists[i_p], shard_dir, out_dir, out_prefix)
+                                     for i_p in range(n_gather)])
+        finally:
+            shutil.rmtree(shard_dir)
+
+        print('repartitioned %d files into %d partitions in %.2e hrs' %
+              (len(in_file_list), len(partition_list), (time.time()-t_start)/3600.0))
+
+        return dict((partition, self.out_name(out_dir, out_prefix, partition))
+                    for partition in sorted(partition_list))
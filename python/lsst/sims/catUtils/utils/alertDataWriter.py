@@ -0,0 +1,714 @@
+"""
+This module provides the classes that the AlertDataGenerator uses to
+write its outputs to disk.  All of the writers expose the same logical
+schema (the tables alert_data, metadata, quiescent_flux and
+baseline_astrometry described in the docstring of the AlertDataGenerator)
+so that downstream code can read the outputs of any of them through
+the read_table() classmethod without caring how they were stored.
+"""
+import numpy as np
+import os
+import sqlite3
+from collections import OrderedDict
+
+try:
+    import h5py
+except ImportError:
+    pass
+
+__all__ = ["alert_data_schema",
+           "AlertDataWriterBase",
+           "AlertDataSqliteWriter",
+           "AlertDataHdf5Writer"]
+
+
+# The logical schema of the files written by the AlertDataGenerator.
+# Each table maps to a list of (column_name, numpy dtype) tuples.
+alert_data_schema = OrderedDict()
+alert_data_schema['alert_data'] = [('uniqueId', np.int64), ('obshistId', np.int64),
+                                   ('xPix', float), ('yPix', float),
+                                   ('chipNum', np.int64), ('dflux', float),
+                                   ('snr', float), ('ra', float), ('dec', float)]
+
+alert_data_schema['metadata'] = [('obshistId', np.int64), ('TAI', float),
+                                 ('band', np.int64)]
+
+alert_data_schema['quiescent_flux'] = [('uniqueId', np.int64), ('band', np.int64),
+                                       ('flux', float), ('snr', float)]
+
+alert_data_schema['baseline_astrometry'] = [('uniqueId', np.int64), ('ra', float),
+                                            ('dec', float), ('pmRA', float),
+                                            ('pmDec', float), ('parallax', float),
+                                            ('TAI', float)]
+
+
+class AlertDataWriterBase(object):
+    """
+    Base class for writers of AlertDataGenerator outputs.
+
+    The write_* methods assemble numpy columns for each table in
+    alert_data_schema and hand them to _append(), which daughter
+    classes must implement.  Daughter classes must also implement
+    flush(), create_indexes(), _close_file() and the classmethod
+    read_table().
+
+    Daughter classes should set the class member file_suffix to the
+    string the AlertDataGenerator will append to prefix_htmid when
+    naming the output file.
+    """
+
+    file_suffix = None
+
+    def __init__(self, file_name):
+        """
+        Parameters
+        ----------
+        file_name is the name of the file to be created
+        """
+        self._file_name = file_name
+        self._n_alert_rows = 0
+        self._indexed = False
+        self._is_open = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # do not bother indexing a file that was only partially written
+        self.close(create_indexes=exc_type is None)
+
+    @property
+    def file_name(self):
+        """
+        The name of the file being written
+        """
+        return self._file_name
+
+    @property
+    def n_alert_rows(self):
+        """
+        The total number of rows written to the alert_data table
+        """
+        return self._n_alert_rows
+
+    def _append(self, table_name, columns):
+        """
+        Append rows to a table.
+
+        Parameters
+        ----------
+        table_name is the name of the table (a key in alert_data_schema)
+
+        columns is an OrderedDict keyed on the column names of the table
+        (in the order of alert_data_schema) whose values are numpy arrays
+        of the same length
+        """
+        raise NotImplementedError()
+
+    def flush(self):
+        raise NotImplementedError()
+
+    def create_indexes(self):
+        raise NotImplementedError()
+
+    def _close_file(self):
+        raise NotImplementedError()
+
+    @classmethod
+    def read_table(cls, file_name, table_name, obshistid=None, unique_id=None):
+        """
+        Read a table from a file written by this class.
+
+        Parameters
+        ----------
+        file_name is the name of the file to read
+
+        table_name is the name of the table to read (a key in
+        alert_data_schema)
+
+        obshistid is an optional int or list of ints.  If not None,
+        only rows with (one of) these obshistIds will be returned (only
+        valid for the alert_data and metadata tables).  Passing all of
+        the obshistIds of interest at once reads the file only once.
+
+        unique_id is an optional numpy array of ints.  If not None,
+        only rows whose uniqueId is in unique_id will be returned
+        (not valid for the metadata table)
+
+        Returns
+        -------
+        A numpy recarray whose columns are those listed for
+        table_name in alert_data_schema
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    def _schema_dtype(table_name):
+        """
+        Return the numpy dtype corresponding to a table in alert_data_schema
+        """
+        return np.dtype(alert_data_schema[table_name])
+
+    def write_metadata(self, obshistid, tai, band):
+        """
+        Write to the metadata table
+
+        Parameters
+        ----------
+        obshistid is a numpy array of the obsHistIDs of the OpSim pointings
+
+        tai is a numpy array of the TAI of those pointings (as an MJD)
+
+        band is a numpy array of ints denoting the filter of each pointing
+        (0=u, 1=g, 2=r, etc.)
+        """
+        obshistid = np.asarray(obshistid, dtype=np.int64)
+        if len(obshistid) == 0:
+            return
+        columns = OrderedDict()
+        columns['obshistId'] = obshistid
+        columns['TAI'] = np.asarray(tai, dtype=float)
+        columns['band'] = np.asarray(band, dtype=np.int64)
+        self._append('metadata', columns)
+
+    def write_alert_data(self, data_cache):
+        """
+        Write a cache of alert data to the alert_data table.
+
+        Parameters
+        ----------
+        data_cache is a dict containing all of the data to be written.
+        It will keyed on a string like 'i_j' where i is the obshistID
+        of an OpSim pointing and j is an arbitrary integer.  That key
+        will lead to another dict keyed on the columns being output to
+        the file.  The values of this second layer of dict are numpy
+        arrays.
+
+        Returns
+        -------
+        The number of rows written to the file
+        """
+        if len(data_cache) == 0:
+            return 0
+
+        tag_list = list(data_cache.keys())
+        chunk_lengths = np.array([len(data_cache[tag]['uniqueId']) for tag in tag_list])
+        n_written = int(chunk_lengths.sum())
+        if n_written == 0:
+            return 0
+
+        def _stack(col_name):
+            return np.concatenate([data_cache[tag][col_name] for tag in tag_list])
+
+        columns = OrderedDict()
+        columns['uniqueId'] = _stack('uniqueId').astype(np.int64)
+        columns['obshistId'] = np.repeat(np.array([int(tag.split('_')[0]) for tag in tag_list],
+                                                  dtype=np.int64), chunk_lengths)
+        columns['xPix'] = _stack('xPix').astype(float)
+        columns['yPix'] = _stack('yPix').astype(float)
+        columns['chipNum'] = _stack('chipNum').astype(np.int64)
+        columns['dflux'] = _stack('dflux').astype(float)
+        columns['snr'] = _stack('SNR').astype(float)
+        columns['ra'] = np.degrees(_stack('raICRS'))
+        columns['dec'] = np.degrees(_stack('decICRS'))
+
+        self._append('alert_data', columns)
+        self._n_alert_rows += n_written
+        return n_written
+
+    def write_quiescent_flux(self, unique_id, flux, snr):
+        """
+        Write to the quiescent_flux table
+
+        Parameters
+        ----------
+        unique_id is a numpy array of the uniqueIds of the sources
+
+        flux is a numpy array of shape (n_bands, len(unique_id)) containing
+        the quiescent flux of each source in each band (in Janskys)
+
+        snr is a numpy array of the same shape as flux containing the
+        signal to noise ratio of each quiescent flux
+        """
+        unique_id = np.asarray(unique_id, dtype=np.int64)
+        flux = np.asarray(flux, dtype=float)
+        snr = np.asarray(snr, dtype=float)
+        n_bands = flux.shape[0]
+        n_obj = len(unique_id)
+        if n_obj == 0:
+            return
+
+        columns = OrderedDict()
+        columns['uniqueId'] = np.tile(unique_id, n_bands)
+        columns['band'] = np.repeat(np.arange(n_bands, dtype=np.int64), n_obj)
+        columns['flux'] = flux.ravel()
+        columns['snr'] = snr.ravel()
+        self._append('quiescent_flux', columns)
+
+    def write_baseline_astrometry(self, unique_id, ra, dec, pmra, pmdec, parallax, tai):
+        """
+        Write to the baseline_astrometry table
+
+        Parameters
+        ----------
+        unique_id is a numpy array of the uniqueIds of the sources
+
+        ra is a numpy array of the RA of the sources in degrees
+
+        dec is a numpy array of the Dec of the sources in degrees
+
+        pmra is a numpy array of the RA proper motion in milliarcseconds/year
+
+        pmdec is a numpy array of the Dec proper motion in milliarcseconds/year
+
+        parallax is a numpy array of the parallax in milliarcseconds
+
+        tai is the TAI (as an MJD) of the baseline astrometry.  It can either
+        be a number or a numpy array.
+        """
+        unique_id = np.asarray(unique_id, dtype=np.int64)
+        n_obj = len(unique_id)
+        if n_obj == 0:
+            return
+
+        columns = OrderedDict()
+        columns['uniqueId'] = unique_id
+        columns['ra'] = np.asarray(ra, dtype=float)
+        columns['dec'] = np.asarray(dec, dtype=float)
+        columns['pmRA'] = np.asarray(pmra, dtype=float)
+        columns['pmDec'] = np.asarray(pmdec, dtype=float)
+        columns['parallax'] = np.asarray(parallax, dtype=float)
+        columns['TAI'] = np.broadcast_to(np.asarray(tai, dtype=float), (n_obj,))
+        self._append('baseline_astrometry', columns)
+
+    def write_table(self, table_name, data):
+        """
+        Write rows that are already in the form of alert_data_schema
+        (e.g. the output of read_table()) to a table.
+
+        Parameters
+        ----------
+        table_name is the name of the table (a key in alert_data_schema)
+
+        data is a numpy recarray containing (at least) the columns
+        listed for table_name in alert_data_schema
+        """
+        if len(data) == 0:
+            return
+        columns = OrderedDict()
+        for col_name, col_type in alert_data_schema[table_name]:
+            columns[col_name] = np.asarray(data[col_name], dtype=col_type)
+        self._append(table_name, columns)
+        if table_name == 'alert_data':
+            self._n_alert_rows += len(data)
+
+    def close(self, create_indexes=True):
+        """
+        Flush any outstanding data, build the indexes (unless
+        create_indexes is False) and close the file.
+        """
+        if not self._is_open:
+            return
+        self.flush()
+        if create_indexes:
+            self.create_indexes()
+        self._close_file()
+        self._is_open = False
+
+
+class AlertDataSqliteWriter(AlertDataWriterBase):
+    """
+    Write the outputs of the AlertDataGenerator to an sqlite file
+    in bulk.
+
+    Each write_* method converts its numpy inputs to rows in a single
+    vectorized step and inserts them with one executemany() call.
+    Nothing is committed until flush() is called, and the indexes
+    on the tables are only built when the writer is closed, after
+    all of the data has been loaded.
+    """
+
+    file_suffix = '_sqlite.db'
+
+    # PRAGMAs appropriate for loading a file that is written once
+    # by a single process.  If the process dies, the file has to be
+    # regenerated anyway, so we do not pay for durability.
+    _bulk_pragmas = ('PRAGMA journal_mode=MEMORY',
+                     'PRAGMA synchronous=OFF',
+                     'PRAGMA temp_store=MEMORY',
+                     'PRAGMA cache_size=-262144')
+
+    _table_definitions = (('alert_data',
+                           '''(uniqueId int, obshistId int, xPix float, yPix float,
+                               chipNum int, dflux float, snr float, ra float, dec float)'''),
+                          ('metadata',
+                           '(obshistId int, TAI float, band int)'),
+                          ('quiescent_flux',
+                           '(uniqueId int, band int, flux float, snr float)'),
+                          ('baseline_astrometry',
+                           '''(uniqueId int, ra real, dec real, pmRA real,
+                               pmDec real, parallax real, TAI real)'''))
+
+    # the largest number of uniqueIds to put in a single
+    # 'WHERE uniqueId IN (...)' query
+    _max_query_ids = 10000
+
+    _index_definitions = ('CREATE INDEX unq_obs ON alert_data (uniqueId, obshistId)',
+                          'CREATE INDEX obs_alert ON alert_data (obshistId)',
+                          'CREATE INDEX unq_flux ON quiescent_flux (uniqueId, band)',
+                          'CREATE INDEX obs ON metadata (obshistid)',
+                          'CREATE INDEX unq_ast ON baseline_astrometry (uniqueId)')
+
+    def __init__(self, file_name):
+        """
+        Parameters
+        ----------
+        file_name is the name of the sqlite file to be created
+        """
+        super(AlertDataSqliteWriter, self).__init__(file_name)
+        self._conn = sqlite3.connect(file_name, isolation_level='EXCLUSIVE')
+        self._cursor = self._conn.cursor()
+        for pragma in self._bulk_pragmas:
+            self._cursor.execute(pragma)
+
+        for table_name, columns in self._table_definitions:
+            self._cursor.execute('CREATE TABLE %s %s' % (table_name, columns))
+        self._conn.commit()
+
+    def _append(self, table_name, columns):
+        values = zip(*[columns[name].tolist() for name in columns])
+        cmd = 'INSERT INTO %s VALUES (%s)' % (table_name, ','.join(['?']*len(columns)))
+        self._cursor.executemany(cmd, values)
+
+    def flush(self):
+        """
+        Commit everything that has been written since the last flush
+        """
+        self._conn.commit()
+
+    def create_indexes(self):
+        """
+        Build the indexes on the tables.  This should only be done
+        after all of the data has been written.
+        """
+        if self._indexed:
+            return
+        for cmd in self._index_definitions:
+            self._cursor.execute(cmd)
+        self._conn.commit()
+        self._indexed = True
+
+    def _close_file(self):
+        self._conn.close()
+        self._conn = None
+        self._cursor = None
+
+    @classmethod
+    def read_table(cls, file_name, table_name, obshistid=None, unique_id=None):
+        dtype = cls._schema_dtype(table_name)
+        query = 'SELECT %s FROM %s' % (', '.join(dtype.names), table_name)
+        constraints = []
+        if obshistid is not None:
+            obshistid = np.unique(np.atleast_1d(np.asarray(obshistid, dtype=np.int64)))
+            constraints.append('obshistId IN (%s)' %
+                               ','.join(['%d' % obs for obs in obshistid.tolist()]))
+
+        # query the uniqueIds a batch at a time
+        if unique_id is None:
+            id_batch_list = [None]
+        else:
+            unique_id = np.unique(np.asarray(unique_id, dtype=np.int64))
+            id_batch_list = [unique_id[i_start:i_start+cls._max_query_ids]
+                             for i_start in range(0, len(unique_id), cls._max_query_ids)]
+
+        rows = []
+        conn = sqlite3.connect(file_name)
+        try:
+            for id_batch in id_batch_list:
+                batch_constraints = list(constraints)
+                if id_batch is not None:
+                    batch_constraints.append('uniqueId IN (%s)' %
+                                             ','.join(['%d' % unq for unq in id_batch.tolist()]))
+                batch_query = query
+                if len(batch_constraints) > 0:
+                    batch_query += ' WHERE ' + ' AND '.join(batch_constraints)
+                rows += conn.execute(batch_query).fetchall()
+        finally:
+            conn.close()
+
+        return np.rec.array(np.array(rows, dtype=dtype))
+
+
+class AlertDataHdf5Writer(AlertDataWriterBase):
+    """
+    Write the outputs of the AlertDataGenerator to a columnar HDF5 file.
+
+    Each table in alert_data_schema is stored as an HDF5 group containing
+    one chunked, compressed, extendable 1-dimensional dataset per column.
+
+    The alert_data table is never read back or sorted as a whole.
+    Instead, each batch of alert_data is sorted on (obshistId, uniqueId)
+    as it is written, and the obshistId, start and count of each run of
+    rows with the same obshistId are recorded.  When the file is closed,
+    these runs are written (sorted on obshistId) to the datasets
+    obshistId, start and count of a group alert_data_index, so that the
+    alerts for a given obshistId are the slices
+    alert_data/col[start:start+count] of its runs.  quiescent_flux is
+    sorted on (uniqueId, band) and baseline_astrometry on uniqueId.  For
+    each of them, the uniqueId of the first row of every chunk_rows rows
+    is written to the dataset uniqueId_index/table_name, so that the rows
+    of a set of uniqueIds can be found without reading the whole table.
+    """
+
+    file_suffix = '.h5'
+
+    # columns that can be stored in single precision without losing
+    # precision that anyone cares about; TAI, ra and dec are always
+    # stored in double precision
+    _float32_able = frozenset(('xPix', 'yPix', 'dflux', 'snr', 'flux',
+                               'pmRA', 'pmDec', 'parallax'))
+
+    _sort_keys = {'alert_data': ('obshistId', 'uniqueId'),
+                  'quiescent_flux': ('uniqueId', 'band'),
+                  'baseline_astrometry': ('uniqueId',)}
+
+    def __init__(self, file_name, chunk_rows=65536, compression='gzip',
+                 compression_opts=4, use_float32=False):
+        """
+        Parameters
+        ----------
+        file_name is the name of the HDF5 file to be created
+
+        chunk_rows is the number of rows in each HDF5 chunk
+
+        compression is the h5py compression filter to use (None
+        for no compression)
+
+        compression_opts are the options passed to the compression
+        filter (the compression level for gzip)
+
+        use_float32 is a boolean.  If True, fluxes, SNRs, pixel
+        coordinates and proper motions/parallaxes will be stored as
+        32 bit floats.
+        """
+        if 'h5py' not in globals():
+            raise RuntimeError('You cannot use the AlertDataHdf5Writer '
+                               'without installing h5py')
+
+        super(AlertDataHdf5Writer, self).__init__(file_name)
+        self._chunk_rows = chunk_rows
+        self._compression = compression
+        self._compression_opts = compression_opts if compression is not None else None
+        self._use_float32 = use_float32
+
+        # the (obshistId, start, count) of each run of alert_data rows
+        # with the same obshistId, as they were written
+        self._run_obshistid = []
+        self._run_start = []
+        self._run_count = []
+
+        if os.path.exists(file_name):
+            raise RuntimeError('%s already exists' % file_name)
+
+        self._file = h5py.File(file_name, 'w')
+        for table_name in alert_data_schema:
+            group = self._file.create_group(table_name)
+            for col_name, col_type in alert_data_schema[table_name]:
+                group.create_dataset(col_name, shape=(0,), maxshape=(None,),
+                                     dtype=self._storage_dtype(col_name, col_type),
+                                     chunks=(chunk_rows,),
+                                     compression=self._compression,
+                                     compression_opts=self._compression_opts,
+                                     shuffle=self._compression is not None)
+
+    def _storage_dtype(self, col_name, col_type):
+        if self._use_float32 and col_name in self._float32_able:
+            return np.float32
+        return col_type
+
+    def _append(self, table_name, columns):
+        group = self._file[table_name]
+        if table_name == 'alert_data':
+            columns = self._index_alert_data(columns, group['obshistId'].shape[0])
+        for col_name in columns:
+            dataset = group[col_name]
+            n_0 = dataset.shape[0]
+            n_new = len(columns[col_name])
+            dataset.resize((n_0+n_new,))
+            dataset[n_0:] = columns[col_name]
+
+    def _index_alert_data(self, columns, n_0):
+        """
+        Sort a batch of alert_data on (obshistId, uniqueId) and record the
+        runs of rows with the same obshistId in it.
+
+        Parameters
+        ----------
+        columns is an OrderedDict of the batch's columns (see _append)
+
+        n_0 is the number of rows already in the alert_data table
+
+        Returns
+        -------
+        An OrderedDict of the sorted columns
+        """
+        keys = self._sort_keys['alert_data']
+        # np.lexsort sorts on the last key first
+        sorted_dex = np.lexsort([columns[key] for key in keys[::-1]])
+        sorted_columns = OrderedDict()
+        for col_name in columns:
+            sorted_columns[col_name] = columns[col_name][sorted_dex]
+
+        unq_obs, start, count = np.unique(sorted_columns['obshistId'], return_index=True,
+                                          return_counts=True)
+        self._run_obshistid.append(unq_obs.astype(np.int64))
+        self._run_start.append(start.astype(np.int64)+n_0)
+        self._run_count.append(count.astype(np.int64))
+        return sorted_columns
+
+    def flush(self):
+        """
+        Flush everything that has been written to disk
+        """
+        self._file.flush()
+
+    def create_indexes(self):
+        """
+        Sort the per-source tables and write the obshistId index on
+        alert_data.  This should only be done after all of the data
+        has been written.
+        """
+        if self._indexed:
+            return
+
+        id_index_group = self._file.create_group('uniqueId_index')
+        id_index_group.attrs['block_rows'] = self._chunk_rows
+        for table_name in self._sort_keys:
+            if table_name == 'alert_data':
+                # sorted batch by batch as it was written
+                continue
+            group = self._file[table_name]
+            keys = self._sort_keys[table_name]
+            sorted_id = np.zeros(0, dtype=np.int64)
+            if group[keys[0]].shape[0] > 0:
+                # np.lexsort sorts on the last key first
+                sorted_dex = np.lexsort([group[key][()] for key in keys[::-1]])
+                for col_name, col_type in alert_data_schema[table_name]:
+                    group[col_name][:] = group[col_name][()][sorted_dex]
+                sorted_id = group['uniqueId'][()]
+            id_index_group.create_dataset(table_name, data=sorted_id[::self._chunk_rows])
+
+        run_obshistid = np.concatenate([np.zeros(0, dtype=np.int64)]+self._run_obshistid)
+        run_start = np.concatenate([np.zeros(0, dtype=np.int64)]+self._run_start)
+        run_count = np.concatenate([np.zeros(0, dtype=np.int64)]+self._run_count)
+        sorted_dex = np.argsort(run_obshistid, kind='mergesort')
+        index_group = self._file.create_group('alert_data_index')
+        index_group.create_dataset('obshistId', data=run_obshistid[sorted_dex])
+        index_group.create_dataset('start', data=run_start[sorted_dex])
+        index_group.create_dataset('count', data=run_count[sorted_dex])
+        self._file.flush()
+        self._indexed = True
+
+    def _close_file(self):
+        self._file.close()
+        self._file = None
+
+    @classmethod
+    def read_table(cls, file_name, table_name, obshistid=None, unique_id=None):
+        dtype = cls._schema_dtype(table_name)
+        with h5py.File(file_name, 'r') as in_file:
+            group = in_file[table_name]
+            n_rows = group[dtype.names[0]].shape[0]
+            row_slices = [slice(0, n_rows)]
+            mask = None
+            if obshistid is not None:
+                obshistid = np.unique(np.atleast_1d(np.asarray(obshistid, dtype=np.int64)))
+                if table_name == 'alert_data' and 'alert_data_index' in in_file:
+                    index = in_file['alert_data_index']
+                    # the runs of all of the obshistIds, in file order
+                    keep = np.where(np.isin(index['obshistId'][()], obshistid))[0]
+                    run_start = index['start'][()][keep]
+                    run_count = index['count'][()][keep]
+                    run_order = np.argsort(run_start)
+                    row_slices = [slice(start, start+count) for start, count in
+                                  zip(run_start[run_order].tolist(),
+                                      run_count[run_order].tolist())]
+                else:
+                    mask = np.isin(group['obshistId'][()], obshistid)
+
+            if unique_id is not None:
+                unique_id = np.unique(np.asarray(unique_id, dtype=np.int64))
+                if (mask is None and 'uniqueId_index' in in_file and
+                    table_name in in_file['uniqueId_index']):
+                    # only read the blocks of rows that can contain the
+                    # uniqueIds we want
+                    row_slices = cls._id_block_slices(in_file['uniqueId_index'], table_name,
+                                                      n_rows, unique_id)
+                elif mask is None:
+                    # only read the range of each slice spanned by the
+                    # uniqueIds we want (the alert_data runs are small)
+                    id_slices = []
+                    for row_slice in row_slices:
+                        keep = np.where(np.isin(group['uniqueId'][row_slice], unique_id))[0]
+                        if len(keep) > 0:
+                            id_slices.append(slice(row_slice.start+keep[0],
+                                                   row_slice.start+keep[-1]+1))
+                    row_slices = id_slices
+
+            out = np.zeros(sum(ss.stop-ss.start for ss in row_slices), dtype=dtype)
+            for col_name in dtype.names:
+                dataset = group[col_name]
+                i_out = 0
+                for row_slice in row_slices:
+                    n_slice = row_slice.stop-row_slice.start
+                    out[col_name][i_out:i_out+n_slice] = dataset[row_slice]
+                    i_out += n_slice
+
+        if mask is not None:
+            out = out[mask]
+        if unique_id is not None:
+            out = out[np.isin(out['uniqueId'], unique_id)]
+        return np.rec.array(out)
+
+    @staticmethod
+    def _id_block_slices(index_group, table_name, n_rows, unique_id):
+        """
+        Find the rows of a table sorted on uniqueId that can contain
+        a set of uniqueIds
+
+        Parameters
+        ----------
+        index_group is the uniqueId_index group (see create_indexes)
+
+        table_name is the name of the table
+
+        n_rows is the number of rows in the table
+
+        unique_id is a sorted numpy array of the uniqueIds of interest
+
+        Returns
+        -------
+        A list of slices covering the blocks of rows (as recorded in the
+        index) that can contain the uniqueIds
+        """
+        block_rows = int(index_group.attrs['block_rows'])
+        first_id = index_group[table_name][()]
+        n_blocks = len(first_id)
+        if n_blocks == 0 or len(unique_id) == 0:
+            return []
+
+        # the rows of each uniqueId lie in the blocks first_block..last_block
+        last_block = np.searchsorted(first_id, unique_id, side='right')-1
+        first_block = np.maximum(np.searchsorted(first_id, unique_id, side='left')-1, 0)
+        valid = last_block >= 0
+        coverage = np.zeros(n_blocks+1, dtype=int)
+        np.add.at(coverage, first_block[valid], 1)
+        np.add.at(coverage, last_block[valid]+1, -1)
+        covered = np.append(np.cumsum(coverage)[:-1] > 0, False)
+
+        # merge runs of consecutive covered blocks into slices
+        edges = np.diff(np.append(False, covered).astype(int))
+        run_start = np.where(edges == 1)[0]
+        run_end = np.where(edges == -1)[0]
+        return [slice(i_start*block_rows, min(i_end*block_rows, n_rows))
+                for i_start, i_end in zip(run_start.tolist(), run_end.tolist())]
@@ -1,4 +1,4 @@
-# This script will provide classes to process the sqlite files produced
+# This script will provide classes to process the files produced
 # by the AlertDataGenerator and write them as avro files
 
 try:
@@ -8,14 +8,17 @@ try:
 except ImportError:
     pass
 
-from lsst.sims.catalogs.db import DBObject
+from lsst.sims.catUtils.utils import AlertDataWriterBase, AlertDataSqliteWriter
 import os
 import numpy as np
 import json
 import warnings
 import time
+import queue
+import threading
+from collections import OrderedDict
 
-__all__ = ["AvroAlertGenerator"]
+__all__ = ["AvroAlertGenerator", "AvroAlertStream", "AvroAlertStreamWriter"]
 
 
 ################
@@ -50,16 +53,43 @@ def load_single_avsc(file_path, names):
 
 class AvroAlertGenerator(object):
     """
-    This class reads in the sqlite files created by the AlertDataGenerator
+    This class reads in the files created by the AlertDataGenerator
     and converts them into avro files separated by obsHistID (the unique
-    integer identifying each pointing in an OpSim run).
+    integer identifying each pointing in an OpSim run).  The files are
+    read with the read_table() method of the AlertDataWriterBase daughter
+    class that wrote them (AlertDataSqliteWriter by default), so the
+    outputs of any of the writers can be turned into alerts.
     """
 
-    def __init__(self):
+    # number of LSST bands; used to build the (uniqueId, band) lookup key
+    _n_bands = 6
+
+    def __init__(self, diaobject_cache_size=100000):
+        """
+        Parameters
+        ----------
+        diaobject_cache_size is the maximum number of diaObjects to keep
+        in memory so that they do not have to be rebuilt every time one
+        of their sources triggers an alert (default 100,000).  The least
+        recently used diaObjects are evicted first.
+        """
         self._diasource_schema = None
         self._diasource_ct = {}
         self._rng = np.random.RandomState(7123)
         self._n_bit_shift = 10
+        self._diaobject_cache = OrderedDict()
+        self._diaobject_cache_size = diaobject_cache_size
+        self._diaobject_cache_hits = 0
+        self._diaobject_cache_misses = 0
+        self._diaobject_dtype = np.dtype([('uniqueId', int), ('ra', float), ('dec', float),
+                                          ('TAI', float), ('pmRA', float), ('pmDec', float),
+                                          ('parallax', float)])
+        self._diasource_dtype = np.dtype([('uniqueId', int), ('obshistId', int),
+                                          ('xPix', float), ('yPix', float),
+                                          ('chipNum', int), ('dflux', float), ('tot_snr', float),
+                                          ('ra', float), ('dec', float), ('band', int),
+                                          ('TAI', float), ('quiescent_flux', float),
+                                          ('quiescent_snr', float)])
 
     def load_schema(self, schema_dir):
         """
@@ -75,11 +105,47 @@ class AvroAlertGenerator(object):
 
         self._alert_schema = combine_schemas(file_names)
 
+    def _diasource_counters(self, unique_id):
+        """
+        Assign the per-source counter used to build diaSourceIds.
+
+        Parameters
+        ----------
+        unique_id is a numpy array of the uniqueIds of a batch of diaSources
+
+        Returns
+        -------
+        A numpy array of ints.  The i_th element is the number of diaSources
+        (including this one) that the source unique_id[i] has generated so far.
+        self._diasource_ct is updated to account for this batch.
+        """
+        unq_vals, inverse, n_per = np.unique(unique_id, return_inverse=True,
+                                             return_counts=True)
+        inverse = inverse.ravel()
+        base_ct = np.array([self._diasource_ct.get(unq, 1) for unq in unq_vals.tolist()],
+                           dtype=np.int64)
+
+        # rank of each diaSource among the diaSources of the same
+        # source within this batch
+        sorted_dex = np.argsort(inverse, kind='mergesort')
+        group_start = np.cumsum(n_per) - n_per
+        rank = np.empty(len(unique_id), dtype=np.int64)
+        rank[sorted_dex] = np.arange(len(unique_id)) - group_start[inverse[sorted_dex]]
+
+        for unq, ct in zip(unq_vals.tolist(), (base_ct+n_per).tolist()):
+            self._diasource_ct[unq] = ct
+
+        return base_ct[inverse] + rank
+
     def _create_sources(self, obshistid, diasource_data):
         """
         Create a list of diaSources that adhere to the corresponding
         avro schema.
 
+        All of the derived quantities (noise, SNR, ids) are computed
+        on whole columns and all of the random numbers are drawn at
+        once, so that the only per-row work is assembling the dicts.
+
         Parameters
         ----------
         obshistid is an integer corresponding to the OpSim pointing
@@ -93,10 +159,11 @@ class AvroAlertGenerator(object):
         A list of dicts, each of which is ready to be written as
         an avro-formatted diaSource.
         """
+        n_sources = len(diasource_data)
+        if n_sources == 0:
+            return []
 
-        bp_name_dict = {0: 'u', 1: 'g', 2: 'r', 3: 'i', 4: 'z', 5: 'y'}
-
-        avro_diasource_list = []
+        bp_name_arr = np.array(['u', 'g', 'r', 'i', 'z', 'y'])
 
         tot_flux = diasource_data['dflux'] + diasource_data['quiescent_flux']
         full_noise = tot_flux/diasource_data['tot_snr']
@@ -104,107 +171,336 @@ class AvroAlertGenerator(object):
         diff_noise = np.sqrt(full_noise**2 + quiescent_noise**2)
         diff_snr = np.abs(diasource_data['dflux']/diff_noise)
 
-        for i_source in range(len(diasource_data)):
-            diasource = diasource_data[i_source]
-            if diasource['uniqueId'] not in self._diasource_ct:
-                self._diasource_ct[diasource['uniqueId']] = 1
+        unique_id = diasource_data['uniqueId'].astype(np.int64)
+        diasource_id = (unique_id << self._n_bit_shift) + self._diasource_counters(unique_id)
+        ccd_visit_id = diasource_data['chipNum'].astype(np.int64)*10**7 + int(obshistid)
+
+        flags = self._rng.randint(10, 1000, size=n_sources)
+        cov = self._rng.random_sample((6, n_sources))*0.001
+        cov[3:5] *= 3600.0/0.2
+
+        return [{'diaSourceId': src_id, 'ccdVisitId': ccd_id, 'diaObjectId': obj_id,
+                 'midPointTai': tai, 'filterName': filter_name,
+                 'ra': ra, 'decl': dec, 'flags': flag,
+                 'x': xpix, 'y': ypix, 'snr': snr, 'psFlux': dflux,
+                 'ra_decl_Cov': {'raSigma': ra_sig, 'declSigma': dec_sig,
+                                 'ra_decl_Cov': ra_dec_cov},
+                 'x_y_Cov': {'xSigma': x_sig, 'ySigma': y_sig, 'x_y_Cov': x_y_cov},
+                 'totFlux': t_flux, 'totFluxErr': t_err,
+                 'diffFlux': dflux, 'diffFluxErr': d_err}
+                for (src_id, ccd_id, obj_id, tai, filter_name, ra, dec, flag,
+                     xpix, ypix, snr, dflux,
+                     ra_sig, dec_sig, ra_dec_cov, x_sig, y_sig, x_y_cov,
+                     t_flux, t_err, d_err) in
+                zip(diasource_id.tolist(), ccd_visit_id.tolist(), unique_id.tolist(),
+                    diasource_data['TAI'].tolist(), bp_name_arr[diasource_data['band']].tolist(),
+                    diasource_data['ra'].tolist(), diasource_data['dec'].tolist(),
+                    flags.tolist(),
+                    diasource_data['xPix'].tolist(), diasource_data['yPix'].tolist(),
+                    diff_snr.tolist(), diasource_data['dflux'].tolist(),
+                    cov[0].tolist(), cov[1].tolist(), cov[2].tolist(),
+                    cov[3].tolist(), cov[4].tolist(), cov[5].tolist(),
+                    tot_flux.tolist(), full_noise.tolist(), diff_noise.tolist())]
 
-            avro_diasource = {}
-            avro_diasource['diaSourceId'] = np.long((diasource['uniqueId'] << self._n_bit_shift) +
-                                                    self._diasource_ct[diasource['uniqueId']])
-            self._diasource_ct[diasource['uniqueId']] += 1
-            avro_diasource['ccdVisitId'] = np.long((diasource['chipNum']*10**7) + obshistid)
-            avro_diasource['diaObjectId'] = np.long(diasource['uniqueId'])
+    def _create_objects(self, diaobject_data):
+        """
+        Create a dict of diaObjects formatted according to the
+        appropriate avro schema
 
-            avro_diasource['midPointTai'] = diasource['TAI']
-            avro_diasource['filterName'] = bp_name_dict[diasource['band']]
-            avro_diasource['ra'] = diasource['ra']
-            avro_diasource['decl'] = diasource['dec']
-            avro_diasource['flags'] = self._rng.randint(10, 1000)
+        As in _create_sources, the random numbers are drawn for
+        all of the diaObjects at once.
 
-            avro_diasource['x'] = diasource['xPix']
-            avro_diasource['y'] = diasource['yPix']
-            avro_diasource['snr'] = diff_snr[i_source]
-            avro_diasource['psFlux'] = diasource['dflux']
+        Parameters
+        ----------
+        diaobject_data is a numpy recarray containing all of the
+        data needed for the diaObject
 
-            ra_dec_cov = {}
-            ra_dec_cov['raSigma'] = self._rng.random_sample()*0.001
-            ra_dec_cov['declSigma'] = self._rng.random_sample()*0.001
-            ra_dec_cov['ra_decl_Cov'] = self._rng.random_sample()*0.001
+        Returns
+        -------
+        A dict keyed on uniqueId (the CatSim unique identifier for each
+        astrophysical source).  Each value is a properly formatted
+        diaObject corresponding to its key.
+        """
+        n_objects = len(diaobject_data)
+        if n_objects == 0:
+            return {}
+
+        flags = self._rng.randint(10, 1000, size=n_objects)
+        cov = self._rng.random_sample((3, n_objects))*0.001
+        fit_stats = self._rng.random_sample((2, n_objects))
+
+        return dict((obj_id,
+                     {'flags': flag, 'diaObjectId': obj_id,
+                      'ra': ra, 'decl': dec,
+                      'ra_decl_Cov': {'raSigma': ra_sig, 'declSigma': dec_sig,
+                                      'ra_decl_Cov': ra_dec_cov},
+                      'radecTai': tai,
+                      'pmRa': pmra, 'pmDecl': pmdec, 'parallax': px,
+                      'pm_parallax_Cov': {'pmRaSigma': 0.0, 'pmDeclSigma': 0.0,
+                                          'parallaxSigma': 0.0, 'pmRa_pmDecl_Cov': 0.0,
+                                          'pmRa_parallax_Cov': 0.0,
+                                          'pmDecl_parallax_Cov': 0.0},
+                      'pmParallaxLnL': lnl, 'pmParallaxChi2': chi2,
+                      'pmParallaxNdata': 0})
+                    for (obj_id, flag, ra, dec, ra_sig, dec_sig, ra_dec_cov,
+                         tai, pmra, pmdec, px, lnl, chi2) in
+                    zip(diaobject_data['uniqueId'].astype(np.int64).tolist(),
+                        flags.tolist(),
+                        diaobject_data['ra'].tolist(), diaobject_data['dec'].tolist(),
+                        cov[0].tolist(), cov[1].tolist(), cov[2].tolist(),
+                        diaobject_data['TAI'].tolist(),
+                        diaobject_data['pmRA'].tolist(), diaobject_data['pmDec'].tolist(),
+                        diaobject_data['parallax'].tolist(),
+                        fit_stats[0].tolist(), fit_stats[1].tolist()))
+
+    def _get_diaobjects(self, reader_class, file_name, unique_id_arr):
+        """
+        Return a dict of diaObjects keyed on uniqueId for all of the
+        uniqueIds in unique_id_arr.
 
-            avro_diasource['ra_decl_Cov'] = ra_dec_cov
+        diaObjects are first looked up in the LRU cache self._diaobject_cache.
+        Only those that are not found are read from the baseline_astrometry
+        table of file_name, built with self._create_objects and added to the
+        cache (evicting the least recently used diaObjects if the cache has
+        grown beyond self._diaobject_cache_size).
 
-            x_y_cov = {}
-            x_y_cov['xSigma'] = self._rng.random_sample()*0.001*3600.0/0.2
-            x_y_cov['ySigma'] = self._rng.random_sample()*0.001*3600.0/0.2
-            x_y_cov['x_y_Cov'] = self._rng.random_sample()*0.001
+        Parameters
+        ----------
+        reader_class is the AlertDataWriterBase daughter class that wrote
+        file_name
 
-            avro_diasource['x_y_Cov'] = x_y_cov
+        file_name is the name of one of the files produced by the
+        AlertDataGenerator
 
-            avro_diasource['totFlux'] = diasource['quiescent_flux'] + diasource['dflux']
-            avro_diasource['totFluxErr'] = full_noise[i_source]
-            avro_diasource['diffFlux'] = diasource['dflux']
-            avro_diasource['diffFluxErr'] = diff_noise[i_source]
+        unique_id_arr is a numpy array of the uniqueIds whose diaObjects
+        are needed
 
-            avro_diasource_list.append(avro_diasource)
+        Returns
+        -------
+        A dict keyed on uniqueId whose values are avro-formatted diaObjects
+        """
+        def load_diaobject_data(missing_id):
+            astrometry = reader_class.read_table(file_name, 'baseline_astrometry',
+                                                 unique_id=missing_id)
+            diaobject_data = np.zeros(len(astrometry), dtype=self._diaobject_dtype)
+            for col_name in diaobject_data.dtype.names:
+                diaobject_data[col_name] = astrometry[col_name]
+            return diaobject_data
 
-        return avro_diasource_list
+        return self._cached_diaobjects(unique_id_arr, load_diaobject_data)
 
-    def _create_objects(self, diaobject_data):
+    def _cached_diaobjects(self, unique_id_arr, load_diaobject_data):
         """
-        Create a dict of diaObjects formatted according to the
-        appropriate avro schema
+        Return the diaObjects for a set of uniqueIds, drawing them from
+        the LRU cache where possible.
 
         Parameters
         ----------
-        diaobject_data is a numpy recarray containing all of the
-        data needed for the diaObject
+        unique_id_arr is a numpy array of the uniqueIds whose diaObjects
+        are needed
+
+        load_diaobject_data is a callable that takes a numpy array of the
+        uniqueIds missing from the cache and returns a numpy recarray
+        (with dtype self._diaobject_dtype) of their baseline astrometry
 
         Returns
         -------
-        A dict keyed on uniqueId (the CatSim unique identifier for each
-        astrophysical source).  Each value is a properly formatted
-        diaObject corresponding to its key.
+        A dict keyed on uniqueId whose values are avro-formatted diaObjects
         """
         diaobject_dict = {}
-        for i_object in range(len(diaobject_data)):
-            diaobject = diaobject_data[i_object]
+        missing_id = []
+        for unq in np.asarray(unique_id_arr).tolist():
+            if unq in self._diaobject_cache:
+                self._diaobject_cache.move_to_end(unq)
+                diaobject_dict[unq] = self._diaobject_cache[unq]
+                self._diaobject_cache_hits += 1
+            else:
+                missing_id.append(unq)
+
+        if len(missing_id) == 0:
+            return diaobject_dict
 
-            avro_diaobject = {}
-            avro_diaobject['flags'] = np.long(self._rng.randint(10, 1000))
-            avro_diaobject['diaObjectId'] = np.long(diaobject['uniqueId'])
-            avro_diaobject['ra'] = diaobject['ra']
-            avro_diaobject['decl'] = diaobject['dec']
+        self._diaobject_cache_misses += len(missing_id)
 
-            ra_dec_cov = {}
-            ra_dec_cov['raSigma'] = self._rng.random_sample()*0.001
-            ra_dec_cov['declSigma'] = self._rng.random_sample()*0.001
-            ra_dec_cov['ra_decl_Cov'] = self._rng.random_sample()*0.001
+        diaobject_data = load_diaobject_data(np.array(missing_id))
 
-            avro_diaobject['ra_decl_Cov'] = ra_dec_cov
-            avro_diaobject['radecTai'] = diaobject['TAI']
+        new_diaobject_dict = self._create_objects(diaobject_data)
+        diaobject_dict.update(new_diaobject_dict)
 
-            avro_diaobject['pmRa'] = diaobject['pmRA']
-            avro_diaobject['pmDecl'] = diaobject['pmDec']
-            avro_diaobject['parallax'] = diaobject['parallax']
-            pm_parallax_cov = {}
+        if self._diaobject_cache_size > 0:
+            self._diaobject_cache.update(new_diaobject_dict)
+            while len(self._diaobject_cache) > self._diaobject_cache_size:
+                self._diaobject_cache.popitem(last=False)
 
-            for field in ('pmRaSigma', 'pmDeclSigma', 'parallaxSigma', 'pmRa_pmDecl_Cov',
-                          'pmRa_parallax_Cov', 'pmDecl_parallax_Cov'):
-                pm_parallax_cov[field] = 0.0
+        return diaobject_dict
 
-            avro_diaobject['pm_parallax_Cov'] = pm_parallax_cov
+    @property
+    def diaobject_cache_stats(self):
+        """
+        A tuple containing the number of hits and misses in the
+        diaObject cache
+        """
+        return (self._diaobject_cache_hits, self._diaobject_cache_misses)
 
-            avro_diaobject['pmParallaxLnL'] = self._rng.random_sample()
-            avro_diaobject['pmParallaxChi2'] = self._rng.random_sample()
-            avro_diaobject['pmParallaxNdata'] = 0
+    @staticmethod
+    def _sort_on_key(columns, key):
+        """
+        Sort a table on a key.
 
-            diaobject_dict[diaobject['uniqueId']] = avro_diaobject
-        return diaobject_dict
+        Parameters
+        ----------
+        columns is a numpy recarray or a dict of numpy arrays
+
+        key is a numpy array of ints with one element per row of columns
+
+        Returns
+        -------
+        A dict of the sorted columns, with the sorted key added as
+        the column 'key'
+        """
+        if hasattr(columns, 'dtype'):
+            col_name_list = columns.dtype.names
+        else:
+            col_name_list = list(columns.keys())
+        sorted_dex = np.argsort(key, kind='mergesort')
+        sorted_columns = dict((col_name, np.asarray(columns[col_name])[sorted_dex])
+                              for col_name in col_name_list)
+        sorted_columns['key'] = np.asarray(key)[sorted_dex]
+        return sorted_columns
+
+    @staticmethod
+    def _lookup(sorted_key, key):
+        """
+        Find key in the sorted array sorted_key.
+
+        Returns
+        -------
+        A numpy array of indices into sorted_key and a boolean
+        numpy array that is True where key was found
+        """
+        if len(sorted_key) == 0:
+            return np.zeros(len(key), dtype=int), np.zeros(len(key), dtype=bool)
+        dex = np.searchsorted(sorted_key, key)
+        dex[dex >= len(sorted_key)] = 0
+        return dex, sorted_key[dex] == key
+
+    def _join_alert_data(self, alert_data, metadata, quiescent_flux, dmag_cutoff):
+        """
+        Assemble diaSources from alert_data by joining it with the metadata
+        and quiescent_flux tables (the equivalent of INNER JOINs on obshistId
+        and on (uniqueId, band)) and applying dmag_cutoff.
+
+        Parameters
+        ----------
+        alert_data is a numpy recarray (or dict of numpy arrays) containing
+        the columns of the alert_data table (see alert_data_schema)
+
+        metadata is the metadata table as returned by _sort_on_key with
+        key = obshistId
+
+        quiescent_flux is the quiescent_flux table as returned by
+        _sort_on_key with key = uniqueId*self._n_bands + band
+
+        dmag_cutoff is the minimum delta magnitude needed to trigger an alert
+
+        Returns
+        -------
+        A numpy recarray with dtype self._diasource_dtype, sorted on
+        (obshistId, uniqueId)
+        """
+        meta_dex, valid = self._lookup(metadata['key'], alert_data['obshistId'])
+        band = metadata['band'][meta_dex]
+        q_dex, q_found = self._lookup(quiescent_flux['key'],
+                                      alert_data['uniqueId']*self._n_bands+band)
+        valid = np.where(np.logical_and(valid, q_found))[0]
+
+        diasource_data = np.zeros(len(valid), dtype=self._diasource_dtype)
+        for col_name in ('uniqueId', 'obshistId', 'xPix', 'yPix', 'chipNum',
+                         'dflux', 'ra', 'dec'):
+            diasource_data[col_name] = alert_data[col_name][valid]
+        diasource_data['tot_snr'] = alert_data['snr'][valid]
+        diasource_data['band'] = band[valid]
+        diasource_data['TAI'] = metadata['TAI'][meta_dex[valid]]
+        diasource_data['quiescent_flux'] = quiescent_flux['flux'][q_dex[valid]]
+        diasource_data['quiescent_snr'] = quiescent_flux['snr'][q_dex[valid]]
+
+        diasource_data = self._apply_dmag_cutoff(diasource_data, dmag_cutoff)
+        return diasource_data[np.lexsort((diasource_data['uniqueId'],
+                                          diasource_data['obshistId']))]
+
+    def _open_avro_file(self, out_name, append=False):
+        """
+        Open an avro DataFileWriter for alerts.
+
+        Parameters
+        ----------
+        out_name is the name of the avro file
+
+        append is a boolean.  If True, out_name must be an existing
+        alert file; new alerts will be appended to it.  Otherwise,
+        out_name is (re)created.
+
+        Returns
+        -------
+        An avro DataFileWriter
+        """
+        if append:
+            return DataFileWriter(open(out_name, "a+b"), DatumWriter())
+        return DataFileWriter(open(out_name, "wb"), DatumWriter(), self._alert_schema)
+
+    @staticmethod
+    def _apply_dmag_cutoff(diasource_data, dmag_cutoff):
+        """
+        Return only those rows of diasource_data (a numpy recarray with
+        dflux and quiescent_flux columns) whose delta magnitude is at
+        least dmag_cutoff
+        """
+        dmag = 2.5*np.log10(1.0+diasource_data['dflux']/diasource_data['quiescent_flux'])
+        return diasource_data[np.where(np.abs(dmag) >= dmag_cutoff)]
+
+    def _write_visit_alerts(self, data_writer, obshistid, visit_data,
+                            diaobject_dict, alert_ct):
+        """
+        Append the alerts for one obsHistID to an avro file.
+
+        Parameters
+        ----------
+        data_writer is the avro DataFileWriter for this obsHistID
+
+        obshistid is the integer identifying the OpSim pointing
+
+        visit_data is a numpy recarray (with dtype self._diasource_dtype)
+        of the diaSources observed in this pointing
+
+        diaobject_dict is a dict of avro-formatted diaObjects keyed
+        on uniqueId (it must contain all of the uniqueIds in visit_data)
+
+        alert_ct is the number of alerts already written for this
+        obsHistID.  alertIds are (obshistid << 20) plus a running count.
+
+        Returns
+        -------
+        The number of alerts written
+        """
+        avro_diasource_list = self._create_sources(obshistid, visit_data)
+
+        for unq, diasource in zip(visit_data['uniqueId'].tolist(),
+                                  avro_diasource_list):
+            avro_alert = {}
+            alert_ct += 1
+            avro_alert['alertId'] = (obshistid << 20) + alert_ct
+            avro_alert['l1dbId'] = unq
+            avro_alert['diaSource'] = diasource
+            avro_alert['diaObject'] = diaobject_dict[unq]
+
+            data_writer.append(avro_alert)
+
+        return len(avro_diasource_list)
 
     def write_alerts(self, obshistid, data_dir, prefix_list,
                      htmid_list, out_dir, out_prefix,
-                     dmag_cutoff, lock=None, log_file_name=None):
+                     dmag_cutoff, lock=None, log_file_name=None,
+                     reader_class=None):
         """
         Write the alerts for an obsHistId to a properly formatted avro file.
 
@@ -213,16 +509,20 @@ class AvroAlertGenerator(object):
         obshistid is the integer uniquely identifying the OpSim pointing
         being simulated
 
-        data_dir is the directory containing the sqlite files created by
+        data_dir is the directory containing the files created by
         the AlertDataGenerator
 
-        prefix_list is a list of prefixes for those sqlite files.
+        prefix_list is a list of prefixes for those files.
 
         htmid_list is the list of htmids identifying the trixels that overlap
         this obshistid's field of view. For each htmid in htmid_list and each
         prefix in prefix_list, this method will process the files
-            data_dir/prefix_htmid_sqlite.db
-        searching for alerts that correspond to this obshistid
+            data_dir/prefix_htmid + reader_class.file_suffix
+        searching for alerts that correspond to this obshistid.  If the
+        files have been repartitioned by obsHistID (or night) with the
+        AlertDataRepartitioner, pass [obshistid] (or [night]) as htmid_list
+        and the prefix given to AlertDataRepartitioner.repartition as
+        prefix_list; each visit is then read from a single file.
 
         out_dir is the directory to which the avro files should be written
 
@@ -236,88 +536,494 @@ class AvroAlertGenerator(object):
 
         log_file_name is the name of an optional text file to which progress is
         written.
+
+        reader_class is the AlertDataWriterBase daughter class that wrote the
+        files (its read_table() method will be used to read them).  Defaults
+        to AlertDataSqliteWriter.
         """
+        self.write_alerts_batch([obshistid], data_dir, prefix_list,
+                                {obshistid: htmid_list}, out_dir, out_prefix,
+                                dmag_cutoff, lock=lock, log_file_name=log_file_name,
+                                reader_class=reader_class)
+
+    def write_alerts_batch(self, obshistid_list, data_dir, prefix_list,
+                           obshistid_to_htmid, out_dir, out_prefix,
+                           dmag_cutoff, lock=None, log_file_name=None,
+                           reader_class=None):
+        """
+        Write the alerts for many obsHistIds to properly formatted avro files
+        (one per obsHistId), reading each file only once.
 
-        out_name = os.path.join(out_dir, '%s_%d.avro' % (out_prefix, obshistid))
-        if os.path.exists(out_name):
-            os.unlink(out_name)
+        Each file overlapping any of the obsHistIds is read once for the
+        alerts of all of the obsHistIds it overlaps (along with the quiescent
+        fluxes of the sources that have alerts).  diaObjects are
+        built once per source (and cached across files and calls, see the
+        diaobject_cache_size kwarg of the constructor).  Alerts are routed
+        to the avro file of their obsHistId as they are read.
 
-        with DataFileWriter(open(out_name, "wb"),
-                            DatumWriter(), self._alert_schema) as data_writer:
+        Parameters
+        ----------
+        obshistid_list is a list of the integers uniquely identifying the
+        OpSim pointings being simulated
 
-            diasource_query = 'SELECT alert.uniqueId, alert.xPix, alert.yPix, '
-            diasource_query += 'alert.chipNum, alert.dflux, alert.snr, alert.ra, alert.dec, '
-            diasource_query += 'meta.band, meta.TAI, quiescent.flux, quiescent.snr '
-            diasource_query += 'FROM alert_data as alert '
-            diasource_query += 'INNER JOIN metadata AS meta ON alert.obshistId=meta.obshistId '
-            diasource_query += 'INNER JOIN quiescent_flux AS quiescent ON quiescent.uniqueId=alert.uniqueID '
-            diasource_query += 'AND quiescent.band=meta.band '
-            diasource_query += 'WHERE alert.obshistId=%d ' % obshistid
-            diasource_query += 'ORDER BY alert.uniqueId'
+        data_dir is the directory containing the files created by
+        the AlertDataGenerator
 
-            diasource_dtype = np.dtype([('uniqueId', int), ('xPix', float), ('yPix', float),
-                                        ('chipNum', int), ('dflux', float), ('tot_snr', float),
-                                        ('ra', float), ('dec', float), ('band', int), ('TAI', float),
-                                        ('quiescent_flux', float), ('quiescent_snr', float)])
+        prefix_list is a list of prefixes for those files.
 
-            diaobject_query = 'SELECT uniqueId, ra, dec, TAI, pmRA, pmDec, parallax '
-            diaobject_query += 'FROM baseline_astrometry'
+        obshistid_to_htmid is a dict mapping each obshistid in obshistid_list
+        to the list of htmids identifying the trixels that overlap that
+        obshistid's field of view (see write_alerts)
 
-            diaobject_dtype = np.dtype([('uniqueId', int), ('ra', float), ('dec', float),
-                                        ('TAI', float), ('pmRA', float), ('pmDec', float),
-                                        ('parallax', float)])
+        out_dir is the directory to which the avro files should be written
 
-            t_start = time.time()
-            alert_ct = 0
-            for htmid in htmid_list:
-                for prefix in prefix_list:
-                    db_name = os.path.join(data_dir, '%s_%d_sqlite.db' % (prefix, htmid))
-                    if not os.path.exists(db_name):
-                        warnings.warn('%s does not exist' % db_name)
-                        continue
+        out_prefix is the prefix of the avro file names.  The avro files will
+        be named out_dir/out_prefix_obshistid.avro
 
-                    db_obj = DBObject(db_name, driver='sqlite')
+        dmag_cutoff is the minimum delta magnitude needed to trigger an alert
 
-                    diaobject_data = db_obj.execute_arbitrary(diaobject_query,
-                                                              dtype=diaobject_dtype)
+        lock is an optional multiprocessing.Lock() for use when running many
+        instances of this method. It prevents multiple processes from writing to
+        the logfile or stdout at once.
 
-                    diaobject_dict = self._create_objects(diaobject_data)
+        log_file_name is the name of an optional text file to which progress is
+        written.
 
-                    diasource_data = db_obj.execute_arbitrary(diasource_query,
-                                                              dtype=diasource_dtype)
+        reader_class is the AlertDataWriterBase daughter class that wrote the
+        files (its read_table() method will be used to read them).  Defaults
+        to AlertDataSqliteWriter.
+        """
 
-                    dmag = 2.5*np.log10(1.0+diasource_data['dflux']/diasource_data['quiescent_flux'])
-                    valid_alerts = np.where(np.abs(dmag) >= dmag_cutoff)
-                    diasource_data = diasource_data[valid_alerts]
-                    avro_diasource_list = self._create_sources(obshistid, diasource_data)
+        if reader_class is None:
+            reader_class = AlertDataSqliteWriter
+
+        obshistid_list = [int(obshistid) for obshistid in obshistid_list]
+
+        # map each htmid to the obshistids it overlaps, preserving the
+        # order in which the htmids are listed for each obshistid
+        htmid_to_obshistid = OrderedDict()
+        for obshistid in obshistid_list:
+            for htmid in obshistid_to_htmid[obshistid]:
+                if htmid not in htmid_to_obshistid:
+                    htmid_to_obshistid[htmid] = []
+                htmid_to_obshistid[htmid].append(obshistid)
+
+        t_start = time.time()
+        alert_ct = dict((obshistid, 0) for obshistid in obshistid_list)
+        data_writer_dict = {}
+        try:
+            for obshistid in obshistid_list:
+                out_name = os.path.join(out_dir, '%s_%d.avro' % (out_prefix, obshistid))
+                if os.path.exists(out_name):
+                    os.unlink(out_name)
+                data_writer_dict[obshistid] = self._open_avro_file(out_name)
+
+            for htmid in htmid_to_obshistid:
+                local_obshistid_list = htmid_to_obshistid[htmid]
 
-                    for i_source in range(len(avro_diasource_list)):
-                        alert_ct += 1
-                        unq = diasource_data[i_source]['uniqueId']
-                        diaobject = diaobject_dict[unq]
-                        diasource = avro_diasource_list[i_source]
+                for prefix in prefix_list:
+                    file_name = os.path.join(data_dir, '%s_%d%s' % (prefix, htmid,
+                                                                    reader_class.file_suffix))
+                    if not os.path.exists(file_name):
+                        warnings.warn('%s does not exist' % file_name)
+                        continue
+
+                    alert_data = reader_class.read_table(file_name, 'alert_data',
+                                                         obshistid=local_obshistid_list)
+                    if len(alert_data) == 0:
+                        continue
 
-                        avro_alert = {}
-                        avro_alert['alertId'] = np.long((obshistid << 20) + alert_ct)
-                        avro_alert['l1dbId'] = np.long(unq)
-                        avro_alert['diaSource'] = diasource
-                        avro_alert['diaObject'] = diaobject
+                    metadata = reader_class.read_table(file_name, 'metadata')
+                    metadata = self._sort_on_key(metadata, metadata['obshistId'])
+                    quiescent_flux = reader_class.read_table(file_name, 'quiescent_flux',
+                                                             unique_id=np.unique(alert_data['uniqueId']))
+                    quiescent_flux = self._sort_on_key(quiescent_flux,
+                                                       quiescent_flux['uniqueId']*self._n_bands +
+                                                       quiescent_flux['band'])
+
+                    diasource_data = self._join_alert_data(alert_data, metadata, quiescent_flux,
+                                                           dmag_cutoff)
+                    if len(diasource_data) == 0:
+                        continue
 
-                        data_writer.append(avro_alert)
+                    diaobject_dict = self._get_diaobjects(reader_class, file_name,
+                                                          np.unique(diasource_data['uniqueId']))
+
+                    # diasource_data is sorted on obshistId
+                    unq_obs, obs_start = np.unique(diasource_data['obshistId'], return_index=True)
+                    obs_end = np.append(obs_start[1:], len(diasource_data))
+                    obs_slices = dict((obshistid, slice(i_start, i_end))
+                                      for obshistid, i_start, i_end in
+                                      zip(unq_obs, obs_start, obs_end))
+
+                    for obshistid in local_obshistid_list:
+                        if obshistid not in obs_slices:
+                            continue
+                        visit_data = diasource_data[obs_slices[obshistid]]
+                        alert_ct[obshistid] += self._write_visit_alerts(data_writer_dict[obshistid],
+                                                                        obshistid, visit_data,
+                                                                        diaobject_dict,
+                                                                        alert_ct=alert_ct[obshistid])
+        finally:
+            for obshistid in data_writer_dict:
+                data_writer_dict[obshistid].close()
 
         if lock is not None:
             lock.acquire()
 
         elapsed = (time.time()-t_start)/3600.0
 
-        msg = 'finished obshistid %d; %d alerts in %.2e hrs' % (obshistid, alert_ct, elapsed)
-
-        print(msg)
+        for obshistid in obshistid_list:
+            msg = 'finished obshistid %d; %d alerts in %.2e hrs' % (obshistid, alert_ct[obshistid],
+                                                                    elapsed)
+            print(msg)
 
-        if log_file_name is not None:
-            with open(log_file_name, 'a') as out_file:
-                out_file.write(msg)
-                out_file.write('\n')
+            if log_file_name is not None:
+                with open(log_file_name, 'a') as out_file:
+                    out_file.write(msg)
+                    out_file.write('\n')
 
         if lock is not None:
             lock.release()
+
+
+class AvroAlertStream(object):
+    """
+    The avro writer stage of a streaming alert pipeline, in which
+    AlertDataGenerator.alert_data_from_htmid hands the alert data it
+    generates straight to avro files, skipping the intermediate sqlite
+    files.  Alerts are written to one avro file per obsHistID, named
+
+    out_dir/out_prefix_obshistid.avro
+
+    as by AvroAlertGenerator.write_alerts_batch, no matter how many
+    trixels they come from.
+
+    Pass the stream to the AvroAlertStreamWriter used as the
+    writer_class of alert_data_from_htmid, e.g.
+
+        avro_gen = AvroAlertGenerator()
+        avro_gen.load_schema(schema_dir)
+        stream = AvroAlertStream(avro_gen, out_dir, 'alerts', 0.005)
+        try:
+            for htmid in htmid_list:
+                alert_gen.alert_data_from_htmid(htmid, dbobj, ...,
+                                                writer_class=AvroAlertStreamWriter,
+                                                writer_kwargs={'alert_stream': stream})
+        finally:
+            stream.close()
+
+    Batches of rows are put on a bounded queue.Queue and consumed by a
+    thread, which keeps the metadata, quiescent_flux and
+    baseline_astrometry tables of each open trixel in memory, joins each
+    batch of alert_data against them (applying dmag_cutoff) and appends
+    the alerts to the avro files.  Simulating the alert data and
+    serializing the alerts therefore overlap.  Because the queue is
+    bounded, the AlertDataGenerator blocks rather than accumulating
+    batches in memory if it gets ahead of the avro encoding.
+
+    alertIds are (obshistid << 20) plus a running count of the alerts
+    of each obsHistID, as in AvroAlertGenerator.write_alerts.  The alerts
+    of each obsHistID are counted in the order in which their trixels
+    are streamed.
+
+    alert_generator is used by the writer thread until the stream is
+    closed (its diaSource counters and diaObject cache are not
+    thread-safe).  A stream lives in a single process; processes
+    running alert_data_from_htmid in parallel each need their own
+    stream (with a different out_prefix).
+    """
+
+    def __init__(self, alert_generator, out_dir, out_prefix, dmag_cutoff,
+                 queue_size=4, max_open_files=256):
+        """
+        Parameters
+        ----------
+        alert_generator is an AvroAlertGenerator whose schema has already
+        been loaded with load_schema()
+
+        out_dir is the directory to which the avro files should be written
+
+        out_prefix is the prefix of the avro file names
+
+        dmag_cutoff is the minimum delta magnitude needed to trigger an alert
+
+        queue_size is the maximum number of batches that can be waiting to
+        be turned into alerts at any one time (default 4)
+
+        max_open_files is the maximum number of avro files to keep open
+        at once.  The least recently used files are closed and later
+        reopened in append mode if necessary (default 256).
+        """
+        self._alert_generator = alert_generator
+        self._out_dir = out_dir
+        self._out_prefix = out_prefix
+        self._dmag_cutoff = dmag_cutoff
+        self._max_open_files = max_open_files
+
+        # the state below is only touched by the writer thread
+        self._trixels = {}
+        self._data_writers = OrderedDict()
+        self._alert_ct = {}
+        self._error = None
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._is_open = True
+        self._thread = threading.Thread(target=self._consume)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def avro_file_name(self, obshistid):
+        """
+        The name of the avro file containing the alerts for obshistid
+        """
+        return os.path.join(self._out_dir, '%s_%d.avro' % (self._out_prefix, obshistid))
+
+    @property
+    def alert_counts(self):
+        """
+        A dict mapping obsHistID to the number of alerts written for it.
+        Only available after the stream has been closed.
+        """
+        if self._is_open:
+            raise RuntimeError("AvroAlertStream.alert_counts is only "
+                               "available after the stream has been closed")
+        return self._alert_ct
+
+    def _put(self, item):
+        """
+        Put an item on the queue, giving up (instead of blocking forever)
+        if the writer thread has died.  Returns True if the item was queued.
+        """
+        while self._thread.is_alive():
+            try:
+                self._queue.put(item, timeout=1.0)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def put(self, trixel_name, table_name, columns):
+        """
+        Put a batch of rows on the queue
+
+        Parameters
+        ----------
+        trixel_name is the name identifying the AvroAlertStreamWriter
+        that produced the batch
+
+        table_name is the name of the table (a key in alert_data_schema),
+        or None to signal that the writer has been closed
+
+        columns is a dict of numpy arrays (or None)
+        """
+        if not self._is_open:
+            raise RuntimeError("AvroAlertStream writing %s_*.avro has been closed" %
+                               os.path.join(self._out_dir, self._out_prefix))
+        if not self._put((trixel_name, table_name, columns)):
+            raise RuntimeError("The AvroAlertStream writer thread died: %s" %
+                               repr(self._error))
+
+    def close(self):
+        """
+        Wait for all of the queued batches to be written and close
+        the avro files
+        """
+        if not self._is_open:
+            return
+        self._put(None)
+        self._thread.join()
+        self._is_open = False
+        if self._error is not None:
+            raise RuntimeError("The AvroAlertStream writer thread failed: %s" %
+                               repr(self._error))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    ######## the methods below run in the writer thread ########
+
+    def _consume(self):
+        """
+        Read batches off of the queue and turn them into avro alerts
+        until the None sentinel is received.
+        """
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                trixel_name, table_name, columns = item
+                if table_name is None:
+                    self._trixels.pop(trixel_name, None)
+                    continue
+                if trixel_name not in self._trixels:
+                    self._trixels[trixel_name] = {'pending': {'metadata': [],
+                                                              'quiescent_flux': [],
+                                                              'baseline_astrometry': []},
+                                                  'metadata': None,
+                                                  'quiescent_flux': None,
+                                                  'baseline_astrometry': None}
+                trixel = self._trixels[trixel_name]
+                if table_name == 'alert_data':
+                    self._receive_alert_data(trixel, columns)
+                else:
+                    trixel['pending'][table_name].append(columns)
+        except Exception as err:
+            self._error = err
+        finally:
+            while len(self._data_writers) > 0:
+                self._data_writers.popitem(last=False)[1].close()
+
+    def _merge_pending(self, trixel, table_name, sort_key):
+        """
+        Merge any pending batches of table_name into the sorted
+        in-memory table of a trixel
+
+        Parameters
+        ----------
+        trixel is the dict holding the in-memory tables of the trixel
+
+        table_name is 'metadata', 'quiescent_flux' or 'baseline_astrometry'
+
+        sort_key is a callable that takes a dict of numpy arrays and
+        returns the integer key on which it is to be sorted
+        """
+        pending = trixel['pending'][table_name]
+        if len(pending) == 0:
+            return
+        col_name_list = list(pending[0].keys())
+        if trixel[table_name] is not None:
+            pending = [trixel[table_name]] + pending
+        merged = dict((col_name, np.concatenate([batch[col_name] for batch in pending]))
+                      for col_name in col_name_list)
+        trixel['pending'][table_name] = []
+        trixel[table_name] = self._alert_generator._sort_on_key(merged, sort_key(merged))
+
+    def _avro_writer(self, obshistid):
+        """
+        Return an open avro DataFileWriter for obshistid, closing the
+        least recently used one if there are too many files open
+        """
+        if obshistid in self._data_writers:
+            self._data_writers.move_to_end(obshistid)
+            return self._data_writers[obshistid]
+
+        out_name = self.avro_file_name(obshistid)
+        append = obshistid in self._alert_ct
+        if not append:
+            if os.path.exists(out_name):
+                os.unlink(out_name)
+            self._alert_ct[obshistid] = 0
+
+        data_writer = self._alert_generator._open_avro_file(out_name, append=append)
+        self._data_writers[obshistid] = data_writer
+        while len(self._data_writers) > self._max_open_files:
+            self._data_writers.popitem(last=False)[1].close()
+        return data_writer
+
+    def _receive_alert_data(self, trixel, columns):
+        """
+        Join a batch of alert_data with the in-memory metadata and
+        quiescent flux of its trixel and append the resulting alerts
+        to the avro files
+        """
+        generator = self._alert_generator
+        n_bands = generator._n_bands
+        self._merge_pending(trixel, 'metadata', lambda tab: tab['obshistId'])
+        self._merge_pending(trixel, 'quiescent_flux',
+                            lambda tab: tab['uniqueId']*n_bands+tab['band'])
+        self._merge_pending(trixel, 'baseline_astrometry', lambda tab: tab['uniqueId'])
+
+        if trixel['metadata'] is None or trixel['quiescent_flux'] is None:
+            return
+
+        diasource_data = generator._join_alert_data(columns, trixel['metadata'],
+                                                    trixel['quiescent_flux'],
+                                                    self._dmag_cutoff)
+        if len(diasource_data) == 0:
+            return
+
+        astrometry = trixel['baseline_astrometry']
+
+        def load_diaobject_data(unique_id):
+            dex, found = generator._lookup(astrometry['key'], unique_id)
+            dex = dex[found]
+            diaobject_data = np.zeros(len(dex), dtype=generator._diaobject_dtype)
+            for col_name in diaobject_data.dtype.names:
+                diaobject_data[col_name] = astrometry[col_name][dex]
+            return diaobject_data
+
+        diaobject_dict = generator._cached_diaobjects(np.unique(diasource_data['uniqueId']),
+                                                      load_diaobject_data)
+
+        unq_obs, obs_start = np.unique(diasource_data['obshistId'], return_index=True)
+        obs_end = np.append(obs_start[1:], len(diasource_data))
+        for obshistid, i_start, i_end in zip(unq_obs.tolist(), obs_start, obs_end):
+            data_writer = self._avro_writer(obshistid)
+            visit_data = diasource_data[i_start:i_end]
+            n_alerts = generator._write_visit_alerts(data_writer, obshistid, visit_data,
+                                                     diaobject_dict, self._alert_ct[obshistid])
+            self._alert_ct[obshistid] += n_alerts
+
+
+class AvroAlertStreamWriter(AlertDataWriterBase):
+    """
+    A writer for the AlertDataGenerator that hands the alert data of
+    one trixel to an AvroAlertStream (see that class for an example)
+    instead of writing it to a file.
+
+    The metadata, quiescent_flux and baseline_astrometry tables are put
+    on the stream's queue as they are written.  Batches of alert_data are
+    buffered until flush() (which the AlertDataGenerator calls after
+    every write_alert_data()) and then put on the queue together.
+
+    No tables are written, so read_table() is not supported.
+    """
+
+    file_suffix = ''
+
+    def __init__(self, file_name, alert_stream):
+        """
+        Parameters
+        ----------
+        file_name is the name identifying this trixel in the stream
+        (no file of this name is created)
+
+        alert_stream is the AvroAlertStream to which the alert data
+        is handed
+        """
+        super(AvroAlertStreamWriter, self).__init__(file_name)
+        self._alert_stream = alert_stream
+        self._alert_data = []
+
+    def _append(self, table_name, columns):
+        if table_name == 'alert_data':
+            self._alert_data.append(columns)
+        else:
+            self._alert_stream.put(self._file_name, table_name, columns)
+
+    def flush(self):
+        if len(self._alert_data) == 0:
+            return
+        pending = self._alert_data
+        self._alert_data = []
+        self._alert_stream.put(self._file_name, 'alert_data',
+                               dict((col_name, np.concatenate([batch[col_name]
+                                                               for batch in pending]))
+                                    for col_name in pending[0]))
+
+    def create_indexes(self):
+        pass
+
+    def _close_file(self):
+        # let the stream drop the in-memory tables of this trixel
+        self._alert_stream.put(self._file_name, None, None)
+
+    @classmethod
+    def read_table(cls, file_name, table_name, obshistid=None, unique_id=None):
+        raise RuntimeError("AvroAlertStreamWriter does not write tables; "
+                           "read the avro files instead")
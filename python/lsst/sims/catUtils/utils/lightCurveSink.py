@@ -0,0 +1,339 @@
+"""
+This module provides a sink which streams the light curves produced by
+the LightCurveGenerator to an HDF5 file as they are generated, and a
+reader which provides random access to the light curves in that file
+by uniqueId.  This allows light curves to be generated for more objects
+than can be held in memory at once.
+"""
+import numpy as np
+import os
+import json
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+try:
+    import h5py
+except ImportError:
+    pass
+
+__all__ = ["LightCurveHdf5Sink", "LightCurveHdf5Reader"]
+
+
+def _to_json(value):
+    """
+    Serialize truth information (a string or a dict of numbers)
+    for storage in the HDF5 file
+    """
+    def _default(obj):
+        if isinstance(obj, np.integer):
+            return int(obj)
+        if isinstance(obj, np.floating):
+            return float(obj)
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, bytes):
+            return obj.decode('utf-8')
+        return str(obj)
+
+    if isinstance(value, np.str_):
+        value = str(value)
+    return json.dumps(value, default=_default)
+
+
+class LightCurveHdf5Sink(object):
+    """
+    Append light curves to an HDF5 file as they are generated.
+
+    The file contains three groups, each of which holds chunked,
+    compressed, extendable 1-dimensional datasets:
+
+    points -- uniqueId, band, mjd, the brightness column ('mag' or
+    'flux'), and error; one row per observation of an object.  band is
+    an index into the list stored (as JSON) in the file attribute
+    'band_names'
+
+    index -- uniqueId, band, start, count; the rows
+    points/col[start:start+count] are observations of one object in one
+    band, sorted on mjd.  An object observed in more than one chunk of
+    the generator has more than one run in the index.
+
+    truth -- uniqueId and truth; the truth information about each
+    object serialized as JSON.
+
+    Pass an instance of this class as the sink kwarg of
+    LightCurveGenerator.light_curves_from_pointings.  The sink is not
+    closed by the LightCurveGenerator, so that one file can collect the
+    light curves from several calls.  Use LightCurveHdf5Reader to read
+    the file back.
+    """
+
+    def __init__(self, file_name, brightness_name='mag', chunk_rows=65536,
+                 compression='gzip', compression_opts=4):
+        """
+        Parameters
+        ----------
+        file_name is the name of the HDF5 file to be created
+
+        brightness_name is the name of the brightness column ('mag'
+        for most LightCurveGenerators; 'flux' for the
+        SNIaLightCurveGenerator)
+
+        chunk_rows is the number of rows in each HDF5 chunk
+
+        compression is the h5py compression filter to use (None
+        for no compression)
+
+        compression_opts are the options passed to the compression
+        filter (the compression level for gzip)
+        """
+        if 'h5py' not in globals():
+            raise RuntimeError('You cannot use the LightCurveHdf5Sink '
+                               'without installing h5py')
+
+        if os.path.exists(file_name):
+            raise RuntimeError('%s already exists' % file_name)
+
+        self.file_name = file_name
+        self.brightness_name = brightness_name
+        self.band_names = []
+        self._band_index = {}
+
+        self._file = h5py.File(file_name, 'w')
+        self._file.attrs['brightness_name'] = brightness_name
+        self._file.attrs['band_names'] = json.dumps(self.band_names)
+
+        schema = {'points': [('uniqueId', np.int64), ('band', np.int8), ('mjd', float),
+                             (brightness_name, float), ('error', float)],
+                  'index': [('uniqueId', np.int64), ('band', np.int8),
+                            ('start', np.int64), ('count', np.int64)],
+                  'truth': [('uniqueId', np.int64),
+                            ('truth', h5py.special_dtype(vlen=str))]}
+
+        for group_name in schema:
+            group = self._file.create_group(group_name)
+            for col_name, col_type in schema[group_name]:
+                group.create_dataset(col_name, shape=(0,), maxshape=(None,),
+                                     dtype=col_type, chunks=(chunk_rows,),
+                                     compression=compression,
+                                     compression_opts=compression_opts if compression is not None else None,
+                                     shuffle=compression is not None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _append(self, group_name, columns):
+        group = self._file[group_name]
+        for col_name in columns:
+            dataset = group[col_name]
+            n_0 = dataset.shape[0]
+            n_new = len(columns[col_name])
+            dataset.resize((n_0+n_new,))
+            dataset[n_0:] = columns[col_name]
+
+    def write(self, light_curves, truth_dict=None):
+        """
+        Append light curves to the file.
+
+        Parameters
+        ----------
+        light_curves is a LightCurveResult (see LightCurveStore)
+
+        truth_dict is an optional dict of truth information keyed
+        on uniqueId
+        """
+        if self._file is None:
+            raise RuntimeError('Cannot write to %s; it has been closed' % self.file_name)
+
+        if light_curves.brightness_name != self.brightness_name:
+            raise RuntimeError('LightCurveHdf5Sink for %s cannot write light curves with %s'
+                               % (self.brightness_name, light_curves.brightness_name))
+
+        data = light_curves.data
+        if len(data) > 0:
+            # map the bands of light_curves onto the bands of this file
+            band_map = np.zeros(len(light_curves.band_names), dtype=np.int8)
+            for i_band, band in enumerate(light_curves.band_names):
+                if band not in self._band_index:
+                    self._band_index[band] = len(self.band_names)
+                    self.band_names.append(band)
+                band_map[i_band] = self._band_index[band]
+            self._file.attrs['band_names'] = json.dumps(self.band_names)
+            band = band_map[data['band']]
+
+            # data is sorted on (uniqueId, band, mjd); find the runs of
+            # rows with the same uniqueId and band
+            is_new_run = np.logical_or(data['uniqueId'][1:] != data['uniqueId'][:-1],
+                                       data['band'][1:] != data['band'][:-1])
+            run_start = np.append([0], np.where(is_new_run)[0]+1)
+            run_count = np.diff(np.append(run_start, len(data)))
+
+            n_0 = self._file['points']['mjd'].shape[0]
+            self._append('points', {'uniqueId': data['uniqueId'],
+                                    'band': band,
+                                    'mjd': data['mjd'],
+                                    self.brightness_name: data[self.brightness_name],
+                                    'error': data['error']})
+
+            self._append('index', {'uniqueId': data['uniqueId'][run_start],
+                                   'band': band[run_start],
+                                   'start': run_start + n_0,
+                                   'count': run_count})
+
+        if truth_dict is not None and len(truth_dict) > 0:
+            unique_id = list(truth_dict.keys())
+            self._append('truth', {'uniqueId': np.array(unique_id, dtype=np.int64),
+                                   'truth': [_to_json(truth_dict[uid]) for uid in unique_id]})
+
+    def flush(self):
+        """
+        Flush everything that has been written to disk
+        """
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class LightCurveHdf5Reader(Mapping):
+    """
+    Read the light curves written by a LightCurveHdf5Sink.
+
+    Only the index is read into memory when the file is opened; the
+    observations of an object are read from disk when that object is
+    asked for.  This class behaves like the dict of light curves
+    returned by LightCurveGenerator.light_curves_from_pointings, i.e.
+
+    reader[111]['u']['mjd'] is a numpy array of the MJD of observations
+    of object 111 in the u band.
+    """
+
+    def __init__(self, file_name):
+        """
+        Parameters
+        ----------
+        file_name is the name of the HDF5 file written by LightCurveHdf5Sink
+        """
+        if 'h5py' not in globals():
+            raise RuntimeError('You cannot use the LightCurveHdf5Reader '
+                               'without installing h5py')
+
+        self.file_name = file_name
+        self._file = h5py.File(file_name, 'r')
+        self.brightness_name = str(self._file.attrs['brightness_name'])
+        self.band_names = tuple(json.loads(self._file.attrs['band_names']))
+
+        index = self._file['index']
+        unique_id = index['uniqueId'][()]
+        band = index['band'][()]
+        start = index['start'][()]
+        sorted_dex = np.lexsort((start, band, unique_id))
+        self._run_unique_id = unique_id[sorted_dex]
+        self._run_band = band[sorted_dex]
+        self._run_start = start[sorted_dex]
+        self._run_count = index['count'][()][sorted_dex]
+
+        self.unique_id, first_dex = np.unique(self._run_unique_id, return_index=True)
+        self._run_offsets = np.append(first_dex, len(self._run_unique_id))
+
+        truth_id = self._file['truth']['uniqueId'][()]
+        # keep the first truth entry written for each object
+        self._truth_id, self._truth_dex = np.unique(truth_id, return_index=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __len__(self):
+        return len(self.unique_id)
+
+    def __iter__(self):
+        for unique_id in self.unique_id.tolist():
+            yield unique_id
+
+    @staticmethod
+    def _find(sorted_arr, value):
+        """
+        Return the index of value in the sorted array sorted_arr
+        (raise a KeyError if it is not there)
+        """
+        try:
+            dex = np.searchsorted(sorted_arr, value)
+        except TypeError:
+            raise KeyError(value)
+        if np.ndim(dex) != 0 or dex >= len(sorted_arr) or sorted_arr[dex] != value:
+            raise KeyError(value)
+        return dex
+
+    def __contains__(self, unique_id):
+        try:
+            self._find(self.unique_id, unique_id)
+        except KeyError:
+            return False
+        return True
+
+    def _read_runs(self, i_first, i_last):
+        """
+        Read the points in runs i_first through i_last-1 of the index
+        into one structured array
+        """
+        points = self._file['points']
+        names = ('mjd', self.brightness_name, 'error')
+        dtype = np.dtype([('band', np.int8)] + [(name, float) for name in names])
+        n_points = self._run_count[i_first:i_last].sum()
+        out = np.zeros(n_points, dtype=dtype)
+        i_out = 0
+        for i_run in range(i_first, i_last):
+            i_start = self._run_start[i_run]
+            i_end = i_start + self._run_count[i_run]
+            out['band'][i_out:i_out+self._run_count[i_run]] = self._run_band[i_run]
+            for name in names:
+                out[name][i_out:i_out+self._run_count[i_run]] = points[name][i_start:i_end]
+            i_out += self._run_count[i_run]
+
+        # runs from different chunks of the generator need to be merged
+        return out[np.lexsort((out['mjd'], out['band']))]
+
+    def __getitem__(self, unique_id):
+        """
+        Return a dict, keyed on bandpass name, of dicts containing
+        the 'mjd', brightness, and 'error' arrays of the object
+        """
+        dex = self._find(self.unique_id, unique_id)
+        rows = self._read_runs(self._run_offsets[dex], self._run_offsets[dex+1])
+
+        band_values, band_start = np.unique(rows['band'], return_index=True)
+        band_end = np.append(band_start[1:], len(rows))
+
+        output = {}
+        for i_band, i_start, i_end in zip(band_values, band_start, band_end):
+            band_rows = rows[i_start:i_end]
+            output[self.band_names[i_band]] = {'mjd': band_rows['mjd'],
+                                               self.brightness_name: band_rows[self.brightness_name],
+                                               'error': band_rows['error']}
+        return output
+
+    def truth(self, unique_id):
+        """
+        Return the truth information stored for the object unique_id
+        """
+        dex = self._find(self._truth_id, unique_id)
+        value = self._file['truth']['truth'][self._truth_dex[dex]]
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return json.loads(value)
@@ -0,0 +1,271 @@
+"""
+This module provides the columnar containers in which the
+LightCurveGenerator accumulates and returns light curves.
+"""
+import numpy as np
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+__all__ = ["LightCurveStore", "LightCurveResult"]
+
+
+class LightCurveStore(object):
+    """
+    Accumulate light curve points in preallocated columnar arrays
+    (uniqueId, band, mjd, brightness, error).  The arrays are grown
+    in blocks of at least block_size rows, so that appending points
+    does not require a Python object per point.
+
+    Call get_result() to sort the points and get a LightCurveResult.
+    """
+
+    def __init__(self, brightness_name='mag', block_size=100000):
+        """
+        Parameters
+        ----------
+        brightness_name is the name of the brightness column
+        ('mag' or 'flux') in the light curves returned
+
+        block_size is the minimum number of rows by which the
+        arrays are grown when they run out of room (default 100000)
+        """
+        if block_size < 1:
+            raise RuntimeError('LightCurveStore needs block_size > 0; you gave %d' % block_size)
+
+        self.brightness_name = brightness_name
+        self._block_size = block_size
+        self._n_rows = 0
+        self._capacity = 0
+
+        # the names of the bands seen so far; the 'band' column
+        # stores indices into this list
+        self.band_names = []
+        self._band_index = {}
+
+        self._unique_id = np.zeros(0, dtype=np.int64)
+        self._band = np.zeros(0, dtype=np.int8)
+        self._mjd = np.zeros(0, dtype=float)
+        self._brightness = np.zeros(0, dtype=float)
+        self._error = np.zeros(0, dtype=float)
+
+    def __len__(self):
+        return self._n_rows
+
+    @property
+    def nbytes(self):
+        """
+        The number of bytes allocated for the light curve points
+        """
+        return (self._unique_id.nbytes + self._band.nbytes + self._mjd.nbytes +
+                self._brightness.nbytes + self._error.nbytes)
+
+    def _grow(self, n_new):
+        """
+        Make sure there is room for n_new more rows
+        """
+        n_needed = self._n_rows + n_new
+        if n_needed <= self._capacity:
+            return
+
+        # grow geometrically so that the total cost of copying stays
+        # linear in the number of points, and in whole blocks
+        new_capacity = max(n_needed, 2*self._capacity)
+        new_capacity = self._block_size*int(np.ceil(new_capacity/float(self._block_size)))
+
+        for name in ('_unique_id', '_band', '_mjd', '_brightness', '_error'):
+            old_arr = getattr(self, name)
+            new_arr = np.zeros(new_capacity, dtype=old_arr.dtype)
+            new_arr[:self._n_rows] = old_arr[:self._n_rows]
+            setattr(self, name, new_arr)
+
+        self._capacity = new_capacity
+
+    def append(self, unique_id, band, mjd, brightness, error):
+        """
+        Add points to the store.
+
+        Parameters
+        ----------
+        unique_id is the uniqueId of the object(s)
+
+        band is the name of the bandpass (a single string)
+
+        mjd is the date of the observation(s)
+
+        brightness is the magnitude or flux of the object(s)
+
+        error is the uncertainty in brightness
+
+        unique_id, mjd, brightness, and error are broadcast against
+        each other, so that, e.g., an array of objects observed at
+        one mjd or one object observed at an array of mjd can be
+        added in one call.
+        """
+        unique_id, mjd, brightness, error = np.broadcast_arrays(np.asarray(unique_id),
+                                                                np.asarray(mjd, dtype=float),
+                                                                np.asarray(brightness, dtype=float),
+                                                                np.asarray(error, dtype=float))
+        n_new = unique_id.size
+        if n_new == 0:
+            return
+
+        if band not in self._band_index:
+            if len(self.band_names) >= np.iinfo(np.int8).max:
+                raise RuntimeError('LightCurveStore cannot hold more than %d bands'
+                                   % np.iinfo(np.int8).max)
+            self._band_index[band] = len(self.band_names)
+            self.band_names.append(band)
+
+        self._grow(n_new)
+        i_end = self._n_rows + n_new
+        self._unique_id[self._n_rows:i_end] = unique_id.ravel()
+        self._band[self._n_rows:i_end] = self._band_index[band]
+        self._mjd[self._n_rows:i_end] = mjd.ravel()
+        self._brightness[self._n_rows:i_end] = brightness.ravel()
+        self._error[self._n_rows:i_end] = error.ravel()
+        self._n_rows = i_end
+
+    def extend(self, light_curves):
+        """
+        Add all of the points in a LightCurveResult to the store
+        (e.g. to merge results generated by different processes)
+        """
+        if light_curves.brightness_name != self.brightness_name:
+            raise RuntimeError('LightCurveStore for %s cannot take light curves with %s'
+                               % (self.brightness_name, light_curves.brightness_name))
+
+        data = light_curves.data
+        for i_band, band in enumerate(light_curves.band_names):
+            rows = data[data['band'] == i_band]
+            self.append(rows['uniqueId'], band, rows['mjd'],
+                        rows[self.brightness_name], rows['error'])
+
+    def get_result(self):
+        """
+        Return a LightCurveResult containing all of the points in
+        the store, sorted on uniqueId, band, and mjd.
+        """
+        n = self._n_rows
+        # sort on mjd within band within object; observations of an
+        # object that appears in multiple spatial pointings are
+        # concatenated out of order
+        sorted_dex = np.lexsort((self._mjd[:n], self._band[:n], self._unique_id[:n]))
+
+        data = np.zeros(n, dtype=LightCurveResult.get_dtype(self.brightness_name))
+        data['uniqueId'] = self._unique_id[sorted_dex]
+        data['band'] = self._band[sorted_dex]
+        data['mjd'] = self._mjd[sorted_dex]
+        data[self.brightness_name] = self._brightness[sorted_dex]
+        data['error'] = self._error[sorted_dex]
+
+        return LightCurveResult(data, self.band_names, brightness_name=self.brightness_name)
+
+
+class LightCurveResult(Mapping):
+    """
+    A compact container of light curves.
+
+    The points are stored in the structured array self.data, with
+    columns 'uniqueId', 'band' (an index into self.band_names),
+    'mjd', the brightness column ('mag' or 'flux'), and 'error',
+    sorted on uniqueId, then band, then mjd.  self.unique_id is the
+    sorted array of the distinct uniqueIds and the points belonging to
+    self.unique_id[i] are self.data[self.offsets[i]:self.offsets[i+1]].
+
+    For backwards compatibility, this class also behaves like the
+    nested dict of light curves which the LightCurveGenerator used to
+    return, i.e.
+
+    result[111]['u']['mjd'] is a numpy array of the MJD of observations
+    of object 111 in the u band.
+
+    The dicts for each object are built when they are asked for;
+    nothing is duplicated in memory until then.
+    """
+
+    @staticmethod
+    def get_dtype(brightness_name):
+        return np.dtype([('uniqueId', np.int64), ('band', np.int8), ('mjd', float),
+                         (brightness_name, float), ('error', float)])
+
+    def __init__(self, data, band_names, brightness_name='mag'):
+        """
+        Parameters
+        ----------
+        data is a numpy structured array with the dtype returned by
+        get_dtype(brightness_name), sorted on uniqueId, band, mjd
+
+        band_names is a list of the bandpass names indexed by data['band']
+
+        brightness_name is 'mag' or 'flux'
+        """
+        self.data = data
+        self.band_names = tuple(band_names)
+        self.brightness_name = brightness_name
+
+        self.unique_id, first_dex = np.unique(data['uniqueId'], return_index=True)
+        self.offsets = np.append(first_dex, len(data)).astype(np.int64)
+
+    def __len__(self):
+        return len(self.unique_id)
+
+    def __iter__(self):
+        for unique_id in self.unique_id.tolist():
+            yield unique_id
+
+    def _object_dex(self, unique_id):
+        """
+        Return the index of unique_id in self.unique_id
+        (raise a KeyError if it is not there)
+        """
+        try:
+            dex = np.searchsorted(self.unique_id, unique_id)
+        except TypeError:
+            raise KeyError(unique_id)
+        if np.ndim(dex) != 0:
+            raise KeyError(unique_id)
+        if dex >= len(self.unique_id) or self.unique_id[dex] != unique_id:
+            raise KeyError(unique_id)
+        return dex
+
+    def __contains__(self, unique_id):
+        try:
+            self._object_dex(unique_id)
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, unique_id):
+        """
+        Return a dict, keyed on bandpass name, of dicts containing
+        the 'mjd', brightness, and 'error' arrays of the object
+        """
+        dex = self._object_dex(unique_id)
+        rows = self.data[self.offsets[dex]:self.offsets[dex+1]]
+
+        # rows are sorted on band, so each band is a contiguous slice
+        band_values, band_start = np.unique(rows['band'], return_index=True)
+        band_end = np.append(band_start[1:], len(rows))
+
+        output = {}
+        for i_band, i_start, i_end in zip(band_values, band_start, band_end):
+            band_rows = rows[i_start:i_end]
+            output[self.band_names[i_band]] = {'mjd': band_rows['mjd'],
+                                               self.brightness_name: band_rows[self.brightness_name],
+                                               'error': band_rows['error']}
+        return output
+
+    def light_curve(self, unique_id, band):
+        """
+        Return the structured array of points for one object in one band
+        """
+        dex = self._object_dex(unique_id)
+        rows = self.data[self.offsets[dex]:self.offsets[dex+1]]
+        if band not in self.band_names:
+            return rows[:0]
+        i_band = self.band_names.index(band)
+        i_start, i_end = np.searchsorted(rows['band'], [i_band, i_band+1])
+        return rows[i_start:i_end]
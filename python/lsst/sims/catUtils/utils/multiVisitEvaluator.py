@@ -0,0 +1,403 @@
+"""
+This module provides a class that evaluates the per-visit columns of an
+alert catalog (magnitudes, fluxes, SNR, astrometry, detector and pixel
+positions) for one chunk of objects and many visits at once, rather than
+instantiating and iterating over one InstanceCatalog per visit.
+"""
+import numpy as np
+import re
+
+from lsst.sims.utils import _applyProperMotion, _pupilCoordsFromRaDec
+from lsst.sims.coordUtils import chipNameFromPupilCoords
+from lsst.sims.coordUtils import pixelCoordsFromPupilCoords
+from lsst.sims.photUtils import BandpassDict, Sed, PhotometricParameters
+from lsst.sims.photUtils import calcSNR_m5, calcGamma
+from lsst.sims.catUtils.mixins import AstrometryStars
+
+__all__ = ["MultiVisitEvaluator"]
+
+
+class MultiVisitEvaluator(object):
+    """
+    Evaluate the columns of an alert catalog (see _baseAlertCatalog) for
+    one chunk of objects observed in many visits in a single vectorized
+    pass.
+
+    Columns that do not depend on the visit (uniqueId, the quiescent
+    magnitudes, proper motions, etc.) are computed once per chunk by the
+    catalog passed to the constructor.  Columns that do depend on the
+    visit are computed for every requested (object, visit) pair at once.
+    The per-visit columns are
+
+    quiescent_mag -- the quiescent magnitude in the band of the visit
+
+    dmag -- the delta magnitude in the band of the visit
+
+    mag -- quiescent_mag + dmag
+
+    quiescent_flux, flux, dflux -- the quiescent flux, the flux and the
+    difference between the two (in Janskys)
+
+    SNR -- the signal to noise ratio of the source at the visit's m5
+
+    raICRS, decICRS -- the ICRS position (with proper motion applied
+    at the visit's epoch if the catalog is an AstrometryStars catalog)
+
+    x_pupil, y_pupil -- pupil coordinates
+
+    chipName, chipNum -- the detector the source lands on; chipNum
+    is the concatenation of the digits in chipName (0 if None)
+
+    xPix, yPix -- pixel coordinates on that detector
+
+    All of these are computed exactly as the getters of _baseAlertCatalog
+    would compute them for a catalog whose obs_metadata was the visit.
+    """
+
+    per_visit_columns = ('quiescent_mag', 'dmag', 'mag',
+                         'quiescent_flux', 'flux', 'dflux', 'SNR',
+                         'raICRS', 'decICRS',
+                         'x_pupil', 'y_pupil',
+                         'chipName', 'chipNum', 'xPix', 'yPix')
+
+    _band_names = ('u', 'g', 'r', 'i', 'z', 'y')
+
+    def __init__(self, catalog, obs_list, bandpass_dict=None, phot_params=None,
+                 camera=None, variability_cache=None, snr_lookup=None):
+        """
+        Parameters
+        ----------
+        catalog is an instantiated alert catalog (e.g. an
+        AlertStellarVariabilityCatalog) that will be used to calculate
+        the columns which do not depend on the visit and the delta magnitudes
+
+        obs_list is a list of ObservationMetaData, one per visit.  Visits are
+        referred to by their index in this list.
+
+        bandpass_dict is a BandpassDict of the LSST bandpasses (optional;
+        defaults to catalog.lsstBandpassDict if it exists, otherwise to
+        the LSST total bandpasses)
+
+        phot_params is an instantiation of PhotometricParameters
+        (optional; defaults to PhotometricParameters())
+
+        camera is the afwCameraGeom camera used for detector and pixel
+        coordinates (optional; defaults to catalog.camera)
+
+        variability_cache is the cache passed along to
+        catalog.applyVariability (optional)
+
+        snr_lookup is an SNRLookup (optional).  If it was built from the
+        same bandpasses and PhotometricParameters as bandpass_dict and
+        phot_params (see SNRLookup.matches), the gamma of each visit is
+        interpolated from its tables rather than calculated with calcGamma.
+        """
+        self._catalog = catalog
+        self._obs_list = list(obs_list)
+
+        if bandpass_dict is None:
+            if hasattr(catalog, 'lsstBandpassDict'):
+                bandpass_dict = catalog.lsstBandpassDict
+            else:
+                bandpass_dict = BandpassDict.loadTotalBandpassesFromFiles()
+        self._bandpass_dict = bandpass_dict
+
+        if phot_params is None:
+            phot_params = PhotometricParameters()
+        self._phot_params = phot_params
+
+        if camera is None:
+            camera = catalog.camera
+        self._camera = camera
+
+        self._variability_cache = variability_cache
+        if snr_lookup is not None and not snr_lookup.matches(bandpass_dict, phot_params):
+            snr_lookup = None
+        self._snr_lookup = snr_lookup
+
+        band_to_int = dict([(name, i_band) for i_band, name in enumerate(self._band_names)])
+        for obs in self._obs_list:
+            if obs.bandpass not in band_to_int:
+                raise RuntimeError('MultiVisitEvaluator cannot handle bandpass %s' % str(obs.bandpass))
+
+        self.mjd = np.array([obs.mjd.TAI for obs in self._obs_list])
+        self.band = np.array([band_to_int[obs.bandpass] for obs in self._obs_list], dtype=int)
+        self.m5 = np.array([obs.m5[obs.bandpass] for obs in self._obs_list])
+
+        self._gamma = None
+        self._dummy_sed = Sed()
+        self._chunk = None
+        self._static_cache = {}
+
+    @property
+    def gamma(self):
+        """
+        The photometric gamma (see calcGamma) of each visit
+        """
+        if self._gamma is None and self._snr_lookup is not None:
+            self._gamma = np.zeros(len(self._obs_list), dtype=float)
+            for i_band in np.unique(self.band):
+                visits = np.where(self.band == i_band)
+                self._gamma[visits] = self._snr_lookup.calcGamma(self._band_names[i_band],
+                                                                 self.m5[visits])
+        elif self._gamma is None:
+            gamma_cache = {}
+            self._gamma = np.zeros(len(self._obs_list), dtype=float)
+            for i_obs in range(len(self._obs_list)):
+                key = (self.band[i_obs], self.m5[i_obs])
+                if key not in gamma_cache:
+                    bp = self._bandpass_dict[self._band_names[self.band[i_obs]]]
+                    gamma_cache[key] = calcGamma(bp, self.m5[i_obs], photParams=self._phot_params)
+                self._gamma[i_obs] = gamma_cache[key]
+        return self._gamma
+
+    def _set_chunk(self, chunk):
+        """
+        Make chunk the set of objects being evaluated
+        """
+        if chunk is not self._chunk:
+            self._catalog._set_current_chunk(chunk)
+            self._chunk = chunk
+            self._static_cache = {}
+
+    def static_column(self, chunk, col_name):
+        """
+        Return the column col_name (which must not depend on the visit)
+        for all of the objects in chunk
+        """
+        self._set_chunk(chunk)
+        if col_name not in self._static_cache:
+            self._static_cache[col_name] = self._catalog.column_by_name(col_name)
+        return self._static_cache[col_name]
+
+    def _quiescent_mags(self, chunk):
+        """
+        Return a (6, n_obj) array of the quiescent magnitudes of chunk
+        """
+        return np.array([self.static_column(chunk, 'quiescent_lsst_%s' % name)
+                         for name in self._band_names])
+
+    def delta_magnitudes(self, chunk):
+        """
+        Return the delta magnitudes of all of the objects in chunk
+        at every visit as an array of shape (n_visits, 6, n_obj)
+        """
+        self._set_chunk(chunk)
+        return self._catalog.applyVariability(chunk['varParamStr'],
+                                              variability_cache=self._variability_cache,
+                                              expmjd=self.mjd).transpose((2, 0, 1))
+
+    def _proper_motion(self, chunk):
+        """
+        Return the proper motion, parallax and radial velocity columns of
+        chunk (or Nones if the catalog does not model stellar motion)
+        """
+        if not isinstance(self._catalog, AstrometryStars):
+            return None, None, None, None
+        return (self.static_column(chunk, 'properMotionRa'),
+                self.static_column(chunk, 'properMotionDec'),
+                self.static_column(chunk, 'parallax'),
+                self.static_column(chunk, 'radialVelocity'))
+
+    def _pupil_coords(self, chunk, obj_dex, visit_dex):
+        """
+        Calculate the pupil coordinates of each (object, visit) pair
+        """
+        ra = self.static_column(chunk, 'raJ2000')
+        dec = self.static_column(chunk, 'decJ2000')
+        pmra, pmdec, px, vrad = self._proper_motion(chunk)
+
+        x_pupil = np.zeros(len(obj_dex), dtype=float)
+        y_pupil = np.zeros(len(obj_dex), dtype=float)
+        for i_obs in np.unique(visit_dex):
+            pairs = np.where(visit_dex == i_obs)
+            obj = obj_dex[pairs]
+            if pmra is not None:
+                xx, yy = _pupilCoordsFromRaDec(ra[obj], dec[obj],
+                                               pm_ra=pmra[obj], pm_dec=pmdec[obj],
+                                               parallax=px[obj], v_rad=vrad[obj],
+                                               obs_metadata=self._obs_list[i_obs])
+            else:
+                xx, yy = _pupilCoordsFromRaDec(ra[obj], dec[obj],
+                                               obs_metadata=self._obs_list[i_obs])
+            x_pupil[pairs] = xx
+            y_pupil[pairs] = yy
+        return x_pupil, y_pupil
+
+    def _icrs_coords(self, chunk, obj_dex, visit_dex):
+        """
+        Calculate raICRS, decICRS of each (object, visit) pair
+        """
+        pmra, pmdec, px, vrad = self._proper_motion(chunk)
+        if pmra is None:
+            return (self.static_column(chunk, 'raICRS')[obj_dex],
+                    self.static_column(chunk, 'decICRS')[obj_dex])
+
+        ra = self.static_column(chunk, 'raJ2000')
+        dec = self.static_column(chunk, 'decJ2000')
+        ra_icrs = np.zeros(len(obj_dex), dtype=float)
+        dec_icrs = np.zeros(len(obj_dex), dtype=float)
+        for i_obs in np.unique(visit_dex):
+            pairs = np.where(visit_dex == i_obs)
+            obj = obj_dex[pairs]
+            rr, dd = _applyProperMotion(ra[obj], dec[obj], pmra[obj], pmdec[obj],
+                                        px[obj], vrad[obj], mjd=self._obs_list[i_obs].mjd)
+            ra_icrs[pairs] = rr
+            dec_icrs[pairs] = dd
+        return ra_icrs, dec_icrs
+
+    @staticmethod
+    def chip_num_from_name(chip_name):
+        """
+        Convert an array of chip names 'R:i,j S:m,n' into an array of
+        ints ijmn (0 for objects that did not land on a chip)
+        """
+        chip_name = np.asarray(chip_name)
+        chip_num = np.zeros(len(chip_name), dtype=int)
+        has_chip = np.array([name is not None for name in chip_name], dtype=bool)
+        if has_chip.any():
+            unique_names, inverse = np.unique(chip_name[has_chip].astype(str), return_inverse=True)
+            unique_num = np.array([int(''.join(re.findall(r'\d+', name)))
+                                   for name in unique_names])
+            chip_num[has_chip] = unique_num[inverse]
+        return chip_num
+
+    def evaluate_pairs(self, chunk, obj_dex, visit_dex, column_names,
+                       dmag_arr=None, chip_name=None, x_pupil=None, y_pupil=None):
+        """
+        Evaluate columns for a set of (object, visit) pairs.
+
+        Parameters
+        ----------
+        chunk is a numpy recarray of database rows (e.g. one chunk yielded
+        by a ChunkIterator)
+
+        obj_dex is an array of indexes in chunk
+
+        visit_dex is an array of indexes in the obs_list passed to the
+        constructor.  (obj_dex[i], visit_dex[i]) is the i_th pair.
+
+        column_names is a list of the columns to evaluate.  These can be
+        any of self.per_visit_columns or any column of the catalog that
+        does not depend on the visit.
+
+        dmag_arr is the output of self.delta_magnitudes(chunk) (optional;
+        if it has already been calculated, passing it in saves calculating
+        it again)
+
+        chip_name, x_pupil, y_pupil are arrays of the detector name and
+        pupil coordinates of each pair (optional; if already known,
+        passing them in saves calculating them again)
+
+        Returns
+        -------
+        A dict keyed on column_names whose values are arrays with one entry
+        per pair
+        """
+        self._set_chunk(chunk)
+        obj_dex = np.asarray(obj_dex, dtype=int)
+        visit_dex = np.asarray(visit_dex, dtype=int)
+        if len(obj_dex) != len(visit_dex):
+            raise RuntimeError('MultiVisitEvaluator.evaluate_pairs: obj_dex has %d entries; '
+                               'visit_dex has %d' % (len(obj_dex), len(visit_dex)))
+
+        band = self.band[visit_dex]
+        values = {}
+
+        def get(col_name):
+            if col_name in values:
+                return values[col_name]
+
+            if col_name == 'quiescent_mag':
+                values[col_name] = self._quiescent_mags(chunk)[band, obj_dex]
+            elif col_name == 'dmag':
+                if dmag_arr is None:
+                    dmag = self.delta_magnitudes(chunk)
+                else:
+                    dmag = dmag_arr
+                values[col_name] = dmag[visit_dex, band, obj_dex]
+            elif col_name == 'mag':
+                values[col_name] = get('quiescent_mag') + get('dmag')
+            elif col_name == 'quiescent_flux':
+                values[col_name] = self._dummy_sed.fluxFromMag(get('quiescent_mag'))
+            elif col_name == 'flux':
+                values[col_name] = self._dummy_sed.fluxFromMag(get('mag'))
+            elif col_name == 'dflux':
+                values[col_name] = get('flux') - get('quiescent_flux')
+            elif col_name == 'SNR':
+                mag = get('mag')
+                gamma = self.gamma[visit_dex]
+                m5 = self.m5[visit_dex]
+                snr = np.zeros(len(obj_dex), dtype=float)
+                for i_band in np.unique(band):
+                    pairs = np.where(band == i_band)
+                    snr[pairs], _ = calcSNR_m5(mag[pairs],
+                                               self._bandpass_dict[self._band_names[i_band]],
+                                               m5[pairs], self._phot_params,
+                                               gamma=gamma[pairs])
+                values[col_name] = snr
+            elif col_name in ('raICRS', 'decICRS'):
+                values['raICRS'], values['decICRS'] = self._icrs_coords(chunk, obj_dex, visit_dex)
+            elif col_name in ('x_pupil', 'y_pupil'):
+                if x_pupil is not None and y_pupil is not None:
+                    values['x_pupil'] = np.asarray(x_pupil)
+                    values['y_pupil'] = np.asarray(y_pupil)
+                else:
+                    values['x_pupil'], values['y_pupil'] = self._pupil_coords(chunk, obj_dex, visit_dex)
+            elif col_name == 'chipName':
+                if chip_name is not None:
+                    values[col_name] = np.asarray(chip_name)
+                else:
+                    values[col_name] = chipNameFromPupilCoords(get('x_pupil'), get('y_pupil'),
+                                                               camera=self._camera)
+            elif col_name == 'chipNum':
+                values[col_name] = self.chip_num_from_name(get('chipName'))
+            elif col_name in ('xPix', 'yPix'):
+                if len(obj_dex) == 0:
+                    values['xPix'] = np.zeros(0, dtype=float)
+                    values['yPix'] = np.zeros(0, dtype=float)
+                else:
+                    values['xPix'], values['yPix'] = \
+                        pixelCoordsFromPupilCoords(get('x_pupil'), get('y_pupil'),
+                                                   chipName=get('chipName'),
+                                                   includeDistortion=True,
+                                                   camera=self._camera)
+            else:
+                values[col_name] = self.static_column(chunk, col_name)[obj_dex]
+
+            return values[col_name]
+
+        return dict([(col_name, get(col_name)) for col_name in column_names])
+
+    def evaluate(self, chunk, column_names, dmag_arr=None):
+        """
+        Evaluate columns for every object in chunk at every visit.
+
+        Parameters
+        ----------
+        chunk is a numpy recarray of database rows
+
+        column_names is a list of the columns to evaluate (see evaluate_pairs)
+
+        dmag_arr is the output of self.delta_magnitudes(chunk) (optional)
+
+        Returns
+        -------
+        A dict keyed on column_names.  Columns in self.per_visit_columns
+        are arrays of shape (n_obj, n_visits); all other columns are arrays
+        of shape (n_obj,).
+        """
+        n_obj = len(chunk)
+        n_visits = len(self._obs_list)
+        obj_dex, visit_dex = np.meshgrid(np.arange(n_obj), np.arange(n_visits), indexing='ij')
+
+        per_visit = [col_name for col_name in column_names if col_name in self.per_visit_columns]
+        output = self.evaluate_pairs(chunk, obj_dex.flatten(), visit_dex.flatten(),
+                                     per_visit, dmag_arr=dmag_arr)
+        for col_name in per_visit:
+            output[col_name] = output[col_name].reshape((n_obj, n_visits))
+
+        for col_name in column_names:
+            if col_name not in self.per_visit_columns:
+                output[col_name] = self.static_column(chunk, col_name)
+        return output
@@ -0,0 +1,276 @@
+"""
+This module provides a local, memory-mapped copy of the pointings in an
+OpSim database, so that the ObservationMetaDataGenerator can answer
+repeated queries without going back to the (multi-GB) sqlite file.
+"""
+import numpy as np
+import os
+import json
+import hashlib
+from lsst.sims.utils import findHtmid, halfSpaceFromRaDec, angularSeparation
+
+__all__ = ["OpSimPointingCache"]
+
+
+class OpSimPointingCache(object):
+    """
+    A columnar copy of the summary table of an OpSim database.
+
+    The pointings are stored, sorted by MJD, as a numpy structured array
+    in a .npy file that is memory-mapped when read, so many processes
+    reading the same cache share one copy of it in memory.  Next to it
+    are stored the htmid (at level htmid_level) of every pointing center,
+    sorted, and the order that sorts them, which serve as a spatial index.
+    A small JSON file records the size and modification time of the
+    OpSim database the cache was built from; the cache is rebuilt if
+    either changes.
+
+    The ObservationMetaDataGenerator builds and uses this class when it
+    is given a cache_dir.
+    """
+
+    # bump this when the layout of the cache files changes
+    _format_version = 1
+
+    def __init__(self, cache_dir, database, table_name, ra_name, dec_name,
+                 mjd_name, in_degrees, htmid_level=7):
+        """
+        Parameters
+        ----------
+        cache_dir is the directory in which the cache files are kept
+
+        database is the path to the OpSim database being cached
+
+        table_name is the name of the summary table being cached
+
+        ra_name, dec_name, and mjd_name are the names of the columns
+        containing the RA, Dec, and MJD of the pointings
+
+        in_degrees is a boolean indicating whether the RA and Dec columns
+        are in degrees (True) or radians (False)
+
+        htmid_level is the level of the HTM mesh used to index the
+        pointing centers (default 7, i.e. trixels about 0.6 degrees
+        on a side)
+        """
+        self.cache_dir = cache_dir
+        self.database = os.path.abspath(database)
+        self.table_name = table_name
+        self.htmid_level = htmid_level
+        self._ra_name = ra_name
+        self._dec_name = dec_name
+        self._mjd_name = mjd_name
+        self._in_degrees = in_degrees
+
+        self._records = None
+        self._htmid = None
+        self._htm_order = None
+
+        tag = hashlib.sha1(('%s:%s' % (self.database, table_name)).encode('utf-8')).hexdigest()[:16]
+        root = os.path.join(cache_dir, 'opsim_%s' % tag)
+        self._records_name = root + '_records.npy'
+        self._htmid_name = root + '_htmid.npy'
+        self._order_name = root + '_htm_order.npy'
+        self._meta_name = root + '_meta.json'
+
+    def _source_meta(self, dtype):
+        """
+        Return the dict of metadata identifying the database (and the
+        dtype of the records) that the cache must match
+        """
+        stat = os.stat(self.database)
+        return {'format_version': self._format_version,
+                'database': self.database,
+                'table_name': self.table_name,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'htmid_level': self.htmid_level,
+                'dtype': str(np.dtype(dtype).descr)}
+
+    def is_valid(self, dtype):
+        """
+        Return True if the cache files exist and were built from the
+        current version of the database with records of this dtype.
+        """
+        for name in (self._records_name, self._htmid_name, self._order_name, self._meta_name):
+            if not os.path.exists(name):
+                return False
+        try:
+            with open(self._meta_name, 'r') as in_file:
+                meta = json.load(in_file)
+        except ValueError:
+            return False
+        return meta == self._source_meta(dtype)
+
+    def _center_htmid(self, ra, dec):
+        """
+        Return the htmid of the points (ra, dec) (in the units of the
+        OpSim database) at self.htmid_level
+        """
+        if not self._in_degrees:
+            ra = np.degrees(ra)
+            dec = np.degrees(dec)
+
+        # many pointings share the same field center
+        centers, center_inv = np.unique(np.array([ra, dec]).transpose(), axis=0,
+                                        return_inverse=True)
+        center_htmid = np.array([findHtmid(cc[0], cc[1], self.htmid_level) for cc in centers],
+                                dtype=np.int64)
+        return center_htmid[center_inv.flatten()]
+
+    def build(self, records, dtype=None):
+        """
+        Write the cache files.
+
+        Parameters
+        ----------
+        records is a numpy structured array containing every pointing
+        in the database (one per MJD), as returned by
+        ObservationMetaDataGenerator.getOpSimRecords()
+
+        dtype is the dtype that will be passed to is_valid() to check
+        the cache (defaults to records.dtype)
+        """
+        if dtype is None:
+            dtype = records.dtype
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        records = np.asarray(records)
+        records = records[np.argsort(records[self._mjd_name], kind='mergesort')]
+        if len(records) > 0:
+            htmid = self._center_htmid(records[self._ra_name], records[self._dec_name])
+        else:
+            htmid = np.zeros(0, dtype=np.int64)
+        htm_order = np.argsort(htmid, kind='mergesort')
+
+        # write to temporary files and move them into place, so that
+        # another process never reads a partially written cache; the
+        # metadata goes last because it marks the cache as valid
+        for name, data in ((self._records_name, records),
+                           (self._htmid_name, htmid[htm_order]),
+                           (self._order_name, htm_order)):
+            tmp_name = '%s.%d.tmp.npy' % (name, os.getpid())
+            np.save(tmp_name, data)
+            os.rename(tmp_name, name)
+
+        tmp_name = '%s.%d.tmp' % (self._meta_name, os.getpid())
+        with open(tmp_name, 'w') as out_file:
+            json.dump(self._source_meta(dtype), out_file)
+        os.rename(tmp_name, self._meta_name)
+
+        self._records = None
+
+    def _load(self):
+        if self._records is None:
+            self._records = np.load(self._records_name, mmap_mode='r')
+            self._htmid = np.load(self._htmid_name, mmap_mode='r')
+            self._htm_order = np.load(self._order_name, mmap_mode='r')
+
+    def __len__(self):
+        self._load()
+        return len(self._records)
+
+    def _spatial_candidates(self, ra_range, dec_range):
+        """
+        Return the sorted indexes of the pointings whose centers could
+        be inside the box defined by ra_range and dec_range (in the
+        units of the OpSim database), found with the HTM index (or None
+        if the box is too large for the index to help).
+        """
+        if not self._in_degrees:
+            ra_range = np.degrees(ra_range)
+            dec_range = np.degrees(dec_range)
+
+        # a circle circumscribing the box; as long as the box spans no
+        # more than 180 degrees in RA, the point on its edge farthest
+        # from its center is one of its corners
+        if ra_range[1] - ra_range[0] > 180.0:
+            return None
+
+        ra_center = 0.5*(ra_range[0]+ra_range[1])
+        dec_center = 0.5*(dec_range[0]+dec_range[1])
+        corner_ra = np.array([ra_range[0], ra_range[0], ra_range[1], ra_range[1]])
+        corner_dec = np.array([dec_range[0], dec_range[1], dec_range[0], dec_range[1]])
+        radius = angularSeparation(ra_center, dec_center, corner_ra, corner_dec).max()
+        radius = min(radius + 1.0/3600.0, 180.0)
+
+        hs = halfSpaceFromRaDec(ra_center, dec_center, radius)
+        candidates = []
+        for htmid_min, htmid_max in hs.findAllTrixels(self.htmid_level):
+            i_start, i_end = np.searchsorted(self._htmid, [htmid_min, htmid_max+1])
+            candidates.append(self._htm_order[i_start:i_end])
+        if len(candidates) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate(candidates))
+
+    def get_records(self, constraints, limit=None):
+        """
+        Return the pointings that satisfy a list of constraints.
+
+        Parameters
+        ----------
+        constraints is a list of tuples.  Each tuple is one of
+
+            ('range', column_name, min, max) -- min <= value <= max
+
+            ('approx', column_name, value, tol) -- |value - column| < tol
+
+            ('equal', column_name, value) -- column == value
+
+        with values in the units of the OpSim database
+
+        limit is the maximum number of pointings to return (optional)
+
+        Returns
+        -------
+        A numpy recarray of the pointings, sorted by MJD (the same
+        records the equivalent SQL query would return)
+        """
+        self._load()
+        records = self._records
+
+        # the records are sorted by MJD, so a range of MJD is a slice
+        i_start = 0
+        i_end = len(records)
+        ra_range = None
+        dec_range = None
+        for cc in constraints:
+            if cc[0] != 'range':
+                continue
+            if cc[1] == self._mjd_name:
+                mjd = records[self._mjd_name]
+                i_start = max(i_start, np.searchsorted(mjd, cc[2], side='left'))
+                i_end = min(i_end, np.searchsorted(mjd, cc[3], side='right'))
+            elif cc[1] == self._ra_name:
+                ra_range = (cc[2], cc[3])
+            elif cc[1] == self._dec_name:
+                dec_range = (cc[2], cc[3])
+
+        dex = None
+        if ra_range is not None and dec_range is not None:
+            dex = self._spatial_candidates(ra_range, dec_range)
+        if dex is not None:
+            dex = dex[np.where(np.logical_and(dex >= i_start, dex < i_end))]
+        else:
+            dex = np.arange(i_start, max(i_start, i_end))
+
+        for cc in constraints:
+            if len(dex) == 0:
+                break
+            column = records[cc[1]][dex]
+            if cc[0] == 'range':
+                valid = np.logical_and(column >= cc[2], column <= cc[3])
+            elif cc[0] == 'approx':
+                valid = np.logical_and(column < cc[2]+cc[3], column > cc[2]-cc[3])
+            elif cc[0] == 'equal':
+                valid = (column == cc[2])
+            else:
+                raise RuntimeError('OpSimPointingCache does not know constraint %s' % cc[0])
+            dex = dex[valid]
+
+        if limit is not None:
+            dex = dex[:limit]
+
+        return np.asarray(records[dex]).view(np.recarray)
@@ -0,0 +1,413 @@
+"""
+This module provides a small, local summary of the variable sources in
+each trixel of the Hierarchical Triangular Mesh, so that the
+AlertDataGenerator can skip (or deprioritize) trixels that cannot
+produce alerts before it ever queries the database.
+"""
+import numpy as np
+import os
+import json
+import sqlite3
+from collections import OrderedDict
+
+from lsst.sims.utils import getAllTrixels, levelFromHtmid
+from lsst.sims.catUtils.utils import AlertDataGenerator
+
+__all__ = ["TrixelVariabilityIndex"]
+
+
+class TrixelVariabilityIndex(object):
+    """
+    A per-trixel summary of the variable sources in a CatalogDBObject.
+
+    For each trixel (at a fixed HTM level) and each variability model
+    (the "m" entry of varParamStr), the index records
+
+    n_obj -- the number of variable sources
+
+    max_dmag -- an upper bound on the amount (in magnitudes) by which
+    any of those sources can brighten (np.inf if no bound is known)
+
+    max_abs_dmag -- an upper bound on the amount (in magnitudes) by which
+    any of those sources can brighten or fade (np.inf if no bound is
+    known).  Alerts are triggered by |delta magnitude|, so this is the
+    bound compared with dmag_cutoff.
+
+    bright_mag -- for each of the six LSST bands, the minimum over the
+    sources of (quiescent magnitude - brightening bound), i.e. the
+    brightest magnitude any of them could reach
+
+    Build the index offline with build() and save it with write();
+    load it with read().  AlertDataGenerator.apply_variability_index
+    uses it to prune and reorder its htmid_list.
+    """
+
+    _dtype = np.dtype([('htmid', np.int64), ('model', 'U40'), ('n_obj', np.int64),
+                       ('max_dmag', float), ('max_abs_dmag', float),
+                       ('bright_mag', float, (6,))])
+
+    _mag_names = ('u', 'g', 'r', 'i', 'z', 'y')
+
+    def __init__(self, htmid_level, data):
+        """
+        Parameters
+        ----------
+        htmid_level is the level of the HTM mesh that was summarized
+
+        data is a numpy array with dtype TrixelVariabilityIndex._dtype
+        containing one row per (htmid, model)
+        """
+        self._htmid_level = htmid_level
+        self._data = data[np.argsort(data['htmid'], kind='mergesort')]
+
+    @property
+    def htmid_level(self):
+        """
+        The level of the HTM mesh that was summarized
+        """
+        return self._htmid_level
+
+    @property
+    def data(self):
+        """
+        A numpy array with one row per (htmid, model)
+        """
+        return self._data
+
+    @staticmethod
+    def _model_bound(model, bound):
+        """
+        Return the bound (a float or a dict mapping model names to
+        floats, or None) that applies to model; np.inf if there is none
+        """
+        if isinstance(bound, dict):
+            return bound.get(model, np.inf)
+        elif bound is not None:
+            return bound
+        return np.inf
+
+    @classmethod
+    def _parse_var_params(cls, var_param_str, max_brightening, max_fading,
+                          kplr_dmag_lookup):
+        """
+        Find the variability model and the brightening and fading
+        bounds of a source
+
+        Parameters
+        ----------
+        var_param_str is the source's varParamStr
+
+        max_brightening and max_fading are floats or dicts mapping model
+        names to floats (or None); see build()
+
+        kplr_dmag_lookup is a dict mapping the integer light curve
+        identifiers of the 'kplr' model to their maximum delta magnitude
+        (or None)
+
+        Returns
+        -------
+        The model name (None if var_param_str does not describe a
+        variable source), the brightening bound and the fading bound
+        """
+        if var_param_str is None or var_param_str == 'None':
+            return None, 0.0, 0.0
+        try:
+            params = json.loads(var_param_str)
+            model = str(params['m'])
+        except (ValueError, KeyError, TypeError):
+            return 'unknown', np.inf, np.inf
+
+        if model == 'kplr' and kplr_dmag_lookup is not None:
+            try:
+                # the lookup bounds |delta magnitude|
+                dmag = kplr_dmag_lookup[int(params['p']['lc'])]
+                return model, dmag, dmag
+            except (KeyError, TypeError, ValueError):
+                pass
+
+        return (model, cls._model_bound(model, max_brightening),
+                cls._model_bound(model, max_fading))
+
+    @classmethod
+    def _summarize(cls, htmid_arr, var_param_arr, mag_arr,
+                   max_brightening, max_fading, kplr_dmag_lookup, summary):
+        """
+        Add a chunk of sources to a summary
+
+        Parameters
+        ----------
+        htmid_arr is a numpy array of the htmid (at the index's level)
+        of each source
+
+        var_param_arr is a numpy array of the varParamStr of each source
+
+        mag_arr is a numpy array of shape (6, n_sources) containing the
+        quiescent magnitudes of the sources
+
+        max_brightening, max_fading, kplr_dmag_lookup -- see build()
+
+        summary is a dict keyed on (htmid, model) whose values are lists
+        [n_obj, max_dmag, max_abs_dmag, bright_mag]; it is updated in place
+        """
+        parsed = [cls._parse_var_params(var_params, max_brightening, max_fading,
+                                        kplr_dmag_lookup)
+                  for var_params in var_param_arr]
+        model_arr = np.array([pp[0] if pp[0] is not None else '' for pp in parsed])
+        dmag_arr = np.array([pp[1] for pp in parsed], dtype=float)
+        fade_arr = np.array([pp[2] for pp in parsed], dtype=float)
+        is_var = np.where(model_arr != '')
+        if len(is_var[0]) == 0:
+            return
+
+        htmid_arr = np.asarray(htmid_arr)[is_var]
+        model_arr = model_arr[is_var]
+        dmag_arr = dmag_arr[is_var]
+        abs_dmag_arr = np.maximum(dmag_arr, fade_arr[is_var])
+        bright_arr = mag_arr[:, is_var[0]] - dmag_arr
+        for htmid in np.unique(htmid_arr).tolist():
+            htmid_dex = np.where(htmid_arr == htmid)[0]
+            for model in np.unique(model_arr[htmid_dex]).tolist():
+                dex = htmid_dex[np.where(model_arr[htmid_dex] == model)]
+                key = (htmid, model)
+                if key not in summary:
+                    summary[key] = [0, -np.inf, -np.inf, np.inf*np.ones(6)]
+                entry = summary[key]
+                entry[0] += len(dex)
+                entry[1] = max(entry[1], dmag_arr[dex].max())
+                entry[2] = max(entry[2], abs_dmag_arr[dex].max())
+                entry[3] = np.fmin(entry[3], np.nanmin(bright_arr[:, dex], axis=1))
+
+    @classmethod
+    def build(cls, dbobj, htmid_level, htmid_list=None, max_brightening=None,
+              max_fading=None, kplr_dmag_lookup=None, chunk_size=100000):
+        """
+        Summarize the variable sources in a CatalogDBObject
+
+        Parameters
+        ----------
+        dbobj is a CatalogDBObject with a query_columns_htmid method
+        (e.g. StellarAlertDBObj)
+
+        htmid_level is the level of the HTM mesh to summarize
+
+        htmid_list is an optional list of the htmids (at htmid_level)
+        to summarize.  If None, the whole sky is summarized.
+
+        max_brightening is a float or a dict mapping variability model
+        names to floats, bounding how far (in magnitudes) sources
+        following each model can brighten.  Sources with no bound get
+        max_dmag = np.inf, which means they are never pruned.
+
+        max_fading is a float or a dict mapping variability model names
+        to floats, bounding how far (in magnitudes) sources following
+        each model can fade.  Sources can trigger alerts by fading, so
+        sources with no bound get max_abs_dmag = np.inf and are never
+        pruned for varying too little.
+
+        kplr_dmag_lookup is an optional dict mapping the integer light
+        curve identifiers of the 'kplr' model to their maximum |delta
+        magnitude| (e.g. read from kplr_dmag_171204.txt in
+        sims_data/catUtilsData).  It takes precedence over
+        max_brightening and max_fading for kplr sources.
+
+        chunk_size is the number of rows to query at once
+
+        Returns
+        -------
+        A TrixelVariabilityIndex
+        """
+        if htmid_list is None:
+            htmid_list = [htmid for htmid in getAllTrixels(htmid_level)
+                          if levelFromHtmid(htmid) == htmid_level]
+
+        if 'umag' in dbobj.columnMap:
+            mag_cols = ['umag', 'gmag', 'rmag', 'imag', 'zmag', 'ymag']
+        elif 'u_ab' in dbobj.columnMap:
+            mag_cols = ['u_ab', 'g_ab', 'r_ab', 'i_ab', 'z_ab', 'y_ab']
+        else:
+            raise RuntimeError('Not sure what quiescent '
+                               'LSST magnitudes are called '
+                               'in this CatalogDBObject')
+
+        if 'variabilityParameters' in dbobj.columnMap:
+            var_param_name = 'variabilityParameters'
+        else:
+            var_param_name = 'varParamStr'
+        var_param_col = dbobj.columnMap[var_param_name]
+        constraint = "%s IS NOT NULL AND %s != 'None'" % (var_param_col, var_param_col)
+
+        n_bits_off = 2*(21-htmid_level)
+        summary = OrderedDict()
+        for htmid in htmid_list:
+            data_iter = dbobj.query_columns_htmid(colnames=['htmid', var_param_name] + mag_cols,
+                                                  htmid=htmid, chunk_size=chunk_size,
+                                                  constraint=constraint)
+            for chunk in data_iter:
+                chunk = chunk[np.where((chunk['htmid'] >> n_bits_off) == htmid)]
+                if len(chunk) == 0:
+                    continue
+                mag_arr = np.array([chunk[col] for col in mag_cols], dtype=float)
+                cls._summarize(np.ones(len(chunk), dtype=np.int64)*htmid,
+                               chunk[var_param_name], mag_arr,
+                               max_brightening, max_fading, kplr_dmag_lookup, summary)
+
+        data = np.zeros(len(summary), dtype=cls._dtype)
+        for i_row, key in enumerate(summary):
+            data['htmid'][i_row] = key[0]
+            data['model'][i_row] = key[1]
+            data['n_obj'][i_row] = summary[key][0]
+            data['max_dmag'][i_row] = summary[key][1]
+            data['max_abs_dmag'][i_row] = summary[key][2]
+            data['bright_mag'][i_row] = summary[key][3]
+
+        return cls(htmid_level, data)
+
+    def write(self, file_name):
+        """
+        Write the index to a sqlite file
+
+        Parameters
+        ----------
+        file_name is the name of the file to create
+        """
+        if os.path.exists(file_name):
+            raise RuntimeError('%s already exists' % file_name)
+
+        mag_cols = ['%s_bright' % name for name in self._mag_names]
+        with sqlite3.connect(file_name) as conn:
+            cursor = conn.cursor()
+            cursor.execute('CREATE TABLE metadata (htmid_level int)')
+            cursor.execute('INSERT INTO metadata VALUES (?)', (int(self._htmid_level),))
+            cursor.execute('CREATE TABLE trixel_variability '
+                           '(htmid int, model text, n_obj int, max_dmag real, '
+                           'max_abs_dmag real, %s)' %
+                           ', '.join(['%s real' % col for col in mag_cols]))
+            # sqlite cannot store inf; use NULL instead
+            rows = [(int(row['htmid']), str(row['model']), int(row['n_obj'])) +
+                    tuple(float(val) if np.isfinite(val) else None
+                          for val in (row['max_dmag'], row['max_abs_dmag'])) +
+                    tuple(float(mag) if np.isfinite(mag) else None for mag in row['bright_mag'])
+                    for row in self._data]
+            cursor.executemany('INSERT INTO trixel_variability VALUES (%s)' %
+                               ','.join(['?']*(5+len(mag_cols))), rows)
+            cursor.execute('CREATE INDEX htmid_model ON trixel_variability (htmid, model)')
+            conn.commit()
+
+    @classmethod
+    def read(cls, file_name):
+        """
+        Read an index written by write()
+
+        Parameters
+        ----------
+        file_name is the name of the sqlite file
+
+        Returns
+        -------
+        A TrixelVariabilityIndex
+        """
+        if not os.path.exists(file_name):
+            raise RuntimeError('%s does not exist' % file_name)
+
+        mag_cols = ['%s_bright' % name for name in cls._mag_names]
+        with sqlite3.connect(file_name) as conn:
+            htmid_level = conn.execute('SELECT htmid_level FROM metadata').fetchone()[0]
+            col_names = [col[1] for col in
+                         conn.execute('PRAGMA table_info(trixel_variability)').fetchall()]
+            # indexes written before fading was bounded have no
+            # max_abs_dmag; they cannot be used to prune anything
+            abs_dmag_col = 'max_abs_dmag' if 'max_abs_dmag' in col_names else 'NULL'
+            rows = conn.execute('SELECT htmid, model, n_obj, max_dmag, %s, %s '
+                                'FROM trixel_variability' %
+                                (abs_dmag_col, ', '.join(mag_cols))).fetchall()
+
+        data = np.zeros(len(rows), dtype=cls._dtype)
+        for i_row, row in enumerate(rows):
+            data['htmid'][i_row] = row[0]
+            data['model'][i_row] = row[1]
+            data['n_obj'][i_row] = row[2]
+            data['max_dmag'][i_row] = row[3] if row[3] is not None else np.inf
+            data['max_abs_dmag'][i_row] = row[4] if row[4] is not None else np.inf
+            data['bright_mag'][i_row] = [mag if mag is not None else -np.inf for mag in row[5:]]
+        return cls(htmid_level, data)
+
+    def _rows_for_htmid(self, htmid):
+        """
+        Return the rows of the index covering the trixel htmid.
+
+        If htmid is at a finer level than the index, the rows of its
+        parent trixel are returned (so the summary is conservative).
+        If htmid is at a coarser level, the rows of all of its children
+        are returned.
+        """
+        level = levelFromHtmid(htmid)
+        if level >= self._htmid_level:
+            parent = htmid >> 2*(level-self._htmid_level)
+            i_start = np.searchsorted(self._data['htmid'], parent, side='left')
+            i_end = np.searchsorted(self._data['htmid'], parent, side='right')
+        else:
+            n_bits_off = 2*(self._htmid_level-level)
+            i_start = np.searchsorted(self._data['htmid'], htmid << n_bits_off, side='left')
+            i_end = np.searchsorted(self._data['htmid'], (htmid+1) << n_bits_off, side='left')
+        return self._data[i_start:i_end]
+
+    def model_counts(self, htmid):
+        """
+        Return a dict mapping variability model names to the number of
+        variable sources following that model in the trixel htmid
+        """
+        counts = {}
+        for row in self._rows_for_htmid(htmid):
+            model = str(row['model'])
+            counts[model] = counts.get(model, 0) + int(row['n_obj'])
+        return counts
+
+    def n_candidates(self, htmid, band_list, dmag_cutoff, obs_mag_cutoff=None):
+        """
+        Return an upper bound on the number of variable sources in the
+        trixel htmid that could trigger an alert.
+
+        Parameters
+        ----------
+        htmid is the trixel of interest
+
+        band_list is a list of the bands observed in that trixel
+        (either ints with 0=u, 1=g, etc. or the names 'u', 'g', etc.)
+
+        dmag_cutoff is the minimum |delta magnitude| needed to trigger
+        an alert.  Models that can neither brighten nor fade by this
+        much are not counted.
+
+        obs_mag_cutoff is the dimmest magnitude at which sources are
+        detected in each of the six bands (defaults to
+        AlertDataGenerator.obs_mag_cutoff)
+
+        Returns
+        -------
+        The number of variable sources in (htmid, model) groups that
+        could be brighter than obs_mag_cutoff in one of the bands in
+        band_list (given their brightening bound) and that could
+        brighten or fade by at least dmag_cutoff
+        """
+        if obs_mag_cutoff is None:
+            obs_mag_cutoff = AlertDataGenerator.obs_mag_cutoff
+        band_list = [self._mag_names.index(band) if isinstance(band, str) else int(band)
+                     for band in band_list]
+        if len(band_list) == 0:
+            return 0
+
+        rows = self._rows_for_htmid(htmid)
+        if len(rows) == 0:
+            return 0
+        cutoff = np.array(obs_mag_cutoff, dtype=float)[band_list]
+        visible = (rows['bright_mag'][:, band_list] <= cutoff).any(axis=1)
+        candidate = np.logical_and(visible, rows['max_abs_dmag'] >= dmag_cutoff)
+        return int(rows['n_obj'][candidate].sum())
+
+    def can_trigger(self, htmid, band_list, dmag_cutoff, obs_mag_cutoff=None):
+        """
+        Return True if any variable source in the trixel htmid could
+        trigger an alert (see n_candidates for the parameters)
+        """
+        return self.n_candidates(htmid, band_list, dmag_cutoff,
+                                 obs_mag_cutoff=obs_mag_cutoff) > 0
@@ -1,10 +1,20 @@
 import unittest
+import os
+import shutil
+import tempfile
 import numpy as np
 
 import lsst.utils.tests
 from lsst.utils import getPackageDir
 from lsst.sims.utils.CodeUtilities import sims_clean_up
-from lsst.sims.catUtils.dust import EBVbase
+from lsst.sims.catUtils.dust import EBVbase, EBVmap, EBVhealpixMap
+from lsst.sims.utils import _galacticFromEquatorial
+
+_skip_healpix_tests = False
+try:
+    import healpy
+except ImportError:
+    _skip_healpix_tests = True
 
 
 def setup_module(module):
@@ -45,6 +55,126 @@ class EbvTestCase(unittest.TestCase):
 
         np.testing.assert_array_equal(ebv1_vals, ebv2_vals)
 
+    def test_mmap(self):
+        """
+        Test that memory-mapped dust maps give the same E(B-V) as maps
+        read from the fits files, and that the copies are only written once
+        """
+        mmap_dir = tempfile.mkdtemp(prefix='test_ebv_mmap_')
+        try:
+            rng = np.random.RandomState(88)
+            gLon = rng.random_sample(1000)*2.0*np.pi
+            gLat = rng.random_sample(1000)*np.pi - 0.5*np.pi
+            control_maps = []
+            for name, sgn in zip((EBVbase.ebvMapNorthName, EBVbase.ebvMapSouthName), (1.0, -1.0)):
+                file_name = os.path.join(EBVbase.ebvDataDir, name)
+                control = EBVmap()
+                control.readMapFits(file_name)
+                control_maps.append(control)
+                test = EBVmap()
+                test.readMapFits(file_name, mmapDir=mmap_dir)
+                self.assertIsInstance(test.data, np.memmap)
+                self.assertTrue(test.data.dtype.isnative)
+                self.assertEqual(test.data.shape, control.data.shape)
+                hemisphere = np.where(sgn*gLat > 0.0)
+                for interp in (False, True):
+                    np.testing.assert_array_equal(test.generateEbv(gLon[hemisphere], gLat[hemisphere],
+                                                                   interpolate=interp),
+                                                  control.generateEbv(gLon[hemisphere], gLat[hemisphere],
+                                                                      interpolate=interp))
+
+                # compare with looking up the pixels one at a time
+                x, y = control.xyFromSky(gLon[hemisphere][:20], gLat[hemisphere][:20])
+                ebv = control.generateEbv(gLon[hemisphere][:20], gLat[hemisphere][:20])
+                for ii in range(20):
+                    self.assertEqual(ebv[ii], control.data[int(y[ii]+0.5)][int(x[ii]+0.5)])
+
+            n_files = len(os.listdir(mmap_dir))
+            self.assertEqual(n_files, 4)
+            mtimes = [os.stat(os.path.join(mmap_dir, ff)).st_mtime for ff in sorted(os.listdir(mmap_dir))]
+
+            # EBVbase with ebvMmapDir reuses the copies written above
+            sims_clean_up()
+            ebv_mmap = EBVbase()
+            ebv_mmap.ebvMmapDir = mmap_dir
+            galacticCoordinates = np.array([gLon, gLat])
+            for interp in (False, True):
+                np.testing.assert_array_equal(ebv_mmap.calculateEbv(galacticCoordinates=galacticCoordinates,
+                                                                    interp=interp),
+                                              EBVbase().calculateEbv(galacticCoordinates=galacticCoordinates,
+                                                                     northMap=control_maps[0],
+                                                                     southMap=control_maps[1],
+                                                                     interp=interp))
+            self.assertIsInstance(ebv_mmap.ebvMapNorth.data, np.memmap)
+            self.assertEqual(len(os.listdir(mmap_dir)), n_files)
+            self.assertEqual(mtimes, [os.stat(os.path.join(mmap_dir, ff)).st_mtime
+                                      for ff in sorted(os.listdir(mmap_dir))])
+        finally:
+            sims_clean_up()
+            shutil.rmtree(mmap_dir)
+
+    @unittest.skipIf(_skip_healpix_tests, "healpy is not installed")
+    def test_healpix(self):
+        """
+        Test the HEALPix backend of EBVbase against the SFD maps
+        """
+        map_dir = tempfile.mkdtemp(prefix='test_ebv_healpix_')
+        try:
+            nside = 64
+            sfd = EBVbase()
+
+            # make a HEALPix map the way bin.src/createHealDustMap.py does
+            lat, ra = healpy.pix2ang(nside, np.arange(healpy.nside2npix(nside)))
+            dec = np.pi/2.0 - lat
+            ebv_pix = sfd.calculateEbv(equatorialCoordinates=np.array([ra, dec]), interp=False)
+            np.savez(os.path.join(map_dir, 'dust_nside_%d.npz' % nside), ebvMap=ebv_pix)
+
+            ebv_healpix = EBVbase()
+            ebv_healpix.ebvMapBackend = 'healpix'
+            ebv_healpix.ebvHealpixNside = nside
+            ebv_healpix.ebvHealpixMapName = os.path.join(map_dir, 'dust_nside_%d.npz')
+
+            # at the pixel centers, the backends agree exactly
+            np.testing.assert_array_equal(ebv_healpix.calculateEbv(equatorialCoordinates=np.array([ra, dec])),
+                                          ebv_pix)
+            self.assertEqual(ebv_healpix.ebvMapHealpix.nside, nside)
+
+            # galactic coordinates are converted to equatorial coordinates
+            rng = np.random.RandomState(45)
+            ra = rng.random_sample(1000)*2.0*np.pi
+            dec = np.arcsin(rng.random_sample(1000)*2.0-1.0)
+            gLon, gLat = _galacticFromEquatorial(ra, dec)
+            for interp in (False, True):
+                ebv_eq = ebv_healpix.calculateEbv(equatorialCoordinates=np.array([ra, dec]), interp=interp)
+                ebv_gal = ebv_healpix.calculateEbv(galacticCoordinates=np.array([gLon, gLat]), interp=interp)
+                np.testing.assert_allclose(ebv_gal, ebv_eq, rtol=1.0e-6)
+
+            # the map is also read from (memory-mapped) .npy files
+            np.save(os.path.join(map_dir, 'dust_nside_%d.npy' % nside), ebv_pix)
+            npy_map = EBVhealpixMap()
+            npy_map.readMap(os.path.join(map_dir, 'dust_nside_%d.npy' % nside))
+            self.assertIsInstance(npy_map.data, np.memmap)
+            np.testing.assert_array_equal(npy_map.generateEbv(ra, dec, interpolate=True),
+                                          ebv_healpix.calculateEbv(equatorialCoordinates=np.array([ra, dec]),
+                                                                   interp=True))
+
+            # interpolation reduces the error in a smoothly varying map
+            smooth_map = EBVhealpixMap()
+            smooth_map.nside = nside
+            lat, phi = healpy.pix2ang(nside, np.arange(healpy.nside2npix(nside)))
+            smooth_map.data = 0.1 + 0.05*np.sin(2.0*(np.pi/2.0-lat)) + 0.02*np.cos(phi)
+            truth = 0.1 + 0.05*np.sin(2.0*dec) + 0.02*np.cos(ra)
+            err_pix = np.abs(smooth_map.generateEbv(ra, dec, interpolate=False)-truth)
+            err_interp = np.abs(smooth_map.generateEbv(ra, dec, interpolate=True)-truth)
+            self.assertLess(np.median(err_interp), 0.5*np.median(err_pix))
+
+            bad = EBVbase()
+            bad.ebvMapBackend = 'planck'
+            self.assertRaises(RuntimeError, bad.calculateEbv, equatorialCoordinates=np.array([ra, dec]))
+        finally:
+            sims_clean_up()
+            shutil.rmtree(map_dir)
+
     def testEBV(self):
 
         ebvObject = EBVbase()
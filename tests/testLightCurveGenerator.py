@@ -21,12 +21,20 @@ from lsst.sims.catUtils.utils import ObservationMetaDataGenerator
 
 from lsst.sims.catUtils.mixins import PhotometryStars, VariabilityStars
 from lsst.sims.catUtils.utils import StellarLightCurveGenerator
+from lsst.sims.catUtils.utils import LightCurveHdf5Sink, LightCurveHdf5Reader
 
 from lsst.sims.catalogs.db import CatalogDBObject
 
 from lsst.sims.catUtils.mixins import PhotometryGalaxies, VariabilityGalaxies
 from lsst.sims.catUtils.utils import AgnLightCurveGenerator
 from lsst.sims.utils import ModifiedJulianDate
+from lsst.sims.utils import haversine
+
+_h5py_is_installed = True
+try:
+    import h5py
+except ImportError:
+    _h5py_is_installed = False
 
 ROOT = os.path.abspath(os.path.dirname(__file__))
 
@@ -222,6 +230,45 @@ class StellarLightCurveTest(unittest.TestCase):
         self.assertGreater(ct_g, 0)
         self.assertGreater(ct_z, 0)
 
+        # the pointings fetched in one query for both bandpasses
+        # should be the pointings fetched for each bandpass separately
+        obs_hist_id = [obs.OpsimMetaData['obsHistID'] for group in pointings for obs in group]
+        single_band_id = []
+        for bp in bandpass:
+            single_band = lc_gen.get_pointings(raRange, decRange, bandpass=bp)
+            single_band_id += [obs.OpsimMetaData['obsHistID'] for group in single_band for obs in group]
+        self.assertEqual(len(obs_hist_id), len(np.unique(obs_hist_id)))
+        self.assertEqual(sorted(obs_hist_id), sorted(single_band_id))
+
+    def test_group_pointings(self):
+        """
+        Test that _group_pointings groups pointings exactly as a brute-force
+        comparison against the first member of each group would
+        """
+        rng = np.random.RandomState(81)
+        fields = rng.random_sample((40, 2))*np.array([2.0*np.pi, 1.0])
+        field_dex = rng.randint(0, 40, size=2000)
+        ra = fields[field_dex, 0]
+        dec = fields[field_dex, 1]
+        # perturb some pointings by much less than the tolerance
+        ra[::7] += 1.0e-14
+
+        group_dex = StellarLightCurveGenerator._group_pointings(ra, dec)
+
+        first_member = []
+        for i_obs in range(len(ra)):
+            truth = -1
+            for i_grp, i_first in enumerate(first_member):
+                if haversine(ra[i_obs], dec[i_obs], ra[i_first], dec[i_first]) < 1.0e-12:
+                    truth = i_grp
+                    break
+            if truth == -1:
+                first_member.append(i_obs)
+                truth = len(first_member)-1
+            self.assertEqual(group_dex[i_obs], truth)
+
+        self.assertEqual(len(first_member), len(np.unique(field_dex)))
+
     def test_stellar_light_curves(self):
         """
         Test the StellarLightCurveGenerator by generating some RR Lyrae light
@@ -451,6 +498,97 @@ class StellarLightCurveTest(unittest.TestCase):
                 total_ct += len(lc_dict[obj_name][bandpass]['mjd'])
         self.assertEqual(ct, total_ct)
 
+    @unittest.skipIf(not _h5py_is_installed, "h5py is not installed")
+    def test_hdf5_sink(self):
+        """
+        Check that light curves streamed to an HDF5 sink are the same as
+        the light curves generated in memory.
+        """
+
+        raRange = (78.0, 82.0)
+        decRange = (-69.0, -65.0)
+        bandpass = ('r', 'g')
+
+        gen = StellarLightCurveGenerator(self.stellar_db, self.opsimDb)
+        pointings = gen.get_pointings(raRange, decRange, bandpass=bandpass)
+        control_lc, control_truth = gen.light_curves_from_pointings(pointings, chunk_size=10)
+        self.assertGreater(len(control_lc), 10)
+
+        file_name = os.path.join(self.scratchDir, 'lc_sink_test.h5')
+        with LightCurveHdf5Sink(file_name) as sink:
+            test_lc, test_truth = gen.light_curves_from_pointings(pointings, chunk_size=10,
+                                                                  sink=sink)
+        self.assertIsNone(test_lc)
+        self.assertIsNone(test_truth)
+
+        with LightCurveHdf5Reader(file_name) as reader:
+            self.assertEqual(list(reader), list(control_lc))
+            for obj_id in control_lc:
+                self.assertEqual(reader.truth(obj_id), control_truth[obj_id])
+                test = reader[obj_id]
+                control = control_lc[obj_id]
+                self.assertEqual(set(test.keys()), set(control.keys()))
+                for bp in control:
+                    for col_name in ('mjd', 'mag', 'error'):
+                        np.testing.assert_array_equal(test[bp][col_name], control[bp][col_name])
+
+        if os.path.exists(file_name):
+            os.unlink(file_name)
+
+    def test_parallel_light_curves(self):
+        """
+        Check that generating light curves with several processes
+        gives the same results as generating them with one.
+        """
+
+        raRange = (78.0, 85.0)
+        decRange = (-69.0, -65.0)
+        bandpass = ('r', 'g')
+
+        gen = StellarLightCurveGenerator(self.stellar_db, self.opsimDb)
+        pointings = gen.get_pointings(raRange, decRange, bandpass=bandpass)
+        self.assertGreater(len(pointings), 1)
+        control_lc, control_truth = gen.light_curves_from_pointings(pointings)
+        test_lc, test_truth = gen.light_curves_from_pointings(pointings, n_processes=3,
+                                                              scratch_dir=self.scratchDir)
+
+        self.assertGreater(len(control_lc), 2)
+        self.assertEqual(list(test_lc), list(control_lc))
+        self.assertEqual(test_truth, control_truth)
+        np.testing.assert_array_equal(test_lc.data['uniqueId'], control_lc.data['uniqueId'])
+        for obj_id in control_lc:
+            self.assertEqual(set(test_lc[obj_id].keys()), set(control_lc[obj_id].keys()))
+            for bp in control_lc[obj_id]:
+                for col_name in ('mjd', 'mag', 'error'):
+                    np.testing.assert_array_equal(test_lc[obj_id][bp][col_name],
+                                                  control_lc[obj_id][bp][col_name])
+
+    def test_obs_metadata_array(self):
+        """
+        Check that passing an ObservationMetaDataArray to
+        light_curves_from_pointings gives the same results as
+        passing the output of get_pointings.
+        """
+
+        raRange = (78.0, 85.0)
+        decRange = (-69.0, -65.0)
+        bandpass = ('r', 'g')
+
+        gen = StellarLightCurveGenerator(self.stellar_db, self.opsimDb)
+        pointings = gen.get_pointings(raRange, decRange, bandpass=bandpass)
+        control_lc, control_truth = gen.light_curves_from_pointings(pointings)
+
+        obs_gen = ObservationMetaDataGenerator(database=self.opsimDb, driver='sqlite')
+        obs_array = obs_gen.getObservationMetaDataArray(fieldRA=raRange, fieldDec=decRange)
+        obs_array = obs_array.select(bandpass=bandpass)
+        self.assertEqual(len(obs_array), sum([len(grp) for grp in pointings]))
+        test_lc, test_truth = gen.light_curves_from_pointings(obs_array)
+
+        self.assertGreater(len(control_lc), 2)
+        self.assertEqual(list(test_lc), list(control_lc))
+        self.assertEqual(test_truth, control_truth)
+        np.testing.assert_array_equal(test_lc.data, control_lc.data)
+
     def test_constraint(self):
         """
         Test that the light curve generator correctly ignores objects
@@ -4,12 +4,14 @@ import os
 import unittest
 import sqlite3
 import tempfile
+import shutil
 import numpy as np
 import lsst.utils.tests
 from lsst.sims.utils.CodeUtilities import sims_clean_up
 from lsst.sims.catUtils.utils import ObservationMetaDataGenerator
+from lsst.sims.catUtils.utils import ObservationMetaDataArray
 from lsst.sims.utils import CircleBounds, BoxBounds, altAzPaFromRaDec
-from lsst.sims.utils import ObservationMetaData
+from lsst.sims.utils import ObservationMetaData, angularSeparation
 from lsst.sims.catUtils.exampleCatalogDefinitions import PhoSimCatalogSersic2D
 from lsst.sims.catUtils.exampleCatalogDefinitions import DefaultPhoSimHeaderMap
 from lsst.sims.catUtils.utils import testGalaxyBulgeDBObj
@@ -434,6 +436,109 @@ class ObservationMetaDataGeneratorTest(unittest.TestCase):
             self.assertGreaterEqual(obs.mjd.TAI, night0+14.9)
             self.assertLessEqual(obs.mjd.TAI, night0+15.9)
 
+    def testObservationMetaDataArray(self):
+        """
+        Test that getObservationMetaDataArray returns the same pointings
+        as getObservationMetaData, and that selections on the array
+        agree with selections on the list
+        """
+        control = self.gen.getObservationMetaData(night=(11, 12), boundLength=2.1)
+        obs_array = self.gen.getObservationMetaDataArray(night=(11, 12), boundLength=2.1)
+        self.assertIsInstance(obs_array, ObservationMetaDataArray)
+        self.assertEqual(len(obs_array), len(control))
+        self.assertGreater(len(control), 100)
+
+        np.testing.assert_array_equal(obs_array.mjd, [obs.mjd.TAI for obs in control])
+        np.testing.assert_array_equal(obs_array.bandpass, [obs.bandpass for obs in control])
+        np.testing.assert_allclose(obs_array.pointingRA, [obs.pointingRA for obs in control],
+                                   rtol=1.0e-12)
+        np.testing.assert_allclose(obs_array._pointingDec, [obs._pointingDec for obs in control],
+                                   rtol=1.0e-12)
+        np.testing.assert_allclose(obs_array.rotSkyPos, [obs.rotSkyPos for obs in control],
+                                   rtol=1.0e-12)
+        np.testing.assert_array_equal(obs_array.m5, [obs.m5[obs.bandpass] for obs in control])
+        np.testing.assert_array_equal(obs_array.seeing,
+                                      [obs.seeing[obs.bandpass] for obs in control])
+        np.testing.assert_array_equal(obs_array.column('night'),
+                                      [obs.OpsimMetaData['night'] for obs in control])
+
+        for i_obs in (0, 17, len(control)-1):
+            test = obs_array[i_obs]
+            self.assertIsInstance(test, ObservationMetaData)
+            self.assertEqual(test.pointingRA, control[i_obs].pointingRA)
+            self.assertEqual(test.mjd.TAI, control[i_obs].mjd.TAI)
+            self.assertEqual(test.boundLength, 2.1)
+            self.assertEqual(test.OpsimMetaData, control[i_obs].OpsimMetaData)
+
+        sub_array = obs_array[10:20]
+        self.assertIsInstance(sub_array, ObservationMetaDataArray)
+        self.assertEqual(len(sub_array), 10)
+        for test, obs in zip(sub_array, control[10:20]):
+            self.assertEqual(test.OpsimMetaData['obsHistID'], obs.OpsimMetaData['obsHistID'])
+
+        # vectorized selection
+        r_array = obs_array.select(bandpass='r', mjd=(49365.0, 49366.0))
+        r_control = [obs for obs in control if obs.bandpass == 'r' and
+                     obs.mjd.TAI >= 49365.0 and obs.mjd.TAI <= 49366.0]
+        self.assertGreater(len(r_control), 0)
+        np.testing.assert_array_equal(r_array.mjd, [obs.mjd.TAI for obs in r_control])
+
+        # spatial filtering
+        ra = control[0].pointingRA
+        dec = control[0].pointingDec
+        near_array = obs_array.within(ra, dec, 10.0)
+        near_control = [obs for obs in control
+                        if angularSeparation(ra, dec, obs.pointingRA, obs.pointingDec) <= 10.0]
+        self.assertGreater(len(near_control), 0)
+        self.assertLess(len(near_control), len(control))
+        np.testing.assert_array_equal(near_array.mjd, [obs.mjd.TAI for obs in near_control])
+
+    def testPointingCache(self):
+        """
+        Test that an ObservationMetaDataGenerator with a cache_dir returns
+        the same OpSim records as one that queries the database
+        """
+        cache_dir = tempfile.mkdtemp(dir=ROOT, prefix='pointing_cache-')
+        try:
+            dbPath = os.path.join(getPackageDir('sims_data'),
+                                  'OpSimData/opsimblitz1_1133_sqlite.db')
+            cached_gen = ObservationMetaDataGenerator(database=dbPath, driver='sqlite',
+                                                      cache_dir=cache_dir)
+
+            query_list = [{'fieldRA': (np.degrees(1.370916), np.degrees(1.40))},
+                          {'fieldRA': (20.0, 60.0), 'fieldDec': (-60.0, -20.0)},
+                          {'fieldRA': (0.0, 360.0), 'fieldDec': (-90.0, 0.0),
+                           'expMJD': (49367.129396, 49370.0)},
+                          {'telescopeFilter': 'r', 'night': (11, 13)},
+                          {'night': 15},
+                          {'m5': (22.815249, 23.0), 'seeing': (0.7, 0.9)},
+                          {'telescopeFilter': 'i', 'limit': 20}]
+
+            for query in query_list:
+                control = self.gen.getOpSimRecords(**query)
+                test = cached_gen.getOpSimRecords(**query)
+                msg = 'failed on %s' % str(query)
+                self.assertGreater(len(control), 0, msg=msg)
+                self.assertEqual(len(test), len(control), msg=msg)
+                for name in control.dtype.names:
+                    np.testing.assert_array_equal(test[name], control[name], err_msg=msg)
+
+            control = self.gen.getObservationMetaData(night=15)
+            test = cached_gen.getObservationMetaData(night=15)
+            self.assertEqual(len(test), len(control))
+            for obs_test, obs_control in zip(test, control):
+                self.assertEqual(obs_test.mjd.TAI, obs_control.mjd.TAI)
+                self.assertEqual(obs_test.OpsimMetaData, obs_control.OpsimMetaData)
+
+            # a second generator reuses the cache files
+            self.assertTrue(cached_gen._pointing_cache.is_valid(cached_gen.dtype))
+            other_gen = ObservationMetaDataGenerator(database=dbPath, driver='sqlite',
+                                                     cache_dir=cache_dir)
+            self.assertTrue(other_gen._pointing_cache.is_valid(other_gen.dtype))
+        finally:
+            if os.path.exists(cache_dir):
+                shutil.rmtree(cache_dir)
+
     def testCreationOfPhoSimCatalog(self):
         """
         Make sure that we can create PhoSim input catalogs using the returned
@@ -589,6 +694,35 @@ class ObsMetaDataGenMockOpsimTest(unittest.TestCase):
             self.assertGreater(obs.pointingRA, raBounds[0])
             self.assertLessEqual(obs.pointingDec, raBounds[1])
 
+    def testPointingCacheInvalidation(self):
+        """
+        Test that the OpSimPointingCache is rebuilt when the
+        database it was built from changes
+        """
+        cache_dir = tempfile.mkdtemp(dir=ROOT, prefix='pointing_cache-')
+        db_name = os.path.join(cache_dir, 'mock_opsim.db')
+        shutil.copyfile(self.opsim_db_name, db_name)
+        try:
+            gen = ObservationMetaDataGenerator(database=db_name, cache_dir=cache_dir)
+            results = gen.getOpSimRecords(expMJD=(0.0, 70000.0))
+            self.assertEqual(len(results), 100)
+            np.testing.assert_array_equal(results['expMJD'], np.sort(results['expMJD']))
+
+            conn = sqlite3.connect(db_name)
+            conn.execute("INSERT INTO Summary VALUES(100, 61000.0, 1.0, -0.5, 'g')")
+            conn.commit()
+            conn.close()
+            os.utime(db_name, (os.stat(db_name).st_atime, os.stat(db_name).st_mtime+10.0))
+
+            self.assertFalse(gen._pointing_cache.is_valid(gen.dtype))
+            results = gen.getOpSimRecords(expMJD=(0.0, 70000.0))
+            self.assertEqual(len(results), 101)
+            self.assertEqual(results['obsHistID'][-1], 100)
+            self.assertTrue(gen._pointing_cache.is_valid(gen.dtype))
+        finally:
+            if os.path.exists(cache_dir):
+                shutil.rmtree(cache_dir)
+
     def testSelectException(self):
         """
         Test that an exception is raised if you try to SELECT pointings on a column that does not exist
@@ -43,7 +43,7 @@ from lsst.sims.catUtils.utils import ObservationMetaDataGenerator
 from lsst.sims.catalogs.db import CatalogDBObject, fileDBObject
 
 # Routines Being Tested
-from lsst.sims.catUtils.supernovae import SNObject
+from lsst.sims.catUtils.supernovae import SNObject, SALT2FluxGrid
 from lsst.sims.catUtils.mixins import SNIaCatalog
 from lsst.sims.catUtils.utils import SNIaLightCurveGenerator
 
@@ -734,6 +734,80 @@ class SNIaLightCurveTest(unittest.TestCase):
 
         self.assertGreater(over_z, 0)
 
+    def test_sne_light_curves_counter_rng(self):
+        """
+        Generate some super nova light curves with SN parameters drawn by
+        the counter-based random number generator.  Verify that they come
+        up with the same fluxes as supernova catalogs drawing their
+        parameters the same way.
+        """
+
+        class CounterRNGControlCatalog(SNIaLightCurveControlCatalog):
+            useCounterRNG = True
+
+        gen = SNIaLightCurveGenerator(self.db, self.opsimDb)
+        gen.sn_universe.useCounterRNG = True
+
+        raRange = (78.0, 85.0)
+        decRange = (-69.0, -65.0)
+        bandpass = 'r'
+
+        pointings = gen.get_pointings(raRange, decRange, bandpass=bandpass)
+        gen.sn_universe._midSurveyTime = 49000.0
+        gen.sn_universe._snFrequency = 0.001
+        lc_dict, truth = gen.light_curves_from_pointings(pointings)
+        self.assertGreater(len(lc_dict), 0)
+
+        n_checked = 0
+        for group in pointings:
+            for obs in group:
+                cat = CounterRNGControlCatalog(self.db, obs_metadata=obs)
+                for sn in cat.iter_catalog():
+                    if sn[1] > 0.0:
+                        lc = lc_dict[sn[0]][bandpass]
+                        dex = np.argmin(np.abs(lc['mjd'] - obs.mjd.TAI))
+                        self.assertLess(np.abs(lc['mjd'][dex] - obs.mjd.TAI), 1.0e-7)
+                        self.assertLess(np.abs(lc['flux'][dex] - sn[1]), 1.0e-7)
+                        n_checked += 1
+        self.assertGreater(n_checked, 0)
+
+    def test_sne_light_curves_flux_grid(self):
+        """
+        Generate some super nova light curves by interpolating a SALT2FluxGrid.
+        Verify that they agree with the light curves generated by integrating
+        the SALT2 spectra.
+        """
+        raRange = (78.0, 85.0)
+        decRange = (-69.0, -65.0)
+        bandpass = 'r'
+
+        gen = SNIaLightCurveGenerator(self.db, self.opsimDb)
+        gen.sn_universe._midSurveyTime = 49000.0
+        gen.sn_universe._snFrequency = 0.001
+        pointings = gen.get_pointings(raRange, decRange, bandpass=bandpass)
+        control_lc, control_truth = gen.light_curves_from_pointings(pointings)
+        self.assertGreater(len(control_lc), 0)
+
+        tolerance = 0.01
+        gen = SNIaLightCurveGenerator(self.db, self.opsimDb)
+        gen.sn_universe._midSurveyTime = 49000.0
+        gen.sn_universe._snFrequency = 0.001
+        gen.flux_grid = SALT2FluxGrid(gen.lsstBandpassDict, tolerance=tolerance)
+        test_lc, test_truth = gen.light_curves_from_pointings(pointings)
+        self.assertEqual(set(test_lc.keys()), set(control_lc.keys()))
+
+        for sn_id in control_lc:
+            control = control_lc[sn_id][bandpass]
+            test = test_lc[sn_id][bandpass]
+            self.assertEqual(test_truth[sn_id]['x0'], control_truth[sn_id]['x0'])
+            common, control_dex, test_dex = np.intersect1d(control['mjd'], test['mjd'],
+                                                           return_indices=True)
+            self.assertGreater(len(common), 0)
+            peak = control['flux'].max()
+            np.testing.assert_array_less(np.abs(test['flux'][test_dex] -
+                                                control['flux'][control_dex]),
+                                         2.0*tolerance*peak)
+
     def test_sne_multiband_light_curves(self):
         """
         Generate some super nova light curves.  Verify that they come up with the same
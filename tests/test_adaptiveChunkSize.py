@@ -0,0 +1,110 @@
+import unittest
+import lsst.utils.tests
+
+from lsst.sims.catUtils.utils import AdaptiveChunkSizer
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+class DummyQuery(object):
+    """
+    Stand-in for a ChunkIterator; only carries a chunk_size
+    """
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+
+
+class AdaptiveChunkSizerTestCase(unittest.TestCase):
+
+    def test_estimate(self):
+        self.assertEqual(AdaptiveChunkSizer.estimate_bytes_per_row(10, n_bands=6, n_arrays=3,
+                                                                   row_bytes=100),
+                         100 + 10*6*3*8)
+        self.assertEqual(AdaptiveChunkSizer.estimate_bytes_per_row(10, n_bands=1, n_arrays=3,
+                                                                   row_bytes=100),
+                         100 + 10*1*3*8)
+
+    def test_initial_size(self):
+        sizer = AdaptiveChunkSizer(10000000, 1000.0)
+        self.assertEqual(sizer.chunk_size, 10000)
+        self.assertEqual(sizer.bytes_per_row, 1000.0)
+
+        # the chunk size is clipped to [min_chunk_size, max_chunk_size]
+        sizer = AdaptiveChunkSizer(10000000, 1.0e6, min_chunk_size=50)
+        self.assertEqual(sizer.chunk_size, 50)
+        sizer = AdaptiveChunkSizer(10000000, 1.0, max_chunk_size=2000)
+        self.assertEqual(sizer.chunk_size, 2000)
+
+    def test_shrink(self):
+        sizer = AdaptiveChunkSizer(10000000, 1000.0)
+        # the chunk used four times the memory expected
+        new_size = sizer.update(10000, 40000000)
+        self.assertEqual(new_size, 2500)
+        self.assertEqual(sizer.chunk_size, 2500)
+        self.assertEqual(sizer.bytes_per_row, 4000.0)
+
+    def test_growth(self):
+        sizer = AdaptiveChunkSizer(10000000, 1000.0, max_growth=1.5)
+        # chunks that use much less memory than expected can only
+        # grow the chunk size by max_growth at each step
+        sizer.update(10000, 100000)
+        self.assertEqual(sizer.chunk_size, 15000)
+        sizer.update(15000, 150000)
+        self.assertEqual(sizer.chunk_size, 22500)
+
+        # the estimate converges on the measured memory per row
+        for ii in range(30):
+            sizer.update(sizer.chunk_size, 100*sizer.chunk_size)
+        self.assertAlmostEqual(sizer.bytes_per_row, 100.0, 3)
+        self.assertGreater(sizer.chunk_size, 99000)
+        self.assertLessEqual(sizer.chunk_size, 100000)
+
+    def test_throughput(self):
+        sizer = AdaptiveChunkSizer(100000000, 1000.0, max_growth=1.5)
+        self.assertEqual(sizer.chunk_size, 100000)
+        sizer.update(100000, 10000000, elapsed=1.0)
+        self.assertEqual(sizer.chunk_size, 150000)
+
+        # 50% more rows took 50% longer; stop growing
+        sizer.update(150000, 15000000, elapsed=1.5)
+        self.assertEqual(sizer.chunk_size, 150000)
+        sizer.update(150000, 15000000, elapsed=1.0)
+        self.assertEqual(sizer.chunk_size, 150000)
+
+        # but still shrink if memory demands go up
+        sizer.update(150000, 200000000, elapsed=1.0)
+        self.assertEqual(sizer.chunk_size, 75000)
+
+    def test_empty_chunk(self):
+        sizer = AdaptiveChunkSizer(10000000, 1000.0)
+        self.assertEqual(sizer.update(0, 0), 10000)
+        self.assertEqual(sizer.bytes_per_row, 1000.0)
+
+    def test_apply(self):
+        sizer = AdaptiveChunkSizer(10000000, 1000.0)
+        query = DummyQuery(5)
+        sizer.apply(query)
+        self.assertEqual(query.chunk_size, 10000)
+
+        # iterators that return everything at once are left alone
+        query = DummyQuery(None)
+        sizer.apply(query)
+        self.assertIsNone(query.chunk_size)
+
+    def test_bad_input(self):
+        with self.assertRaises(RuntimeError):
+            AdaptiveChunkSizer(0, 1000.0)
+        with self.assertRaises(RuntimeError):
+            AdaptiveChunkSizer(1000, -1.0)
+
+
+class MemoryTestClass(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
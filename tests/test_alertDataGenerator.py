@@ -15,6 +15,7 @@ from lsst.sims.catalogs.decorators import register_method
 from lsst.sims.catalogs.db import CatalogDBObject
 from lsst.sims.catalogs.db import DBObject
 from lsst.sims.catUtils.utils import ObservationMetaDataGenerator
+from lsst.sims.catUtils.utils import ObservationMetaDataArray
 from lsst.sims.catUtils.utils import AlertStellarVariabilityCatalog
 from lsst.sims.catUtils.utils import AlertDataGenerator
 from lsst.sims.catUtils.utils import StellarAlertDBObjMixin
@@ -519,6 +520,92 @@ class AlertDataGeneratorTestCase(unittest.TestCase):
         self.assertLess(len(obshistid_unqid_simulated_set), n_total_observations)
         self.assertGreater(n_tot_ast_simulated, 0)
 
+    def test_quiescent_mag_constraint(self):
+        """
+        Test that the SQL constraint built by quiescent_mag_constraint
+        keeps exactly the sources that could be visible in some band
+        observed in each trixel
+        """
+
+        class StarConstraintTestDBObj(StellarAlertDBObjMixin, CatalogDBObject):
+            objid = 'star_alert_constraint'
+            tableid = 'stars'
+            idColKey = 'simobjid'
+            raColName = 'ra'
+            decColName = 'dec'
+            objectTypeId = 0
+            columns = [('raJ2000', 'ra*0.01745329252'),
+                       ('decJ2000', 'dec*0.01745329252'),
+                       ('variabilityParameters', 'varParamStr', str, 500)]
+
+        star_db = StarConstraintTestDBObj(database=self.star_db_name, driver='sqlite')
+        alert_gen = AlertDataGenerator(testing=True)
+        alert_gen.subdivide_obs(self.obs_list, htmid_level=6)
+        mag_name_to_int = {'u': 0, 'g': 1, 'r': 2, 'i': 3, 'z': 4, 'y': 5}
+
+        self.assertIsNone(alert_gen.quiescent_mag_constraint(star_db, alert_gen.htmid_list[0]))
+
+        conn = sqlite3.connect(self.star_db_name)
+        all_rows = conn.execute('SELECT simobjid, umag, gmag, rmag, imag, zmag, ymag, '
+                                'varParamStr FROM stars').fetchall()
+        mags = np.array([row[1:7] for row in all_rows])
+        is_var = np.array([row[7] is not None and row[7] != 'None' for row in all_rows])
+        simobjid = np.array([row[0] for row in all_rows])
+
+        n_dropped = 0
+        for htmid in alert_gen.htmid_list:
+            band_list = np.unique([mag_name_to_int[obs.bandpass]
+                                   for obs in alert_gen.obs_from_htmid(htmid)])
+            for brightening in (0.0, 1.5):
+                constraint = alert_gen.quiescent_mag_constraint(star_db, htmid,
+                                                                max_brightening=brightening,
+                                                                variables_only=True)
+                kept = conn.execute('SELECT simobjid FROM stars WHERE %s' % constraint).fetchall()
+                kept = np.sort([row[0] for row in kept])
+
+                cutoff = np.array(self.obs_mag_cutoff)[band_list] + brightening
+                visible = (mags[:, band_list] <= cutoff).any(axis=1)
+                truth = np.sort(simobjid[np.where(np.logical_and(visible, is_var))])
+                np.testing.assert_array_equal(kept, truth)
+                n_dropped += len(simobjid) - len(kept)
+
+            # a per-model brightening only constrains the listed models
+            constraint = alert_gen.quiescent_mag_constraint(star_db, htmid,
+                                                            max_brightening={'not_a_model': 0.0})
+            kept = conn.execute('SELECT simobjid FROM stars WHERE %s' % constraint).fetchall()
+            self.assertEqual(len(kept), len(simobjid))
+
+        conn.close()
+        self.assertGreater(n_dropped, 0)
+
+    def test_subdivide_obs_array(self):
+        """
+        Test that subdivide_obs assigns the pointings in an
+        ObservationMetaDataArray to the same trixels as the
+        corresponding list of ObservationMetaData
+        """
+        obs_gen = ObservationMetaDataGenerator(database=self.opsim_db)
+        obs_array = obs_gen.getObservationMetaDataArray(night=(0, 2))
+        obshistid_list = [obs.OpsimMetaData['obsHistID'] for obs in self.obs_list]
+        obs_array = obs_array[np.isin(obs_array.column('obsHistID'), obshistid_list)]
+        self.assertIsInstance(obs_array, ObservationMetaDataArray)
+        self.assertEqual(len(obs_array), len(self.obs_list))
+
+        control_gen = AlertDataGenerator(testing=True)
+        control_gen.subdivide_obs(self.obs_list, htmid_level=6)
+        test_gen = AlertDataGenerator(testing=True)
+        test_gen.subdivide_obs(obs_array, htmid_level=6)
+
+        np.testing.assert_array_equal(np.sort(test_gen.htmid_list),
+                                      np.sort(control_gen.htmid_list))
+        for htmid in control_gen.htmid_list:
+            self.assertEqual(test_gen.n_obs(htmid), control_gen.n_obs(htmid))
+            test_obs = test_gen.obs_from_htmid(htmid)
+            self.assertIsInstance(test_obs, ObservationMetaDataArray)
+            np.testing.assert_array_equal(np.sort([obs.OpsimMetaData['obsHistID'] for obs in test_obs]),
+                                          np.sort([obs.OpsimMetaData['obsHistID']
+                                                   for obs in control_gen.obs_from_htmid(htmid)]))
+
 
 class MemoryTestClass(lsst.utils.tests.MemoryTestCase):
     pass
@@ -0,0 +1,164 @@
+import unittest
+import os
+import tempfile
+import shutil
+import numpy as np
+import lsst.utils.tests
+
+from lsst.sims.catUtils.utils import AlertDataSqliteWriter
+from lsst.sims.catUtils.utils import AlertDataRepartitioner
+
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+class AlertDataRepartitionerTestCase(unittest.TestCase):
+
+    longMessage = True
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Write some fake per-trixel files in the format produced by
+        the AlertDataGenerator
+        """
+        cls.scratch_dir = tempfile.mkdtemp(dir=ROOT, prefix='alertRepartition')
+        cls.in_dir = os.path.join(cls.scratch_dir, 'trixels')
+        os.mkdir(cls.in_dir)
+
+        rng = np.random.RandomState(6612)
+        cls.obshistid_list = np.arange(100, 112)
+        # two visits per night
+        cls.tai_list = 59580.2 + 0.5*np.arange(len(cls.obshistid_list))
+        cls.band_list = rng.randint(0, 6, size=len(cls.obshistid_list))
+
+        cls.in_file_list = []
+        cls.truth_alerts = []
+        cls.truth_q_flux = {}
+        for i_trixel, htmid in enumerate((8000, 8001, 8002)):
+            file_name = os.path.join(cls.in_dir, 'fake_%d_sqlite.db' % htmid)
+            cls.in_file_list.append(file_name)
+
+            unq = np.arange(20) + 1000*i_trixel
+            q_flux = rng.random_sample((6, len(unq)))
+            for i_obj, uid in enumerate(unq):
+                cls.truth_q_flux[uid] = q_flux[:, i_obj]
+
+            visit_dex = rng.choice(np.arange(len(cls.obshistid_list)), size=7,
+                                   replace=False)
+            data_cache = {}
+            for i_visit in visit_dex:
+                n_obj = rng.randint(1, 10)
+                tag = '%d_0' % cls.obshistid_list[i_visit]
+                data_cache[tag] = {}
+                data_cache[tag]['uniqueId'] = rng.choice(unq, size=n_obj, replace=False)
+                for col_name in ('xPix', 'yPix', 'dflux', 'SNR', 'raICRS', 'decICRS'):
+                    data_cache[tag][col_name] = rng.random_sample(n_obj)
+                data_cache[tag]['chipNum'] = rng.randint(0, 5000, size=n_obj)
+                for i_obj in range(n_obj):
+                    cls.truth_alerts.append((data_cache[tag]['uniqueId'][i_obj],
+                                             cls.obshistid_list[i_visit],
+                                             data_cache[tag]['xPix'][i_obj]))
+
+            with AlertDataSqliteWriter(file_name) as writer:
+                writer.write_metadata(cls.obshistid_list[visit_dex],
+                                      cls.tai_list[visit_dex],
+                                      cls.band_list[visit_dex])
+                writer.write_alert_data(data_cache)
+                writer.write_quiescent_flux(unq, q_flux, q_flux)
+                writer.write_baseline_astrometry(unq, q_flux[0], q_flux[1],
+                                                 q_flux[2], q_flux[3], q_flux[4],
+                                                 59580.0)
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.path.exists(cls.scratch_dir):
+            shutil.rmtree(cls.scratch_dir)
+
+    def verify_partitions(self, out_files, partition_of_obshistid):
+        """
+        Verify that the files in out_files (the output of
+        AlertDataRepartitioner.repartition) contain the right data
+        """
+        n_alerts = 0
+        for partition in out_files:
+            file_name = out_files[partition]
+            self.assertTrue(os.path.exists(file_name))
+            alert_data = AlertDataSqliteWriter.read_table(file_name, 'alert_data')
+            self.assertGreater(len(alert_data), 0)
+            n_alerts += len(alert_data)
+
+            # data is sorted
+            sort_key = alert_data['obshistId']*100000 + alert_data['uniqueId']
+            np.testing.assert_array_equal(sort_key, np.sort(sort_key))
+
+            truth = [alert for alert in self.truth_alerts
+                     if partition_of_obshistid[alert[1]] == partition]
+            self.assertEqual(len(truth), len(alert_data))
+            for alert in truth:
+                match = np.where(np.logical_and(alert_data['uniqueId'] == alert[0],
+                                                alert_data['obshistId'] == alert[1]))
+                self.assertEqual(len(match[0]), 1)
+                self.assertAlmostEqual(alert_data['xPix'][match[0][0]], alert[2], 10)
+
+            metadata = AlertDataSqliteWriter.read_table(file_name, 'metadata')
+            np.testing.assert_array_equal(np.sort(metadata['obshistId']),
+                                          np.unique(alert_data['obshistId']))
+
+            q_flux = AlertDataSqliteWriter.read_table(file_name, 'quiescent_flux')
+            self.assertEqual(len(q_flux), 6*len(np.unique(alert_data['uniqueId'])))
+            for row in q_flux:
+                self.assertAlmostEqual(row['flux'], self.truth_q_flux[row['uniqueId']][row['band']], 10)
+
+            astrometry = AlertDataSqliteWriter.read_table(file_name, 'baseline_astrometry')
+            np.testing.assert_array_equal(np.sort(astrometry['uniqueId']),
+                                          np.unique(alert_data['uniqueId']))
+
+        self.assertEqual(n_alerts, len(self.truth_alerts))
+
+    def test_repartition_by_obshistid(self):
+        partition_of_obshistid = dict((obshistid, obshistid)
+                                      for obshistid in self.obshistid_list)
+        for n_processes in (1, 2):
+            out_dir = tempfile.mkdtemp(dir=self.scratch_dir, prefix='by_obs')
+            repartitioner = AlertDataRepartitioner(buffer_rows=10)
+            out_files = repartitioner.repartition(self.in_file_list, out_dir, 'visit',
+                                                  n_processes=n_processes)
+            self.verify_partitions(out_files, partition_of_obshistid)
+            for obshistid in out_files:
+                self.assertEqual(out_files[obshistid],
+                                 os.path.join(out_dir, 'visit_%d_sqlite.db' % obshistid))
+            # only the output files should be left
+            self.assertEqual(len(os.listdir(out_dir)), len(out_files))
+
+    def test_repartition_by_night(self):
+        night_zero = 59580.0
+        partition_of_obshistid = dict((obshistid, int(np.floor(tai - night_zero)))
+                                      for obshistid, tai in zip(self.obshistid_list,
+                                                                self.tai_list))
+        out_dir = tempfile.mkdtemp(dir=self.scratch_dir, prefix='by_night')
+        repartitioner = AlertDataRepartitioner(partition_by='night',
+                                               night_mjd_zero=night_zero)
+        out_files = repartitioner.repartition(self.in_file_list, out_dir, 'night',
+                                              n_processes=2)
+        self.assertLess(len(out_files), len(self.obshistid_list))
+        self.verify_partitions(out_files, partition_of_obshistid)
+
+    def test_bad_partition(self):
+        with self.assertRaises(RuntimeError):
+            AlertDataRepartitioner(partition_by='htmid')
+        with self.assertRaises(RuntimeError):
+            AlertDataRepartitioner(partition_by='night')
+
+
+class MemoryTestClass(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,280 @@
+import unittest
+import os
+import tempfile
+import shutil
+import sqlite3
+import numpy as np
+import lsst.utils.tests
+
+from lsst.sims.catUtils.utils import AlertDataSqliteWriter
+from lsst.sims.catUtils.utils import AlertDataHdf5Writer
+
+_h5py_is_installed = True
+try:
+    import h5py
+except ImportError:
+    _h5py_is_installed = False
+
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+class AlertDataSqliteWriterTestCase(unittest.TestCase):
+
+    longMessage = True
+
+    def setUp(self):
+        self.scratch_dir = tempfile.mkdtemp(dir=ROOT, prefix='alertDataWriter')
+
+    def tearDown(self):
+        if os.path.exists(self.scratch_dir):
+            shutil.rmtree(self.scratch_dir)
+
+    def test_bulk_writer(self):
+        """
+        Write some data with AlertDataSqliteWriter and verify that it
+        can be read back from the sqlite file
+        """
+        rng = np.random.RandomState(88)
+        db_name = os.path.join(self.scratch_dir, 'writer_test_sqlite.db')
+
+        data_cache = {}
+        n_truth = 0
+        for obshistid, n_obj in zip((11, 12, 11), (5, 7, 0)):
+            tag = '%d_%d' % (obshistid, len(data_cache))
+            data_cache[tag] = {}
+            data_cache[tag]['uniqueId'] = rng.randint(0, 1000, size=n_obj)
+            for col_name in ('xPix', 'yPix', 'dflux', 'SNR', 'raICRS', 'decICRS'):
+                data_cache[tag][col_name] = rng.random_sample(n_obj)
+            data_cache[tag]['chipNum'] = rng.randint(0, 5000, size=n_obj)
+            n_truth += n_obj
+
+        q_unq = np.arange(4)
+        q_flux = rng.random_sample((6, 4))
+        q_snr = rng.random_sample((6, 4))
+
+        with AlertDataSqliteWriter(db_name) as writer:
+            writer.write_metadata(np.array([11, 12]), np.array([59580.1, 59580.2]),
+                                  np.array([1, 4]))
+            n_written = writer.write_alert_data(data_cache)
+            self.assertEqual(n_written, n_truth)
+            writer.write_quiescent_flux(q_unq, q_flux, q_snr)
+            writer.write_baseline_astrometry(q_unq, q_flux[0], q_flux[1],
+                                             q_flux[2], q_flux[3], q_flux[4],
+                                             59580.0)
+            writer.flush()
+            self.assertEqual(writer.n_alert_rows, n_truth)
+
+        conn = sqlite3.connect(db_name)
+        cursor = conn.cursor()
+        rows = cursor.execute('SELECT uniqueId, obshistId, xPix, ra '
+                              'FROM alert_data').fetchall()
+        self.assertEqual(len(rows), n_truth)
+
+        for tag in data_cache:
+            obshistid = int(tag.split('_')[0])
+            for unq, xpix, ra in zip(data_cache[tag]['uniqueId'],
+                                     data_cache[tag]['xPix'],
+                                     data_cache[tag]['raICRS']):
+                match = [row for row in rows
+                         if row[0] == unq and row[1] == obshistid
+                         and np.abs(row[2]-xpix) < 1.0e-10]
+                self.assertEqual(len(match), 1)
+                self.assertAlmostEqual(match[0][3], np.degrees(ra), 10)
+
+        rows = cursor.execute('SELECT uniqueId, band, flux, snr '
+                              'FROM quiescent_flux').fetchall()
+        self.assertEqual(len(rows), 24)
+        for row in rows:
+            self.assertAlmostEqual(row[2], q_flux[row[1]][row[0]], 10)
+            self.assertAlmostEqual(row[3], q_snr[row[1]][row[0]], 10)
+
+        rows = cursor.execute('SELECT uniqueId, TAI FROM baseline_astrometry').fetchall()
+        self.assertEqual(len(rows), 4)
+        for row in rows:
+            self.assertAlmostEqual(row[1], 59580.0, 10)
+
+        rows = cursor.execute('SELECT obshistId, band FROM metadata').fetchall()
+        self.assertEqual(sorted(rows), [(11, 1), (12, 4)])
+
+        index_list = cursor.execute("SELECT name FROM sqlite_master "
+                                    "WHERE type='index'").fetchall()
+        self.assertEqual(len(index_list), 5)
+        conn.close()
+
+    def _write_test_data(self, writer_class, file_name, rng, **kwargs):
+        """
+        Write the same random data with any writer class; return the
+        data_cache that was written to alert_data
+        """
+        data_cache = {}
+        for i_tag, obshistid in enumerate((21, 20, 21, 22)):
+            n_obj = 6
+            tag = '%d_%d' % (obshistid, i_tag)
+            data_cache[tag] = {}
+            data_cache[tag]['uniqueId'] = rng.randint(0, 1000, size=n_obj)
+            for col_name in ('xPix', 'yPix', 'dflux', 'SNR', 'raICRS', 'decICRS'):
+                data_cache[tag][col_name] = rng.random_sample(n_obj)
+            data_cache[tag]['chipNum'] = rng.randint(0, 5000, size=n_obj)
+
+        with writer_class(file_name, **kwargs) as writer:
+            writer.write_metadata(np.array([20, 21, 22]),
+                                  np.array([59580.1, 59580.2, 59580.3]),
+                                  np.array([0, 2, 5]))
+            # write alert_data in two batches, so that obshistId 21
+            # appears in both
+            tag_list = sorted(data_cache.keys(), key=lambda tag: int(tag.split('_')[1]))
+            for batch in (tag_list[:2], tag_list[2:]):
+                writer.write_alert_data(dict((tag, data_cache[tag]) for tag in batch))
+            unq = np.array([9, 3, 5])
+            writer.write_quiescent_flux(unq, rng.random_sample((6, 3)),
+                                        rng.random_sample((6, 3)))
+            writer.write_baseline_astrometry(unq, rng.random_sample(3),
+                                             rng.random_sample(3),
+                                             rng.random_sample(3),
+                                             rng.random_sample(3),
+                                             rng.random_sample(3),
+                                             59580.0)
+        return data_cache
+
+    @unittest.skipIf(not _h5py_is_installed, "h5py is not installed")
+    def test_hdf5_matches_sqlite(self):
+        """
+        Write the same data with the sqlite and HDF5 writers; verify
+        that read_table() returns the same thing for both
+        """
+        sqlite_name = os.path.join(self.scratch_dir, 'writer_test_sqlite.db')
+        hdf5_name = os.path.join(self.scratch_dir, 'writer_test.h5')
+        self._write_test_data(AlertDataSqliteWriter, sqlite_name,
+                              np.random.RandomState(1173))
+        self._write_test_data(AlertDataHdf5Writer, hdf5_name,
+                              np.random.RandomState(1173),
+                              chunk_rows=4)
+
+        sort_keys = {'alert_data': ('obshistId', 'uniqueId', 'xPix'),
+                     'metadata': ('obshistId',),
+                     'quiescent_flux': ('uniqueId', 'band'),
+                     'baseline_astrometry': ('uniqueId',)}
+
+        for table_name in sort_keys:
+            sqlite_data = AlertDataSqliteWriter.read_table(sqlite_name, table_name)
+            hdf5_data = AlertDataHdf5Writer.read_table(hdf5_name, table_name)
+            self.assertGreater(len(sqlite_data), 0)
+            self.assertEqual(len(sqlite_data), len(hdf5_data))
+            self.assertEqual(sqlite_data.dtype, hdf5_data.dtype)
+            sqlite_data = np.sort(sqlite_data, order=sort_keys[table_name])
+            hdf5_data = np.sort(hdf5_data, order=sort_keys[table_name])
+            for col_name in sqlite_data.dtype.names:
+                np.testing.assert_array_equal(sqlite_data[col_name], hdf5_data[col_name])
+
+        # test the obshistId index
+        for obshistid in (20, 21, 22, 23):
+            sqlite_data = AlertDataSqliteWriter.read_table(sqlite_name, 'alert_data',
+                                                           obshistid=obshistid)
+            hdf5_data = AlertDataHdf5Writer.read_table(hdf5_name, 'alert_data',
+                                                       obshistid=obshistid)
+            self.assertEqual(len(sqlite_data), len(hdf5_data))
+            np.testing.assert_array_equal(np.sort(sqlite_data['xPix']),
+                                          np.sort(hdf5_data['xPix']))
+            if obshistid != 23:
+                self.assertGreater(len(hdf5_data), 0)
+            else:
+                self.assertEqual(len(hdf5_data), 0)
+
+        # read several obshistIds at once
+        control = AlertDataSqliteWriter.read_table(sqlite_name, 'alert_data')
+        control = control[np.isin(control['obshistId'], [20, 22])]
+        self.assertGreater(len(control), 0)
+        for reader_class, file_name in ((AlertDataSqliteWriter, sqlite_name),
+                                        (AlertDataHdf5Writer, hdf5_name)):
+            test_data = reader_class.read_table(file_name, 'alert_data',
+                                                obshistid=[22, 20, 23])
+            self.assertEqual(len(test_data), len(control))
+            np.testing.assert_array_equal(np.sort(test_data['xPix']),
+                                          np.sort(control['xPix']))
+            metadata = reader_class.read_table(file_name, 'metadata', obshistid=[20, 22])
+            np.testing.assert_array_equal(np.sort(metadata['obshistId']), [20, 22])
+
+        # test the uniqueId filter (querying the sqlite file a few
+        # uniqueIds at a time)
+        alert_data = AlertDataSqliteWriter.read_table(sqlite_name, 'alert_data')
+        unique_id = np.unique(alert_data['uniqueId'])[::3]
+        self.assertGreater(len(unique_id), 3)
+        max_query_ids = AlertDataSqliteWriter._max_query_ids
+        AlertDataSqliteWriter._max_query_ids = 2
+        try:
+            for table_name, obshistid in (('alert_data', None), ('alert_data', 21),
+                                          ('quiescent_flux', None),
+                                          ('baseline_astrometry', None)):
+                control = AlertDataSqliteWriter.read_table(sqlite_name, table_name,
+                                                           obshistid=obshistid)
+                control = control[np.isin(control['uniqueId'], unique_id)]
+                for reader_class, file_name in ((AlertDataSqliteWriter, sqlite_name),
+                                                (AlertDataHdf5Writer, hdf5_name)):
+                    test_data = reader_class.read_table(file_name, table_name,
+                                                        obshistid=obshistid,
+                                                        unique_id=unique_id)
+                    self.assertEqual(len(test_data), len(control), msg=table_name)
+                    np.testing.assert_array_equal(np.sort(test_data['uniqueId']),
+                                                  np.sort(control['uniqueId']))
+        finally:
+            AlertDataSqliteWriter._max_query_ids = max_query_ids
+
+        self.assertEqual(len(AlertDataHdf5Writer.read_table(hdf5_name, 'quiescent_flux',
+                                                            unique_id=[-1])), 0)
+
+        with h5py.File(hdf5_name, 'r') as in_file:
+            self.assertEqual(in_file['alert_data']['xPix'].dtype, np.float64)
+            self.assertEqual(in_file['alert_data']['xPix'].chunks, (4,))
+            # one run per obshistId per batch of alert_data
+            np.testing.assert_array_equal(in_file['alert_data_index']['obshistId'][()],
+                                          np.array([20, 21, 21, 22]))
+            self.assertEqual(in_file['alert_data_index']['count'][()].sum(),
+                             in_file['alert_data']['obshistId'].shape[0])
+
+            # the sorted per-source tables record the uniqueId of the
+            # first row of each block of chunk_rows rows; looking up
+            # a uniqueId only reads the blocks that can contain it
+            ast_id = in_file['baseline_astrometry']['uniqueId'][()]
+            np.testing.assert_array_equal(in_file['uniqueId_index']['baseline_astrometry'][()],
+                                          ast_id[::4])
+            for i_row in range(len(ast_id)):
+                row_slices = AlertDataHdf5Writer._id_block_slices(in_file['uniqueId_index'],
+                                                                  'baseline_astrometry',
+                                                                  len(ast_id), ast_id[i_row:i_row+1])
+                self.assertLessEqual(sum(ss.stop-ss.start for ss in row_slices), 8)
+                self.assertTrue(any(ss.start <= i_row < ss.stop for ss in row_slices))
+
+    @unittest.skipIf(not _h5py_is_installed, "h5py is not installed")
+    def test_hdf5_float32(self):
+        """
+        Test that use_float32 only affects the columns it should
+        """
+        hdf5_name = os.path.join(self.scratch_dir, 'writer_test_float32.h5')
+        data_cache = self._write_test_data(AlertDataHdf5Writer, hdf5_name,
+                                           np.random.RandomState(2231),
+                                           use_float32=True)
+        with h5py.File(hdf5_name, 'r') as in_file:
+            self.assertEqual(in_file['alert_data']['xPix'].dtype, np.float32)
+            self.assertEqual(in_file['alert_data']['snr'].dtype, np.float32)
+            self.assertEqual(in_file['alert_data']['ra'].dtype, np.float64)
+            self.assertEqual(in_file['metadata']['TAI'].dtype, np.float64)
+            self.assertEqual(in_file['quiescent_flux']['flux'].dtype, np.float32)
+
+        alert_data = AlertDataHdf5Writer.read_table(hdf5_name, 'alert_data')
+        n_truth = np.sum([len(data_cache[tag]['uniqueId']) for tag in data_cache])
+        self.assertEqual(len(alert_data), n_truth)
+        self.assertEqual(alert_data['xPix'].dtype, np.float64)
+
+
+class MemoryTestClass(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -28,8 +28,17 @@ from lsst.sims.catalogs.decorators import compound, cached
 
 from lsst.sims.catUtils.utils import AlertDataGenerator
 from lsst.sims.catUtils.utils import AvroAlertGenerator
+from lsst.sims.catUtils.utils import AvroAlertStream
+from lsst.sims.catUtils.utils import AvroAlertStreamWriter
+from lsst.sims.catUtils.utils import AlertDataHdf5Writer
 
 
+_h5py_is_installed = True
+try:
+    import h5py
+except ImportError:
+    _h5py_is_installed = False
+
 _avro_is_installed = True
 try:
     from avro.io import DatumReader
@@ -624,6 +633,345 @@ class AvroAlertTestCase(unittest.TestCase):
 
         self.assertEqual(alert_ct, len(true_alert_dict))
 
+    def test_avro_alert_generation_batch(self):
+        """
+        Test that write_alerts_batch produces the same alerts as
+        calling write_alerts on each obsHistID
+        """
+        dmag_cutoff = 0.005
+
+        star_db = StarAlertTestDBObj_avro(database=self.star_db_name, driver='sqlite')
+
+        log_file_name = tempfile.mktemp(dir=self.alert_data_output_dir, suffix='log.txt')
+        alert_gen = AlertDataGenerator(testing=True)
+
+        alert_gen.subdivide_obs(self.obs_list, htmid_level=6)
+
+        for htmid in alert_gen.htmid_list:
+            alert_gen.alert_data_from_htmid(htmid, star_db,
+                                            photometry_class=TestAlertsVarCat_avro,
+                                            output_prefix='alert_test',
+                                            output_dir=self.alert_data_output_dir,
+                                            dmag_cutoff=dmag_cutoff,
+                                            log_file_name=log_file_name)
+
+        obshistid_to_htmid = {}
+        for htmid in alert_gen.htmid_list:
+            for obs in alert_gen.obs_from_htmid(htmid):
+                obshistid = obs.OpsimMetaData['obsHistID']
+                if obshistid not in obshistid_to_htmid:
+                    obshistid_to_htmid[obshistid] = []
+                obshistid_to_htmid[obshistid].append(htmid)
+
+        obshistid_list = [obs.OpsimMetaData['obsHistID'] for obs in self.obs_list]
+        schema_dir = os.path.join(getPackageDir('sims_catUtils'), 'tests', 'testData', 'avroSchema')
+        sql_prefix_list = ['alert_test']
+
+        single_dir = os.path.join(self.avro_out_dir, 'single')
+        batch_dir = os.path.join(self.avro_out_dir, 'batch')
+        os.mkdir(single_dir)
+        os.mkdir(batch_dir)
+
+        avro_gen = AvroAlertGenerator()
+        avro_gen.load_schema(schema_dir)
+        for obshistid in obshistid_list:
+            avro_gen.write_alerts(obshistid, self.alert_data_output_dir,
+                                  sql_prefix_list,
+                                  obshistid_to_htmid[obshistid],
+                                  single_dir, 'test_avro', dmag_cutoff)
+
+        # use a tiny cache so that diaObjects get evicted
+        avro_gen = AvroAlertGenerator(diaobject_cache_size=5)
+        avro_gen.load_schema(schema_dir)
+        avro_gen.write_alerts_batch(obshistid_list, self.alert_data_output_dir,
+                                    sql_prefix_list, obshistid_to_htmid,
+                                    batch_dir, 'test_avro', dmag_cutoff)
+
+        (n_hits, n_misses) = avro_gen.diaobject_cache_stats
+        self.assertGreater(n_misses, 0)
+
+        def read_alerts(dir_name):
+            alert_dict = {}
+            for avro_file_name in os.listdir(dir_name):
+                full_name = os.path.join(dir_name, avro_file_name)
+                with DataFileReader(open(full_name, 'rb'), DatumReader()) as data_reader:
+                    for alert in data_reader:
+                        obshistid = alert['alertId'] >> 20
+                        key = (obshistid, alert['diaObject']['diaObjectId'])
+                        self.assertNotIn(key, alert_dict)
+                        alert_dict[key] = alert
+            return alert_dict
+
+        single_alerts = read_alerts(single_dir)
+        batch_alerts = read_alerts(batch_dir)
+        self.assertGreater(len(single_alerts), 10)
+        self.assertEqual(len(single_alerts), len(batch_alerts))
+        self.assertEqual(len(os.listdir(single_dir)), len(os.listdir(batch_dir)))
+
+        for key in single_alerts:
+            self.assertIn(key, batch_alerts)
+            single = single_alerts[key]
+            batch = batch_alerts[key]
+            self.assertEqual(single['l1dbId'], batch['l1dbId'])
+            self.assertEqual(single['diaSource']['ccdVisitId'], batch['diaSource']['ccdVisitId'])
+            for field in ('ra', 'decl', 'x', 'y', 'snr', 'psFlux', 'totFlux',
+                          'totFluxErr', 'diffFlux', 'diffFluxErr', 'midPointTai'):
+                self.assertEqual(single['diaSource'][field], batch['diaSource'][field],
+                                 msg=field)
+            for field in ('ra', 'decl', 'radecTai', 'pmRa', 'pmDecl', 'parallax'):
+                self.assertEqual(single['diaObject'][field], batch['diaObject'][field],
+                                 msg=field)
+
+    @unittest.skipIf(not _h5py_is_installed, "h5py is not installed")
+    def test_avro_alert_generation_hdf5(self):
+        """
+        Test that write_alerts_batch produces the same alerts from the
+        files written by AlertDataHdf5Writer as from the sqlite files
+        """
+        dmag_cutoff = 0.005
+
+        star_db = StarAlertTestDBObj_avro(database=self.star_db_name, driver='sqlite')
+        schema_dir = os.path.join(getPackageDir('sims_catUtils'), 'tests', 'testData', 'avroSchema')
+
+        log_file_name = tempfile.mktemp(dir=self.alert_data_output_dir, suffix='log.txt')
+        alert_gen = AlertDataGenerator(testing=True)
+        alert_gen.subdivide_obs(self.obs_list, htmid_level=6)
+
+        obshistid_to_htmid = {}
+        for htmid in alert_gen.htmid_list:
+            for writer_class in (None, AlertDataHdf5Writer):
+                alert_gen.alert_data_from_htmid(htmid, star_db,
+                                                photometry_class=TestAlertsVarCat_avro,
+                                                output_prefix='alert_test',
+                                                output_dir=self.alert_data_output_dir,
+                                                dmag_cutoff=dmag_cutoff,
+                                                log_file_name=log_file_name,
+                                                writer_class=writer_class)
+            for obs in alert_gen.obs_from_htmid(htmid):
+                obshistid = obs.OpsimMetaData['obsHistID']
+                if obshistid not in obshistid_to_htmid:
+                    obshistid_to_htmid[obshistid] = []
+                obshistid_to_htmid[obshistid].append(htmid)
+
+        obshistid_list = [obs.OpsimMetaData['obsHistID'] for obs in self.obs_list]
+        alert_dicts = []
+        for reader_class in (None, AlertDataHdf5Writer):
+            out_dir = tempfile.mkdtemp(dir=self.avro_out_dir)
+            avro_gen = AvroAlertGenerator()
+            avro_gen.load_schema(schema_dir)
+            avro_gen.write_alerts_batch(obshistid_list, self.alert_data_output_dir,
+                                        ['alert_test'], obshistid_to_htmid,
+                                        out_dir, 'test_avro', dmag_cutoff,
+                                        reader_class=reader_class)
+
+            alert_dict = {}
+            for avro_file_name in os.listdir(out_dir):
+                full_name = os.path.join(out_dir, avro_file_name)
+                with DataFileReader(open(full_name, 'rb'), DatumReader()) as data_reader:
+                    for alert in data_reader:
+                        alert_dict[alert['alertId']] = alert
+            alert_dicts.append(alert_dict)
+
+        sqlite_alerts, hdf5_alerts = alert_dicts
+        self.assertGreater(len(sqlite_alerts), 10)
+        self.assertEqual(sorted(sqlite_alerts.keys()), sorted(hdf5_alerts.keys()))
+        for alert_id in sqlite_alerts:
+            self.assertEqual(sqlite_alerts[alert_id]['l1dbId'], hdf5_alerts[alert_id]['l1dbId'])
+            for field in ('ra', 'decl', 'x', 'y', 'psFlux', 'totFlux', 'midPointTai'):
+                self.assertAlmostEqual(sqlite_alerts[alert_id]['diaSource'][field],
+                                       hdf5_alerts[alert_id]['diaSource'][field], 10, msg=field)
+            for field in ('ra', 'decl', 'pmRa', 'parallax'):
+                self.assertAlmostEqual(sqlite_alerts[alert_id]['diaObject'][field],
+                                       hdf5_alerts[alert_id]['diaObject'][field], 10, msg=field)
+
+    def test_avro_alert_streaming(self):
+        """
+        Test that streaming alert data through an AvroAlertStreamWriter
+        produces the same alerts as writing sqlite files and running
+        write_alerts_batch on them
+        """
+        dmag_cutoff = 0.005
+
+        star_db = StarAlertTestDBObj_avro(database=self.star_db_name, driver='sqlite')
+        schema_dir = os.path.join(getPackageDir('sims_catUtils'), 'tests', 'testData', 'avroSchema')
+
+        stream_dir = os.path.join(self.avro_out_dir, 'stream')
+        batch_dir = os.path.join(self.avro_out_dir, 'stream_batch')
+        os.mkdir(stream_dir)
+        os.mkdir(batch_dir)
+
+        log_file_name = tempfile.mktemp(dir=self.alert_data_output_dir, suffix='log.txt')
+        alert_gen = AlertDataGenerator(testing=True)
+        alert_gen.subdivide_obs(self.obs_list, htmid_level=6)
+
+        stream_gen = AvroAlertGenerator()
+        stream_gen.load_schema(schema_dir)
+        stream = AvroAlertStream(stream_gen, stream_dir, 'test_avro', dmag_cutoff,
+                                 queue_size=1, max_open_files=2)
+
+        obshistid_to_htmid = {}
+        try:
+            for htmid in alert_gen.htmid_list:
+                alert_gen.alert_data_from_htmid(htmid, star_db,
+                                                photometry_class=TestAlertsVarCat_avro,
+                                                output_prefix='alert_test',
+                                                output_dir=self.alert_data_output_dir,
+                                                dmag_cutoff=dmag_cutoff,
+                                                log_file_name=log_file_name)
+
+                alert_gen.alert_data_from_htmid(htmid, star_db,
+                                                photometry_class=TestAlertsVarCat_avro,
+                                                output_prefix='stream_test',
+                                                output_dir=stream_dir,
+                                                dmag_cutoff=dmag_cutoff,
+                                                log_file_name=log_file_name,
+                                                writer_class=AvroAlertStreamWriter,
+                                                writer_kwargs={'alert_stream': stream})
+
+                for obs in alert_gen.obs_from_htmid(htmid):
+                    obshistid = obs.OpsimMetaData['obsHistID']
+                    if obshistid not in obshistid_to_htmid:
+                        obshistid_to_htmid[obshistid] = []
+                    obshistid_to_htmid[obshistid].append(htmid)
+        finally:
+            stream.close()
+
+        obshistid_list = [obs.OpsimMetaData['obsHistID'] for obs in self.obs_list]
+        batch_gen = AvroAlertGenerator()
+        batch_gen.load_schema(schema_dir)
+        batch_gen.write_alerts_batch(obshistid_list, self.alert_data_output_dir,
+                                     ['alert_test'], obshistid_to_htmid,
+                                     batch_dir, 'test_avro', dmag_cutoff)
+
+        def read_alerts(dir_name):
+            alert_dict = {}
+            for avro_file_name in os.listdir(dir_name):
+                if not avro_file_name.endswith('.avro'):
+                    continue
+                full_name = os.path.join(dir_name, avro_file_name)
+                with DataFileReader(open(full_name, 'rb'), DatumReader()) as data_reader:
+                    for alert in data_reader:
+                        obshistid = alert['diaSource']['ccdVisitId'] % 10**7
+                        key = (obshistid, alert['diaObject']['diaObjectId'])
+                        self.assertNotIn(key, alert_dict)
+                        alert_dict[key] = alert
+            return alert_dict
+
+        batch_alerts = read_alerts(batch_dir)
+        stream_alerts = read_alerts(stream_dir)
+        self.assertGreater(len(batch_alerts), 10)
+        self.assertEqual(len(batch_alerts), len(stream_alerts))
+
+        # one file per obsHistID, as written by write_alerts_batch
+        stream_files = set(file_name for file_name in os.listdir(stream_dir)
+                           if file_name.endswith('.avro'))
+        for obshistid in stream.alert_counts:
+            self.assertIn(os.path.basename(stream.avro_file_name(obshistid)), stream_files)
+        self.assertEqual(len(stream_files), len(stream.alert_counts))
+        self.assertEqual(sum(stream.alert_counts.values()), len(stream_alerts))
+
+        # alertIds are running counts within each obsHistID
+        def alert_ids(alert_dict):
+            id_dict = {}
+            for key in alert_dict:
+                if key[0] not in id_dict:
+                    id_dict[key[0]] = []
+                id_dict[key[0]].append(alert_dict[key]['alertId'])
+            return dict((obshistid, sorted(id_dict[obshistid])) for obshistid in id_dict)
+
+        stream_ids = alert_ids(stream_alerts)
+        self.assertEqual(alert_ids(batch_alerts), stream_ids)
+        for obshistid in stream_ids:
+            self.assertEqual(stream_ids[obshistid],
+                             [(obshistid << 20) + i_alert
+                              for i_alert in range(1, len(stream_ids[obshistid])+1)])
+
+        for key in batch_alerts:
+            self.assertIn(key, stream_alerts)
+            batch = batch_alerts[key]
+            streamed = stream_alerts[key]
+            self.assertEqual(batch['l1dbId'], streamed['l1dbId'])
+            self.assertEqual(batch['diaSource']['ccdVisitId'], streamed['diaSource']['ccdVisitId'])
+            self.assertEqual(batch['diaSource']['filterName'], streamed['diaSource']['filterName'])
+            for field in ('ra', 'decl', 'x', 'y', 'snr', 'psFlux', 'totFlux',
+                          'totFluxErr', 'diffFlux', 'diffFluxErr', 'midPointTai'):
+                self.assertAlmostEqual(batch['diaSource'][field], streamed['diaSource'][field],
+                                       10, msg=field)
+            for field in ('ra', 'decl', 'radecTai', 'pmRa', 'pmDecl', 'parallax'):
+                self.assertAlmostEqual(batch['diaObject'][field], streamed['diaObject'][field],
+                                       10, msg=field)
+
+
+class AvroRecordConstructionTestCase(unittest.TestCase):
+    """
+    Test the construction of diaSource and diaObject records
+    from columnar data (this does not require avro)
+    """
+
+    def test_diasource_ids(self):
+        gen = AvroAlertGenerator()
+        dtype = np.dtype([('uniqueId', int), ('obshistId', int),
+                          ('xPix', float), ('yPix', float),
+                          ('chipNum', int), ('dflux', float),
+                          ('tot_snr', float), ('ra', float), ('dec', float),
+                          ('band', int), ('TAI', float),
+                          ('quiescent_flux', float), ('quiescent_snr', float)])
+
+        rng = np.random.RandomState(8812)
+        data = np.zeros(6, dtype=dtype)
+        data['uniqueId'] = [11, 12, 11, 13, 11, 12]
+        data['band'] = [0, 1, 2, 3, 4, 5]
+        data['chipNum'] = rng.randint(0, 200, size=6)
+        for col_name in ('xPix', 'yPix', 'dflux', 'tot_snr', 'ra', 'dec', 'TAI',
+                         'quiescent_flux', 'quiescent_snr'):
+            data[col_name] = rng.random_sample(6)+1.0
+
+        source_list = gen._create_sources(77, data)
+        self.assertEqual(len(source_list), len(data))
+        ct_list = [src['diaSourceId'] - (src['diaObjectId'] << gen._n_bit_shift)
+                   for src in source_list]
+        self.assertEqual(ct_list, [1, 1, 2, 1, 3, 2])
+
+        # counters persist between calls
+        source_list_2 = gen._create_sources(78, data[:2])
+        ct_list = [src['diaSourceId'] - (src['diaObjectId'] << gen._n_bit_shift)
+                   for src in source_list_2]
+        self.assertEqual(ct_list, [4, 3])
+
+        for src, row in zip(source_list, data):
+            self.assertIsInstance(src['diaSourceId'], numbers.Integral)
+            self.assertEqual(src['diaObjectId'], row['uniqueId'])
+            self.assertEqual(src['ccdVisitId'], row['chipNum']*10**7 + 77)
+            self.assertEqual(src['filterName'], 'ugrizy'[row['band']])
+            tot_flux = row['dflux'] + row['quiescent_flux']
+            full_noise = tot_flux/row['tot_snr']
+            diff_noise = np.sqrt(full_noise**2 +
+                                 (row['quiescent_flux']/row['quiescent_snr'])**2)
+            self.assertAlmostEqual(src['totFlux'], tot_flux, 10)
+            self.assertAlmostEqual(src['totFluxErr'], full_noise, 10)
+            self.assertAlmostEqual(src['diffFluxErr'], diff_noise, 10)
+            self.assertAlmostEqual(src['snr'], np.abs(row['dflux']/diff_noise), 10)
+            self.assertGreaterEqual(src['flags'], 10)
+            self.assertLess(src['flags'], 1000)
+
+        self.assertEqual(gen._create_sources(77, data[:0]), [])
+
+    def test_diaobjects(self):
+        gen = AvroAlertGenerator()
+        data = np.zeros(3, dtype=gen._diaobject_dtype)
+        data['uniqueId'] = [5, 9, 14]
+        data['ra'] = [1.0, 2.0, 3.0]
+        data['pmRA'] = [0.1, 0.2, 0.3]
+        obj_dict = gen._create_objects(data)
+        self.assertEqual(sorted(obj_dict.keys()), [5, 9, 14])
+        for row in data:
+            obj = obj_dict[row['uniqueId']]
+            self.assertEqual(obj['diaObjectId'], row['uniqueId'])
+            self.assertEqual(obj['ra'], row['ra'])
+            self.assertEqual(obj['pmRa'], row['pmRA'])
+            self.assertEqual(obj['pmParallaxNdata'], 0)
+        self.assertEqual(gen._create_objects(data[:0]), {})
+
 
 class MemoryTestClass(lsst.utils.tests.MemoryTestCase):
     pass
@@ -0,0 +1,173 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import lsst.utils.tests
+
+from lsst.sims.photUtils import BandpassDict, Sed
+from lsst.sims.catUtils.mixins import ExtinctionTable, PhotometryStars
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+class ExtinctionTableTestCatalog(PhotometryStars):
+    """
+    A minimal stand-in for an InstanceCatalog that only knows
+    the columns needed to load stellar SEDs
+    """
+
+    def __init__(self, columns):
+        self._columns = columns
+        self._actually_calculated_columns = ['lsst_%s' % bp for bp in 'ugrizy']
+
+    def column_by_name(self, name):
+        return self._columns[name]
+
+
+class ExtinctionTableTestCase(unittest.TestCase):
+
+    longMessage = True
+
+    @classmethod
+    def setUpClass(cls):
+        cls.bp_dict = BandpassDict.loadTotalBandpassesFromFiles()
+        cls.scratch_dir = tempfile.mkdtemp(prefix='test_extinction_table_')
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.path.exists(cls.scratch_dir):
+            shutil.rmtree(cls.scratch_dir)
+
+    def test_stellar_magnitudes(self):
+        """
+        Test that PhotometryStars returns the same magnitudes with and
+        without an ExtinctionTable
+        """
+        sed_names = np.array(['km20_5750.fits_g40_5790', 'kp10_9250.fits_g40_9250',
+                              'bergeron_6500_85.dat_6700', 'km20_5750.fits_g40_5790',
+                              'kp10_9250.fits_g40_9250'])
+        columns = {'sedFilename': sed_names,
+                   'magNorm': np.array([20.0, 21.0, 22.0, 20.5, 18.0]),
+                   'galacticAv': np.array([0.1, 0.25, 0.3, 1.17, 12.0])}
+        col_names = ['lsst_%s' % bp for bp in 'ugrizy']
+
+        control = ExtinctionTableTestCatalog(columns)
+        control_mags = control._quiescentMagnitudeGetter(self.bp_dict, col_names)
+
+        ext_table = ExtinctionTable(tolerance=1.0e-4)
+        cat = ExtinctionTableTestCatalog(columns)
+        cat.extinctionTable = ext_table
+        test_mags = cat._quiescentMagnitudeGetter(self.bp_dict, col_names)
+        self.assertEqual(test_mags.shape, control_mags.shape)
+        for name in np.unique(sed_names):
+            self.assertLessEqual(ext_table.max_error(self.bp_dict, name), ext_table.tolerance)
+
+        # the last star is beyond av_max, so the tables are extended
+        np.testing.assert_allclose(test_mags, control_mags, rtol=0.0, atol=2.0*ext_table.tolerance)
+        self.assertFalse(hasattr(cat, '_sedList'))
+
+    def test_persistence(self):
+        """
+        Test that tables are written to cache_dir, read back from it,
+        and rebuilt if their inputs change
+        """
+        cache_dir = os.path.join(self.scratch_dir, 'persistence')
+        rng = np.random.RandomState(17)
+        av = rng.uniform(0.0, 3.0, size=20)
+        names = ['km20_5750.fits_g40_5790']*20
+
+        ext_table = ExtinctionTable(cache_dir=cache_dir, av_max=3.0)
+        control = ext_table.extinction(self.bp_dict, names, av)
+        self.assertEqual(control.shape, (20, len(self.bp_dict)))
+        self.assertTrue((control > 0.0).all())
+        file_list = os.listdir(cache_dir)
+        self.assertEqual(len(file_list), 1)
+
+        # a new instance reads the table rather than building it
+        new_table = ExtinctionTable(cache_dir=cache_dir, av_max=3.0)
+
+        def fail(*args, **kwargs):
+            raise RuntimeError('the table should have been read from disk')
+
+        new_table._build_table = fail
+        np.testing.assert_array_equal(new_table.extinction(self.bp_dict, names, av), control)
+
+        # different bandpasses or R_v need different tables
+        r_dict = BandpassDict([self.bp_dict['r']], ['r'])
+        np.testing.assert_allclose(ext_table.extinction(r_dict, names, av)[:, 0],
+                                   control[:, 2], rtol=0.0, atol=2.0*ext_table.tolerance)
+        ext_table.extinction(self.bp_dict, names, av, rv=2.5)
+        self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+        # compare with the exact calculation
+        exact = ext_table.exact_magnitudes(self.bp_dict, names[0], av)
+        exact -= ext_table.exact_magnitudes(self.bp_dict, names[0], [0.0])
+        np.testing.assert_allclose(control, exact, rtol=0.0, atol=2.0*ext_table.tolerance)
+
+    def test_extension(self):
+        """
+        Test that tables are extended to cover large A_v, with few nodes,
+        and that A_v are only evaluated exactly if they are negative
+        """
+        name = 'km20_5750.fits_g40_5790'
+        ext_table = ExtinctionTable(av_max=1.0)
+        av_grid = ext_table._get_table(self.bp_dict, name, 3.1, 1.0)[0]
+        self.assertGreaterEqual(av_grid[-1], 1.0)
+        self.assertLess(av_grid[-1], 2.0)
+
+        rng = np.random.RandomState(44)
+        av = rng.uniform(0.0, 25.0, size=30)
+        av[3] = -0.1
+        exact = ext_table.exact_magnitudes(self.bp_dict, name, av)
+        n_exact = []
+        exact_magnitudes = ext_table.exact_magnitudes
+
+        def counting_exact(bandpassDict, name, av, rv=3.1):
+            n_exact.append(len(np.atleast_1d(av)))
+            return exact_magnitudes(bandpassDict, name, av, rv=rv)
+
+        ext_table.exact_magnitudes = counting_exact
+        mags = ext_table.magnitudes(self.bp_dict, [name]*len(av), np.zeros(len(av)), av)
+        np.testing.assert_allclose(mags, exact, rtol=0.0, atol=2.0*ext_table.tolerance)
+
+        av_grid, mag_grid, error = ext_table._get_table(self.bp_dict, name, 3.1, av.max())
+        self.assertGreaterEqual(av_grid[-1], av.max())
+        self.assertTrue((error <= ext_table.tolerance).all())
+        # building the extension and evaluating the one negative A_v
+        self.assertLess(sum(n_exact), 200)
+        self.assertEqual(n_exact[-1], 1)
+
+    def test_registered_sed(self):
+        """
+        Test that SEDs that are not in the SED library can be tabulated
+        """
+        wavelen = np.arange(200.0, 1500.0, 0.5)
+        flat_sed = Sed(wavelen=wavelen, flambda=np.ones(len(wavelen)))
+        ext_table = ExtinctionTable(av_max=2.0)
+        ext_table.register_sed('flat', flat_sed)
+        mags = ext_table.magnitudes(self.bp_dict, ['flat', 'None'], [20.0, 20.0], [0.5, 0.5])
+        self.assertTrue(np.isfinite(mags[0]).all())
+        self.assertTrue(np.isnan(mags[1]).all())
+
+        a_x, b_x = flat_sed.setupCCM_ab()
+        wv, fl = flat_sed.addDust(a_x, b_x, A_v=0.5, wavelen=wavelen, flambda=np.ones(len(wavelen)))
+        dusty_sed = Sed(wavelen=wv, flambda=fl)
+        control = np.array(self.bp_dict.magListForSed(dusty_sed)) - \
+                  np.array(self.bp_dict.magListForSed(flat_sed))
+        np.testing.assert_allclose(ext_table.extinction(self.bp_dict, ['flat'], [0.5])[0],
+                                   control, rtol=0.0, atol=1.0e-3)
+
+        with self.assertRaises(RuntimeError):
+            ExtinctionTable(av_max=0.0)
+
+
+class MemoryTestClass(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
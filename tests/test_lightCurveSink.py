@@ -0,0 +1,119 @@
+import unittest
+import os
+import tempfile
+import shutil
+import numpy as np
+import lsst.utils.tests
+
+from lsst.sims.catUtils.utils import LightCurveStore
+from lsst.sims.catUtils.utils import LightCurveHdf5Sink, LightCurveHdf5Reader
+
+_h5py_is_installed = True
+try:
+    import h5py
+except ImportError:
+    _h5py_is_installed = False
+
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+class LightCurveSinkTestCase(unittest.TestCase):
+
+    longMessage = True
+
+    def setUp(self):
+        self.scratch_dir = tempfile.mkdtemp(dir=ROOT, prefix='lightCurveSink')
+
+    def tearDown(self):
+        if os.path.exists(self.scratch_dir):
+            shutil.rmtree(self.scratch_dir)
+
+    @unittest.skipIf(not _h5py_is_installed, "h5py is not installed")
+    def test_round_trip(self):
+        """
+        Stream several chunks of light curves (with objects that
+        appear in more than one chunk) to a file and verify that
+        the reader returns the same light curves as accumulating
+        everything in memory
+        """
+        rng = np.random.RandomState(5513)
+        control = LightCurveStore()
+        control_truth = {}
+        file_name = os.path.join(self.scratch_dir, 'lc.h5')
+        with LightCurveHdf5Sink(file_name, chunk_rows=16) as sink:
+            for i_chunk in range(4):
+                store = LightCurveStore()
+                truth = {}
+                for i_visit in range(15):
+                    band = 'ugrizy'[rng.randint(0, 6)]
+                    mjd = 59580.0 + rng.random_sample()*1000.0
+                    unique_id = rng.choice(np.arange(40)*1024+5, size=rng.randint(1, 15),
+                                           replace=False)
+                    mag = rng.random_sample(len(unique_id))*5.0 + 18.0
+                    sigma = rng.random_sample(len(unique_id))*0.1
+                    store.append(unique_id, band, mjd, mag, sigma)
+                    control.append(unique_id, band, mjd, mag, sigma)
+                    for uid in unique_id:
+                        truth[uid] = '{"m": "test", "p": {"chunk": %d, "uid": %d}}' % (i_chunk, uid)
+                        if uid not in control_truth:
+                            control_truth[uid] = truth[uid]
+                sink.write(store.get_result(), truth_dict=truth)
+
+            with self.assertRaises(RuntimeError):
+                sink.write(LightCurveStore(brightness_name='flux').get_result())
+
+        with self.assertRaises(RuntimeError):
+            LightCurveHdf5Sink(file_name)
+
+        control = control.get_result()
+        with LightCurveHdf5Reader(file_name) as reader:
+            self.assertEqual(reader.brightness_name, 'mag')
+            self.assertEqual(len(reader), len(control))
+            self.assertEqual(list(reader), list(control))
+            for uid in control:
+                self.assertIn(uid, reader)
+                test_lc = reader[uid]
+                control_lc = control[uid]
+                self.assertEqual(set(test_lc.keys()), set(control_lc.keys()))
+                for bp in control_lc:
+                    for col_name in ('mjd', 'mag', 'error'):
+                        np.testing.assert_array_equal(test_lc[bp][col_name],
+                                                      control_lc[bp][col_name])
+                self.assertEqual(reader.truth(uid), control_truth[uid])
+
+            self.assertNotIn(6, reader)
+            with self.assertRaises(KeyError):
+                reader[6]
+            with self.assertRaises(KeyError):
+                reader.truth(6)
+
+    @unittest.skipIf(not _h5py_is_installed, "h5py is not installed")
+    def test_dict_truth(self):
+        """
+        Test that dicts of truth information (as produced by the
+        SNIaLightCurveGenerator) survive the round trip
+        """
+        file_name = os.path.join(self.scratch_dir, 'sn_lc.h5')
+        store = LightCurveStore(brightness_name='flux')
+        store.append(9, 'r', [1.0, 2.0], [3.0, 4.0], [0.1, 0.2])
+        truth = {9: {'t0': np.float64(55.0), 'z': 0.5, 'c': 0.01}}
+        with LightCurveHdf5Sink(file_name, brightness_name='flux', compression=None) as sink:
+            sink.write(store.get_result(), truth_dict=truth)
+
+        with LightCurveHdf5Reader(file_name) as reader:
+            np.testing.assert_array_equal(reader[9]['r']['flux'], [3.0, 4.0])
+            self.assertEqual(reader.truth(9), {'t0': 55.0, 'z': 0.5, 'c': 0.01})
+
+
+class MemoryTestClass(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,132 @@
+import unittest
+import numpy as np
+import lsst.utils.tests
+
+from lsst.sims.catUtils.utils import LightCurveStore, LightCurveResult
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+class LightCurveStoreTestCase(unittest.TestCase):
+
+    longMessage = True
+
+    def test_store(self):
+        """
+        Add points in random order and verify that the result matches
+        a dict of light curves built by hand
+        """
+        rng = np.random.RandomState(8812)
+        store = LightCurveStore(block_size=7)
+        control = {}
+        for i_visit in range(60):
+            band = 'ugrizy'[rng.randint(0, 6)]
+            mjd = 59580.0 + rng.random_sample()*1000.0
+            unique_id = rng.choice(np.arange(50)*1024+17, size=rng.randint(0, 20), replace=False)
+            mag = rng.random_sample(len(unique_id))*5.0 + 18.0
+            sigma = rng.random_sample(len(unique_id))*0.1
+            store.append(unique_id, band, mjd, mag, sigma)
+
+            for uid, mm, ss in zip(unique_id, mag, sigma):
+                if uid not in control:
+                    control[uid] = {}
+                if band not in control[uid]:
+                    control[uid][band] = []
+                control[uid][band].append((mjd, mm, ss))
+
+        n_points = sum([len(control[uid][bp]) for uid in control for bp in control[uid]])
+        self.assertEqual(len(store), n_points)
+        self.assertGreaterEqual(store._capacity, n_points)
+        self.assertEqual(store._capacity % 7, 0)
+
+        result = store.get_result()
+        self.assertIsInstance(result, LightCurveResult)
+        self.assertEqual(len(result.data), n_points)
+        self.assertEqual(len(result), len(control))
+        self.assertEqual(set(result), set(control))
+        np.testing.assert_array_equal(result.unique_id, np.sort(list(control.keys())))
+        self.assertEqual(result.offsets[-1], n_points)
+
+        for i_obj, uid in enumerate(result.unique_id):
+            rows = result.data[result.offsets[i_obj]:result.offsets[i_obj+1]]
+            np.testing.assert_array_equal(rows['uniqueId'], uid)
+
+        for uid in control:
+            self.assertIn(uid, result)
+            lc = result[uid]
+            self.assertEqual(set(lc.keys()), set(control[uid].keys()))
+            for bp in control[uid]:
+                points = sorted(control[uid][bp])
+                np.testing.assert_array_equal(lc[bp]['mjd'], [pp[0] for pp in points])
+                np.testing.assert_array_equal(lc[bp]['mag'], [pp[1] for pp in points])
+                np.testing.assert_array_equal(lc[bp]['error'], [pp[2] for pp in points])
+                np.testing.assert_array_equal(result.light_curve(uid, bp)['mjd'], lc[bp]['mjd'])
+
+        self.assertNotIn(1, result)
+        self.assertNotIn('a', result)
+        with self.assertRaises(KeyError):
+            result[1]
+        with self.assertRaises(KeyError):
+            result[10**7]
+
+    def test_one_object(self):
+        """
+        Test adding many points for one object at once and
+        naming the brightness column 'flux'
+        """
+        store = LightCurveStore(brightness_name='flux')
+        mjd = np.array([5.0, 3.0, 4.0])
+        store.append(11, 'r', mjd, mjd*2.0, mjd*0.1)
+        store.append(11, 'g', 1.0, 2.0, 0.1)
+        store.append(12, 'r', [], [], [])
+        result = store.get_result()
+        self.assertEqual(len(result), 1)
+        self.assertEqual(list(result), [11])
+        np.testing.assert_array_equal(result[11]['r']['mjd'], [3.0, 4.0, 5.0])
+        np.testing.assert_array_equal(result[11]['r']['flux'], [6.0, 8.0, 10.0])
+        np.testing.assert_array_equal(result[11]['g']['flux'], [2.0])
+        self.assertEqual(len(result.light_curve(11, 'z')), 0)
+
+    def test_extend(self):
+        """
+        Test merging LightCurveResults into one store
+        """
+        store_1 = LightCurveStore()
+        store_1.append([1, 2, 3], 'g', 10.0, [20.0, 21.0, 22.0], [0.1, 0.2, 0.3])
+        store_1.append([2, 3], 'r', 11.0, [19.0, 18.0], [0.4, 0.5])
+        store_2 = LightCurveStore()
+        store_2.append([3, 4], 'i', 9.0, [17.0, 16.0], [0.6, 0.7])
+        store_2.append([3], 'g', 8.0, [15.0], [0.8])
+
+        merged = LightCurveStore()
+        merged.extend(store_1.get_result())
+        merged.extend(store_2.get_result())
+        result = merged.get_result()
+        self.assertEqual(list(result), [1, 2, 3, 4])
+        np.testing.assert_array_equal(result[3]['g']['mjd'], [8.0, 10.0])
+        np.testing.assert_array_equal(result[3]['g']['mag'], [15.0, 22.0])
+        np.testing.assert_array_equal(result[3]['r']['error'], [0.5])
+        np.testing.assert_array_equal(result[4]['i']['mag'], [16.0])
+
+        with self.assertRaises(RuntimeError):
+            merged.extend(LightCurveStore(brightness_name='flux').get_result())
+
+    def test_empty(self):
+        result = LightCurveStore().get_result()
+        self.assertEqual(len(result), 0)
+        self.assertEqual(list(result), [])
+        self.assertNotIn(5, result)
+
+        with self.assertRaises(RuntimeError):
+            LightCurveStore(block_size=0)
+
+
+class MemoryTestClass(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
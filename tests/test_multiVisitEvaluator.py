@@ -0,0 +1,219 @@
+import unittest
+import os
+import numpy as np
+import tempfile
+import sqlite3
+import shutil
+import numbers
+from collections import OrderedDict
+import lsst.utils.tests
+
+from lsst.utils import getPackageDir
+from lsst.sims.utils.CodeUtilities import sims_clean_up
+from lsst.sims.catalogs.decorators import register_method
+from lsst.sims.catalogs.db import CatalogDBObject
+from lsst.sims.catUtils.utils import ObservationMetaDataGenerator
+from lsst.sims.catUtils.utils import AlertStellarVariabilityCatalog
+from lsst.sims.catUtils.utils import StellarAlertDBObjMixin
+from lsst.sims.catUtils.utils import MultiVisitEvaluator
+from lsst.sims.utils import _pupilCoordsFromRaDec
+from lsst.sims.coordUtils import chipNameFromPupilCoords
+from lsst.sims.photUtils import BandpassDict
+
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+class EvaluatorTestDBObj(StellarAlertDBObjMixin, CatalogDBObject):
+    objid = 'multi_visit_evaluator_stars'
+    tableid = 'stars'
+    idColKey = 'simobjid'
+    raColName = 'ra'
+    decColName = 'dec'
+    objectTypeId = 0
+    columns = [('raJ2000', 'ra*0.01745329252'),
+               ('decJ2000', 'dec*0.01745329252'),
+               ('parallax', 'px*0.01745329252/3600.0'),
+               ('properMotionRa', 'pmra*0.01745329252/3600.0'),
+               ('properMotionDec', 'pmdec*0.01745329252/3600.0'),
+               ('radialVelocity', 'vrad'),
+               ('variabilityParameters', 'varParamStr', str, 100)]
+
+
+class EvaluatorTestVarCat(AlertStellarVariabilityCatalog):
+
+    @register_method('evaluator_test')
+    def applyEvaluatorTest(self, valid_dexes, params, expmjd, variability_cache=None):
+        if len(params) == 0:
+            return np.array([[], [], [], [], [], []])
+
+        if isinstance(expmjd, numbers.Number):
+            dMags_out = np.zeros((6, self.num_variable_obj(params)))
+        else:
+            dMags_out = np.zeros((6, self.num_variable_obj(params), len(expmjd)))
+
+        for i_star in range(self.num_variable_obj(params)):
+            if params['amp'][i_star] is not None:
+                dmags = params['amp'][i_star]*np.cos(params['per'][i_star]*expmjd)
+                for i_filter in range(6):
+                    dMags_out[i_filter][i_star] = dmags*(1.0+0.1*i_filter)
+
+        return dMags_out
+
+
+class MultiVisitEvaluatorTestCase(unittest.TestCase):
+
+    longMessage = True
+
+    @classmethod
+    def setUpClass(cls):
+        opsim_db = os.path.join(getPackageDir('sims_data'),
+                                'OpSimData',
+                                'opsimblitz1_1133_sqlite.db')
+
+        rng = np.random.RandomState(7123)
+        obs_gen = ObservationMetaDataGenerator(database=opsim_db)
+        obs_list = obs_gen.getObservationMetaData(night=(0, 2))
+        obs_0 = obs_list[0]
+        # keep visits that overlap the first one so that some
+        # stars land on a detector more than once
+        cls.obs_list = [obs for obs in obs_list
+                        if obs.OpsimMetaData['fieldID'] == obs_0.OpsimMetaData['fieldID']]
+        cls.obs_list += list(rng.choice(obs_list, 4, replace=False))
+
+        cls.scratch_dir = tempfile.mkdtemp(dir=ROOT, prefix='multiVisitEvaluator')
+        cls.db_name = os.path.join(cls.scratch_dir, 'stars.db')
+
+        n_stars = 50
+        rr = rng.random_sample(n_stars)*1.5
+        theta = rng.random_sample(n_stars)*2.0*np.pi
+        ra = obs_0.pointingRA + rr*np.cos(theta)
+        dec = obs_0.pointingDec + rr*np.sin(theta)
+        mags = rng.random_sample((6, n_stars))*5.0 + 17.0
+        px = rng.random_sample(n_stars)*0.1
+        pmra = rng.random_sample(n_stars)*50.0 + 100.0
+        pmdec = rng.random_sample(n_stars)*50.0 + 100.0
+        vrad = rng.random_sample(n_stars)*600.0 - 300.0
+        amp = rng.random_sample(n_stars)
+        per = rng.random_sample(n_stars)*0.25
+
+        with sqlite3.connect(cls.db_name) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''CREATE TABLE stars
+                              (simobjid int, htmid int, ra real, dec real,
+                               umag real, gmag real, rmag real,
+                               imag real, zmag real, ymag real,
+                               px real, pmra real, pmdec real,
+                               vrad real, varParamStr text)''')
+            rows = []
+            for i_star in range(n_stars):
+                var_param_str = ('{"m":"evaluator_test", "p":{"amp":%.4f, "per": %.4f}}'
+                                 % (amp[i_star], per[i_star]))
+                rows.append((i_star, 0, ra[i_star], dec[i_star]) +
+                            tuple(mags[:, i_star]) +
+                            (px[i_star], pmra[i_star], pmdec[i_star], vrad[i_star],
+                             var_param_str))
+            cursor.executemany('INSERT INTO stars VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', rows)
+            conn.commit()
+
+        cls.bp_dict = BandpassDict.loadTotalBandpassesFromFiles()
+
+    @classmethod
+    def tearDownClass(cls):
+        sims_clean_up()
+        if os.path.exists(cls.scratch_dir):
+            shutil.rmtree(cls.scratch_dir)
+
+    def test_evaluator_vs_catalogs(self):
+        """
+        Compare the output of MultiVisitEvaluator with the output of
+        one alert catalog per visit
+        """
+        db_obj = EvaluatorTestDBObj(database=self.db_name, driver='sqlite')
+        photometry_catalog = EvaluatorTestVarCat(db_obj, obs_metadata=self.obs_list[0],
+                                                 column_outputs=['lsst_u'])
+        col_names = ['raJ2000', 'decJ2000', 'umag', 'gmag', 'rmag', 'imag', 'zmag', 'ymag',
+                     'properMotionRa', 'properMotionDec', 'parallax', 'radialVelocity',
+                     'varParamStr', 'simobjid', 'htmid']
+        chunk = db_obj.query_columns(colnames=col_names, chunk_size=None)
+        if not isinstance(chunk, np.ndarray):
+            chunk = next(chunk)
+
+        evaluator = MultiVisitEvaluator(photometry_catalog, self.obs_list,
+                                        bandpass_dict=self.bp_dict)
+
+        col_list = ['uniqueId', 'raICRS', 'decICRS', 'flux', 'dflux', 'SNR',
+                    'chipNum', 'xPix', 'yPix']
+        dmag_arr = evaluator.delta_magnitudes(chunk)
+        self.assertEqual(dmag_arr.shape, (len(self.obs_list), 6, len(chunk)))
+        output = evaluator.evaluate(chunk, col_list, dmag_arr=dmag_arr)
+
+        for col_name in col_list:
+            if col_name == 'uniqueId':
+                self.assertEqual(output[col_name].shape, (len(chunk),))
+            else:
+                self.assertEqual(output[col_name].shape, (len(chunk), len(self.obs_list)))
+
+        n_on_chip = 0
+        for i_obs, obs in enumerate(self.obs_list):
+            x_pup, y_pup = _pupilCoordsFromRaDec(chunk['raJ2000'], chunk['decJ2000'],
+                                                 pm_ra=chunk['properMotionRa'],
+                                                 pm_dec=chunk['properMotionDec'],
+                                                 parallax=chunk['parallax'],
+                                                 v_rad=chunk['radialVelocity'],
+                                                 obs_metadata=obs)
+            chip_name = chipNameFromPupilCoords(x_pup, y_pup, camera=photometry_catalog.camera)
+
+            cat = EvaluatorTestVarCat(db_obj, obs_metadata=obs)
+            cat.lsstBandpassDict = self.bp_dict
+            column_cache = {}
+            column_cache['deltaMagAvro'] = OrderedDict([('delta_%smag' % bp, dmag_arr[i_obs][i_bp])
+                                                        for i_bp, bp in enumerate('ugrizy')])
+            column_cache['chipName'] = chip_name
+            column_cache['pupilFromSky'] = OrderedDict([('x_pupil', x_pup), ('y_pupil', y_pup)])
+
+            for truth, chunk_map in cat.iter_catalog_chunks(query_cache=[chunk],
+                                                            column_cache=column_cache):
+                np.testing.assert_array_equal(output['uniqueId'], truth[chunk_map['uniqueId']])
+                for col_name in ('raICRS', 'decICRS', 'flux', 'dflux', 'SNR'):
+                    np.testing.assert_allclose(output[col_name][:, i_obs],
+                                               truth[chunk_map[col_name]],
+                                               rtol=1.0e-10, atol=0.0, err_msg=col_name)
+                np.testing.assert_array_equal(output['chipNum'][:, i_obs],
+                                              truth[chunk_map['chipNum']])
+                for col_name in ('xPix', 'yPix'):
+                    np.testing.assert_allclose(output[col_name][:, i_obs],
+                                               truth[chunk_map[col_name]],
+                                               rtol=1.0e-10, atol=1.0e-10, err_msg=col_name)
+            n_on_chip += (output['chipNum'][:, i_obs] > 0).sum()
+
+        self.assertGreater(n_on_chip, 0)
+
+        # evaluating a subset of (object, visit) pairs gives the same answer
+        obj_dex = np.array([3, 7, 3, 11])
+        visit_dex = np.array([0, 0, 2, 1])
+        pairs = evaluator.evaluate_pairs(chunk, obj_dex, visit_dex, ['flux', 'SNR', 'raICRS'],
+                                         dmag_arr=dmag_arr)
+        for col_name in ('flux', 'SNR', 'raICRS'):
+            np.testing.assert_array_equal(pairs[col_name], output[col_name][obj_dex, visit_dex])
+
+        with self.assertRaises(RuntimeError):
+            evaluator.evaluate_pairs(chunk, obj_dex, visit_dex[:2], ['flux'])
+
+    def test_chip_num(self):
+        chip_name = np.array(['R:2,2 S:1,1', None, 'R:0,1 S:2,0', 'R:2,2 S:1,1'])
+        np.testing.assert_array_equal(MultiVisitEvaluator.chip_num_from_name(chip_name),
+                                      np.array([2211, 0, 120, 2211]))
+
+
+class MemoryTestClass(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
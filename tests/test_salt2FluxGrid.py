@@ -0,0 +1,130 @@
+from __future__ import with_statement
+import unittest
+import os
+import tempfile
+import shutil
+import numpy as np
+
+import lsst.utils.tests
+from lsst.sims.photUtils import BandpassDict
+from lsst.sims.catUtils.supernovae import SNObject, SALT2FluxGrid
+
+from astropy.config import get_config_dir
+
+_skip_sn_tests = False
+try:
+    get_config_dir()
+except:
+    _skip_sn_tests = True
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+@unittest.skipIf(_skip_sn_tests, "cannot properly load astropy config dir")
+class SALT2FluxGridTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.bp_dict = BandpassDict.loadTotalBandpassesFromFiles()
+        cls.tolerance = 0.01
+        cls.grid_kwargs = {'z_range': (0.1, 0.5), 'x1_range': (-1.0, 1.0),
+                           'c_range': (-0.1, 0.1), 'tolerance': cls.tolerance,
+                           'n_check': 20}
+        cls.scratch_dir = tempfile.mkdtemp(dir=ROOT, prefix='scratchSpace-')
+        cls.grid_name = os.path.join(cls.scratch_dir, 'salt2_grid.npz')
+        cls.grid = SALT2FluxGrid(cls.bp_dict, file_name=cls.grid_name, **cls.grid_kwargs)
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.path.exists(cls.scratch_dir):
+            shutil.rmtree(cls.scratch_dir)
+
+    def control_fluxes(self, mjd, t0, z, x1, c, x0, ebv):
+        """
+        Calculate fluxes in all bandpasses with SNObject.catsimBandFlux
+        """
+        sn = SNObject()
+        sn.set(t0=t0, z=z, x1=x1, c=c, x0=x0)
+        sn.set_MWebv(ebv)
+        return np.array([[sn.catsimBandFlux(time=tt, bandpassobject=self.bp_dict[bp])
+                          for bp in self.bp_dict] for tt in mjd])
+
+    def test_fluxes(self):
+        """
+        Test that the interpolated fluxes agree with SNObject.catsimBandFlux
+        to within the tolerance of the grid
+        """
+        rng = np.random.RandomState(81)
+        self.assertLessEqual(self.grid.max_error.max(), self.tolerance)
+        for i_sn in range(5):
+            t0 = 59580.0
+            z = rng.uniform(0.1, 0.5)
+            x1 = rng.uniform(-1.0, 1.0)
+            c = rng.uniform(-0.1, 0.1)
+            x0 = 1.0e-5
+            ebv = rng.uniform(0.0, 0.2)
+            mjd = t0 + np.arange(-30.0, 80.0, 3.3)
+            control = self.control_fluxes(mjd, t0, z, x1, c, x0, ebv)
+            test = self.grid.fluxes(mjd, t0, z, x1, c, x0, ebv=ebv)
+            self.assertEqual(test.shape, control.shape)
+            peak = control.max(axis=0)
+            # the grid tolerance is checked without extinction; allow
+            # for the interpolation in E(B-V)
+            self.assertLessEqual((np.abs(test-control)/peak).max(), 2.0*self.tolerance)
+
+            # fluxes in one bandpass at a time
+            bp_names = np.array(list(self.bp_dict.keys()))
+            bp_dex = rng.randint(0, len(bp_names), size=len(mjd))
+            single = self.grid.fluxes(mjd, t0, z, x1, c, x0, ebv=ebv,
+                                      bandpass_name=bp_names[bp_dex])
+            np.testing.assert_array_equal(single, test[np.arange(len(mjd)), bp_dex])
+
+    def test_off_grid(self):
+        """
+        Test that supernovae outside of the grid are evaluated exactly
+        """
+        t0 = 59580.0
+        mjd = t0 + np.arange(-30.0, 80.0, 5.0)
+        for z, x1, c in ((0.8, 0.0, 0.0), (0.3, 2.5, 0.0), (0.3, 0.0, -0.25)):
+            control = self.control_fluxes(mjd, t0, z, x1, c, 2.0e-6, 0.05)
+            test = self.grid.fluxes(mjd, t0, z, x1, c, 2.0e-6, ebv=0.05)
+            np.testing.assert_allclose(test, control, rtol=1.0e-8, atol=0.0)
+
+        # outside of the time range of the model, fluxes are zero
+        test = self.grid.fluxes(np.array([t0-1000.0, t0+1000.0]),
+                                t0, 0.3, 0.0, 0.0, 1.0e-5)
+        np.testing.assert_array_equal(test, np.zeros(test.shape))
+
+    def test_persistence(self):
+        """
+        Test that the grid is read back from its file and that the file
+        is ignored if it was built for a different grid
+        """
+        self.assertTrue(os.path.exists(self.grid_name))
+        reread = SALT2FluxGrid(self.bp_dict, file_name=self.grid_name, **self.grid_kwargs)
+        np.testing.assert_array_equal(reread._flux, self.grid._flux)
+        np.testing.assert_array_equal(reread._phase_grid, self.grid._phase_grid)
+        np.testing.assert_array_equal(reread.max_error, self.grid.max_error)
+
+        kwargs = dict(self.grid_kwargs)
+        kwargs['z_range'] = (0.1, 0.4)
+        other_name = os.path.join(self.scratch_dir, 'other_grid.npz')
+        shutil.copy(self.grid_name, other_name)
+        other = SALT2FluxGrid(self.bp_dict, file_name=other_name, **kwargs)
+        self.assertAlmostEqual(other._z_grid.max(), 0.4, 10)
+        self.assertFalse(np.array_equal(other._z_grid, self.grid._z_grid))
+        reread = SALT2FluxGrid(self.bp_dict, file_name=other_name, **kwargs)
+        np.testing.assert_array_equal(reread._flux, other._flux)
+
+
+class MemoryTestClass(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
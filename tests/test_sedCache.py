@@ -0,0 +1,148 @@
+import unittest
+import sys
+import numpy as np
+import lsst.utils.tests
+
+from lsst.sims.photUtils import BandpassDict
+from lsst.sims.catUtils.mixins import SedCache, PhotometryStars
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+class SedCacheTestCatalog(PhotometryStars):
+    """
+    A minimal stand-in for an InstanceCatalog that only knows
+    the columns needed to load stellar SEDs
+    """
+
+    def __init__(self, columns):
+        self._columns = columns
+        self._actually_calculated_columns = ['lsst_%s' % bp for bp in 'ugrizy']
+
+    def column_by_name(self, name):
+        return self._columns[name]
+
+
+class SedCacheTestCase(unittest.TestCase):
+
+    longMessage = True
+
+    @classmethod
+    def setUpClass(cls):
+        cls.bp_dict = BandpassDict.loadTotalBandpassesFromFiles()
+
+    def test_lru(self):
+        """
+        Test that entries are evicted in least-recently-used order
+        when the cache exceeds its memory budget
+        """
+        keys = [('a', 'star', 'sed_%d' % ii, 20.0, 0.1) for ii in range(10)]
+        mags = np.arange(30, dtype=float).reshape(10, 3)
+        cache = SedCache()
+        cache.store(keys[:1], mags[:1])
+        entry_bytes = cache.n_bytes
+
+        # the estimate includes the contents of the key, not just the tuple
+        self.assertGreater(entry_bytes, sys.getsizeof(keys[0]) + mags[:1].nbytes +
+                           sum([sys.getsizeof(vv) for vv in keys[0][2:]]))
+
+        cache = SedCache(max_bytes=4*entry_bytes)
+        cache.store(keys[:4], mags[:4])
+        self.assertEqual(len(cache), 4)
+        self.assertEqual(cache.n_bytes, 4*entry_bytes)
+
+        # use keys[0] so that keys[1] is now the least recently used
+        test, missing = cache.lookup([keys[0], keys[7]], 3)
+        np.testing.assert_array_equal(test[0], mags[0])
+        self.assertTrue(np.isnan(test[1]).all())
+        np.testing.assert_array_equal(missing, [False, True])
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+
+        cache.store(keys[4:6], mags[4:6])
+        self.assertEqual(len(cache), 4)
+        self.assertLessEqual(cache.n_bytes, cache.max_bytes)
+        for ii in (0, 3, 4, 5):
+            self.assertIn(keys[ii], cache)
+        for ii in (1, 2):
+            self.assertNotIn(keys[ii], cache)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.n_bytes, 0)
+
+        with self.assertRaises(RuntimeError):
+            SedCache(max_bytes=0)
+
+    def test_keys(self):
+        """
+        Test that keys depend on the bandpasses and that NaNs
+        in the key columns do not prevent matches
+        """
+        cache = SedCache()
+        names = np.array(['x', 'y'])
+        mag_norm = np.array([np.nan, 21.0])
+        keys_1 = cache.make_keys(self.bp_dict, [names, mag_norm], tag='star')
+        keys_2 = cache.make_keys(self.bp_dict, [names, mag_norm.copy()], tag='star')
+        self.assertEqual(keys_1, keys_2)
+        self.assertNotEqual(keys_1, cache.make_keys(self.bp_dict, [names, mag_norm], tag='agn'))
+
+        r_dict = BandpassDict([self.bp_dict['r']], ['r'])
+        self.assertNotEqual(cache.bandpass_key(r_dict), cache.bandpass_key(self.bp_dict))
+
+        # each BandpassDict is only hashed once
+        def fail(bandpassDict):
+            raise RuntimeError('the bandpass key should have been memoised')
+
+        cache.bandpass_key = fail
+        self.assertEqual(cache.make_keys(self.bp_dict, [names, mag_norm], tag='star'), keys_1)
+        with self.assertRaises(RuntimeError):
+            cache.make_keys(r_dict, [names, mag_norm], tag='star')
+
+    def test_stellar_magnitudes(self):
+        """
+        Test that PhotometryStars returns the same magnitudes with and
+        without a SedCache, and that repeated objects hit the cache
+        """
+        sed_names = np.array(['km20_5750.fits_g40_5790', 'kp10_9250.fits_g40_9250',
+                              'bergeron_6500_85.dat_6700', 'km20_5750.fits_g40_5790'])
+        columns = {'sedFilename': sed_names,
+                   'magNorm': np.array([20.0, 21.0, 22.0, 20.5]),
+                   'galacticAv': np.array([0.1, 0.2, 0.3, 0.1])}
+        col_names = ['lsst_%s' % bp for bp in 'ugrizy']
+
+        control = SedCacheTestCatalog(columns)
+        control_mags = control._quiescentMagnitudeGetter(self.bp_dict, col_names)
+
+        sed_cache = SedCache()
+        cat = SedCacheTestCatalog(columns)
+        cat.sedCache = sed_cache
+        test_mags = cat._quiescentMagnitudeGetter(self.bp_dict, col_names)
+        np.testing.assert_allclose(test_mags, control_mags, rtol=1.0e-10)
+        self.assertEqual(sed_cache.misses, 4)
+        self.assertEqual(sed_cache.hits, 0)
+
+        # a new chunk with two old objects and a new one
+        new_columns = {'sedFilename': sed_names[[2, 0, 1]],
+                       'magNorm': np.array([22.0, 20.0, 19.0]),
+                       'galacticAv': np.array([0.3, 0.1, 0.2])}
+        control = SedCacheTestCatalog(new_columns)
+        control_mags = control._quiescentMagnitudeGetter(self.bp_dict, col_names)
+        cat = SedCacheTestCatalog(new_columns)
+        cat.sedCache = sed_cache
+        test_mags = cat._quiescentMagnitudeGetter(self.bp_dict, col_names)
+        np.testing.assert_allclose(test_mags, control_mags, rtol=1.0e-10)
+        self.assertEqual(sed_cache.misses, 5)
+        self.assertEqual(sed_cache.hits, 2)
+        self.assertEqual(len(cat._sedList), 1)
+
+
+class MemoryTestClass(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
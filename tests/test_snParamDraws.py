@@ -0,0 +1,153 @@
+import unittest
+import numpy as np
+
+import lsst.utils.tests
+from lsst.sims.catUtils.supernovae import SNObject, SNUniverse
+from lsst.sims.catUtils.supernovae import CounterRNG, SALT2X0Lookup
+
+from astropy.config import get_config_dir
+
+_skip_sn_tests = False
+try:
+    get_config_dir()
+except:
+    _skip_sn_tests = True
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+class CounterRNGTestCase(unittest.TestCase):
+
+    def test_chunk_independence(self):
+        """
+        Test that the numbers drawn for a key do not depend on the other
+        keys drawn with it
+        """
+        rng = CounterRNG(seed=12)
+        keys = np.arange(1000, 3000, 7)
+        full = rng.normal(keys, 3, 1.0, 2.0)
+        for i_start in range(0, len(keys), 50):
+            np.testing.assert_array_equal(rng.normal(keys[i_start:i_start+50], 3, 1.0, 2.0),
+                                          full[i_start:i_start+50])
+        shuffled = np.random.RandomState(3).permutation(len(keys))
+        np.testing.assert_array_equal(rng.normal(keys[shuffled], 3, 1.0, 2.0), full[shuffled])
+        self.assertEqual(rng.uniform(keys[5], 0)[0], rng.uniform(keys, 0)[5])
+
+        # different counters and seeds give different numbers
+        self.assertFalse(np.array_equal(rng.uniform(keys, 0), rng.uniform(keys, 1)))
+        self.assertFalse(np.array_equal(rng.uniform(keys, 0), CounterRNG(seed=13).uniform(keys, 0)))
+
+    def test_distributions(self):
+        """
+        Test that uniform and normal produce the right distributions
+        """
+        rng = CounterRNG()
+        keys = np.arange(200000)
+        uu = rng.uniform(keys, 0, 2.0, 5.0)
+        self.assertGreater(uu.min(), 2.0)
+        self.assertLess(uu.max(), 5.0)
+        self.assertAlmostEqual(uu.mean(), 3.5, 1)
+        self.assertAlmostEqual(uu.std(), 3.0/np.sqrt(12.0), 2)
+
+        nn = rng.normal(keys, 1, -19.3, 0.3)
+        self.assertAlmostEqual(nn.mean(), -19.3, 2)
+        self.assertAlmostEqual(nn.std(), 0.3, 2)
+        self.assertLess(np.abs(np.corrcoef(uu, nn)[0][1]), 0.01)
+
+
+@unittest.skipIf(_skip_sn_tests, "cannot properly load astropy config dir")
+class SNParamDrawTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.x0_lookup = SALT2X0Lookup(x1_range=(-2.0, 2.0), c_range=(-0.3, 0.3))
+
+    def control_x0(self, x1, c, mag):
+        """
+        Find x0 the way SNUniverse.drawFromX0Dist does
+        """
+        sn = SNObject()
+        sn.set(x1=x1, c=c)
+        sn.source.set_peakmag(mag, band='bessellb', magsys='ab')
+        return sn.get('x0')
+
+    def test_x0_lookup(self):
+        """
+        Test that SALT2X0Lookup agrees with source.set_peakmag
+        """
+        rng = np.random.RandomState(44)
+        x1 = rng.uniform(-2.5, 2.5, size=20)
+        c = rng.uniform(-0.35, 0.35, size=20)
+        mag = rng.uniform(20.0, 26.0, size=20)
+        x0 = self.x0_lookup.x0(x1, c, mag)
+        self.assertLessEqual(self.x0_lookup.max_error, self.x0_lookup.tolerance)
+        for ii in range(len(x1)):
+            control = self.control_x0(x1[ii], c[ii], mag[ii])
+            self.assertLess(np.abs(2.5*np.log10(x0[ii]/control)), 2.0*self.x0_lookup.tolerance)
+
+    def test_param_arrays(self):
+        """
+        Test that drawSNParamArrays is deterministic per host and that
+        x0 is consistent with mB
+        """
+        universe = SNUniverse()
+        universe.suppressDimSN = False
+        universe.badvalues = np.nan
+        default_lookup = SNUniverse._x0_lookup
+        SNUniverse._x0_lookup = self.x0_lookup
+        try:
+            self._check_param_arrays(universe)
+        finally:
+            SNUniverse._x0_lookup = default_lookup
+
+    def _check_param_arrays(self, universe):
+
+        rng = np.random.RandomState(7)
+        hostid = rng.randint(0, 2**40, size=300)
+        hostmu = rng.uniform(38.0, 44.0, size=300)
+        c, x1, x0, t0, mB = universe.drawSNParamArrays(hostid, hostmu)
+        for vv in (c, x1, x0, t0, mB):
+            self.assertEqual(len(vv), len(hostid))
+            self.assertTrue(np.isfinite(vv).all())
+
+        c_half, x1_half, x0_half, t0_half, mB_half = \
+            universe.drawSNParamArrays(hostid[100:200], hostmu[100:200])
+        np.testing.assert_array_equal(c_half, c[100:200])
+        np.testing.assert_array_equal(x1_half, x1[100:200])
+        np.testing.assert_array_equal(x0_half, x0[100:200])
+        np.testing.assert_array_equal(t0_half, t0[100:200])
+        np.testing.assert_array_equal(mB_half, mB[100:200])
+
+        for ii in range(0, len(hostid), 60):
+            if np.abs(x1[ii]) < 2.0 and np.abs(c[ii]) < 0.3:
+                control = self.control_x0(x1[ii], c[ii], mB[ii])
+                self.assertLess(np.abs(2.5*np.log10(x0[ii]/control)),
+                                2.0*self.x0_lookup.tolerance)
+
+        # SNParamDistFromHost uses drawSNParamArrays if useCounterRNG
+        universe.useCounterRNG = True
+        universe.numobjs = len(hostid)
+        vals = universe.SNparamDistFromHost(np.zeros(len(hostid)), hostid, hostmu)
+        np.testing.assert_array_equal(vals, np.array([c, x1, x0, t0]).transpose())
+
+        # suppressed SN get badvalues for all of their parameters
+        universe.suppressDimSN = True
+        universe.mjdobs = t0[17]
+        universe.maxTimeSNVisible = 100.0
+        c, x1, x0, t0, mB = universe.drawSNParamArrays(hostid, hostmu)
+        self.assertTrue(np.isfinite(t0[17]))
+        bad = np.isnan(t0)
+        self.assertGreater(bad.sum(), 0)
+        for vv in (c, x1, x0, mB):
+            np.testing.assert_array_equal(np.isnan(vv), bad)
+
+
+class MemoryTestClass(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
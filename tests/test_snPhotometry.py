@@ -0,0 +1,93 @@
+import unittest
+import numpy as np
+
+import lsst.utils.tests
+from lsst.sims.photUtils import BandpassDict, PhotometricParameters
+from lsst.sims.catUtils.supernovae import SNObject, SALT2PhotometryEngine
+
+from astropy.config import get_config_dir
+
+_skip_sn_tests = False
+try:
+    get_config_dir()
+except:
+    _skip_sn_tests = True
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+@unittest.skipIf(_skip_sn_tests, "cannot properly load astropy config dir")
+class SALT2PhotometryEngineTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.bp_dict = BandpassDict.loadTotalBandpassesFromFiles()
+        cls.phot_params = PhotometricParameters(nexp=1, exptime=30.0)
+
+    def test_photometry(self):
+        """
+        Test that SALT2PhotometryEngine agrees with SNObject
+        """
+        engine = SALT2PhotometryEngine(self.bp_dict, photParams=self.phot_params)
+
+        rng = np.random.RandomState(615)
+        n_sne = 20
+        mjd = 59600.0
+        c = rng.normal(0.0, 0.1, size=n_sne)
+        x1 = rng.normal(0.0, 1.0, size=n_sne)
+        x0 = rng.uniform(1.0e-6, 1.0e-4, size=n_sne)
+        t0 = mjd + rng.uniform(-100.0, 40.0, size=n_sne)
+        z = rng.uniform(0.05, 1.0, size=n_sne)
+        ebv = rng.uniform(0.0, 0.5, size=n_sne)
+        t0[3] = np.nan
+
+        flux, mag, adu = engine.photometry(mjd, c, x1, x0, t0, z, ebv)
+        self.assertEqual(flux.shape, (n_sne, len(self.bp_dict)))
+        self.assertEqual(mag.shape, flux.shape)
+        self.assertEqual(adu.shape, flux.shape)
+
+        in_range = engine.in_time_range(mjd, t0, z)
+        self.assertGreater(in_range.sum(), 0)
+        self.assertLess(in_range.sum(), n_sne)
+
+        sn = SNObject()
+        for ii in range(n_sne):
+            sn.set(c=c[ii], x1=x1[ii], x0=x0[ii], t0=t0[ii], z=z[ii])
+            sn.set_MWebv(ebv[ii])
+            if in_range[ii]:
+                self.assertGreaterEqual(mjd, sn.mintime())
+                self.assertLessEqual(mjd, sn.maxtime())
+            else:
+                np.testing.assert_array_equal(flux[ii], np.zeros(len(self.bp_dict)))
+                np.testing.assert_array_equal(adu[ii], np.zeros(len(self.bp_dict)))
+                np.testing.assert_array_equal(mag[ii], np.inf*np.ones(len(self.bp_dict)))
+                continue
+
+            control_flux = sn.catsimManyBandFluxes(mjd, self.bp_dict)
+            control_mag = sn.catsimManyBandMags(mjd, self.bp_dict)
+            control_adu = sn.catsimManyBandADUs(mjd, self.bp_dict, photParams=self.phot_params)
+            np.testing.assert_allclose(flux[ii], control_flux, rtol=1.0e-10)
+            np.testing.assert_allclose(mag[ii], control_mag, rtol=1.0e-10)
+            np.testing.assert_allclose(adu[ii], control_adu, rtol=1.0e-6)
+            np.testing.assert_allclose(flux[ii], [sn.catsimBandFlux(mjd, self.bp_dict[bp])
+                                                  for bp in self.bp_dict], rtol=1.0e-10)
+
+    def test_empty(self):
+        """
+        Test that SALT2PhotometryEngine handles no supernovae
+        """
+        engine = SALT2PhotometryEngine(self.bp_dict)
+        flux, mag, adu = engine.photometry(59600.0, [], [], [], [], [], [])
+        self.assertEqual(flux.shape, (0, len(self.bp_dict)))
+        self.assertEqual(adu.shape, (0, len(self.bp_dict)))
+
+
+class MemoryTestClass(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
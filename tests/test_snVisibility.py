@@ -0,0 +1,73 @@
+import unittest
+import numpy as np
+
+import lsst.utils.tests
+from lsst.sims.catUtils.supernovae import SNObject, SALT2VisibilityWindow
+
+from astropy.config import get_config_dir
+
+_skip_sn_tests = False
+try:
+    get_config_dir()
+except:
+    _skip_sn_tests = True
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+@unittest.skipIf(_skip_sn_tests, "cannot properly load astropy config dir")
+class SALT2VisibilityWindowTestCase(unittest.TestCase):
+
+    def test_mjd_window(self):
+        """
+        Test that the window agrees with SNObject.mintime() and maxtime()
+        """
+        window = SALT2VisibilityWindow()
+        rng = np.random.RandomState(81)
+        t0 = rng.uniform(59580.0, 61000.0, size=20)
+        z = rng.uniform(0.01, 1.2, size=20)
+        mjd_min, mjd_max = window.mjd_window(t0, z)
+        sn = SNObject()
+        for ii in range(len(t0)):
+            sn.set(t0=t0[ii], z=z[ii])
+            self.assertAlmostEqual(mjd_min[ii], sn.mintime(), 9)
+            self.assertAlmostEqual(mjd_max[ii], sn.maxtime(), 9)
+
+        self.assertTrue(window.in_window(mjd_min[3], t0[3], z[3])[0])
+        self.assertTrue(window.in_window(mjd_max[3], t0[3], z[3])[0])
+        self.assertFalse(window.in_window(mjd_max[3]+0.01, t0[3], z[3])[0])
+        self.assertFalse(window.in_window(mjd_min[3], np.nan, z[3])[0])
+
+    def test_visit_slices(self):
+        """
+        Test that visit_slices finds the same visits as a brute force
+        comparison of every visit to every window
+        """
+        window = SALT2VisibilityWindow()
+        rng = np.random.RandomState(22)
+        mjd = np.sort(rng.uniform(59580.0, 60580.0, size=2000))
+        t0 = rng.uniform(59400.0, 60700.0, size=200)
+        z = rng.uniform(0.01, 1.2, size=200)
+        t0[5] = np.nan
+        mjd_min, mjd_max = window.mjd_window(t0, z)
+        i_start, i_end = window.visit_slices(mjd, t0, z)
+        n_empty = 0
+        for ii in range(len(t0)):
+            control = np.where(np.logical_and(mjd >= mjd_min[ii], mjd <= mjd_max[ii]))[0]
+            np.testing.assert_array_equal(np.arange(i_start[ii], i_end[ii]), control)
+            if len(control) == 0:
+                n_empty += 1
+        self.assertGreater(n_empty, 1)
+        self.assertLess(n_empty, len(t0))
+        self.assertEqual(i_start[5], i_end[5])
+
+
+class MemoryTestClass(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
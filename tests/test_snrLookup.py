@@ -0,0 +1,152 @@
+import unittest
+import numpy as np
+import lsst.utils.tests
+
+from lsst.sims.utils import ObservationMetaData
+from lsst.sims.photUtils import BandpassDict, PhotometricParameters
+from lsst.sims.photUtils import calcSNR_m5, calcMagError_m5, calcGamma
+from lsst.sims.catUtils.mixins import SNRLookup, PhotometryBase
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+class UncertaintyTestCatalog(PhotometryBase):
+    """
+    A minimal stand-in for an InstanceCatalog that only knows
+    how to return its LSST magnitudes
+    """
+
+    def __init__(self, mags, obs_metadata, bandpass_dict):
+        self._mags = mags
+        self.obs_metadata = obs_metadata
+        self.lsstBandpassDict = bandpass_dict
+        self._actually_calculated_columns = ['sigma_lsst_%s' % bp for bp in 'ugrizy']
+
+    def column_by_name(self, name):
+        return self._mags[name]
+
+
+class SNRLookupTestCase(unittest.TestCase):
+
+    longMessage = True
+
+    @classmethod
+    def setUpClass(cls):
+        cls.bp_dict = BandpassDict.loadTotalBandpassesFromFiles()
+        cls.phot_params = PhotometricParameters()
+
+    def test_gamma(self):
+        lookup = SNRLookup(self.bp_dict, photParams=self.phot_params, tolerance=1.0e-7)
+        rng = np.random.RandomState(18)
+        m5 = np.concatenate([rng.random_sample(20)*5.0 + 21.0, [14.0, 31.0]])
+        for bp in 'ugrizy':
+            gamma = lookup.calcGamma(bp, m5)
+            self.assertLessEqual(lookup.max_error[bp], 1.0e-7)
+            truth = np.array([calcGamma(self.bp_dict[bp], mm, photParams=self.phot_params)
+                              for mm in m5])
+            np.testing.assert_allclose(0.04-gamma, 0.04-truth, rtol=2.0e-7, atol=0.0)
+
+            # m5 outside of the table is calculated exactly
+            self.assertEqual(gamma[-2], truth[-2])
+            self.assertEqual(gamma[-1], truth[-1])
+
+        with self.assertRaises(RuntimeError):
+            lookup.calcGamma('q', m5)
+        with self.assertRaises(RuntimeError):
+            SNRLookup(self.bp_dict, m5_min=25.0, m5_max=20.0)
+
+    def test_snr_and_mag_error(self):
+        """
+        Evaluate a (n_obj, n_visits) grid of magnitudes at once
+        """
+        lookup = SNRLookup(self.bp_dict, photParams=self.phot_params)
+        rng = np.random.RandomState(44)
+        n_obj = 30
+        n_visits = 12
+        band = np.array(['ugrizy'[ii] for ii in rng.randint(0, 6, size=n_visits)])
+        m5 = rng.random_sample(n_visits)*3.0 + 22.0
+        mag = rng.random_sample((n_obj, n_visits))*10.0 + 16.0
+
+        snr = lookup.calcSNR_m5(mag, band, m5)
+        sigma = lookup.calcMagError_m5(mag, band, m5)
+        self.assertEqual(snr.shape, (n_obj, n_visits))
+        self.assertEqual(sigma.shape, (n_obj, n_visits))
+
+        for i_visit in range(n_visits):
+            bp = self.bp_dict[band[i_visit]]
+            snr_truth, gamma = calcSNR_m5(mag[:, i_visit], bp, m5[i_visit], self.phot_params)
+            sigma_truth, gamma = calcMagError_m5(mag[:, i_visit], bp, m5[i_visit], self.phot_params)
+            np.testing.assert_allclose(snr[:, i_visit], snr_truth, rtol=1.0e-6)
+            np.testing.assert_allclose(sigma[:, i_visit], sigma_truth, rtol=1.0e-6)
+
+        # scalar inputs give scalar outputs
+        snr_truth, gamma = calcSNR_m5(21.0, self.bp_dict['r'], 24.0, self.phot_params)
+        snr = lookup.calcSNR_m5(21.0, 'r', 24.0)
+        self.assertIsInstance(snr, float)
+        self.assertAlmostEqual(snr/snr_truth, 1.0, 6)
+
+    def test_mixin(self):
+        """
+        Test that PhotometryBase uses an SNRLookup when one is provided
+        """
+        rng = np.random.RandomState(91)
+        mags = {}
+        for bp in 'ugrizy':
+            mags['lsst_%s' % bp] = rng.random_sample(25)*8.0 + 17.0
+
+        obs = ObservationMetaData(m5=[23.0, 23.2, 23.4, 23.6, 23.8, 24.0],
+                                  bandpassName=list('ugrizy'))
+
+        name_list = ['lsst_%s' % bp for bp in 'ugrizy']
+        cat = UncertaintyTestCatalog(mags, obs, self.bp_dict)
+        truth = cat._magnitudeUncertaintyGetter(name_list, list('ugrizy'), 'lsstBandpassDict')
+
+        cat = UncertaintyTestCatalog(mags, obs, self.bp_dict)
+        cat.snrLookup = SNRLookup(self.bp_dict, photParams=cat.photParams)
+        test = cat._magnitudeUncertaintyGetter(name_list, list('ugrizy'), 'lsstBandpassDict')
+        self.assertFalse(hasattr(cat, '_gamma_cache'))
+        np.testing.assert_allclose(test, truth, rtol=1.0e-6)
+
+    def test_mismatch(self):
+        """
+        Test that PhotometryBase ignores an SNRLookup built for other
+        bandpasses or other PhotometricParameters
+        """
+        rng = np.random.RandomState(17)
+        mags = {}
+        for bp in 'ugrizy':
+            mags['lsst_%s' % bp] = rng.random_sample(25)*8.0 + 17.0
+
+        obs = ObservationMetaData(m5=[23.0, 23.2, 23.4, 23.6, 23.8, 24.0],
+                                  bandpassName=list('ugrizy'))
+
+        name_list = ['lsst_%s' % bp for bp in 'ugrizy']
+        cat = UncertaintyTestCatalog(mags, obs, self.bp_dict)
+        truth = cat._magnitudeUncertaintyGetter(name_list, list('ugrizy'), 'lsstBandpassDict')
+
+        other_params = PhotometricParameters(exptime=30.0, nexp=1)
+        other_bp_dict = BandpassDict.loadTotalBandpassesFromFiles(bandpassNames=['u', 'g', 'r'])
+
+        lookup = SNRLookup(self.bp_dict, photParams=self.phot_params)
+        self.assertTrue(lookup.matches(self.bp_dict, PhotometricParameters()))
+        self.assertFalse(lookup.matches(self.bp_dict, other_params))
+        self.assertFalse(lookup.matches(other_bp_dict, self.phot_params))
+
+        for bad_lookup in (SNRLookup(self.bp_dict, photParams=other_params),
+                           SNRLookup(other_bp_dict, photParams=self.phot_params)):
+            cat = UncertaintyTestCatalog(mags, obs, self.bp_dict)
+            cat.snrLookup = bad_lookup
+            test = cat._magnitudeUncertaintyGetter(name_list, list('ugrizy'), 'lsstBandpassDict')
+            self.assertTrue(hasattr(cat, '_gamma_cache'))
+            np.testing.assert_array_equal(test, truth)
+
+
+class MemoryTestClass(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
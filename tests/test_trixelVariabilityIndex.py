@@ -0,0 +1,221 @@
+import unittest
+import os
+import tempfile
+import shutil
+import sqlite3
+import json
+import numpy as np
+import lsst.utils.tests
+
+from lsst.sims.utils import findHtmid
+from lsst.sims.utils.CodeUtilities import sims_clean_up
+from lsst.sims.catalogs.db import CatalogDBObject
+from lsst.sims.catUtils.utils import StellarAlertDBObjMixin
+from lsst.sims.catUtils.utils import AlertDataGenerator
+from lsst.sims.catUtils.utils import TrixelVariabilityIndex
+
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+class IndexTestDBObj(StellarAlertDBObjMixin, CatalogDBObject):
+    objid = 'trixel_var_index_test'
+    tableid = 'stars'
+    idColKey = 'simobjid'
+    raColName = 'ra'
+    decColName = 'dec'
+    objectTypeId = 0
+    columns = [('raJ2000', 'ra*0.01745329252'),
+               ('decJ2000', 'dec*0.01745329252'),
+               ('variabilityParameters', 'varParamStr', str, 100)]
+
+
+class TrixelVariabilityIndexTestCase(unittest.TestCase):
+
+    longMessage = True
+
+    @classmethod
+    def setUpClass(cls):
+        cls.scratch_dir = tempfile.mkdtemp(dir=ROOT, prefix='trixelVarIndex')
+        cls.db_name = os.path.join(cls.scratch_dir, 'stars.db')
+        cls.htmid_level = 4
+
+        rng = np.random.RandomState(88)
+        n_stars = 400
+        cls.ra = rng.random_sample(n_stars)*30.0 + 20.0
+        cls.dec = rng.random_sample(n_stars)*30.0 - 40.0
+        cls.mags = rng.random_sample((6, n_stars))*6.0 + 23.0
+        model_choice = rng.randint(0, 4, size=n_stars)
+        cls.var_param_str = []
+        for i_star in range(n_stars):
+            if model_choice[i_star] == 0:
+                cls.var_param_str.append('None')
+            elif model_choice[i_star] == 1:
+                cls.var_param_str.append('{"m": "kplr", "p": {"lc": %d}}' % rng.randint(0, 3))
+            elif model_choice[i_star] == 2:
+                cls.var_param_str.append('{"m":"applyRRly", "p":{"amp": 1.0}}')
+            else:
+                cls.var_param_str.append('{"m":"applyAmcvn", "p":{"amp": 1.0}}')
+
+        cls.htmid_21 = np.array([findHtmid(ra, dec, 21) for ra, dec in zip(cls.ra, cls.dec)])
+
+        with sqlite3.connect(cls.db_name) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''CREATE TABLE stars
+                              (simobjid int, htmid int, ra real, dec real,
+                               umag real, gmag real, rmag real,
+                               imag real, zmag real, ymag real,
+                               varParamStr text)''')
+            rows = [(i_star, int(cls.htmid_21[i_star]), cls.ra[i_star], cls.dec[i_star]) +
+                    tuple(cls.mags[:, i_star]) + (cls.var_param_str[i_star],)
+                    for i_star in range(n_stars)]
+            cursor.executemany('INSERT INTO stars VALUES (?,?,?,?,?,?,?,?,?,?,?)', rows)
+            conn.commit()
+
+        cls.kplr_dmag_lookup = {0: 0.001, 1: 0.5, 2: 2.0}
+        cls.max_brightening = {'applyRRly': 1.0, 'applyAmcvn': 0.3}
+        cls.max_fading = {'applyAmcvn': 0.3}
+
+    @classmethod
+    def tearDownClass(cls):
+        sims_clean_up()
+        if os.path.exists(cls.scratch_dir):
+            shutil.rmtree(cls.scratch_dir)
+
+    def truth_bound(self, i_star):
+        """
+        Return the model, brightening bound and |delta magnitude| bound
+        of a star
+        """
+        params = json.loads(self.var_param_str[i_star])
+        if params['m'] == 'kplr':
+            dmag = self.kplr_dmag_lookup[params['p']['lc']]
+            return 'kplr', dmag, dmag
+        bound = self.max_brightening.get(params['m'], np.inf)
+        return params['m'], bound, max(bound, self.max_fading.get(params['m'], np.inf))
+
+    def test_index(self):
+        db_obj = IndexTestDBObj(database=self.db_name, driver='sqlite')
+        htmid_arr = self.htmid_21 >> 2*(21-self.htmid_level)
+        htmid_list = np.unique(htmid_arr)
+
+        index = TrixelVariabilityIndex.build(db_obj, self.htmid_level,
+                                             htmid_list=htmid_list,
+                                             max_brightening=self.max_brightening,
+                                             max_fading=self.max_fading,
+                                             kplr_dmag_lookup=self.kplr_dmag_lookup,
+                                             chunk_size=50)
+
+        file_name = os.path.join(self.scratch_dir, 'index.db')
+        index.write(file_name)
+        with self.assertRaises(RuntimeError):
+            index.write(file_name)
+        index = TrixelVariabilityIndex.read(file_name)
+        self.assertEqual(index.htmid_level, self.htmid_level)
+
+        obs_mag_cutoff = np.array(AlertDataGenerator.obs_mag_cutoff)
+        n_pruned = 0
+        for htmid in htmid_list:
+            in_trixel = np.where(htmid_arr == htmid)[0]
+            truth_counts = {}
+            truth_groups = {}
+            for i_star in in_trixel:
+                if self.var_param_str[i_star] == 'None':
+                    continue
+                model, bound, abs_bound = self.truth_bound(i_star)
+                truth_counts[model] = truth_counts.get(model, 0) + 1
+                if model not in truth_groups:
+                    truth_groups[model] = []
+                truth_groups[model].append((i_star, bound, abs_bound))
+
+            self.assertEqual(index.model_counts(htmid), truth_counts)
+
+            for band_list in ([0], [1, 5], [0, 1, 2, 3, 4, 5]):
+                for dmag_cutoff in (0.005, 0.75):
+                    truth = 0
+                    for model in truth_groups:
+                        max_dmag = max([abs_bound for i_star, bound, abs_bound
+                                        in truth_groups[model]])
+                        if max_dmag < dmag_cutoff:
+                            continue
+                        visible = False
+                        for i_star, bound, abs_bound in truth_groups[model]:
+                            if (self.mags[band_list, i_star] - bound <=
+                                obs_mag_cutoff[band_list]).any():
+                                visible = True
+                        if visible:
+                            truth += len(truth_groups[model])
+                    self.assertEqual(index.n_candidates(htmid, band_list, dmag_cutoff), truth)
+                    self.assertEqual(index.can_trigger(htmid, band_list, dmag_cutoff), truth > 0)
+                    if truth == 0:
+                        n_pruned += 1
+
+            # finer trixels inherit the summary of their parent
+            self.assertEqual(index.model_counts(htmid << 2), truth_counts)
+
+        self.assertGreater(n_pruned, 0)
+
+        # a trixel with no variable sources cannot trigger anything
+        empty_htmid = [htmid for htmid in range(htmid_list.min(), htmid_list.max())
+                       if htmid not in htmid_list]
+        self.assertGreater(len(empty_htmid), 0)
+        self.assertEqual(index.model_counts(empty_htmid[0]), {})
+        self.assertFalse(index.can_trigger(empty_htmid[0], [0, 1, 2, 3, 4, 5], 0.0))
+
+    def test_fading(self):
+        """
+        Test that trixels whose sources can only trigger alerts by
+        fading are not pruned
+        """
+        db_name = os.path.join(self.scratch_dir, 'faders.db')
+        ra = np.array([30.0, 30.001, 30.002])
+        dec = np.array([-20.0, -20.001, -20.002])
+        htmid_21 = [findHtmid(rr, dd, 21) for rr, dd in zip(ra, dec)]
+        htmid = htmid_21[0] >> 2*(21-self.htmid_level)
+        with sqlite3.connect(db_name) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''CREATE TABLE stars
+                              (simobjid int, htmid int, ra real, dec real,
+                               umag real, gmag real, rmag real,
+                               imag real, zmag real, ymag real,
+                               varParamStr text)''')
+            rows = [(i_star, int(htmid_21[i_star]), ra[i_star], dec[i_star]) +
+                    (20.0,)*6 + ('{"m": "eclipse", "p": {"depth": 1.0}}',)
+                    for i_star in range(len(ra))]
+            cursor.executemany('INSERT INTO stars VALUES (?,?,?,?,?,?,?,?,?,?,?)', rows)
+            conn.commit()
+
+        db_obj = IndexTestDBObj(database=db_name, driver='sqlite')
+
+        # eclipsing sources never brighten, but they can fade by 1 magnitude
+        index = TrixelVariabilityIndex.build(db_obj, self.htmid_level, htmid_list=[htmid],
+                                             max_brightening={'eclipse': 0.0},
+                                             max_fading={'eclipse': 1.0})
+        file_name = os.path.join(self.scratch_dir, 'fade_index.db')
+        index.write(file_name)
+        index = TrixelVariabilityIndex.read(file_name)
+        self.assertEqual(index.data['max_dmag'][0], 0.0)
+        self.assertEqual(index.data['max_abs_dmag'][0], 1.0)
+        self.assertEqual(index.n_candidates(htmid, [0, 1, 2], 0.5), 3)
+        self.assertEqual(index.n_candidates(htmid, [0, 1, 2], 1.5), 0)
+
+        # without a bound on fading, nothing is pruned for varying too little
+        index = TrixelVariabilityIndex.build(db_obj, self.htmid_level, htmid_list=[htmid],
+                                             max_brightening={'eclipse': 0.0})
+        self.assertEqual(index.n_candidates(htmid, [0, 1, 2], 10.0), 3)
+
+        # the brightening bound still decides whether the sources are visible
+        self.assertEqual(index.n_candidates(htmid, [0], 10.0, obs_mag_cutoff=[19.5]*6), 0)
+
+
+class MemoryTestClass(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()